@@ -342,6 +342,49 @@ class AntArray(Array, ant.Antenna):
         W  = np.exp(1j*k[None,None,:]*up[...,None])
         return(W)
 
+    def afactor(self, th, ph, w=[], fGHz=[], dtype=complex):
+        """ array factor of the array
+
+        Parameters
+        ----------
+
+        th : np.array (Nd,)
+        ph : np.array (Nd,)
+        w : np.array (Nb x Na x Nf) | list of 3 np.array (Nb x Ni x Nf)
+            weights (default self.w, a single beam)
+        fGHz : np.array
+            (default self.fGHz)
+        dtype : complex | np.complex64
+
+        Returns
+        -------
+
+        AF : np.array (Nb x Nd x Nf)
+
+        See Also
+        --------
+
+        pylayers.antprop.aarray.afactor
+
+        """
+        if len(fGHz) == 0:
+            fGHz = self.fGHz
+        if len(w) == 0:
+            w = self.w
+            if len(w) == 0:
+                w = np.ones((1, self.Na, len(fGHz)))
+            elif w.ndim == 2:
+                w = w[None, ...]
+            else:
+                w = w.reshape(1, -1, w.shape[-1])
+        # self.array is [] (see __init__) or the AntArray of a subarray,
+        # the regular grid shape N only holds in the first case
+        if isinstance(self.array, list) and len(self.array) == 0:
+            N = self.N
+        else:
+            N = []
+        return afactor(self.p, w, th, ph, fGHz, N=N, dtype=dtype)
+
     def __repr__(self):
         st = ant.Antenna.__repr__(self)
         N = np.prod(self.N)
@@ -445,6 +488,158 @@ class Combiner(AntArray):
         # s x r x f
         self.Wsr = np.einsum('shf,hrf->srf',Wsh,self.Whr)
 
+def _grid(p, N):
+    """ decompose a set of points on a regular grid
+
+    Parameters
+    ----------
+
+    p : np.array (3 x Na)
+        points in the ULArray order (ix slowest)
+    N : list
+        [Nx,Ny,Nz]
+
+    Returns
+    -------
+
+    o : np.array (3,)
+        first point
+    T : np.array (3 x 3)
+        steps along the 3 axes (columns)
+
+    or None if the points are not on the grid
+
+    """
+    N = [int(n) for n in N]
+    if len(N) != 3 or p.ndim != 2 or np.prod(N) != p.shape[1]:
+        return None
+    pp = p.reshape(3, N[0], N[1], N[2])
+    o = pp[:, 0, 0, 0]
+    T = np.zeros((3, 3))
+    if N[0] > 1:
+        T[:, 0] = pp[:, 1, 0, 0] - o
+    if N[1] > 1:
+        T[:, 1] = pp[:, 0, 1, 0] - o
+    if N[2] > 1:
+        T[:, 2] = pp[:, 0, 0, 1] - o
+    ix = np.arange(N[0])[None, :, None, None]
+    iy = np.arange(N[1])[None, None, :, None]
+    iz = np.arange(N[2])[None, None, None, :]
+    q = (o[:, None, None, None] + T[:, 0][:, None, None, None]*ix
+         + T[:, 1][:, None, None, None]*iy + T[:, 2][:, None, None, None]*iz)
+    if not np.allclose(q, pp):
+        return None
+    return o, T
+
+def afactor(p, w, th, ph, fGHz, N=[], dtype=complex, nmax=2**22):
+    r""" array factor of a set of beams
+
+    Parameters
+    ----------
+
+    p : np.array (3 x Na)
+        element positions (meters)
+    w : np.array (Nb x Na x Nf) | list of 3 np.array (Nb x Ni x Nf)
+        weights of the Nb beams, or separable weights of a regular grid
+        along its 3 axes, :math:`w_{n} = w^x_{i_x} w^y_{i_y} w^z_{i_z}`
+    th : np.array (Nd,)
+    ph : np.array (Nd,)
+    fGHz : np.array (Nf,)
+    N : list
+        [Nx,Ny,Nz] if the elements are on a regular grid in the ULArray
+        order. The steering vectors are then the products of 1D steering
+        vectors.
+    dtype : complex | np.complex64
+    nmax : int
+        maximum number of elements of the temporary steering arrays
+
+    Returns
+    -------
+
+    AF : np.array (Nb x Nd x Nf)
+
+    Notes
+    -----
+
+    .. math::
+
+        AF_{b}(\theta,\phi,f) = \sum_n w_{bn}(f) e^{+jk\mathbf{s}.\mathbf{p}_n}
+
+    For each block of directions the contraction over the elements is a
+    single batched matrix product over the frequencies. With separable
+    weights its cost is in Nx+Ny+Nz instead of Na.
+
+    Examples
+    --------
+
+    >>> from pylayers.antprop.aarray import *
+    >>> fGHz = np.array([28.])
+    >>> A = ULArray(N=[16,1,16],dm=[0.0054,0,0.0054])
+    >>> w = np.ones((1,256,1))
+    >>> AF = afactor(A.p,w,np.array([np.pi/2]),np.array([np.pi/2]),fGHz,N=A.N)
+    >>> assert np.allclose(np.abs(AF),256)
+
+    """
+    rdtype = np.float32 if np.dtype(dtype) == np.complex64 else np.float64
+    th = np.asarray(th, dtype=float).ravel()
+    ph = np.asarray(ph, dtype=float).ravel()
+    fGHz = np.atleast_1d(np.asarray(fGHz, dtype=float))
+    k = 2*np.pi*fGHz/0.3
+    s = np.vstack((np.sin(th)*np.cos(ph), np.sin(th)*np.sin(ph), np.cos(th)))
+    Nd = s.shape[1]
+    Nf = len(fGHz)
+    p = p.reshape(3, -1)
+    Na = p.shape[1]
+
+    bsep = isinstance(w, (list, tuple))
+    g = _grid(p, N) if len(N) > 0 else None
+    assert (not bsep) or (g is not None), 'separable weights need a grid'
+
+    if bsep:
+        Nb = w[0].shape[0]
+        lW = [np.ascontiguousarray(wi.transpose(2, 0, 1)).astype(dtype) for wi in w]
+        Ne = sum(N)
+    else:
+        if w.ndim == 2:
+            w = w[None, ...]
+        Nb = w.shape[0]
+        W = np.ascontiguousarray(w.transpose(2, 0, 1)).astype(dtype)
+        Ne = Na
+
+    AF = np.empty((Nb, Nd, Nf), dtype=dtype)
+    nd = max(1, nmax//(Nf*Ne))
+    for d0 in range(0, Nd, nd):
+        u = slice(d0, min(d0+nd, Nd))
+        su = s[:, u]
+        if g is None:
+            # F x d x a
+            arg = (k[:, None, None]*np.dot(su.T, p)[None, ...]).astype(rdtype)
+            E = np.exp(1j*arg)
+        else:
+            o, T = g
+            arg0 = (k[:, None]*np.dot(o, su)[None, :]).astype(rdtype)
+            E0 = np.exp(1j*arg0)
+            lE = []
+            for i in range(3):
+                ii = np.arange(N[i])
+                # F x d x Ni
+                arg = (k[:, None, None]*np.dot(T[:, i], su)[None, :, None]
+                       *ii[None, None, :]).astype(rdtype)
+                lE.append(np.exp(1j*arg))
+            if not bsep:
+                E = (lE[0][:, :, :, None, None]*lE[1][:, :, None, :, None]
+                     *lE[2][:, :, None, None, :]).reshape(Nf, -1, Na)
+                E = E*E0[..., None]
+        if bsep:
+            # F x b x d
+            A = E0[:, None, :]
+            for Wi, Ei in zip(lW, lE):
+                A = A*np.matmul(Wi, Ei.transpose(0, 2, 1))
+        else:
+            A = np.matmul(W, E.transpose(0, 2, 1))
+        AF[:, u, :] = A.transpose(1, 2, 0)
+    return AF
+
 def k2xyz(ik, sh):
     """
 
@@ -26,7 +26,7 @@ from scipy.special import sici, fresnel
 import pandas as pd
 import pylayers.util.pyutil as pyu
 import pylayers.util.geomutil as geu
-from pylayers.util.project import PyLayers
+from pylayers.util.project import PyLayers, logger
 from pylayers.antprop.spharm import *
 from pylayers.antprop.antssh import ssh, SSHFunc2, SSHFunc, SSHCoeff, CartToSphere
 from pylayers.antprop.coeffModel import *
@@ -203,8 +203,14 @@ class Pattern(PyLayers):
 
         #
         # evaluation of the specific Pattern__p function
+        # or interpolation in the pattern table (see tabulate)
         #
-        Ft,Fp = eval('self._Pattern__p'+self.typ)(param=self.param)
+        F = None
+        if (not self.grid) and (getattr(self, 'tab', None) is not None):
+            F = self._tabeval()
+        if F is None:
+            F = eval('self._Pattern__p'+self.typ)(param=self.param)
+        Ft, Fp = F
         if kwargs['inplace']:
             self.Ft = Ft
             self.Fp = Fp
@@ -213,6 +219,176 @@ class Pattern(PyLayers):
         else:
             return Ft,Fp
 
+    def tabulate(self, dtheta=np.pi/180, dphi=np.pi/180, fGHz=[], tol=None,
+                 nchk=1000, save=True):
+        """ build a pattern lookup table
+
+        Parameters
+        ----------
+
+        dtheta : float
+            theta step (radians)
+        dphi : float
+            phi step (radians)
+        fGHz : np.array
+            frequencies of the table (default self.fGHz)
+        tol : float
+            accuracy bound. The steps are halved (at most 3 times) until
+            the maximum interpolation error relative to the maximum of the
+            pattern is lower than tol (default None : no bound)
+        nchk : int
+            number of random directions of the accuracy check
+        save : boolean
+            if True the table of an antenna loaded from a file is saved
+            in <file>.tab.npz next to it and reloaded by later calls with
+            the same fGHz, dtheta, dphi and tol
+
+        Returns
+        -------
+
+        err : float
+            maximum interpolation error on the check directions relative
+            to the maximum of the pattern
+
+        Notes
+        -----
+
+        Once tabulated, the evaluations of the pattern on a set of
+        directions (not on a grid) are bilinear interpolations in the
+        table, for the frequencies of the table. The theta nodes are the
+        centers of the dtheta intervals, the poles are never evaluated.
+        Set self.tab to None to come back to the exact evaluation.
+
+        Examples
+        --------
+
+        >>> from pylayers.antprop.antenna import *
+        >>> A = Antenna('Gauss')
+        >>> err = A.tabulate(dtheta=np.pi/90,dphi=np.pi/90)
+        >>> A.eval(th=np.array([0.5,1.2]),ph=np.array([0.1,4]))
+
+        """
+        assert self.typ != 'azel', 'azel pattern can not be tabulated'
+        if len(fGHz) == 0:
+            if not hasattr(self, 'fGHz'):
+                self.eval()
+            fGHz = self.fGHz
+        fGHz = np.atleast_1d(np.asarray(fGHz, dtype=float))
+
+        # the table evaluation must not change the current pattern state
+        lattr = ['theta', 'phi', 'grid', 'full', 'nth', 'nph', 'fGHz', 'nf']
+        state = {k: self.__dict__[k] for k in lattr if k in self.__dict__}
+
+        # requested steps and accuracy, the table steps may be refined
+        tol0 = np.nan if tol is None else float(tol)
+        req = {'dtheta0': dtheta, 'dphi0': dphi, 'tol0': tol0}
+
+        tabfile = ''
+        if save and self.fromfile and isinstance(self._filename, str):
+            directory = getattr(self, '_directory', pstruc['DIRANT'])
+            filename = pyu.getlong(self._filename, directory)
+            tabfile = os.path.splitext(filename)[0] + '.tab.npz'
+            if (os.path.isfile(tabfile) and os.path.isfile(filename) and
+                    os.path.getmtime(tabfile) < os.path.getmtime(filename)):
+                tabfile_ok = False
+            else:
+                tabfile_ok = os.path.isfile(tabfile)
+            if tabfile_ok:
+                tab = dict(np.load(tabfile))
+                if (all(k in tab for k in req)
+                        and (len(tab['fGHz']) == len(fGHz))
+                        and np.allclose(tab['fGHz'], fGHz)
+                        and all(np.isclose(tab[k], req[k], equal_nan=True)
+                                for k in req)):
+                    self.tab = tab
+                    return float(tab['err'])
+
+        rs = np.random.RandomState(0)
+        thc = np.arccos(1-2*rs.rand(nchk))
+        phc = 2*np.pi*rs.rand(nchk)
+
+        for k in range(4):
+            self.tab = None
+            nth = int(np.ceil(np.pi/dtheta))
+            nph = int(np.ceil(2*np.pi/dphi))
+            dth = np.pi/nth
+            Ft, Fp = self.eval(th0=dth/2., th1=np.pi-dth/2., nth=nth,
+                               ph0=0, ph1=2*np.pi, nph=nph,
+                               fGHz=fGHz, inplace=False)
+            tab = {'theta': self.theta, 'phi': self.phi, 'fGHz': fGHz,
+                   'Ft': Ft, 'Fp': Fp, 'dtheta': dtheta, 'dphi': dphi}
+            tab.update(req)
+            # accuracy check
+            Fte, Fpe = self.eval(th=thc, ph=phc, fGHz=fGHz, inplace=False)
+            self.tab = tab
+            Fti, Fpi = self._tabeval()
+            Fmax = max(np.nanmax(np.abs(Fte)), np.nanmax(np.abs(Fpe)))
+            err = max(np.nanmax(np.abs(Fti-Fte)),
+                      np.nanmax(np.abs(Fpi-Fpe)))/Fmax
+            tab['err'] = err
+            if (tol is None) or (err <= tol):
+                break
+            dtheta = dtheta/2.
+            dphi = dphi/2.
+        else:
+            logger.warning('tabulate : accuracy %g not reached (%g)', tol, err)
+
+        self.__dict__.update(state)
+        if tabfile != '':
+            np.savez(tabfile, **tab)
+        return err
+
+    def _tabeval(self):
+        """ bilinear interpolation in the pattern table
+
+        Returns
+        -------
+
+        Ft, Fp : np.array (Ndir x ... x Nf)
+            or None if self.fGHz are not frequencies of the table
+
+        See Also
+        --------
+
+        tabulate
+
+        """
+        tab = self.tab
+        ftab = tab['fGHz']
+        fGHz = np.atleast_1d(self.fGHz)
+        uf = np.minimum(np.searchsorted(ftab, fGHz-1e-9), len(ftab)-1)
+        if not np.allclose(ftab[uf], fGHz):
+            return None
+        theta = np.asarray(self.theta, dtype=float)
+        phi = np.mod(np.asarray(self.phi, dtype=float), 2*np.pi)
+        nth = len(tab['theta'])
+        nph = len(tab['phi'])
+        dth = np.pi/nth
+        dph = 2*np.pi/nph
+        # theta nodes at the center of the intervals, constant beyond
+        x = np.clip(theta/dth - 0.5, 0, nth-1)
+        i0 = np.minimum(x.astype(int), nth-2)
+        wt = x - i0
+        # phi is periodic
+        y = phi/dph
+        j0 = np.floor(y).astype(int)
+        wp = y - j0
+        j0 = np.mod(j0, nph)
+        j1 = np.mod(j0+1, nph)
+        lF = []
+        for T in [tab['Ft'], tab['Fp']]:
+            if len(uf) != len(ftab) or (uf != np.arange(len(ftab))).any():
+                T00, T01 = T[i0, j0][..., uf], T[i0, j1][..., uf]
+                T10, T11 = T[i0+1, j0][..., uf], T[i0+1, j1][..., uf]
+            else:
+                T00, T01 = T[i0, j0], T[i0, j1]
+                T10, T11 = T[i0+1, j0], T[i0+1, j1]
+            sh = (len(theta),) + (1,)*(T00.ndim-1)
+            a = wt.reshape(sh)
+            b = wp.reshape(sh)
+            lF.append((1-a)*((1-b)*T00 + b*T01) + a*((1-b)*T10 + b*T11))
+        return lF[0], lF[1]
+
     def vsh(self,threshold=-1):
         if self.evaluated:
             vsh(self)
@@ -1243,15 +1419,7 @@ class Pattern(PyLayers):
 
         # V, W = VW(lBr, mBr, theta, phi)
         V, W = VW(lBr, mBr, theta, phi)
-        Fth = np.dot(Br, np.real(V.T)) - \
-              np.dot(Bi, np.imag(V.T)) + \
-              np.dot(Ci, np.real(W.T)) + \
-              np.dot(Cr, np.imag(W.T))
-
-        Fph = -np.dot(Cr, np.real(V.T)) + \
-               np.dot(Ci, np.imag(V.T)) + \
-               np.dot(Bi, np.real(W.T)) + \
-               np.dot(Br, np.imag(W.T))
+        Fth, Fph = VWsynth(Br, Bi, Cr, Ci, V, W)
 
         # here Nf x Nd
 
@@ -1687,6 +1855,26 @@ class Pattern(PyLayers):
         #if len(.w.shape)==3:
         #    self.wp   = self.wp[None,:,:,:]
 
+        if self.grid:
+            #
+            # same pattern on each point : pattern x array factor
+            # Fp  : Nd x Nf
+            # Ft  : Nd x Nf
+            #
+            from pylayers.antprop.aarray import afactor
+            th = np.arccos(np.clip(sz,-1,1))
+            ph = np.arctan2(sy,sx)
+            N = getattr(self,'N',[])
+            if len(lshp)>2:
+                N = []
+            AF = afactor(p,wp[None,...],th,ph,self.fGHz,N=N)[0]
+            Ft = aFt[:,0,:]*AF
+            Fp = aFp[:,0,:]*AF
+            sh = Ft.shape
+            Ft = Ft.reshape(self.nth,self.nph,sh[1])
+            Fp = Fp.reshape(self.nth,self.nph,sh[1])
+            return Ft,Fp
+
         # aFT :  Nd x Np x Nf
         # E   :  Nd x Np x Nf
 
@@ -1700,19 +1888,6 @@ class Pattern(PyLayers):
         Ft = wp[None,...]*aFt*E
         Fp = wp[None,...]*aFp*E
 
-        if self.grid:
-        #
-        # Integrate over the Np points (axis =1)
-        # only if self.grid
-        # Fp  : Nd x Nf
-        # Ft  : Nd x Nf
-        #
-            Ft = np.sum(Ft,axis=1)
-            Fp = np.sum(Fp,axis=1)
-            sh = Ft.shape
-            Ft = Ft.reshape(self.nth,self.nph,sh[1])
-            Fp = Fp.reshape(self.nth,self.nph,sh[1])
-
         return Ft,Fp
 
     def radF(self):
@@ -2192,6 +2367,7 @@ class Antenna(Pattern):
         self.source = kwargs['source']
 
         self.param = kwargs['param']
+        self._directory = kwargs['directory']
 
         # super(Antenna,self).__init__()
         #Pattern.__init__(self)
@@ -4427,16 +4603,7 @@ class Antenna(Pattern):
 
             # vector spherical harmonics basis functions
             V, W = VW(lBr, mBr, theta, phi)
-
-            Fth = np.dot(Br, np.real(V.T)) - \
-                  np.dot(Bi, np.imag(V.T)) + \
-                  np.dot(Ci, np.real(W.T)) + \
-                  np.dot(Cr, np.imag(W.T))
-
-            Fph = -np.dot(Cr, np.real(V.T)) + \
-                   np.dot(Ci, np.imag(V.T)) + \
-                   np.dot(Bi, np.real(W.T)) + \
-                   np.dot(Br, np.imag(W.T))
+            Fth, Fph = VWsynth(Br, Bi, Cr, Ci, V, W)
 
             if self.grid:
 
@@ -8,7 +8,10 @@
 """
 from __future__ import print_function
 import doctest
+import os
 import pdb
+import tempfile
+import weakref
 import numpy as np
 import numpy.ma as ma
 import numpy.linalg as la
@@ -35,6 +38,226 @@ try:
 except:
     print('h5py is not installed: Ctilde(object cannot be saved)')
 
+
+def chanalloc(shape, dirname=None, dtype=complex):
+    """ allocate a zeroed channel array
+
+    Parameters
+    ----------
+
+    shape : tuple
+    dirname : string
+        if None the array is kept in memory, otherwise it is a
+        np.memmap backed by a temporary file created in dirname
+    dtype : numpy dtype
+
+    Returns
+    -------
+
+    C : np.ndarray or np.memmap
+
+    Notes
+    -----
+
+    The temporary file is only a backing store. On POSIX systems it is
+    unlinked as soon as it is mapped, its disk space is released with
+    the last view of C. Elsewhere it is removed when C is garbage
+    collected.
+
+    """
+    if dirname is None:
+        return np.zeros(shape, dtype=dtype)
+    fd, filename = tempfile.mkstemp(suffix='.dat', dir=dirname)
+    os.close(fd)
+    logger.info(" chanalloc %s %s -> %s", str(shape), str(dtype), filename)
+    C = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    if os.name == 'posix':
+        os.remove(filename)
+    else:
+        weakref.finalize(C, _rmtemp, filename)
+    return C
+
+
+def _rmtemp(filename):
+    """ remove a chanalloc temporary file (see chanalloc)
+    """
+    try:
+        os.remove(filename)
+    except OSError:
+        logger.warning(" chanalloc file %s not removed", filename)
+
+
+def fchunks(n, nchunk=None):
+    """ generator of the slices of a n points axis by chunks of nchunk points
+
+    Parameters
+    ----------
+
+    n : int
+    nchunk : int
+        if None a single chunk is returned
+
+    Examples
+    --------
+
+    >>> [ (u.start,u.stop) for u in fchunks(5,2) ]
+    [(0, 2), (2, 4), (4, 5)]
+
+    """
+    if (nchunk is None) or (nchunk < 1):
+        nchunk = max(n, 1)
+    for k0 in range(0, n, nchunk):
+        yield slice(k0, min(k0 + nchunk, n))
+
+
+def _nocopy(cls, x, y, **kwargs):
+    """ build a Bsignal of class cls sharing y without copy
+
+    Bsignal.__init__ casts y to complex, which copies y and would load
+    a memmap in memory.
+
+    """
+    y0 = np.zeros((1,)*(y.ndim-1) + (len(x),))
+    S = cls(x=x, y=y0, **kwargs)
+    S.y = y
+    return S
+
+
+def _energy(x, y, Friis=True, mode='mean', fchunk=None):
+    """ energy along the last (frequency) axis of y by frequency chunks
+
+    Parameters
+    ----------
+
+    x : np.array (,f)
+        frequency (GHz)
+    y : np.array (...,f)
+    Friis : boolean
+        apply the Friis factor
+    mode : string
+        center | mean | integ | first | last
+
+    See Also
+    --------
+
+    pylayers.signal.bsignal.FUsignal.energy
+
+    """
+    nf = len(x)
+    dk = {'center': nf//2, 'first': 0, 'last': nf-1}
+    if mode in dk:
+        k = dk[mode]
+        H = y[..., k]
+        if Friis:
+            H = H*(-1j*0.3/(4*np.pi*x[k]))
+        return np.real(H*np.conj(H))
+    E = 0
+    for u in fchunks(nf, fchunk):
+        H = np.asarray(y[..., u])
+        if Friis:
+            H = H*(-1j*0.3/(4*np.pi*x[u]))
+        E = E + np.sum(np.real(H*np.conj(H)), axis=-1)
+    if mode == 'mean':
+        E = E/nf
+    if mode == 'integ':
+        E = E*(x[1]-x[0])
+    return E
+
+
+def _rotate(Ra, Rb, Ctt, Ctp, Cpt, Cpp):
+    """ apply the 2x2 rotations Rb (left) and Ra (right) to the ray channel
+
+    Ra, Rb : 2 x 2 x r
+    Ctt, Ctp, Cpt, Cpp : r x f
+
+    Returns
+    -------
+
+    Cttl, Ctpl, Cptl, Cppl : r x f
+
+    """
+    #r0 = rb00
+    r0 = Rb[0,0,:][:, None]
+    #r1 = rb01
+    r1 = Rb[0,1,:][:, None]
+
+    t00 = r0 * Ctt + r1 * Cpt
+    t01 = r0 * Ctp + r1 * Cpp
+
+    #r0 = rb10
+    r0 = Rb[1, 0,:][:, None]
+    #r1 = rb11
+    r1 = Rb[1, 1,:][:, None]
+
+    t10 = r0 * Ctt + r1 * Cpt
+    t11 = r0 * Ctp + r1 * Cpp
+
+    #r0 = ra00
+    r0 = Ra[0, 0, :][:, None]
+    #r1 = ra10
+    r1 = Ra[1, 0, :][:, None]
+
+    Cttl = t00 * r0 + t01 * r1
+    Cptl = t10 * r0 + t11 * r1
+
+    #r0 = ra01
+    r0 = Ra[0, 1, :][:, None]
+    #r1 = ra11
+    r1 = Ra[1, 1, :][:, None]
+
+    Ctpl = t00 * r0 + t01 * r1
+    Cppl = t10 * r0 + t11 * r1
+
+    return Cttl, Ctpl, Cptl, Cppl
+
+
+def ctildeconcat(lC):
+    """ concatenate the rays of a list of Ctilde
+
+    Parameters
+    ----------
+
+    lC : list of Ctilde
+        same frequency points and, once in the local frames, same
+        antenna rotations
+
+    Returns
+    -------
+
+    C : Ctilde
+    ptr : np.array (len(lC)+1)
+        rays of lC[k] are C rays ptr[k]:ptr[k+1]
+
+    Notes
+    -----
+
+    The antennas of the concatenated channel are evaluated once for all
+    the rays by Ctilde.prop2tran.
+
+    """
+    C0 = lC[0]
+    nray = np.array([Ck.nray for Ck in lC])
+    ptr = np.hstack((0, np.cumsum(nray)))
+    dirname = getattr(C0, 'dirname', None)
+    Cf = chanalloc((2, 2, ptr[-1], C0.nfreq), dirname)
+    for k, Ck in enumerate(lC):
+        u = slice(ptr[k], ptr[k+1])
+        Cf[0, 0, u] = Ck.Ctt.y
+        Cf[0, 1, u] = Ck.Ctp.y
+        Cf[1, 0, u] = Ck.Cpt.y
+        Cf[1, 1, u] = Ck.Cpp.y
+    C = Ctilde()
+    C.fromarray(C0.fGHz, Cf, fchunk=getattr(C0, 'fchunk', None),
+                dirname=dirname)
+    for name in ['tauk', 'tang', 'rang', 'tangl', 'rangl']:
+        setattr(C, name, np.concatenate([getattr(Ck, name) for Ck in lC]))
+    C.islocal = C0.islocal
+    if hasattr(C0, 'Ta'):
+        C.Ta = C0.Ta
+        C.Tb = C0.Tb
+    return C, ptr
+
+
 class AFPchannel(bs.FUsignal):
     """ Angular Frequency Profile channel
 
@@ -3141,6 +3364,9 @@ class Tchannel(bs.FUsignal):
         self.windowed = False
         self.calibrated = False
         self.filcal = "calibration.mat"
+        # out-of-core mode (see Ctilde._prop2tran)
+        self.fchunk = None
+        self.dirname = None
         bs.FUsignal.__init__(self,x=x,y=y,label='Channel')
 
 
@@ -3405,7 +3631,13 @@ class Tchannel(bs.FUsignal):
 
         pylayers.signal.channel.rir
 
+        In out-of-core mode (self.fchunk not None) the rays are processed
+        by blocks and the impulse responses are written in an array
+        allocated with chanalloc in self.dirname.
+
         """
+        if getattr(self, 'fchunk', None) is not None:
+            return self._applywav(Wgam)
 
         # product in frequency domain between Channel (self) and waveform
         Y = self.apply(Wgam)
@@ -3413,6 +3645,46 @@ class Tchannel(bs.FUsignal):
         rir = Y.rir(Nz=500,ffts=1)
         return rir
 
+    def _raychunk(self, nf):
+        """ number of rays of a block of about nray x fchunk values on a nf points axis
+        """
+        nray = self.y.shape[0]
+        return max(1, (self.fchunk*nray)//max(nf, 1))
+
+    def _applywav(self, Wgam=[]):
+        """ applywav by blocks of rays (out-of-core mode)
+
+        The blocks share the time axis of the whole channel (see Tchannel.rir)
+        A channel without ray gives an empty TUsignal.
+
+        """
+        nray = self.y.shape[0]
+        if nray == 0:
+            return bs.TUsignal(x=np.zeros(0), y=np.zeros((0, 0)))
+        tau = self.taud + self.taue
+        taumin = min(tau)
+        taumax = max(tau)
+        rir = None
+        for u in fchunks(nray, self._raychunk(len(self.x))):
+            Hu = _nocopy(Tchannel, self.x, self.y[u], tau=self.taud[u],
+                         dod=self.dod[u], doa=self.doa[u])
+            Hu.taue = self.taue[u]
+            s = Hu.apply(Wgam).ift(500, 1)
+            Nt = s.y.shape[-1]
+            if rir is None:
+                t0 = s.x[0]
+                te = s.x[-1]
+                dx = s.x[1]-s.x[0]
+                N = int(np.ceil((taumax-taumin)/dx)) + Nt
+                rir = chanalloc((nray, N), self.dirname, dtype=float)
+            # convert tau in an integer offset
+            itau = np.floor((tau[u]-taumin)/dx).astype(int)
+            col2 = itau[:, None] + np.arange(Nt)[None, :]
+            col1 = np.arange(u.start, u.stop)[:, None]
+            rir[col1, col2] = np.real(s.y).reshape(len(itau), Nt)
+        t = np.linspace(t0+taumin, te+taumax, N)
+        return _nocopy(bs.TUsignal, t, rir)
+
 
     def getcir(self,BWGHz=1,Nf=40000,fftshift=False):
         """ get the channel impulse response
@@ -3433,16 +3705,24 @@ class Tchannel(bs.FUsignal):
         fGHz  = np.linspace(0,BWGHz,Nf)
         dfGHz = fGHz[1]-fGHz[0]
         tauns = np.linspace(0,1/dfGHz,Nf)
-        # E : r x nr x nt x f
-        E    = np.exp(-2*1j*np.pi*self.taud[:,None,None,None]*fGHz[None,None,None,:])
-        # self.y : r x nr x nt x f
-        if self.y.shape[3]==E.shape[3]:
-            H    = np.sum(E*self.y,axis=0)
+        if getattr(self, 'fchunk', None) is not None:
+            # out-of-core mode : sum over blocks of rays
+            lu = fchunks(self.y.shape[0], self._raychunk(Nf))
         else:
-            if self.y.shape[3]==1:
-                H    = np.sum(E*self.y,axis=0)
+            lu = [slice(None)]
+        H = 0
+        for u in lu:
+            # E : r x nr x nt x f
+            E    = np.exp(-2*1j*np.pi*self.taud[u,None,None,None]*fGHz[None,None,None,:])
+            # self.y : r x nr x nt x f
+            y    = self.y[u]
+            if y.shape[3]==E.shape[3]:
+                H    = H + np.sum(E*y,axis=0)
             else:
-                H    = np.sum(E*self.y[:,:,:,0][:,:,:,None],axis=0)
+                if y.shape[3]==1:
+                    H    = H + np.sum(E*y,axis=0)
+                else:
+                    H    = H + np.sum(E*y[:,:,:,0][:,:,:,None],axis=0)
         # back in time - last axis is frequency (axis=2)
         cir  = np.fft.ifft(H,axis=2)
         if fftshift:
@@ -4062,7 +4342,9 @@ class Tchannel(bs.FUsignal):
         #  axis 1 : frequency
         #
 
-        if self.isFriis:
+        if getattr(self, 'fchunk', None) is not None:
+            Etot = _energy(self.x, self.y, not self.isFriis, mode, self.fchunk)
+        elif self.isFriis:
             Etot = bs.FUsignal.energy(self,axis=1,mode=mode,Friis=False)
         else:
             Etot = bs.FUsignal.energy(self,axis=1,mode=mode,Friis=True)
@@ -5037,6 +5319,43 @@ class Ctilde(PyLayers):
         #
         self.tangl = np.array([[np.pi/2,np.pi/2]])
         self.rangl = np.array([[np.pi/2,3*np.pi/2]])
+        # out-of-core mode (see Ctilde.fromarray)
+        self.fchunk = None
+        self.dirname = None
+
+    def fromarray(self, fGHz, C, fchunk=None, dirname=None):
+        """ set the ray propagation channel from a 2 x 2 x r x f array
+
+        Parameters
+        ----------
+
+        fGHz : np.array (,f)
+        C : np.array or np.memmap (2 x 2 x r x f)
+            C is not copied, Ctt,Ctp,Cpt,Cpp are views of C
+        fchunk : int
+            number of frequency points processed at once by locbas,
+            energy and prop2tran (default None : all frequency points)
+        dirname : string
+            directory of the memmap files of the channels derived
+            from C (default None : in memory)
+
+        Notes
+        -----
+
+        With a memmap C (see chanalloc) and fchunk set, the
+        memory used by locbas, energy and prop2tran does not grow
+        with the number of frequency points.
+
+        """
+        self.fGHz = fGHz
+        self.nfreq = len(fGHz)
+        self.nray = C.shape[2]
+        self.Ctt = _nocopy(bs.FUsignal, fGHz, C[0, 0])
+        self.Ctp = _nocopy(bs.FUsignal, fGHz, C[0, 1])
+        self.Cpt = _nocopy(bs.FUsignal, fGHz, C[1, 0])
+        self.Cpp = _nocopy(bs.FUsignal, fGHz, C[1, 1])
+        self.fchunk = fchunk
+        self.dirname = dirname
 
     def __repr__(self):
         s = 'Ctilde : Ray Propagation Channel Tensor (2x2xrxf)'+'\n---------\n'
@@ -5756,43 +6075,25 @@ class Ctilde(PyLayers):
         self.tangl = tangl
         self.rangl = rangl
 
-        #uf = np.ones(self.nfreq)
+        fchunk = getattr(self, 'fchunk', None)
+        if fchunk is not None:
+            #
+            # out-of-core mode : in place by frequency chunks
+            #
+            for u in fchunks(len(fGHz), fchunk):
+                Cl = _rotate(Ra, Rb, self.Ctt.y[:, u], self.Ctp.y[:, u],
+                                     self.Cpt.y[:, u], self.Cpp.y[:, u])
+                self.Ctt.y[:, u] = Cl[0]
+                self.Ctp.y[:, u] = Cl[1]
+                self.Cpt.y[:, u] = Cl[2]
+                self.Cpp.y[:, u] = Cl[3]
+            return
 
         #
         # r0 : r x 1(f)
         #
-
-        #r0 = rb00
-        r0 = Rb[0,0,:][:, None]
-        #r1 = rb01
-        r1 = Rb[0,1,:][:, None]
-
-        t00 = r0 * self.Ctt.y + r1 * self.Cpt.y
-        t01 = r0 * self.Ctp.y + r1 * self.Cpp.y
-
-        #r0 = rb10 
-        r0 = Rb[1, 0,:][:, None]
-        #r1 = rb11 
-        r1 = Rb[1, 1,:][:, None]
-
-        t10 = r0 * self.Ctt.y + r1 * self.Cpt.y
-        t11 = r0 * self.Ctp.y + r1 * self.Cpp.y
-
-        #r0 = ra00 
-        r0 = Ra[0, 0, :][:, None]
-        #r1 = ra10 
-        r1 = Ra[1, 0, :][:, None]
-
-        Cttl = t00 * r0 + t01 * r1
-        Cptl = t10 * r0 + t11 * r1
-
-        #r0 = ra01
-        r0 = Ra[0, 1, :][:, None]
-        #r1 = ra11
-        r1 = Ra[1, 1, :][:, None]
-
-        Ctpl = t00 * r0 + t01 * r1
-        Cppl = t10 * r0 + t11 * r1
+        Cttl, Ctpl, Cptl, Cppl = _rotate(Ra, Rb, self.Ctt.y, self.Ctp.y,
+                                         self.Cpt.y, self.Cpp.y)
 
         self.Ctt = bs.FUsignal(fGHz, Cttl)
         self.Ctp = bs.FUsignal(fGHz, Ctpl)
@@ -6033,10 +6334,17 @@ class Ctilde(PyLayers):
         #  axis 1 : frequency
         #
 
-        ECtt = self.Ctt.energy(axis=1,Friis=Friis,mode=mode)
-        ECtp = self.Ctp.energy(axis=1,Friis=Friis,mode=mode)
-        ECpt = self.Cpt.energy(axis=1,Friis=Friis,mode=mode)
-        ECpp = self.Cpp.energy(axis=1,Friis=Friis,mode=mode)
+        fchunk = getattr(self, 'fchunk', None)
+        if fchunk is not None:
+            ECtt = _energy(self.fGHz, self.Ctt.y, Friis, mode, fchunk)
+            ECtp = _energy(self.fGHz, self.Ctp.y, Friis, mode, fchunk)
+            ECpt = _energy(self.fGHz, self.Cpt.y, Friis, mode, fchunk)
+            ECpp = _energy(self.fGHz, self.Cpp.y, Friis, mode, fchunk)
+        else:
+            ECtt = self.Ctt.energy(axis=1,Friis=Friis,mode=mode)
+            ECtp = self.Ctp.energy(axis=1,Friis=Friis,mode=mode)
+            ECpt = self.Cpt.energy(axis=1,Friis=Friis,mode=mode)
+            ECpp = self.Cpp.energy(axis=1,Friis=Friis,mode=mode)
 
         if sumray:
             ECtt = np.sum(ECtt,axis=0)
@@ -6136,6 +6444,12 @@ class Ctilde(PyLayers):
 
         H : Tchannel(bs.FUsignal)
 
+        Notes
+        -----
+
+        If self.fchunk is set (see Ctilde.fromarray) the transmission
+        channel is built by frequency chunks (see Ctilde._prop2tran)
+
 
         """
         freq  = self.fGHz
@@ -6151,6 +6465,10 @@ class Ctilde(PyLayers):
         if b ==[]:
             b = ant.Antenna('Omni',param={'pol':'t','GmaxdB':0},fGHz=self.fGHz)
 
+        fchunk = getattr(self, 'fchunk', None)
+        if fchunk is not None:
+            return self._prop2tran(a, b, Friis, fchunk)
+
         a.eval(th = self.tangl[:, 0], ph = self.tangl[:, 1])
         Fat = bs.FUsignal(a.fGHz, a.Ft)
         Fap = bs.FUsignal(a.fGHz, a.Fp)
@@ -6247,6 +6565,86 @@ class Ctilde(PyLayers):
 
         return H
 
+    def _prop2tran(self, a, b, Friis, fchunk):
+        """ transform propagation channel into transmission channel by frequency chunks
+
+        Parameters
+        ----------
+
+        a : antenna or array a
+        b : antenna or array b
+        Friis : boolean
+        fchunk : int
+            number of frequency points processed at once
+
+        Returns
+        -------
+
+        H : Tchannel(bs.FUsignal)
+            H.y is allocated with chanalloc in self.dirname
+
+        Notes
+        -----
+
+        The antennas are evaluated on each chunk of self.fGHz, the
+        Friis factor is applied on the fly and the chunk is written
+        in H.y. The debug information of prop2tran is not available.
+
+        """
+        fGHz = self.fGHz
+        nf = len(fGHz)
+        lfGHz = [a.fGHz, b.fGHz]
+        y = None
+        for u in fchunks(nf, fchunk):
+            Fat, Fap = a.eval(th=self.tangl[:, 0], ph=self.tangl[:, 1],
+                              fGHz=fGHz[u], inplace=False)
+            Fbt, Fbp = b.eval(th=self.rangl[:, 0], ph=self.rangl[:, 1],
+                              fGHz=fGHz[u], inplace=False)
+            # r x f
+            ctt = self.Ctt.y[:, u]
+            ctp = self.Ctp.y[:, u]
+            cpt = self.Cpt.y[:, u]
+            cpp = self.Cpp.y[:, u]
+            if Fat.ndim == 3:
+                ctt, ctp = ctt[:, None, :], ctp[:, None, :]
+                cpt, cpp = cpt[:, None, :], cpp[:, None, :]
+            t1 = ctt * Fat + ctp * Fap
+            t2 = cpt * Fat + cpp * Fap
+            if t1.ndim == 3:
+                T1 = t1[:, None, :, :]
+                T2 = t2[:, None, :, :]
+            else:
+                T1 = t1[:, None, None, :]
+                T2 = t2[:, None, None, :]
+            if Fbt.ndim == 3:
+                FBt = Fbt[:, :, None, :]
+                FBp = Fbp[:, :, None, :]
+            else:
+                FBt = Fbt[:, None, None, :]
+                FBp = Fbp[:, None, None, :]
+            # r x Nb x Na x f
+            alpha = (np.einsum('ljkm,lkim->ljim', FBt, T1) +
+                     np.einsum('ljkm,lkim->ljim', FBp, T2))
+            if Friis:
+                alpha = alpha * (-1j*0.3/(4*np.pi*fGHz[u]))
+            if y is None:
+                y = chanalloc(alpha.shape[:3] + (nf,), self.dirname)
+            y[..., u] = alpha
+
+        # restore the antennas frequency axis
+        for A, fA in zip([a, b], lfGHz):
+            A.fGHz = fA
+            A.nf = len(fA)
+            if hasattr(A, '_fGHz'):
+                A.param.update({'fGHz': fA})
+
+        H = _nocopy(Tchannel, fGHz, y,
+                    tau=self.tauk, dod=self.tang, doa=self.rang)
+        H.isFriis = Friis
+        H.fchunk = fchunk
+        H.dirname = self.dirname
+        return H
+
 if __name__ == "__main__":
     plt.ion()
     doctest.testmod()
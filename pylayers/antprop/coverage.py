@@ -29,7 +29,8 @@ else:
 
 import pdb
 import doctest
-from itertools import product
+import multiprocessing as mp
+from pylayers.antprop.channel import chanalloc
 
 try:
     from mayavi import mlab
@@ -38,6 +39,33 @@ except:
     print('mayavi not installed')
 
 
+def _covertile_init(C,lactiveAP):
+    """ initialize a Coverage.cover worker process
+
+    Parameters
+    ----------
+
+    C : Coverage
+    lactiveAP : list
+        active access points
+
+    Notes
+    -----
+
+    The context is stored in a module global. With the fork start method
+    the Layout is inherited by the worker without being pickled.
+
+    """
+    global _covertile_ctx
+    _covertile_ctx = (C,lactiveAP)
+
+def _covertile(bg):
+    """ evaluate the tile bg of the coverage (see Coverage._tile)
+    """
+    C,lactiveAP = _covertile_ctx
+    return bg,C._tile(bg,lactiveAP)
+
+
 class Coverage(PyLayers):
     """ Handle Layout Coverage
 
@@ -295,7 +323,12 @@ class Coverage(PyLayers):
         snr  : boolean
         best : boolean
         size : integer 
-            size of grid points block
+            size of grid points block (tile)
+        nproc : integer
+            number of processes evaluating the tiles (default 1)
+        dirname : string
+            if not None the f x g x a outputs are memmap files created
+            in dirname (see pylayers.antprop.channel.chanalloc)
 
         Examples
         --------
@@ -331,6 +364,11 @@ class Coverage(PyLayers):
         + snro : SNR polar o (H)
         + snrp : SNR polar p (H)
 
+        The grid is split in tiles of size points. Each tile is evaluated
+        independently, possibly by a pool of nproc processes sharing the
+        Layout (fork), and is written in the outputs as soon as it is
+        finished. evsnr, evsinr and evbestsv also proceed tile by tile.
+
         See Also
         --------
 
@@ -340,6 +378,8 @@ class Coverage(PyLayers):
         """
 
         sizebloc = kwargs.pop('size',100)
+        nproc = kwargs.pop('nproc',1)
+        dirname = kwargs.pop('dirname',None)
 
         #
         # select active AP
@@ -409,138 +449,147 @@ class Coverage(PyLayers):
         if self.ng != r1[-1]:
             r1 = np.append(r1,self.ng)
         lblock = list(zip(r1[0:-1],r1[1:]))
+        self.lblock = lblock
+        self.dirname = dirname
 
-        for bg in lblock:
-            p = product(range(bg[0],bg[1]),lactiveAP)
-            #
-            # pa : access point ,3
-            # pg : grid point ,2
-            #
-            # 1 x na
-
-            for k in p:
-                pg = self.grid[k[0],:]
-                pa = np.array(self.dap[k[1]]['p'])
-                # exemple with 3 AP
-                # 321 0
-                # 321 1
-                # 321 2
-                # 322 0
-                try:
-                    self.pa = np.vstack((self.pa,pa))
-                except:
-                    self.pa = pa
-                try:
-                    self.pg = np.vstack((self.pg,pg))
-                except:
-                    self.pg = pg
+        # retrieving dimensions along the 3 axis
+        # a : number of active access points
+        # g : grid point
+        # f : frequency
 
-            self.pa = self.pa.T
-            shpa = self.pa.shape
-            shpg = self.pg.shape
+        na = len(lactiveAP)
+        self.na = na
+        ng = self.ng
+        nf = self.nf
 
-            # extend in 3 dimensions if necessary
+        # access points 3 x a and grid points 3 x g
+        self.pa = np.array([self.dap[iap]['p'] for iap in lactiveAP],dtype=float).T
+        if self.pa.shape[0] != 3:
+            self.pa = np.vstack((self.pa,np.ones(na)))
+        self.pg = np.vstack((self.grid.T,self.zgrid*np.ones(ng)))
 
-            if shpa[0] != 3:
-                self.pa = np.vstack((self.pa,np.ones(shpa[1])))
+        #
+        # f x g x a outputs, written tile by tile
+        #
+        for name in ['Lwo','Lwp','Edo','Edp','freespace','tgain','CmWo','CmWp']:
+            setattr(self,name,chanalloc((nf,ng,na),dirname,dtype=float))
 
-            self.pg = self.pg.T
-            self.pg = np.vstack((self.pg,self.zgrid*np.ones(shpg[0])))
+        if nproc > 1:
+            pool = mp.Pool(processes=nproc,
+                           initializer=_covertile_init,
+                           initargs=(self,lactiveAP))
+            try:
+                for bg,tile in pool.imap_unordered(_covertile,lblock):
+                    self._settile(bg,tile)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for bg in lblock:
+                self._settile(bg,self._tile(bg,lactiveAP))
 
-            # retrieving dimensions along the 3 axis
-            # a : number of active access points
-            # g : grid block
-            # f : frequency
+        if self.snr:
+            self.evsnr()
+        if self.sinr:
+            self.evsinr()
+        if self.best:
+            self.evbestsv()
 
-            na = len(lactiveAP)
-            self.na = na
-            ng = self.ng
-            nf = self.nf
+    def _tile(self,bg,lactiveAP):
+        """ evaluate the coverage of a tile of grid points
 
-            # calculate antenna gain from ap to grid point
-            #
-            # loop over all AP
-            #
-            k = 0
-            for iap in self.dap:
-                # select only one access point
-                # n
-                u = na*np.arange(0,bg[1]-bg[0],1).astype('int')+k
-                if self.dap[iap]['on']:
-                    pa = self.pa[:,u]
-                    pg = self.pg[:,u]
-                    azoffset = self.dap[iap]['phideg']*np.pi/180.
-                    # the eval function of antenna should also specify polar
-                    self.dap[iap].A.eval(fGHz=self.fGHz, pt=pa, pr=pg, azoffset=azoffset)
-                    gain = (self.dap[iap].A.G).T
-                    # to handle omnidirectional antenna (nf,1,1)
-                    if gain.shape[1]==1:
-                        gain = np.repeat(gain,bg[1]-bg[0],axis=1)
-                    if k==0:
-                        tgain = gain[:,:,None]
-                    else:
-                        tgain = np.dstack((tgain,gain[:,:,None]))
-                    k = k+1
-
-            tgain = tgain.reshape(nf,tgain.shape[1]*tgain.shape[2])
-            Lwo,Lwp,Edo,Edp = loss.Losst(self.L, self.fGHz, self.pa, self.pg, dB=False)
-            logger.info('Lwo[0][0] %.2f' % Lwo[0,0])
-            freespace = loss.PL(self.fGHz, self.pa, self.pg, dB=False)
-            try:
-                self.Lwo = np.hstack((self.Lwo,Lwo))
-                self.Lwp = np.hstack((self.Lwp,Lwp))
-                self.Edo = np.hstack((self.Edo,Edo))
-                self.Edp = np.hstack((self.Edp,Edp))
-                self.freespace = np.hstack((self.freespace,freespace))
-                self.tgain = np.hstack((self.tgain,tgain))
-            except:
-                self.Lwo = Lwo
-                self.Lwp = Lwp
-                self.Edo = Edo
-                self.Edp = Edp
-                self.freespace = freespace
-                self.tgain = tgain
+        Parameters
+        ----------
 
+        bg : tuple
+            (first,last+1) grid point indices of the tile
+        lactiveAP : list
+            active access points
 
-        self.Lwo = self.Lwo.reshape(nf,ng,na)
-        self.Edo = self.Edo.reshape(nf,ng,na)
-        self.Lwp = self.Lwp.reshape(nf,ng,na)
-        self.Edp = self.Edp.reshape(nf,ng,na)
-        self.tgain = self.tgain.reshape(nf,ng,na)
+        Returns
+        -------
+
+        tile : dict of f x g x a arrays
+            Lwo,Lwp,Edo,Edp,freespace,tgain,CmWo,CmWp
 
-        self.freespace = self.freespace.reshape(nf,ng,na)
+        """
+        na = len(lactiveAP)
+        nf = self.nf
+        ngt = bg[1]-bg[0]
+        #
+        # pa : access point 3 x (g x a)
+        # pg : grid point 3 x (g x a)
+        #
+        # exemple with 3 AP
+        # 321 0
+        # 321 1
+        # 321 2
+        # 322 0
+        pa = np.tile(self.pa,ngt)
+        pg = np.repeat(self.pg[:,bg[0]:bg[1]],na,axis=1)
+
+        # calculate antenna gain from ap to grid point
+        #
+        # loop over all AP
+        #
+        tgain = np.empty((nf,ngt,na))
+        for k,iap in enumerate(lactiveAP):
+            # select only one access point
+            u = na*np.arange(0,ngt,1).astype('int')+k
+            azoffset = self.dap[iap]['phideg']*np.pi/180.
+            # the eval function of antenna should also specify polar
+            self.dap[iap].A.eval(fGHz=self.fGHz, pt=pa[:,u], pr=pg[:,u], azoffset=azoffset)
+            gain = (self.dap[iap].A.G).T
+            # to handle omnidirectional antenna (nf,1,1)
+            tgain[:,:,k] = gain.reshape(nf,-1)
+
+        Lwo,Lwp,Edo,Edp = loss.Losst(self.L, self.fGHz, pa, pg, dB=False)
+        freespace = loss.PL(self.fGHz, pa, pg, dB=False)
+
+        tile = {'Lwo':Lwo,'Lwp':Lwp,'Edo':Edo,'Edp':Edp,'freespace':freespace}
+        for name in tile:
+            tile[name] = tile[name].reshape(nf,ngt,na)
+        tile['tgain'] = tgain
 
         # transmitting power
         # f x g x a
 
         # CmW : Received Power coverage in mW
         # TODO : tgain in o and p polarization
-        self.CmWo = 10**(self.ptdbm[np.newaxis,...]/10.)*self.Lwo*self.freespace*self.tgain
-        self.CmWp = 10**(self.ptdbm[np.newaxis,...]/10.)*self.Lwp*self.freespace*self.tgain
-        #self.CmWo = 10**(self.ptdbm[np.newaxis,...]/10.)*self.Lwo*self.freespace
-        #self.CmWp = 10**(self.ptdbm[np.newaxis,...]/10.)*self.Lwp*self.freespace
+        PtmW = 10**(self.ptdbm[np.newaxis,...]/10.)
+        tile['CmWo'] = PtmW*tile['Lwo']*tile['freespace']*tgain
+        tile['CmWp'] = PtmW*tile['Lwp']*tile['freespace']*tgain
+        return tile
 
-
-        if self.snr:
-            self.evsnr()
-        if self.sinr:
-            self.evsinr()
-        if self.best:
-            self.evbestsv()
+    def _settile(self,bg,tile):
+        """ write a tile evaluated by _tile in the f x g x a outputs
+        """
+        logger.info('coverage tile %d:%d' % bg)
+        for name in tile:
+            getattr(self,name)[:,bg[0]:bg[1],:] = tile[name]
 
     def evsnr(self):
         """ calculates signal to noise ratio
+
+        The ratio is evaluated tile by tile (see cover)
+
         """
 
         NmW = 10**(self.pndbm/10.)[np.newaxis,:]
 
-        self.snro = self.CmWo/NmW
-        self.snrp = self.CmWp/NmW
+        shape = self.CmWo.shape
+        self.snro = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        self.snrp = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        for u in self._tiles():
+            self.snro[:,u,:] = self.CmWo[:,u,:]/NmW
+            self.snrp[:,u,:] = self.CmWp[:,u,:]/NmW
         self.snr = True
 
     def evsinr(self):
         """ calculates sinr
 
+        The ratio is evaluated tile by tile (see cover)
+
         """
 
         # na : number of access point
@@ -549,17 +598,22 @@ class Coverage(PyLayers):
         # U : 1 x 1 x na x na
         U = (np.ones((na,na))-np.eye(na))[np.newaxis,np.newaxis,:,:]
 
-        # CmWo : received power in mW orthogonal polarization
-        # CmWp : received power in mW parallel polarization
-
-        ImWo = np.einsum('ijkl,ijl->ijk',U,self.CmWo)
-        ImWp = np.einsum('ijkl,ijl->ijk',U,self.CmWp)
+        NmW = 10**(self.pndbm/10.)[np.newaxis,:]
 
+        shape = self.CmWo.shape
+        self.sinro = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        self.sinrp = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        for u in self._tiles():
+            # CmWo : received power in mW orthogonal polarization
+            # CmWp : received power in mW parallel polarization
+            CmWo = self.CmWo[:,u,:]
+            CmWp = self.CmWp[:,u,:]
 
-        NmW = 10**(self.pndbm/10.)[np.newaxis,:]
+            ImWo = np.einsum('ijkl,ijl->ijk',U,CmWo)
+            ImWp = np.einsum('ijkl,ijl->ijk',U,CmWp)
 
-        self.sinro = self.CmWo/(ImWo+NmW)
-        self.sinrp = self.CmWp/(ImWp+NmW)
+            self.sinro[:,u,:] = CmWo/(ImWo+NmW)
+            self.sinrp[:,u,:] = CmWp/(ImWp+NmW)
 
         self.sinr = True
 
@@ -569,27 +623,31 @@ class Coverage(PyLayers):
         Notes
         -----
 
-        C.bestsv
+        C.bestsv : f x g x a
+            ka+1 if ka is the best server of the grid point, 0 otherwise
+
+        The map is evaluated tile by tile (see cover)
 
         """
         na = self.na
-        ng = self.ng
-        nf = self.nf
+        shape = self.CmWo.shape
+        self.bestsvo = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        self.bestsvp = chanalloc(shape,getattr(self,'dirname',None),dtype=float)
+        ka = np.arange(1,na+1)[np.newaxis,np.newaxis,:]
         # find best server regions
-        Vo = self.CmWo
-        Vp = self.CmWp
-        self.bestsvo = np.empty(nf*ng*na).reshape(nf,ng,na)
-        self.bestsvp = np.empty(nf*ng*na).reshape(nf,ng,na)
-        for kf in range(nf):
-            MaxVo = np.max(Vo[kf,:,:],axis=1)
-            MaxVp = np.max(Vp[kf,:,:],axis=1)
-            for ka in range(na):
-                uo = np.where(Vo[kf,:,ka]==MaxVo)
-                up = np.where(Vp[kf,:,ka]==MaxVp)
-                self.bestsvo[kf,uo,ka]=ka+1
-                self.bestsvp[kf,up,ka]=ka+1
+        for u in self._tiles():
+            Vo = self.CmWo[:,u,:]
+            Vp = self.CmWp[:,u,:]
+            self.bestsvo[:,u,:] = np.where(Vo==np.max(Vo,axis=2)[...,None],ka,0)
+            self.bestsvp[:,u,:] = np.where(Vp==np.max(Vp,axis=2)[...,None],ka,0)
         self.best = True
 
+    def _tiles(self):
+        """ slices of the grid point tiles used by cover
+        """
+        lblock = getattr(self,'lblock',[(0,self.CmWo.shape[1])])
+        return [slice(b0,b1) for (b0,b1) in lblock]
+
 
 #    def showEd(self,polar='o',**kwargs):
 #        """ shows a map of direct path excess delay
@@ -901,12 +959,13 @@ class Coverage(PyLayers):
             if kwargs['db']:
                 U = 10*np.log10(U)
 
-        D = np.sqrt(np.sum((self.pa-self.pg)*(self.pa-self.pg),axis=0))
+        # g x a
+        V = self.pa[:,np.newaxis,:]-self.pg[:,:,np.newaxis]
+        D = np.sqrt(np.sum(V*V,axis=0))
         if kwargs['a']!=-1:
-            D = D.reshape(self.ng,self.na)
             ax.semilogx(D[:,kwargs['a']],U,'.',color=kwargs['col'],label=kwargs['label'])
         else:
-            ax.semilogx(D,U,'.',color=kwargs['col'],label=kwargs['label'])
+            ax.semilogx(D.reshape(self.ng*self.na),U,'.',color=kwargs['col'],label=kwargs['label'])
 
         return fig,ax
 
@@ -39,11 +39,10 @@ def diff(fGHz,phi0,phi,si,sd,N,mat0,matN,beta=np.pi/2,mode='tab',debug=False):
     beta : np.array (Nb)
         skew incidence angle (rad)
     mode : str ( 'tab','exact')
-        if 'tab': the Fresnel function is interpolated
-        ( increase speed)
+        if 'tab': the Fresnel function is interpolated in the table
+        of the process ( increase speed, see Ftab)
         if 'exact': the Fresnel function is computed for each values
-        ( increase accuracy)
-        (see FreF)
+        ( increase accuracy, see FreF)
 
     Returns
     -------
@@ -93,38 +92,48 @@ def diff(fGHz,phi0,phi,si,sd,N,mat0,matN,beta=np.pi/2,mode='tab',debug=False):
     if not isinstance(beta,np.ndarray):
         beta = np.array([beta])
 
-    fGHz  = fGHz[:,None]
-    phi0  = phi0[None,:]
-    phi   = phi[None,:]
-    si    = si[None,:]
-    sd    = sd[None,:]
-    N     = N[None,:]
-    beta  = beta[None,:]
+    D = Dkernel(fGHz,phi0,phi,si,sd,N,beta=beta,mode=mode)
+    Rsofto,Rhardo,Rsoftn,Rhardn = Rwedge(fGHz,phi0,phi,N,mat0,matN)
 
-    L     = si*sd/(si+sd)
-    k     = 2*np.pi*fGHz/0.3
+#--------------------------------------
+#n>=1 : exterior wedge
+#--------------------------------------
+    Dsoft = D[0]+D[1]+Rsoftn*D[2]+Rsofto*D[3]
+    Dhard = D[0]+D[1]+Rhardn*D[2]+Rhardo*D[3]
+
+    if debug:
+        return Dsoft,Dhard,D[0],D[1],D[2],D[3]
+    else :
+        return Dsoft,Dhard
 
-#--------------------------------------------------
-# R on faces 'o' and 'n'
-#--------------------------------------------------
 
+def Rwedge(fGHz,phi0,phi,N,mat0,matN):
+    """ reflection coefficients on the faces o and n of the wedges
 
-    tho  = np.empty((fGHz.shape[0],phi.shape[1]))
-    thn  = np.empty((fGHz.shape[0],phi.shape[1]))
-    # PHI0 = phi0 * np.ones(phi.shape)
-    # PHI  = np.ones(phi0.shape)*phi
-    # BN   = np.ones(phi0.shape)*N
+    Parameters
+    ----------
 
+    fGHz : np.array (Nf)
+    phi0 : np.array (Nr)
+    phi : np.array (Nr)
+    N : np.array (Nr)
+    mat0 : Mat
+        material of face o
+    matN : Mat
+        material of face n
 
+    Returns
+    -------
 
-    c1 = phi>phi0
-    c2 = ~c1
-    tho[:,c1[0,:]] = phi0[:,c1[0,:]]
-    thn[:,c1[0,:]] = N[:,c1[0,:]]*np.pi-phi[:,c1[0,:]]
-    tho[:,c2[0,:]] = phi[:,c2[0,:]]
-    thn[:,c2[0,:]] = N[:,c2[0,:]]*np.pi-phi0[:,c2[0,:]]
+    Rsofto,Rhardo,Rsoftn,Rhardn : np.array (Nf,Nr) or (1,Nr)
+        the metallic coefficients do not depend on frequency
 
+    """
+    k = 2*np.pi*fGHz[:,None]/0.3
 
+    c1 = phi>phi0
+    tho = np.where(c1,phi0,phi)[None,:]
+    thn = np.where(c1,N*np.pi-phi,N*np.pi-phi0)[None,:]
 
     er0  = np.real(mat0['epr'])
     err0 = np.imag(mat0['epr'])
@@ -140,116 +149,176 @@ def diff(fGHz,phi0,phi,si,sd,N,mat0,matN,beta=np.pi/2,mode='tab',debug=False):
     sigmaN = matN['sigma']
     deltahN = matN['roughness']
 
-
     Rsofto,Rhardo = R(tho,k,er0,err0,sigma0,ur0,urr0,deltah0)
     Rsoftn,Rhardn = R(thn,k,erN,errN,sigmaN,urN,urrN,deltahN)
 
-#--------------------------------------------------
-# grazing angle Go et Gn
-#--------------------------------------------------
+    return Rsofto,Rhardo,Rsoftn,Rhardn
 
-    Gsofto,Gsoftn = G(N,phi0,Rsofto,Rsoftn)
 
-    Ghardo,Ghardn = G(N,phi0,Rhardo,Rhardn)
+def Dkernel(fGHz,phi0,phi,si,sd,N,beta=np.pi/2,mode='tab'):
+    """ the four terms of the diffraction coefficient in one pass
 
-#--------------------------------------------------
-#calcul des 4 termes du coeff diff
-#--------------------------------------------------
-    #by construction
-    #0 < KLA < 2*k*L
-    klamax = 2*np.max(k)*np.max(L)
-    if mode == 'tab':
-        #xF0 = np.logspace(-6,-2,1000)
-        #xF1 = np.logspace(-2,np.log10(klamax),1000)
-        #xF = np.hstack((xF0,xF1))
-        #pdb.set_trace()
-        # xF = np.logspace(-6,np.log10(klamax),1000)
-        xF =  np.linspace(-8,np.log10(klamax),2000)
-        pxF = 10**xF
-        F = FreF(pxF)[0]
-    else :
-        xF = []
-        F=[]
+    Parameters
+    ----------
+
+    fGHz : np.array (Nf)
+    phi0 : np.array (Nr)
+    phi : np.array (Nr)
+    si : np.array (Nr)
+        distance source-D
+    sd : np.array (Nr)
+        distance D-observation
+    N : np.array (Nr)
+        wedge parameter
+    beta : np.array (Nr)
+        skew incidence angle
+    mode : str ( 'tab','exact')
+        if 'tab' the transition function is interpolated in the
+        table of the process (see Ftab)
 
-    sign  =  1.0
-    D1     = Dfunc(sign,k,N,phi-phi0,si,sd,xF,F,beta)
+    Returns
+    -------
 
-    sign  =  -1.0
-    D2     = Dfunc(sign,k,N,phi-phi0,si,sd,xF,F,beta)
+    D : np.array (4,Nf,Nr)
+        D1,D2,D3,D4 terms
 
-    sign  =  +1.0
-    D3     = Dfunc(sign,k,N,phi+phi0,si,sd,xF,F,beta)
+    Notes
+    -----
 
-    sign  =  -1.0
-    D4     = Dfunc(sign,k,N,phi+phi0,si,sd,xF,F,beta)
+    This is Dfunc evaluated for the 4 (sign,dphi) pairs at once.
+    The angular quantities do not depend on frequency, they are
+    evaluated on (4,1,Nr) arrays, only KLA and the transition function
+    are (4,Nf,Nr).
 
-#--------------------------------------
-#n>=1 : exterior wedge
-#--------------------------------------
-    Dsoft =np.empty(np.shape(D1),dtype=complex)
-    Dhard =np.empty(np.shape(D1),dtype=complex)
-
-    #c1 = BN>=1.0
-
-    Dsoft = D1+D2+Rsoftn*D3+Rsofto*D4
-    Dhard = D1+D2+Rhardn*D3+Rhardo*D4
-#    Dsoft = D2-D4
-#    Dhard = D2+D4
-    #Dsoft = D1+D2-D3-D4
-    #Dhard = D1+D2+D3+D4
-#    Dsoft = Gsoftn*(D1+Rsoftn*D3)+Gsofto*(D2+Rsofto*D4)
-#    Dhard = Ghardn*(D1+Rhardn*D3)+Ghardo*(D2+Rhardo*D4)
-#    c1 = abs(Gsoftn+1.0) < 1e-6
-#    c2 = abs(Gsofto+1.0) < 1e-6
-#    c3 = abs(Ghardn+1.0) < 1e-6
-#    c4 = abs(Ghardo+1.0) < 1e-6
-#
-#    Dsoft[c1]= 0.5*(D1[c1]+D3[c1])+Gsofto[c1]*(D2[c1]+Rsofto[c1]*D4[c1])
-#    Dsoft[c2]= Gsoftn[c2]*(D1[c2]+Rsoftn[c2]*D3[c2])+0.5*(D2[c2]+D4[c2])
-#    Dhard[c3]= 0.5*(D1[c3]+D3[c3])+Ghardo[c3]*(D2[c3]+Rhardo[c3]*D4[c3])
-#    Dhard[c4]= Ghardn[c4]*(D1[c4]+Rhardn[c4]*D3[c4])+0.5*(D2[c4]+D4[c4])
-#--------------------------------------
-#traitement des cas ou Go (ou Gn) = -1
-#--------------------------------------
+    """
+    fGHz = np.asarray(fGHz,dtype=float).reshape(-1)
+    k    = 2*np.pi*fGHz[:,None]/0.3
+    N    = np.asarray(N,dtype=float)
+    sb   = np.sin(beta)
+
+    sign = np.array([1.,-1.,1.,-1.])[:,None,None]
+    dm   = phi-phi0
+    dp   = phi+phi0
+    dphi = np.array([dm,dm,dp,dp],dtype=float).reshape(4,1,-1)
+
+    rnn = (dphi+np.pi*sign)/(2.0*N*np.pi)
+    nn  = (1.0*(rnn>0.5) + (rnn>1.5)) - ((rnn<-0.5)*1.0 + (rnn<-1.5))
+
+    # KLA  ref[1] eq 27
+    L   = ((si*sd)*sb**2)/(1.*(si+sd))
+    AC  = np.cos( (2.0*N*nn*np.pi-dphi) / 2.0 )
+    A   = 2*AC**2
+    KLA = (k*L)*A
+
+    tan = np.tan((np.pi+sign*dphi)/(2.0*N))
+
+    if mode == 'tab':
+        D = FreFtab(KLA)
+    else:
+        D = FreF(KLA.ravel())[0].reshape(KLA.shape)
+
+    # 4.56 Mac Namara
+    cste = (1.0-1.0*1j)*(1.0/(4.0*N*np.sqrt(k*np.pi)*sb))
+    D *= -cste
+    small = np.abs(tan)<1e-9
+    with np.errstate(divide='ignore',invalid='ignore'):
+        D /= tan
+    if small.any():
+        D = np.where(small,0.5*np.sqrt(L),D)
+
+    return(D)
 
-#        if (abs(Gsoftn+1.0) < 1e-6):
-#            DTsoft = 0.5*(D1+D3)+Gsofto*(D2+Rsofto*D4)
-#
-#        if (abs(Gsofto+1.0)<1e-6):
-#            DTsoft = Gsoftn*(D1+Rsoftn*D3)+0.5*(D2+D4)
-#
-#        if (abs(Ghardn+1.0) < 1.0e-6):
-#            DThard = 0.5*(D1+D3)+Ghardo*(D2+Rhardo*D4)
-#
-#        if (abs(Ghardo+1.0)<1e-6):
-#            DThard = Ghardn*(D1+Rhardn*D3)+0.5*(D2+D4)
-#
-##--------------------------------------
-##cas ou n<1 : interior wedge
-##--------------------------------------
-#    else:
-#
-#        thoz  = N*np.pi-tho
-#        thnz  = N*np.pi-thn
-#
-#
-#        [Rsoftnz,Rhardnz] = R(thnz,k,ero,erro,condo,uro,deltaho)
-#        [Rsoftoz,Rhardoz] = R(thoz,k,ern,errn,condn,urn,deltahn)
 #
-#        DTsoft = Rsoftoz*Rsoftnz*D1+Rsoftn*D3+(Rsofto*Rsoftn*D2+Rsofto*D4)
+# table of the transition function, built once per process
 #
-#        DThard = Rhardoz*Rhardnz*D1+Rhardn*D3+(Rhardo*Rhardn*D2+Rhardo*D4)
-    if np.isnan(Dsoft).any():
-        u = np.isnan(Dsoft)
-        pdb.set_trace()
-    if np.isnan(Dhard).any():
-        v = np.where(Dhard==np.nan)
-        pdb.set_trace()
-    if debug:
-        return Dsoft,Dhard,D1,D2,D3,D4
-    else :
-        return Dsoft,Dhard#,D1,D2,D3,D4
+_Ftab = {}
+
+def Ftab(xmin=-8.,xmax=1.,Npt=4096):
+    """ table of the transition function F
+
+    Parameters
+    ----------
+
+    xmin : float
+        log10 of the lower bound of the table
+    xmax : float
+        log10 of the upper bound of the table
+    Npt : int
+        number of points
+
+    Returns
+    -------
 
+    xF : np.array (Npt)
+        log10 of the support (uniform)
+    F : np.array (Npt)
+        transition function
+
+    Notes
+    -----
+
+    The table is computed on the first call and kept in the module, so
+    that it is shared by all the links of a process, and by the workers
+    forked after the first call. Above 10**xmax the asymptotic expansion
+    of F is exact (see FreF) and the table is not used.
+
+    """
+    key = (xmin,xmax,Npt)
+    if key not in _Ftab:
+        xF = np.linspace(xmin,xmax,Npt)
+        _Ftab[key] = (xF,FreF(10**xF)[0])
+    return _Ftab[key]
+
+def FreFtab(x,xF=[],F=[]):
+    """ transition function F interpolated in a table
+
+    Parameters
+    ----------
+
+    x : np.array
+        real positive argument
+    xF : np.array
+        log10 of the table support (uniform), default Ftab()
+    F : np.array
+        table values
+
+    Returns
+    -------
+
+    y : np.array
+        F(x), linear interpolation in log10(x). Values below the table
+        are clipped to F[0].
+
+    Examples
+    --------
+
+        >>> import numpy as np
+        >>> from pylayers.antprop.diffRT import *
+        >>> x = np.logspace(-4,2,100)
+        >>> np.allclose(FreFtab(x),FreF(x)[0],atol=1e-5)
+        True
+
+    """
+    if len(F) == 0:
+        xF,F = Ftab()
+    x = np.asarray(x,dtype=float)
+    y = np.empty(x.shape,dtype=complex)
+
+    xm = 10**xF[-1]
+    u  = x > xm
+    if u.any():
+        xl  = x[u]
+        ixl = 1.0/xl
+        ix2 = ixl*ixl
+        y[u] = 1-0.75*ix2+4.6875*ix2*ix2 + 1j*(0.5*ixl-1.875*ix2*ixl)
+    v  = ~u
+    xs = x[v]
+    dx = (xF[-1]-xF[0])/(len(F)-1.)
+    val = (np.log10(np.maximum(xs,10**xF[0]))-xF[0])/dx
+    i  = np.minimum(val.astype(int),len(F)-2)
+    w  = val - i
+    y[v] = F[i] + w*(F[i+1]-F[i])
+    return y
 
 def G(N,phi0,Ro,Rn):
     """ grazing angle correction
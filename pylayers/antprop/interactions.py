@@ -154,6 +154,34 @@ class Inter(PyLayers):
         elif self.typ == -1: # B
             self.sout = np.zeros((len(self.data[:, 0])))
 
+    def _out(self, I=None):
+        """ output array of eval and rows of the interactions
+
+        Parameters
+        ----------
+
+        I : np.array (nf x nimax x 3 x 3) | None
+            if None self.A (nf x ninter x 3 x 3) is allocated
+
+        Returns
+        -------
+
+        A : np.array
+            I or self.A
+        ia : np.array
+            rows of the interactions in A
+
+        """
+        if I is None:
+            self.A = np.zeros((self.nf, len(self.idx), 3, 3), dtype=complex)
+            A = self.A
+            ia = np.arange(len(self.idx))
+        else:
+            A = I
+            ia = np.asarray(self.idx, dtype=int)
+        A[:, ia, 0, 0] = 1
+        return A, ia
+
     def stack(self, data=np.array(()), idx=0, isdata=True):
         """ stack data and the associated idx
 
@@ -230,6 +258,8 @@ class Interactions(Inter,dict):
 
         add(self,li): add a list of basis interactions
         addi(self,i): add a single interaction
+        group(self) : build the slab grouped index and the R, T, D interactions
+                      from the interaction table
         eval(self) : evaluate all the interactions added thanks to self.add or self.addi
                      and create the self.I which gather all thoses interactions
 
@@ -241,11 +271,47 @@ class Interactions(Inter,dict):
         T : Transmission
         D : Diffraction
 
+        Attributes
+        ----------
+
+        The interactions of all the rays are stored in a table of nimax
+        rows (one row per interaction index) :
+
+        ityp : np.array (nimax,)
+            interaction type (signature convention)
+            0 : no interaction (LOS)
+            1 : D
+            2 : R
+            3 : T
+            4 : R (floor)
+            5 : R (ceil)
+        isl : np.array (nimax,)
+            slab index in lsl (wedge index for D)
+        theta : np.array (nimax,)
+            incidence angle
+        si0 : np.array (nimax,)
+            distance from the previous interaction to the one
+        sout : np.array (nimax,)
+            distance from one interaction to the next one
+        dvec : np.array (nimax x 4)
+            (phi0,phi,beta,N) of diffraction interactions
+        lsl : list
+            slab names (mat0@matN for diffraction wedges)
+        dgroup : dict
+            {(typ,slabname) : interaction indices} slab grouped index
 
     """
 
-    def __init__(self,slab={}):
+    def __init__(self,slab={},nimax=0):
         """ object constructor
+
+        Parameters
+        ----------
+
+        slab : SlabDB
+        nimax : int
+            number of rows of the interaction table
+
         """
         Inter.__init__(self,slab=slab)
         self['B'] = []
@@ -254,7 +320,63 @@ class Interactions(Inter,dict):
         self['T'] = []
         self['D'] = []
         self.evaluated = False
-        self.nimax = 0
+        self.lsl = []
+        self.dsl = {}
+        self.dgroup = {}
+        self.alloc(nimax)
+
+    def alloc(self,nimax):
+        """ allocate the interaction table
+
+        Parameters
+        ----------
+
+        nimax : int
+            total number of interactions (of all rays)
+
+        """
+        self.nimax = nimax
+        self.ityp = np.zeros((nimax), dtype=np.int8)
+        self.isl = np.zeros((nimax), dtype=int)
+        self.theta = np.zeros((nimax))
+        self.si0 = np.zeros((nimax))
+        self.sout = np.zeros((nimax))
+        self.dvec = np.zeros((nimax, 4))
+        self.typ = np.zeros((nimax), dtype=str)
+
+    def slabid(self,lname):
+        """ index of slab names in self.lsl
+
+        Parameters
+        ----------
+
+        lname : list of string
+            slab names, the unknown names are appended to self.lsl
+
+        Returns
+        -------
+
+        isl : np.array (len(lname),)
+
+        Examples
+        --------
+
+        >>> from pylayers.antprop.interactions import *
+        >>> I = Interactions()
+        >>> I.slabid(['WOOD','AIR','WOOD'])
+        array([1, 0, 1])
+        >>> I.lsl
+        ['AIR', 'WOOD']
+
+        """
+        if len(lname) == 0:
+            return np.array((), dtype=int)
+        uname, inv = np.unique(lname, return_inverse=True)
+        for name in uname:
+            if name not in self.dsl:
+                self.dsl[name] = len(self.lsl)
+                self.lsl.append(name)
+        return np.array([self.dsl[name] for name in uname], dtype=int)[inv]
 
     def add(self, li):
         """ add a list of interactions
@@ -265,11 +387,16 @@ class Interactions(Inter,dict):
         li : list
             list of interactions
 
+        Notes
+        -----
+
+        The interaction table is allocated from the largest index of li.
+
         """
         # determine the total number of interactions
-        for i in li:
-            if i.idx != []:
-                self.nimax = max(self.nimax,max((i.idx)))+1
+        nimax = max([self.nimax] + [max(i.idx)+1 for i in li if len(i.idx) != 0])
+        if nimax != self.nimax:
+            self.alloc(nimax)
 
         for i in li:
             self.addi(i)
@@ -282,10 +409,14 @@ class Interactions(Inter,dict):
 
         i : Inter object
 
+        Notes
+        -----
+
+        The rows of R, T and D interactions are written in the
+        interaction table.
+
         """
 
-        if not isinstance(self.typ, np.ndarray):
-            self.typ = np.zeros((self.nimax), dtype=str)
         if i.typ == -1:
             self.B = i
             self['B'] = i.idx
@@ -307,13 +438,79 @@ class Interactions(Inter,dict):
             self['T'] = i.idx
             self.typ[i.idx] = 'T'
 
-    def eval(self,fGHz=np.array([2.4])):
+        if (i.typ in [1, 2, 3]) and (len(i.idx) != 0):
+            if np.shape(i.data)[0] != len(i.idx):
+                i.data = i.data.T
+            i.sinsout()
+            idx = np.array(i.idx)
+            self.ityp[idx] = i.typ
+            self.si0[idx] = i.si0
+            self.sout[idx] = i.sout
+            if i.typ == 1:
+                self.dvec[idx] = i.data[:, 0:4]
+            else:
+                self.theta[idx] = i.data[:, 0]
+            for m in i.dusl:
+                self.isl[idx[i.dusl[m]]] = self.slabid([m])
+
+    def group(self):
+        """ build the slab grouped index and the R, T, D interactions
+
+        Notes
+        -----
+
+        The rows of the interaction table are sorted by (type, slab).
+        self.R, self.T and self.D hold their interactions grouped by slab,
+        the dusl index of each slab is a contiguous range, so that each
+        (type,slab) group is evaluated by a single call of the kernel
+        (SlabDB.eval, Dkernel/Rwedge).
+
+        """
+        nsl = max(len(self.lsl), 1)
+        # floor and ceil reflexions are reflexions
+        utyp = np.array([0, 1, 2, 3, 2, 2], dtype=int)[self.ityp]
+        u = np.where(utyp > 0)[0]
+        key = utyp[u]*nsl + self.isl[u]
+        order = np.argsort(key, kind='stable')
+        ukey, ptr = np.unique(key[order], return_index=True)
+        ptr = np.hstack((ptr, len(u)))
+
+        self.typ = np.array(['', 'D', 'R', 'T'])[utyp]
+        self.dgroup = {}
+        for k, kk in enumerate(ukey):
+            self.dgroup[(kk//nsl, self.lsl[kk % nsl])] = u[order[ptr[k]:ptr[k+1]]]
+
+        for typ, key, Int in ((3, 'T', IntT), (2, 'R', IntR), (1, 'D', IntD)):
+            inter = Int(slab=self.slab)
+            k = np.where(ukey//nsl == typ)[0]
+            if len(k) != 0:
+                idx = u[order[ptr[k[0]]:ptr[k[-1]+1]]]
+                inter.idx = idx
+                if typ == 1:
+                    inter.data = np.hstack((self.dvec[idx],
+                                            self.si0[idx][:, None],
+                                            self.sout[idx][:, None]))
+                else:
+                    inter.data = np.vstack((self.theta[idx],
+                                            self.si0[idx],
+                                            self.sout[idx])).T
+                inter.dusl = dict([(self.lsl[ukey[j] % nsl],
+                                    np.arange(ptr[j], ptr[j+1]) - ptr[k[0]])
+                                   for j in k])
+            setattr(self, key, inter)
+            self[key] = inter.idx
+
+    def eval(self,fGHz=np.array([2.4]),mode='exact'):
         """ evaluate all the interactions
 
         Parameters
         ----------
 
         fGHz : np.array()
+        mode : str ('exact','tab')
+            slab coefficients from the exact evaluation (Slab.eval)
+            or from lookup tables (Slab.evaltab, approximate within
+            Slab.evaltab tol, only worth it when fGHz is evaluated again)
 
         Notes
         -----
@@ -330,6 +527,9 @@ class Interactions(Inter,dict):
         self.gamma :
             !! gamma**2 !!! (squared included) as described
 
+        R, T and D are evaluated by (type,slab) group (see group)
+        and written in place in the rows of self.I.
+
         """
 
         # Initialize the global I matrix which gathers all interactions
@@ -341,72 +541,107 @@ class Interactions(Inter,dict):
         self.nf = len(fGHz)
 
         self.I = np.zeros((self.nf, self.nimax, 3, 3), dtype=complex)
-        self.sout = np.zeros((self.nimax))
-        self.si0 = np.zeros((self.nimax))
         self.alpha = np.ones((self.nimax), dtype=complex)
         self.gamma = np.ones((self.nimax), dtype=complex)
 
-        # evaluate B and fill I 
-        #OUT DATED , B MDA are stored outside of I
-        # try:
-        #     self.I[:, self.B.idx, :, :] = self.B.eval(fGHz=fGHz)
-        #     self.sout[self.B.idx] = self.B.sout
-        #     self.si0[self.B.idx] = self.B.si0
-
-        # except:
-        #     print 'Warning : No B interaction Evaluated'
-
-        # evaluate L and fill I
-        # OUT DATED , Los interaction is managed oustside of I
-        # try:
-        #     self.I[:, self.L.idx, :, :] = self.L.eval(fGHz=fGHz)
-        #     self.sout[self.L.idx] = self.L.sout
-        #     self.si0[self.L.idx] = self.L.si0
-
-        # except:
-        #     print 'Warning : No L interaction Evaluated'
+        # B, L interactions are managed outside of I
 
         # evaluate R and fill I
         if len(self.R.data)!=0:
-            #try:
-            self.I[:, self.R.idx, :, :] = self.R.eval(fGHz=fGHz)
-            self.sout[self.R.idx] = self.R.sout
-            self.si0[self.R.idx] = self.R.si0
+            self.R.eval(fGHz=fGHz,mode=mode,I=self.I)
             self.alpha[self.R.idx] = self.R.alpha
             self.gamma[self.R.idx] = self.R.gamma
-            #except:
-            #    print Warning('Warning Interaction.eval: No R interaction Evaluated,\ whereas Reflection rays found')
-            #    pdb.set_trace()
         # evaluate T and fill I
         if len(self.T.data)!=0:
-            #try:
-            self.I[:, self.T.idx, :, :] = self.T.eval(fGHz=fGHz)
-            self.sout[self.T.idx] = self.T.sout
-            self.si0[self.T.idx] = self.T.si0
+            self.T.eval(fGHz=fGHz,mode=mode,I=self.I)
             self.alpha[self.T.idx] = self.T.alpha
             self.gamma[self.T.idx] = self.T.gamma
-
-            #except:
-            #     print Warning('Warning Interaction.eval: No T interaction Evaluated,\ whereas Transmission rays found')
-            #    pdb.set_trace()
         # evaluate D and fill I
-
         if len(self.D.data)!=0:
-            #try:
-            self.I[:, self.D.idx, :, :] = self.D.eval(fGHz=fGHz)
-            self.sout[self.D.idx] = self.D.sout
-            self.si0[self.D.idx] = self.D.si0
-
-                # self.alpha[self.D.idx] = self.D.alpha
-                # self.gamma[self.D.idx] = self.D.gamma
-            #except:
-            #    print Warning('Warning Interaction.eval: No D interaction Evaluated,\ whereas Diffraction rays found')
-            #    pdb.set_trace()
+            self.D.eval(fGHz=fGHz,I=self.I)
 
         self.evaluated = True
 
 
 
+def interconcat(lI):
+    """ concatenate the interactions of several sets of rays
+
+    Parameters
+    ----------
+
+    lI : list of Interactions
+        filled interactions (see Rays.fillinter)
+
+    Returns
+    -------
+
+    I : Interactions
+        R, T and D interactions of all elements of lI
+    nptr : np.array (len(lI)+1,)
+        interaction pointer. The interactions of lI[k] are
+        the interactions nptr[k]:nptr[k+1] of I
+
+    Notes
+    -----
+
+    This allows to evaluate the slab coefficients of many links
+    in a single call of Interactions.eval.
+
+    See Also
+    --------
+
+    intersplit
+
+    """
+    nptr = np.cumsum([0] + [Ik.nimax for Ik in lI])
+
+    I = Interactions(slab=lI[0].slab, nimax=nptr[-1])
+
+    for k, Ik in enumerate(lI):
+        u = slice(nptr[k], nptr[k+1])
+        I.ityp[u] = Ik.ityp
+        I.theta[u] = Ik.theta
+        I.si0[u] = Ik.si0
+        I.sout[u] = Ik.sout
+        I.dvec[u] = Ik.dvec
+        I.isl[u] = I.slabid(Ik.lsl)[Ik.isl] if len(Ik.lsl) != 0 else 0
+    I.group()
+
+    return I, nptr
+
+def intersplit(I, lI, nptr):
+    """ dispatch evaluated concatenated interactions
+
+    Parameters
+    ----------
+
+    I : Interactions
+        evaluated Interactions returned by interconcat
+    lI : list of Interactions
+        list passed to interconcat
+    nptr : np.array (len(lI)+1,)
+        interaction pointer returned by interconcat
+
+    Notes
+    -----
+
+    Each element of lI is set as evaluated, ``Rays.eval`` can then be
+    called with ``evalI=False``.
+
+    """
+    for k, Ik in enumerate(lI):
+        u = slice(nptr[k], nptr[k+1])
+        Ik.fGHz = I.fGHz
+        Ik.nf = I.nf
+        Ik.I = I.I[:, u, :, :]
+        Ik.sout = I.sout[u]
+        Ik.si0 = I.si0[u]
+        Ik.alpha = I.alpha[u]
+        Ik.gamma = I.gamma[u]
+        Ik.evaluated = True
+
+
 class IntB(Inter):
     """ Local Basis interaction class
 
@@ -580,13 +815,18 @@ class IntR(Inter):
         s = 'number of R interactions :' + str(np.shape(self.data)[0])
         return s    
 
-    def eval(self,fGHz=np.array([2.4])):
+    def eval(self,fGHz=np.array([2.4]),mode='exact',I=None):
         """ evaluation of reflexion interactions
 
         Parameters
         ----------
 
         fGHz : np.array (,Nf)
+        mode : str ('exact','tab')
+            see Slab.evaltab
+        I : np.array (nf x nimax x 3 x 3)
+            if given, the interactions are written in the rows self.idx
+            of I (see Interactions.eval) and self.A is not allocated
 
 
         Returns
@@ -646,36 +886,27 @@ class IntR(Inter):
 
         # A : f ri 2 2
 
-        self.A = np.zeros((self.nf, len(self.idx), 3, 3), dtype=complex)
-        self.A[:,:,0,0]=1
+        A, ia = self._out(I)
 
         if np.shape(self.data)[0]!=len(self.idx):
             self.data=self.data.T
 
 
         if len(self.data) != 0:
-            mapp = []
-            # loop on all type of materials used for reflexion
+            # used theta of all the slabs used for reflexion
+            dtheta = {}
             for m in self.dusl.keys():
-                # used theta of the given slab
-                ut = self.data[self.dusl[m], 0]
-                if not ut.size == 0:
-                    # find the index of angles which satisfied the data
-                    #if m not in self.slab:
-                    #    m = m.lower()
-                    self.slab[m].eval(fGHz=fGHz, theta=ut, RT='R')
-                    try:
-                        R = np.concatenate((R, self.slab[m].R), axis=1)
-                        mapp.extend(self.dusl[m])
-                    except:
-                        R = self.slab[m].R
-                        mapp.extend(self.dusl[m])
+                if len(self.dusl[m]) != 0:
+                    dtheta[m] = self.data[self.dusl[m], 0]
+            # all slabs in one batch (see SlabDB.eval)
+            R = self.slab.eval(fGHz, dtheta, RT='R', mode=mode)
+            mapp = np.hstack([self.dusl[m] for m in dtheta]).astype(int)
 
             # replace in correct order the reflexion coeff
-            self.A[:, np.array((mapp)), 1:, 1:] = R
-            self.alpha = np.array(self.alpha*len(self.idx), dtype=complex)
-            self.gamma = np.array(self.gamma*len(self.idx), dtype=complex)
-            return(self.A)
+            A[:, ia[mapp], 1:, 1:] = R
+            self.alpha = np.ones((len(self.idx)), dtype=complex)
+            self.gamma = np.ones((len(self.idx)), dtype=complex)
+            return(A)
 
         else:
             self.A = self.data[:, None, None, None]
@@ -709,9 +940,19 @@ class IntT(Inter):
         s = 'number of T interaction :' + str(np.shape(self.data)[0])
         return(s)
 
-    def eval(self,fGHz=np.array([2.4])):
+    def eval(self,fGHz=np.array([2.4]),mode='exact',I=None):
         """ evaluate transmission
 
+        Parameters
+        ----------
+
+        fGHz : np.array (,Nf)
+        mode : str ('exact','tab')
+            see Slab.evaltab
+        I : np.array (nf x nimax x 3 x 3)
+            if given, the interactions are written in the rows self.idx
+            of I (see Interactions.eval) and self.A is not allocated
+
         Examples
         --------
 
@@ -757,8 +998,7 @@ class IntT(Inter):
         self.fGHz=fGHz
         self.nf=len(fGHz)
 
-        self.A = np.zeros((self.nf, len(self.idx), 3, 3), dtype=complex)
-        self.A[:,:,0,0] = 1
+        A, ia = self._out(I)
 
         self.alpha = np.zeros((len(self.idx)), dtype=complex)
         self.gamma = np.zeros((len(self.idx)), dtype=complex)
@@ -768,48 +1008,31 @@ class IntT(Inter):
             self.data=self.data.T
 
         if len(self.data) != 0:
-            mapp = []
+            dtheta = {}
             for m in self.dusl.keys():
                 # ut : used theta of the given slab
                 ut = self.data[self.dusl[m], 0]
                 if ut.size != 0:
-                    #if m not in self.slab:
-                    #    m = m.lower()
+                    dtheta[m] = ut
                     # get alpha and gamma for divergence factor
                     if len(self.slab[m]['lmat']) > 1:
                         print('Warning : IntR class implemented for mat with only 1 layer ')
                     #
                     #  1/sqrt(epsr)
                     #
-                    a = 1./np.sqrt(np.array(([self.slab[m]['lmat'][0]['epr']])) \
-                               * np.ones(len(ut), dtype=complex))
+                    a = 1./np.sqrt(complex(self.slab[m]['lmat'][0]['epr']))
                     #
                     #  (1-sin(theta)^2)  / ( 1 - (1/sqrt(epr)) sin(theta)^2 )
                     #
-                    g = (1.-np.sin(ut)**2)/(1.-a*np.sin(ut)**2)
-                    try:
-                        alpha = np.concatenate((alpha, a), axis=0)
-                        gamma = np.concatenate((gamma, g), axis=0)
-                    except:
-    #                    print 'Warning : alpha or gamma fail'
-                        alpha = a
-                        gamma = g
-
-                    # find the index of angles which satisfied the data
-                    self.slab[m].eval(fGHz=fGHz, theta=ut, RT='T', compensate=True)
-
-                    try:
-                        T = np.concatenate((T, self.slab[m].T), axis=1)
-                        mapp.extend(self.dusl[m])
-                    except:
-                        T = self.slab[m].T
-                        mapp.extend(self.dusl[m])
+                    self.alpha[self.dusl[m]] = a
+                    self.gamma[self.dusl[m]] = (1.-np.sin(ut)**2)/(1.-a*np.sin(ut)**2)
+
+            # all slabs in one batch (see SlabDB.eval)
+            T = self.slab.eval(fGHz, dtheta, RT='T', compensate=True, mode=mode)
+            mapp = np.hstack([self.dusl[m] for m in dtheta]).astype(int)
             # replace in proper order the Transmission coeff
-            self.A[:, np.array((mapp)), 1:, 1:] = T
-            self.alpha[np.array((mapp))] = alpha
-            self.gamma[np.array((mapp))] = gamma
-#            self.sm[np.array((mapp))]=sm
-            return(self.A)
+            A[:, ia[mapp], 1:, 1:] = T
+            return(A)
 
         else:
             #print 'no T interaction to evaluate'
@@ -827,22 +1050,31 @@ class IntD(Inter):
         s = 'number of D interaction :' + str(np.shape(self.data)[0])
         return s
 
-    def eval(self,fGHz=np.array([2.4])):
+    def eval(self,fGHz=np.array([2.4]),I=None):
         """ evaluate diffraction interaction
 
         Parameters
         ----------
 
         fGHz : np.array
+        I : np.array (nf x nimax x 3 x 3)
+            if given, the interactions are written in the rows self.idx
+            of I (see Interactions.eval) and self.A is not allocated
 
+        Notes
+        -----
+
+        Dkernel is called once for all the D interactions. In
+        DLink.eval_many the interactions of all the links are concatenated
+        (interconcat) before the evaluation, so a single call covers the
+        diffractions of all the links.
 
         """
 
 
         self.fGHz = fGHz
         self.nf = len(fGHz)
-        self.A = np.zeros((self.nf, len(self.idx), 3, 3), dtype=complex)
-        self.A[:,:,0,0]=1
+        A, ia = self._out(I)
 
         if len(self.data) != 0 :
             self.phi0 = self.data[:,0]
@@ -850,42 +1082,29 @@ class IntD(Inter):
             self.beta = self.data[:,2]
             self.N    = self.data[:,3]
             self.sinsout()
-            D = np.zeros([self.nf, len(self.phi), 2, 2], dtype=complex)
-            mapp=[]
+            #
+            # the 4 terms of all the D interactions are evaluated in
+            # one pass, only the face coefficients depend on materials
+            #
+            D4 = Dkernel(self.fGHz,self.phi0,self.phi,self.si0,self.sout,self.N,beta=self.beta,mode='tab')
             for m in self.dusl.keys():
                 idx = self.dusl[m]
-                mats = m.split('@') # cf Rays.locbas =>Start diffraction specific case
+                mats = m.split('@') # cf Rays.locbas =>Start diffraction specific case
                 mat0name = mats[0]
                 matNname = mats[1]
-                # 
-                # mat0 first material of slab 0 
-                # matN first material of slab N 
+                #
+                # mat0 first material of slab 0
+                # matN first material of slab N
                 #
                 mat0 = self.slab[mat0name]['lmat'][0]
                 matN = self.slab[matNname]['lmat'][0]
-                # from IPython.core.debugger import Tracer
-                # Tracer()()
-                # Ds,Dh = diff(self.fGHz,self.phi0[idx],self.phi[idx],self.si0[idx],self.sout[idx],self.N[idx],mat0,matN,beta=self.beta[idx])
-                Ds,Dh = diff(self.fGHz,self.phi0[idx],self.phi[idx],self.si0[idx],self.sout[idx],self.N[idx],mat0,matN,mode='tab',beta=self.beta[idx])
-                #D[:,idx,0,0]=-Dh
-                #D[:,idx,1,1]=Ds
-                D[:,idx,1,1]=-Dh
-                D[:,idx,0,0]=Ds
-                # from IPython.core.debugger import Tracer
-                # Tracer()()
-                mapp.extend(self.dusl[m])
-                # import ipdb
-                # ipdb.set_trace()
-                # try:
-                #     D = np.concatenate((D, self.slab[m].T), axis=1)
-                #     mapp.extend(self.dusl[m])
-                # except:
-                #     D = np.empty([self.nf, len(idx), 2, 2], dtype=complex)
-                #     D[:,:,0,0]=Ds
-                #     D[:,:,1,1]=Dh
-                #     mapp.extend(self.dusl[m])
-            self.A[:, np.array((mapp)), 1:, 1:] = D[:,mapp,:,:]
-            return(self.A)
+                Rsofto,Rhardo,Rsoftn,Rhardn = Rwedge(self.fGHz,self.phi0[idx],self.phi[idx],self.N[idx],mat0,matN)
+                D12 = D4[0][:,idx]+D4[1][:,idx]
+                Ds = D12 + Rsoftn*D4[2][:,idx] + Rsofto*D4[3][:,idx]
+                Dh = D12 + Rhardn*D4[2][:,idx] + Rhardo*D4[3][:,idx]
+                A[:,ia[idx],2,2]=-Dh
+                A[:,ia[idx],1,1]=Ds
+            return(A)
         else :
             self.A = self.data[:, None, None, None]
             return(self.A)
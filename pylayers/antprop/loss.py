@@ -21,6 +21,7 @@ from pylayers.util.project import logger
 import numpy.linalg as la
 import pdb
 import time
+import multiprocessing as mp
 from numba import jit
 
 
@@ -835,7 +836,30 @@ def LossPenetration(fGHz, alpha = 0.3, typ='low'):
     return(PLTW)
 
 
-def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
+def _scatteradd(index,W,N):
+    """ sum the columns of W with the same index
+
+    Parameters
+    ----------
+
+    index : np.array (,n)
+        column index in [0,N[
+    W : np.array (m x n)
+    N : int
+
+    Returns
+    -------
+
+    S : np.array (m x N)
+        S[:,k] = sum of W[:,index==k]
+
+    """
+    m = W.shape[0]
+    ind = (index[None,:] + N*np.arange(m)[:,None]).ravel()
+    S = np.bincount(ind,weights=W.ravel(),minlength=m*N)
+    return S.reshape(m,N)
+
+def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False,mode='exact',nbin=1024):
     """  calculate Losses between links p1-p2
 
     Parameters
@@ -850,6 +874,25 @@ def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
         (3 x Np2) array or (3,) array
     dB : boolean
     bceilfloor : boolean
+    mode : string
+        'exact' : the slab losses are evaluated for each incidence angle
+        'tab' : the slab losses are evaluated on a grid of nbin+1
+        values of cos(theta) in [0,1] and linearly interpolated
+    nbin : int
+        number of intervals of the 'tab' grid (default 1024)
+
+    Notes
+    -----
+
+    The sparse link x segment crossing matrix is obtained in one pass
+    over all the links by Layout.angleonlink3 (spatial index and bounding
+    box culling). For each slab the losses are evaluated once per distinct
+    incidence angle (or once per used node of the 'tab' grid) and
+    accumulated on the links with a scatter-add.
+
+    In 'tab' mode the modulus of the transmission coefficient and the
+    excess delay are interpolated in cos(theta), in which they stay
+    smooth up to the grazing incidence.
 
     Examples
     --------
@@ -879,6 +922,7 @@ def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
 
     pylayers.antprop.coverage
     pylayers.slab.Interface.losst
+    pylayers.gis.layout.Layout.angleonlink3
 
     """
 
@@ -903,11 +947,8 @@ def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
 
     # as many slabs as segments and subsegments
     us = data['s']
-    slabs = np.array([ L.Gs.node[x]['name'] for x in us ])
-
-
-    #slabs = L.sla[us]
-    check = np.where(slabs=='')
+    useg, iseg = np.unique(us, return_inverse=True)
+    slabs = np.array([ L.Gs.node[x]['name'] for x in useg ])[iseg]
 
     #
     # As segment numbering is not necessarily contiguous
@@ -920,46 +961,58 @@ def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
     if '_AIR' in cslab:
         cslab.remove('_AIR')
 
-
-    LossWallo = np.zeros((len(fGHz),Nlink))
-    LossWallp = np.zeros((len(fGHz),Nlink))
-    EdWallo = np.zeros((len(fGHz),Nlink))
-    EdWallp = np.zeros((len(fGHz),Nlink))
+    nf = len(fGHz)
+    LossWallo = np.zeros((nf,Nlink))
+    LossWallp = np.zeros((nf,Nlink))
+    EdWallo = np.zeros((nf,Nlink))
+    EdWallp = np.zeros((nf,Nlink))
 
     for slname in cslab:
         # u index of slabs of name slname
         # data['a'][u] angle
         # data['s'][u] segment number including subsegment
-        u = np.nonzero(np.array(slabs)==slname)[0]
+        u = np.nonzero(slabs==slname)[0]
+        if mode == 'tab':
+            # nodes k and k+1 of the cos(theta) grid around each angle
+            x = np.cos(data['a'][u].astype(float))*nbin
+            k = np.minimum(x.astype(int),nbin-1)
+            w = x - k
+            node, ia = np.unique(np.hstack((k,k+1)), return_inverse=True)
+            # the grazing incidence is replaced by its limit
+            theta = np.arccos(np.maximum(node/(1.*nbin),1e-6))
+        else:
+            # distinct angles, ia : index in the distinct angles
+            theta, ia = np.unique(data['a'][u], return_inverse=True)
         #
         # calculate Loss for slab slname
         #
-        lko,lkp  = L.sl[slname].losst(fGHz,data['a'][u])
+        lko,lkp  = L.sl[slname].losst(fGHz,theta)
         #
         # calculate Excess delay for slab slname
         #
-        do , dp  = L.sl[slname].excess_grdelay(theta=data['a'][u])
+        do , dp  = L.sl[slname].excess_grdelay(theta=theta)
+        if mode == 'tab':
+            n = len(u)
+            i0, i1 = ia[:n], ia[n:]
+            to = 10**(-lko/20.)
+            tp = 10**(-lkp/20.)
+            lko = -20*np.log10(to[:,i0]*(1-w) + to[:,i1]*w)
+            lkp = -20*np.log10(tp[:,i0]*(1-w) + tp[:,i1]*w)
+            do = do[i0]*(1-w) + do[i1]*w
+            dp = dp[i0]*(1-w) + dp[i1]*w
+        else:
+            lko, lkp = lko[:,ia], lkp[:,ia]
+            do, dp = do[ia], dp[ia]
         # data['i'][u] links number
         indexu = data['i'][u]
-        # reduce to involved links
-        involved_links, indices = np.unique(indexu,return_index=True)
-        indicep = np.hstack((indices[1:],np.array([len(indexu)])))
-        # range on involved links
-        irange = np.arange(len(involved_links))
         #
         # sum contribution of slab of a same link
         #
-        Wallo = np.array([ np.sum(lko[:,indices[x]:indicep[x]],axis=1) for x in irange ] ).T
-        Wallp = np.array([ np.sum(lkp[:,indices[x]:indicep[x]],axis=1) for x in irange ] ).T
+        LossWallo += _scatteradd(indexu,lko,Nlink)
+        LossWallp += _scatteradd(indexu,lkp,Nlink)
 
-        Edo = np.array([np.sum(do[indices[x]:indicep[x]]) for x in irange]).T
-        Edp = np.array([np.sum(dp[indices[x]:indicep[x]]) for x in irange]).T
-
-        LossWallo[:,involved_links] = LossWallo[:,involved_links] + Wallo
-        LossWallp[:,involved_links] = LossWallp[:,involved_links] + Wallp
-
-        EdWallo[:,involved_links] = EdWallo[:,involved_links] + Edo
-        EdWallp[:,involved_links] = EdWallp[:,involved_links] + Edp
+        EdWallo += _scatteradd(indexu,do[None,:],Nlink)
+        EdWallp += _scatteradd(indexu,dp[None,:],Nlink)
 
     if bceilfloor:
     # Managing Ceil / Floor transmission
@@ -1043,7 +1096,6 @@ def Losst(L,fGHz,p1,p2,dB=True,bceilfloor=False):
         LossWallo = 10**(-LossWallo/10)
         LossWallp = 10**(-LossWallp/10)
 
-    print(LossWallo)
     return(LossWallo,LossWallp,EdWallo,EdWallp)
 
 def gaspl(d,fGHz,T,PhPa,wvden):
@@ -1363,37 +1415,138 @@ def route(X, Y, Z, Ha, Hb, fGHz, K, method='deygout'):
         L[ip, :] = LDiff+LOS
     return(L)
 
-def cover(X, Y, Z, Ha, Hb, fGHz, K, method='deygout'):
-    """ outdoor coverage on a region
+def _fresnelloss(nu):
+    """ knife edge diffraction loss (dB) of the Fresnel parameter nu
+    """
+    w = nu - 0.1
+    return np.maximum(6.9 + 20*np.log10(np.sqrt(w**2+1)+w), 0)
+
+def _edge(g, mask):
+    """ dominant edge of a set of profiles
+
+    Parameters
+    ----------
+
+    g : np.array (...,Nr)
+        geometric Fresnel parameter h*sqrt(2(1/d1+1/d2))
+    mask : np.array (...,Nr)
+        True for the candidate edges
+
+    Returns
+    -------
+
+    k : np.array (...)
+        index of the dominant edge (0 if there is no candidate)
+    gmax : np.array (...)
+        geometric Fresnel parameter of the edge (-inf if there is
+        no candidate)
+
+    """
+    g = np.where(mask, g, -np.inf)
+    k = np.argmax(g, axis=-1)
+    gmax = np.take_along_axis(g, k[..., None], axis=-1)[..., 0]
+    return k, gmax
+
+def _coverdeygout(X, Y, Z, Ha, Hb, fGHz, K):
+    """ Deygout losses along a block of radials for all ranges at once
 
     Parameters
     ----------
 
     X : np.array (Nphi,Nr)
-        cartesian coordinate grid
     Y : np.array (Nphi,Nr)
-        cartesian coordinate grid
     Z : np.array (Nphi,Nr)
-        height (meters)
-
     Ha : float
     Hb : float
     fGHz : np.array (,Nf)
-        frequency in GHz
-    method : 'deygout' | 'bullington'
+    K : float
 
     Returns
     -------
 
-    L : Losses (dB)
+    L : np.array (Nphi,Nr,Nf)
+
+    Notes
+    -----
 
+    The profile of the link ending at range il is the row il of a
+    (Nphi,Nr,Nr) array, the edges are found with masked argmax along the
+    last axis. The main edge and the two secondary edges are those of
+    the recursive deygout function with depth 3.
 
     """
     Nphi, Nr = Z.shape
+    Nf = len(fGHz)
+    L = np.zeros((Nphi, Nr, Nf))
+    if Nr < 4:
+        return(L)
+    # cf : (,Nf) frequency factor of the Fresnel parameter
+    cf = np.sqrt(1/(0.3/fGHz))
+    # d : Nphi x Nr
+    d = np.sqrt((X-X[:, 0:1])**2+(Y-Y[:, 0:1])**2)
+    # il : end of the link   ik : point of the profile
+    il = np.arange(Nr)[:, None]
+    ik = np.arange(Nr)[None, :]
+    inside = ik <= il
+    # d[il-ik] : distance reversed along each profile
+    dr = d[:, np.where(inside, il-ik, 0)]
+    # z : Nphi x Nr(il) x Nr(ik)
+    # effect of refraction in equivalent earth curvature
+    z = Z[:, None, :] + d[:, None, :]*dr/(2*K*6375e3)
+    z[:, :, 0] = z[:, :, 0] + Ha
+    iN = np.arange(Nr)
+    z[:, iN, iN] = z[:, iN, iN] + Hb
+    D = d[:, :, None]
+    dk = d[:, None, :]
+    zl = z[:, iN, iN][:, :, None]
+    #
+    # main edge (interior points of the profile)
+    #
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = ik/(il*1.0)
+        h = z - (z[:, :, 0:1]*(1-u)+zl*u)
+        g = h*np.sqrt(2*(1/dk+1/(D-dk)))
+    mask = (ik > 0) & (ik < il) & (il > 2)
+    m, g1 = _edge(g, mask)
+    nu1 = g1[..., None]*cf
+    bdiff = (nu1 > -0.78).any(axis=-1)
+    #
+    # secondary edges, between the terminations and the main edge
+    #
+    zm = np.take_along_axis(z, m[..., None], axis=-1)
+    dm = np.take_along_axis(D[..., 0], m, axis=-1)[..., None]
+    mm = m[..., None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # left link 0 ... m
+        u = ik/(mm*1.0)
+        h = z - (z[:, :, 0:1]*(1-u)+zm*u)
+        g = h*np.sqrt(2*(1/dk+1/(dm-dk)))
+        ml, gl = _edge(g, (ik > 0) & (ik < mm) & (mm > 2))
+        # right link m ... il (distances from the link origin)
+        u = (ik-mm)/((il-mm)*1.0)
+        h = z - (zm*(1-u)+zl*u)
+        g = h*np.sqrt(2*(1/dk+1/(D-dk)))
+        mr, gr = _edge(g, (ik > mm) & (ik < il) & (il-mm > 2))
+    nul = gl[..., None]*cf
+    nur = gr[..., None]*cf
+    Ll = np.where((nul > -0.78).any(axis=-1)[..., None], _fresnelloss(nul), 0)
+    Lr = np.where((nur > -0.78).any(axis=-1)[..., None], _fresnelloss(nur), 0)
+    LDiff = np.where(bdiff[..., None], _fresnelloss(nu1)+Lr+Ll, 0)
+    with np.errstate(divide='ignore'):
+        LOS = 32.4 + 20*np.log10(fGHz)[None, None, :] + 20*np.log10(D)
+    L[:, 2:Nr-1, :] = LDiff[:, 2:Nr-1, :]+LOS[:, 2:Nr-1, :]
+    return(L)
 
-    if (type(fGHz) == float):
-        fGHz = np.array([fGHz])
+def _coverloop(X, Y, Z, Ha, Hb, fGHz, K, method='deygout'):
+    """ losses along a block of radials, one profile per range
+
+    See Also
+    --------
+
+    cover
 
+    """
+    Nphi, Nr = Z.shape
     Nf = len(fGHz)
     L = np.zeros((Nphi, Nr, Nf))
     L0 = np.zeros(Nf)
@@ -1422,6 +1575,83 @@ def cover(X, Y, Z, Ha, Hb, fGHz, K, method='deygout'):
             L[ip, il, :] = LDiff[None, :]+LOS[None,:]
     return(L)
 
+def _coverblock(args):
+    """ evaluate a block of radials (see cover)
+    """
+    X, Y, Z, Ha, Hb, fGHz, K, method = args
+    if method == 'deygout':
+        return _coverdeygout(X, Y, Z, Ha, Hb, fGHz, K)
+    return _coverloop(X, Y, Z, Ha, Hb, fGHz, K, method=method)
+
+def cover(X, Y, Z, Ha, Hb, fGHz, K, method='deygout', nproc=1):
+    """ outdoor coverage on a region
+
+    Parameters
+    ----------
+
+    X : np.array (Nphi,Nr)
+        cartesian coordinate grid
+    Y : np.array (Nphi,Nr)
+        cartesian coordinate grid
+    Z : np.array (Nphi,Nr)
+        height (meters)
+
+    Ha : float
+    Hb : float
+    fGHz : np.array (,Nf)
+        frequency in GHz
+    method : 'deygout' | 'bullington'
+    nproc : int
+        number of processes the blocks of radials are shared between
+        (default 1)
+
+    Returns
+    -------
+
+    L : Losses (dB)
+
+    Notes
+    -----
+
+    With the Deygout method all the ranges of a radial are evaluated at
+    once : the profiles of the links ending at each range are the rows of
+    a triangular array, and the main and secondary edges are obtained
+    with masked argmax instead of recursive calls. The radials are
+    processed by blocks of about 2**21 profile points. The Bullington
+    method still evaluates the profiles one by one.
+
+    See Also
+    --------
+
+    deygout
+    bullington
+
+    """
+    Nphi, Nr = Z.shape
+
+    if (type(fGHz) == float):
+        fGHz = np.array([fGHz])
+
+    if method == 'deygout':
+        nb = max(1, 2**21//(Nr*Nr))
+    else:
+        nb = max(1, Nphi//(4*nproc))
+    lblock = [(X[k:k+nb], Y[k:k+nb], Z[k:k+nb], Ha, Hb, fGHz, K, method)
+              for k in range(0, Nphi, nb)]
+
+    if nproc > 1:
+        pool = mp.Pool(processes=nproc)
+        try:
+            lL = pool.map(_coverblock, lblock)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        lL = [_coverblock(b) for b in lblock]
+
+    L = np.concatenate(lL, axis=0)
+    return(L)
+
 
 def deygout(d, height, fGHz, L, depth):
     """ Deygout attenuation
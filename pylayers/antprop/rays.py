@@ -37,12 +37,78 @@ import pylayers.util.pyutil as pyu
 from pylayers.util.project import *
 from pylayers.antprop.interactions import *
 from pylayers.antprop.slab import *
-from pylayers.antprop.channel import Ctilde
+from pylayers.antprop.channel import Ctilde, chanalloc
 from pylayers.gis.layout import Layout
-import pylayers.signal.bsignal as bs
-import shapely.geometry as shg
+import shapely.vectorized as shv
 import h5py
 import operator
+try:
+    import resource
+except ImportError:
+    # not available on Windows (see Rays.eval peakMB)
+    resource = None
+
+
+def _outdoorpts(L, p):
+    """ points strictly inside an outdoor cycle of the Layout
+
+    Parameters
+    ----------
+
+    L : Layout
+    p : np.array (2 x Np)
+
+    Returns
+    -------
+
+    bout : np.array (Np,) of bool
+
+    Notes
+    -----
+
+    The candidate cycles are taken from the spatial index of the cycles,
+    only the outdoor candidates are tested.
+
+    """
+    bout = np.zeros(p.shape[1], dtype=bool)
+    if p.shape[1] == 0:
+        return bout
+    lcy, cyindex = L._cycleindex()
+    boutcy = np.array([not L.Gt.node[x].get('indoor', True) for x in lcy],
+                      dtype=bool).reshape(-1)
+    ip, ic = cyindex.query(p, p)
+    bcand = boutcy[ic]
+    ip = ip[bcand]
+    ic = ic[bcand]
+    for c in np.unique(ic):
+        u = ip[ic == c]
+        bu = shv.contains(L.Gt.node[lcy[c]]['polyg'], p[0, u], p[1, u])
+        bout[u[bu]] = True
+    return bout
+
+
+def _neighbours(bkeep):
+    """ previous and next kept rows along axis 0
+
+    Parameters
+    ----------
+
+    bkeep : np.array (n x r) of bool
+
+    Returns
+    -------
+
+    iprev : np.array (n x r)
+        index of the last kept row <= i (-1 if none)
+    inext : np.array (n x r)
+        index of the first kept row >= i (n if none)
+
+    """
+    n = bkeep.shape[0]
+    i = np.arange(n)[:, None]
+    iprev = np.maximum.accumulate(np.where(bkeep, i, -1), axis=0)
+    inext = np.minimum.accumulate(np.where(bkeep, i, n)[::-1], axis=0)[::-1]
+    return iprev, inext
 
 
 class Rays(PyLayers, dict):
@@ -58,17 +124,15 @@ class Rays(PyLayers, dict):
     B    : IntB
     B0   : IntB
     I    : Interactions
+        interaction table (nI rows)
     I.I  : np.array
         (f,nI,3,3)
     I.T  : IntT
-    I.T.A : np.array
-        (f,iT,3,3)
+        transmissions grouped by slab
     I.R  : IntR
-    I.R.A : np.array
-        (f,iR,3,3)
+        reflexions grouped by slab
     I.D  : IntD
-    I.D.A : np.array
-        (f,iD,3,3)
+        diffractions grouped by wedge
     Lfilename : string
         Layout name
     delays : np.array
@@ -1194,6 +1258,17 @@ class Rays(PyLayers, dict):
 
         r3d : Rays
 
+        Notes
+        -----
+
+        For each group of 2D interactions and each vertical pattern of
+        mirror, all the rays of the group are processed at once : the
+        ceil/floor points are inserted by sorting the parameterization,
+        their horizontal coordinates are interpolated between the
+        neighbouring 2D points and the invalid rays (iso segments, air
+        diffraction points, ceil reflexions in outdoor cycles) are
+        removed with a mask. The 3D groups are concatenated once.
+
         See Also
         --------
 
@@ -1214,12 +1289,6 @@ class Rays(PyLayers, dict):
 
         d = self.mirror(H=H, N=N, za=tx[2], zb=rx[2])
 
-        #
-        # Elimination of invalid diffraction point 
-        # If the diffaction point is a separation between 2 air wall 
-        # it should be removed.
-
-
         #
         # Phase 2 : calculate 2D parameterization in the horizontal plane
         #
@@ -1228,38 +1297,20 @@ class Rays(PyLayers, dict):
         for i in self:
 
             pts = self[i]['pt'][0:2, :, :]
-            sig = self[i]['sig']
-
-            if pts.shape[2]!=0:
-                # broadcasting of t and r
-                t = self.pTx[0:2].reshape((2, 1, 1)) * \
-                np.ones((1, 1, len(pts[0, 0, :])))
-                r = self.pRx[0:2].reshape((2, 1, 1)) * \
-                np.ones((1, 1, len(pts[0, 0, :])))
-                pts1 = np.hstack((t, np.hstack((pts, r))))
-            else:
-                t = self.pTx[0:2].reshape((2, 1, 1))
-                r = self.pRx[0:2].reshape((2, 1, 1))
-                pts1 = np.hstack((t,r))
+            Nrayi = pts.shape[2]
             # append t and r to interaction points in 2D
-
-
+            pts1 = np.concatenate((np.repeat(tx[0:2, None, None], Nrayi, axis=2),
+                                   pts,
+                                   np.repeat(rx[0:2, None, None], Nrayi, axis=2)),
+                                  axis=1)
             si1 = pts1[:, 1:, :] - pts1[:, :-1, :]
             # array of all ray segments distances
             si = np.sqrt(np.sum(si1 * si1, axis=0))
             # array of cumulative distance of 2D ray
             al1 = np.cumsum(si, axis=0)
-
-            # initialize parameterization parameter alpha
-            self[i]['alpha'] = np.zeros(np.shape(si[:-1, :]))
-
-            for j in range(len(self[i]['alpha'][:, 0])):
-                # get alpha
-                self[i]['alpha'][j, :] = np.sum(si[0:j+1, :], axis=0) \
-                        /np.sum(si, axis=0)
-                # get z coordinate
-                self[i]['pt'][2, j, :] = tx[2] + self[i]['alpha'][j, :] \
-                    * (rx[2] - tx[2])
+            # parameterization alpha and z coordinate
+            self[i]['alpha'] = al1[:-1, :]/al1[-1, :]
+            self[i]['pt'][2, :, :] = tx[2] + self[i]['alpha'] * (rx[2] - tx[2])
 
         #
         #  Phase 3 : Initialize 3D rays dictionnary
@@ -1269,225 +1320,106 @@ class Rays(PyLayers, dict):
         r3d.is3D = True
         r3d.nray2D = len(self)
         r3d.nb_origin_sig = self.nb_origin_sig
+
+        if len(L.lsss)>0:
+            # lsss : list of sub segments ( iso segments siges)
+            # lnss : list of diffaction point involving
+            lsss = np.array(L.lsss)
+            lnss = np.array(L.lnss)
+
         #
         # Phase 4 : Fill 3D rays information
         #
-        # Two nested loops
-        #
         #      for all interaction group
         #          for all type of 3D rays
         #             1) extension
         #             2) sort
         #             3) coordinates as a function of parameter
         #
+        # dchunk[k] : list of (pt,sig,sig2d) of 3D group k
+        dchunk = {}
         for k in self:   # for all interaction group k
-            # k = int(k)
             # Number of rays in interaction group k
             Nrayk = np.shape(self[k]['alpha'])[1]
+            irk = np.arange(Nrayk)
 
-            # get  2D horizontal parameterization
-            a1 = self[k]['alpha']
-
-            #if (k==1):
-            #    pdb.set_trace()
             # get  2D signature
-            sig = self[k]['sig']
-            #print "signatures 2D ",sig
-            #print "----"
-            sigsave = copy.copy(sig)
+            sigsave = self[k]['sig']
             # add parameterization of tx and rx (0,1)
-            a1 = np.concatenate((np.zeros((1, Nrayk)), a1, np.ones((1, Nrayk))))
-            # reshape signature in adding tx and rx
-
-            if sig.shape[0]!=0:
-                sig = np.hstack((np.zeros((2, 1, Nrayk), dtype=int),
-                             sig,
-                             np.zeros((2, 1, Nrayk), dtype=int)))  # add signature of Tx and Rx (0,0))
-            else:
-                sig = np.hstack((np.zeros((2, 1, Nrayk), dtype=int),
-                                 np.zeros((2, 1, Nrayk), dtype=int)))
-            # broadcast tx and rx
-            Tx = tx.reshape(3, 1, 1)*np.ones((1, 1, Nrayk))
-            Rx = rx.reshape(3, 1, 1)*np.ones((1, 1, Nrayk))
-
-            if k!=0:
-                # pte is the sequence of point in 3D ndim =3   ( ndim x k x Nrayk)
-                pte = self[k]['pt']
-                # ndim x k+2 x Nrayk
-                pte = np.hstack((Tx, pte, Rx))
-            else:
-                 pte = np.hstack((Tx, Rx))
+            a1 = np.concatenate((np.zeros((1, Nrayk)),
+                                 self[k]['alpha'],
+                                 np.ones((1, Nrayk))))
+            # add signature of Tx and Rx (0,0)
+            z2 = np.zeros((2, 1, Nrayk), dtype=int)
+            sig = np.hstack((z2, sigsave, z2))
+            # pte is the sequence of point in 3D ( ndim x k+2 x Nrayk)
+            pte = np.hstack((np.repeat(tx[:, None, None], Nrayk, axis=2),
+                             self[k]['pt'],
+                             np.repeat(rx[:, None, None], Nrayk, axis=2)))
 
             # extension
             for l in d:                     # for each vertical pattern (C,F,CF,FC,....)
-                #print k,l,d[l]
                 Nint = len(d[l])            # number of additional interaction
-                #if ((k==1) & (l==5.0)):print
                 if Nint > 0:                # if new interaction ==> need extension
                     # a1e : extended horizontal+vertical parameterization
-                    a1e = np.concatenate((a1, d[l].reshape(len(d[l]), 1)*
+                    a1e = np.concatenate((a1, d[l].reshape(Nint, 1)*
                                           np.ones((1, Nrayk))))
                     # get sorted indices
                     ks = np.argsort(a1e, axis=0)
                     # a1es : extended sorted horizontal + vertical parameterization
                     a1es = np.sort(a1e, axis=0)
 
-                    # #### Check if it exists the same parameter value in the horizontal plane
-                    # #### and the vertical plane. Move parameter if so.
-
+                    # Check if it exists the same parameter value in the horizontal plane
+                    # and the vertical plane. Move parameter if so.
                     da1es = np.diff(a1es,axis=0)
                     pda1es = np.where(da1es<1e-10)
                     a1es[pda1es]=a1es[pda1es]-1e-3
 
-
-                    # prepare an extended sequence of points ( ndim x  (Nint+k+2) x Nrayk )
-                    ptee = np.hstack((pte, np.zeros((3, Nint, Nrayk))))
-
                     #
-                    # Boolean ceil/floor detector
-                    #
-                    # u is 4 (floor interaction )
-                    #      5 (ceil interaction )
-                    #  depending on the vertical pattern l.
+                    # u is 4 (floor interaction ) or 5 (ceil interaction )
+                    # depending on the vertical pattern l.
                     #
                     #  l <0 corresponds to last reflexion on floor
                     #  l >0 corresponds to last reflexion on ceil
                     #
-                    # u =0 (floor) or 1 (ceil)
-                    # if l < 0:
-                    #     u = np.mod(range(Nint), 2)
-                    # else:
-                    #     u = 1 - np.mod(range(Nint), 2)
-
-
-                    if l < 0 and Nint%2 ==1: # l<0 Nint odd
+                    if (l < 0) == (Nint%2 == 1):
                         u = np.mod(range(Nint), 2)
-
-                    elif l > 0 and Nint%2 ==1: # l>0 Nint odd
-                        u = 1 - np.mod(range(Nint), 2)
-
-
-                    elif l < 0 and Nint%2 ==0: # l<0 Nint even
+                    else:
                         u = 1 - np.mod(range(Nint), 2)
-
-                    elif l > 0 and Nint%2 ==0: # l>0 Nint even
-                        u = np.mod(range(Nint), 2)
-
-                    #
                     u = u + 4
-                    #
-                    # At that point we introduce the signature of the new
-                    # introduced points on the ceil and/or floor.
-                    #
-                    # A signature is composed of two lines
-                    # esigs sup line : interaction number
-                    # esigi inf line : interaction type
-                    #
-                    esigs = np.zeros((1, Nint, Nrayk), dtype=int)
-                    esigi = u.reshape(1, Nint, 1)* np.ones((1, 1, Nrayk), dtype=int)
-                    # esig : extension of the signature
-                    esig = np.vstack((esigs, esigi))
+
                     # sige : signature extended  ( 2 x (Nint+k+2) x Nrayk )
+                    esig = np.zeros((2, Nint, Nrayk), dtype=int)
+                    esig[1] = u[:, None]
                     sige = np.hstack((sig, esig))
+                    # prepare an extended sequence of points ( ndim x  (Nint+k+2) x Nrayk )
+                    ptee = np.hstack((pte, np.zeros((3, Nint, Nrayk))))
 
-                    #
-                    # 2 x (Nint+k+2) x Nrayk
-                    #
-                    # sort extended sequence of points
-                    # and extended sequence of signatures with the sorting
-                    # index ks obtained from argsort of merge parametization
-                    #
-                    # sequence of extended sorted points
-                    #
-                    ptees = ptee[:, ks, range(Nrayk)]
-                    siges = sige[:, ks, range(Nrayk)]
-
-                    # extended and sorted signature
-                    iint_f, iray_f = np.where(siges[ 1, :] == 4)  # floor interaction
-                    iint_c, iray_c = np.where(siges[ 1, :] == 5)  # ceil interaction
-                    #print siges
-                    #
-                    # find the list of the previous and next point around the
-                    # new ceil or floor point. The case of successive ceil or
-                    # floor reflexion make
-                    #
-                    # Tous les points prcdents qui ne sont pas des Ceils ou
-                    # des floors et tous les points suivants qui ne sont pas
-                    # des points de rflexion ceil ou floor
-                    #
-                    # Afin de tenir compte du rayon et du groupe d'interactions
-                    # concerne, il faut passer un tuple qui concatene la valeur
-                    # de l'indice d'interaction floor ou ceil et l'indice de
-                    # rayons du groupe associe (d'ou le zip)
-                    #
-                    # Cette sequence d'instruction fixe le bug #133
-                    #
-                    # Antrieurement il y avait une hypothese de succession
-                    # immediate d'un point 2D renseigne.
-                    #
-                    try:
-                        iintm_f = [ np.where( (siges[1,0:x[0],x[1]]!=4) &
-                                             (siges[1,0:x[0],x[1]]!=5))[0][-1]
-                                   for x in  zip(iint_f,iray_f) ]
-                        iintp_f = [ np.where( (siges[1,x[0]:,x[1]]!=4) &
-                                             (siges[1,x[0]:,x[1]]!=5))[0][0]+x[0]
-                                   for x in  zip(iint_f,iray_f) ]
-                        iintm_c = [ np.where( (siges[1,0:x[0],x[1]]!=4) &
-                                             (siges[1,0:x[0],x[1]]!=5))[0][-1]
-                                   for x in zip(iint_c,iray_c) ]
-                        iintp_c = [ np.where( (siges[1,x[0]:,x[1]]!=4) &
-                                             (siges[1,x[0]:,x[1]]!=5))[0][0]+x[0]
-                                   for x in  zip(iint_c,iray_c) ]
-                    except:
-                        pdb.set_trace()
-
-                    # Update coordinate in the horizontal plane
-                    #
-                    #
-                    # The new interaction ceil or floor has no coordinates in
-                    # the horizontal plane.
-                    # Those coordinates are evaluated first by finding a sub
-                    # parameterization of the point with respect to the two
-                    # known adjascent interaction point j-1 and j+1 (Thales)
-                    #
-
-                    #iintm_f = iint_f - 1
-                    #iintp_f = iint_f + 1
-
-                    #iintm_c = iint_c - 1
-                    #iintp_c = iint_c + 1
-
+                    # sort extended sequence of points and signatures
+                    ptees = ptee[:, ks, irk]
+                    siges = sige[:, ks, irk]
 
                     #
-                    # If there are floor points
+                    # The new ceil or floor points have no coordinates in
+                    # the horizontal plane. They are interpolated (Thales)
+                    # between the previous and the next points which are
+                    # not ceil or floor points (fixes bug #133)
                     #
+                    bcf = (siges[1] == 4) | (siges[1] == 5)
+                    iprev, inext = _neighbours(~bcf)
+                    iint, iray = np.where(bcf)
+                    iintm = iprev[iint, iray]
+                    iintp = inext[iint, iray]
 
-                    if len(iint_f)>0:
-                        a1esm_f = a1es[iintm_f, iray_f]
-                        a1esc_f = a1es[iint_f, iray_f]
-                        a1esp_f = a1es[iintp_f, iray_f]
-
+                    a1esm = a1es[iintm, iray]
+                    a1esc = a1es[iint, iray]
+                    a1esp = a1es[iintp, iray]
 
-                        pteesm_f = ptees[0:2, iintm_f, iray_f]
-                        pteesp_f = ptees[0:2, iintp_f, iray_f]
+                    pteesm = ptees[0:2, iintm, iray]
+                    pteesp = ptees[0:2, iintp, iray]
 
-                        coeff_f = (a1esc_f-a1esm_f)/(a1esp_f-a1esm_f)
-
-                        ptees[0:2, iint_f, iray_f] = pteesm_f + coeff_f*(pteesp_f-pteesm_f)
-
-                    #
-                    # If there are ceil points
-                    #
-                    if len(iint_c)>0:
-                        a1esm_c = a1es[iintm_c, iray_c]
-                        a1esc_c = a1es[iint_c, iray_c]
-                        a1esp_c = a1es[iintp_c, iray_c]
-
-                        pteesm_c = ptees[0:2, iintm_c, iray_c]
-                        pteesp_c = ptees[0:2, iintp_c, iray_c]
-
-                        coeff_c = (a1esc_c-a1esm_c)/(a1esp_c-a1esm_c)
-                        ptees[0:2, iint_c, iray_c] = pteesm_c + coeff_c*(pteesp_c-pteesm_c)
+                    coeff = (a1esc-a1esm)/(a1esp-a1esm)
+                    ptees[0:2, iint, iray] = pteesm + coeff*(pteesp-pteesm)
 
                     if H != 0:
                         z  = np.mod(l+a1es*(rx[2]-l), 2*H)
@@ -1497,161 +1429,73 @@ class Rays(PyLayers, dict):
                     # case where ceil reflection are inhibited
                     elif H==0:
                         z  = abs(l+a1es*(rx[2]-l))
-                        # pz = np.where(z > H)
-                        # z[pz] = 2*H-z[pz]
                         ptees[2, :] = z
 
                 # recopy old 2D parameterization (no extension)
                 else:
-                    a1es = a1
-                    ks = np.argsort(a1es, axis=0)
                     ptees = pte
-                    # fixing bug
                     siges = copy.copy(sig)
-                    #print siges
+
+                # bdel : rays to delete
+                bdel = np.zeros(Nrayk, dtype=bool)
 
                 #---------------------------------
                 # handling multi segment (iso segments)
                 #    Height of reflexion interaction
                 #    Height of diffraction interaction
                 #---------------------------------
-                #
-                #   ptes (3 x i+2 x r )
                 if len(L.lsss)>0:
-                    #
-                    # lsss : list of sub segments ( iso segments siges)
-                    # lnss : list of diffaction point involving
-
-                    lsss = np.array(L.lsss)
-                    lnss = np.array(L.lnss)
-
                     # array of structure element (nstr) with TxRx extension  (nstr=0)
                     anstr = siges[0,:,:]
-                    # type of interaction
-                    typi = siges[1,:,:]
 
                     # lss : list of subsegments in the current signature
-                    #
-                    # scalability : avoid a loop over all the subsegments in lsss
-                    #
-                    lss = [ x for x in lsss if x in anstr.ravel()]
-
-                    ray_to_delete = []
+                    lss = lsss[np.in1d(lsss, anstr)]
                     for s in lss:
                         u  = np.where(anstr==s)
-                        if len(u)>0:
-                            zs = ptees[2,u[0],u[1]]
-                            zinterval = L.Gs.node[s]['z']
-                            unot_in_interval = ~((zs<=zinterval[1]) & (zs>=zinterval[0]))
-                            ray_to_delete.extend(u[1][unot_in_interval])
+                        zs = ptees[2,u[0],u[1]]
+                        zinterval = L.Gs.node[s]['z']
+                        unot_in_interval = ~((zs<=zinterval[1]) & (zs>=zinterval[0]))
+                        bdel[u[1][unot_in_interval]] = True
 
                     # lns : list of diffraction points in the current signature
                     #       with involving multi segments (iso)
-                    # scalability : avoid a loop over all the points in lnss
-                    #
-                    lns = [ x for x in lnss if x in anstr.ravel()]
-
-                    #
-                    # loop over multi diffraction points
-                    #
-
+                    lns = lnss[np.in1d(lnss, anstr)]
                     for npt in lns:
-                        # diffraction cornet in espoo.lay
-                        #if npt==-225:
-                        #    import ipdb
-                        #    ipdb.set_trace()
-
                         u  = np.where(anstr==npt)
-                        if len(u)>0:
-                           # height of the diffraction point
-                            zp = ptees[2,u[0],u[1]]
-
-                            #
-                            # At which couple of segments belongs this height ?
-                            # get_diffslab function answers that question
-                            #
-
-                            ltu_seg,ltu_slab = L.get_diffslab(npt,zp)
-
-                            #
-                            # delete rays where diffraction point is connected to
-                            # 2 AIR segments
-                            #
-
-                            [ray_to_delete.append(u[1][i]) for i in range(len(zp))
-                            if ((ltu_slab[i][0]=='AIR') & (ltu_slab[i][1]=='AIR'))]
-                            # #zinterval = L.Gs.node[s]['z']
-                            # # if (zs<=zinterval[1]) & (zs>=zinterval[0]):
-                            # if ((tu_slab[0]!='AIR') & (tu_slab[1]!='AIR')):
-                            #     #print(npt , zp)
-                            #     pass
-                            # else:
-                            #     ray_to_delete.append(u[1][0])
-
-                    # # nstr : structure number
-                    # nstr  = np.delete(nstr,ray_to_delete,axis=1)
-                    # typi : type of interaction
-                    typi  = np.delete(typi,ray_to_delete,axis=1)
-                    # 3d sequence of points
-                    ptees = np.delete(ptees,ray_to_delete,axis=2)
-                    # extended (floor/ceil) signature
-                    siges = np.delete(siges,ray_to_delete,axis=2)
+                        # height of the diffraction point
+                        zp = ptees[2,u[0],u[1]]
+                        #
+                        # At which couple of segments belongs this height ?
+                        # get_diffslab function answers that question
+                        #
+                        ltu_seg,ltu_slab = L.get_diffslab(npt,zp)
+                        #
+                        # delete rays where diffraction point is connected to
+                        # 2 AIR segments
+                        #
+                        bair = np.array([(x[0]=='AIR') & (x[1]=='AIR')
+                                         for x in ltu_slab], dtype=bool)
+                        bdel[u[1][bair]] = True
 
                 if rmoutceilR:
-                    # 1 determine Ceil reflexion index
-                    # uc (inter x ray)
+                    # remove ceil reflexions in outdoor cycles
                     uc = np.where(siges[1,:,:]==5)
-                    ptc = ptees[:,uc[0],uc[1]]
-                    if len(uc[0]) !=0:
-                        P = shg.MultiPoint(ptc[:2,:].T)
-                        # to determine the cycle where ceil reflexions append
-                        # uinter(nb pt x nb cycles)
-                        mapnode = list(L.Gt.nodes())
-                        uinter = np.array([[L.Gt.node[x]['polyg'].contains(p) for x in mapnode if x>0] for p in P])
-                        # import ipdb
-                        # ipdb.set_trace()
-                        #[plt.scatter(p.xy[0],p.xy[1],c='r') for up,p in enumerate(P) if uinter[0,up]]
-                        #[ plt.scatter(p.xy[0],p.xy[1],c='r') for up,p in enumerate(P) if uinter[0,up]]
-                        # find points are indoor/outdoor cycles
-                        upt,ucy = np.where(uinter)
-                        uout = np.where([not L.Gt.node[mapnode[u+1]]['indoor'] for u in ucy])[0] #ucy+1 is to manage cycle 0
-                        # 3 remove ceil reflexions of outdoor cycles
-                        if len(uout)>0:
-                            ptees = np.delete(ptees,uc[1][uout],axis=2)
-                            siges = np.delete(siges,uc[1][uout],axis=2)
-                            sigsave = np.delete(sigsave,uc[1][uout],axis=2)
-
-                if k+Nint in r3d:
-                    r3d[k+Nint]['pt']  = np.dstack((r3d[k+Nint]['pt'], ptees))
-                    r3d[k+Nint]['sig'] = np.dstack((r3d[k+Nint]['sig'], siges))
-                    r3d[k+Nint]['sig2d'].append(sigsave)
+                    bout = _outdoorpts(L, ptees[0:2, uc[0], uc[1]])
+                    bdel[uc[1][bout]] = True
+
+                if bdel.any():
+                    ptees = ptees[:, :, ~bdel]
+                    siges = siges[:, :, ~bdel]
+                    sig2d = sigsave[:, :, ~bdel]
                 else:
-                    if ptees.shape[2]!=0:
-                        r3d[k+Nint] = {}
-                        r3d[k+Nint]['pt'] = ptees
-                        r3d[k+Nint]['sig'] = siges
-                        r3d[k+Nint]['sig2d'] = [sigsave]
-                # ax=plt.gca()
-                # uu = np.where(ptees[2,...]==3.0)
-                # ax.plot(ptees[0,uu[0],uu[1]],ptees[1,uu[0],uu[1]],'ok')
-                # import ipdb
-                # ipdb.set_trace()
-        #
-        # Add Line Of Sight ray information
-        #   pt =  [tx,rx]
-        #   sig = [0,0]
+                    sig2d = sigsave
+
+                if k+Nint in dchunk:
+                    dchunk[k+Nint].append((ptees, siges, sig2d))
+                elif ptees.shape[2]!=0:
+                    dchunk[k+Nint] = [(ptees, siges, sig2d)]
+
         #
-        #pdb.set_trace()
-        # if (self.los) & (np.sqrt(np.sum((tx-rx)**2)) !=0) :
-        #     r3d[0] = {}
-        #     r3d[0]['sig'] = np.zeros((2,2,1))
-        #     r3d[0]['sig2d'] = np.zeros((2,2,1))
-        #     r3d[0]['pt'] = np.zeros((3,2,1))
-        #     r3d[0]['pt'][:,0,:] = tx[:,np.newaxis]
-        #     r3d[0]['pt'][:,1,:] = rx[:,np.newaxis]
-
-        # r3d.nray = reduce(lambda x,y : y + np.shape(r3d[x]['sig'])[2],lnint)
-        # count total number of ray
         # evaluate length of ray segment
         #
         # vsi
@@ -1659,8 +1503,12 @@ class Rays(PyLayers, dict):
         # dis
         #
         val =0
+        for k in dchunk:
+            r3d[k] = {}
+            r3d[k]['pt'] = np.concatenate([x[0] for x in dchunk[k]], axis=2)
+            r3d[k]['sig'] = np.concatenate([x[1] for x in dchunk[k]], axis=2)
+            r3d[k]['sig2d'] = [x[2] for x in dchunk[k]]
 
-        for k in r3d.keys():
             nrayk = np.shape(r3d[k]['sig'])[2]
             r3d[k]['nbrays'] = nrayk
             r3d[k]['rayidx'] = np.arange(nrayk)+val
@@ -1676,14 +1524,6 @@ class Rays(PyLayers, dict):
             v = r3d[k]['pt'][:, 1:, :]-r3d[k]['pt'][:, 0:-1, :]
             lsi = np.sqrt(np.sum(v*v, axis=0))
             rlength = np.sum(lsi,axis=0)
-            if (lsi.any()==0):
-                pdb.set_trace()
-            if not (lsi.all()>0):
-                pdb.set_trace()
-            #assert(lsi.all()>0)
-
-            if (len(np.where(lsi==0.))==0) :
-                pdb.set_trace()
 
             #
             # sort rays w.r.t their length
@@ -1692,7 +1532,6 @@ class Rays(PyLayers, dict):
             u = np.argsort(rlength)
             r3d[k]['pt']  = r3d[k]['pt'][:,:,u]
             r3d[k]['sig'] = r3d[k]['sig'][:,:,u]
-            #r3d[k]['sig2d'] = r3d[k]['sig2d'][:,:,u]
             si = v/lsi             # ndim , nint - 1 , nray
 
             # vsi : 3 x (i+1) x r
@@ -1713,7 +1552,6 @@ class Rays(PyLayers, dict):
         r3d.filename = L._filename.split('.')[0] + '_' + str(r3d.nray)
         return(r3d)
 
-
     def get_rays_slabs(self,L,ir):
         """ return the slabs for a given interaction index 
 
@@ -1739,102 +1577,103 @@ class Rays(PyLayers, dict):
 
     def remove_aw(self,L):
         """ remove AIR interactions
-        """
-        # def consecutive(data, stepsize=1):
-        #     return np.split(data, np.where(np.diff(data) != stepsize)[0]+1)
 
+        Parameters
+        ----------
+
+        L : Layout
 
-        R = Rays(self.pTx,self.pRx)
-        R.__dict__.update(self.__dict__)
-        # R.is3D=True
-        # R.nray = self.nray
-        # R.nray2D = self.nray2D
-        # R.nray2D = self.nray2D
-        # R.nray2D = self.nray2D
+        Returns
+        -------
 
-        for k in self:
-            lr = self[k]['sig'].shape[1]
-
-            inter = self.get_rays_slabs(L,k)
-
-            for ur,r in enumerate(inter.T):
-
-                not_air_mask  = ~((r =='_AIR') | (r == 'AIR' ))
-                nb_air = sum(~not_air_mask)
-                if nb_air != 0 :
-                    new_bi = k-nb_air
-                    # +2 : add tx & rx interaciton
-                    # -1 : 2 interactions correspond to 1 distance
-                    lsi = new_bi + 2 - 1 
-                    si = np.zeros(lsi) 
-                    si_old = self[k]['si'][:,ur]
-
-                    vsi = np.zeros((3,lsi)) 
-                    vsi_old = self[k]['vsi'][...,ur]
-
-                    sig = self[k]['sig'][:,not_air_mask,ur][...,None]
-                    # sig2d = self[k]['sig2d'][0][...,ur]
-                    pt = self[k]['pt'][:,not_air_mask,ur][...,None]
-
-                    u = 0
-                    si_aw = 0
-
-                    # import ipdb
-                    # ipdb.set_trace()
-
-                    for uold,b in enumerate(not_air_mask[1:]):
-                        if b:
-                            # update new si with sum of all 
-                            # distance from preceding airwall
-                            si[u] = si_old[uold] + si_aw
-                            # keep vsi from the last airwall
-                            # because vsi don't change on an airwall
-                            vsi[:,u] = vsi_old[:,uold] 
-                            u += 1
-                            si_aw=0
-                        else:
-                            si_aw += si_old[uold]
-                    si = si[...,None]
-                    vsi = vsi[...,None]
-                    dis = np.array([np.sum(si)])
-                    assert np.allclose(dis,np.sum(si_old))
+        R : Rays
+            rays without the interactions on AIR segments
 
+        Notes
+        -----
+
+        The rays of a group with the same number of AIR interactions are
+        processed at once. The segment lengths on both sides of an AIR
+        interaction are merged, the direction of the merged segment is
+        the direction of its last part.
+
+        """
+        R = Rays(self.pTx,self.pRx)
+        R.__dict__.update(self.__dict__)
 
+        # isair[nstr] : True if nstr is an AIR segment
+        nsmax = max(L.Gs.node.keys())
+        isair = np.zeros(nsmax+2, dtype=bool)
+        lair = [x for x in L.Gs.node if (x > 0) and
+                (L.Gs.node[x].get('name','') in ['AIR','_AIR'])]
+        isair[lair] = True
 
+        for k in self:
+            # interactions (Tx and Rx included) which are kept
+            nstr = np.clip(self[k]['sig'][0], 0, nsmax+1)
+            bkeep = ~isair[nstr]
+            nb_air = np.sum(~bkeep, axis=0)
+            # new number of interactions of each ray
+            new_bi = k - nb_air
+            unb, ufirst = np.unique(new_bi, return_index=True)
+            for nb in unb[np.argsort(ufirst)].tolist():
+                ur = np.where(new_bi == nb)[0]
+                if nb == k:
+                    # no air wall case, fill R with self values
+                    pt = self[k]['pt'][..., ur]
+                    sig = self[k]['sig'][..., ur]
+                    si = self[k]['si'][:, ur]
+                    vsi = self[k]['vsi'][..., ur]
+                    dis = self[k]['dis'][ur]
                 else:
-                    # no air wall case, fill R with self values
-                    new_bi = k
-                    pt = self[k]['pt'][...,ur][...,None]
-                    sig = self[k]['sig'][...,ur][...,None]
-                    # sig2d = self[k]['sig2d'][0][...,ur]
-                    si = self[k]['si'][:,ur][:,None]
-                    vsi = self[k]['vsi'][...,ur][...,None]
-                    dis = np.array([self[k]['dis'][ur]])
-
-                if new_bi in R:
-
-                    # R[new_bi]['sig2d'].append(self[k]['sig2d'][ur])
-                    R[new_bi]['pt'] = np.concatenate((R[new_bi]['pt'],pt),axis=2)
-                    R[new_bi]['sig'] = np.concatenate((R[new_bi]['sig'],sig),axis=2)
-                    R[new_bi]['rayidx'] = np.concatenate((R[new_bi]['rayidx'],np.array([self[k]['rayidx'][ur]])))
-                    R[new_bi]['si'] = np.concatenate((R[new_bi]['si'],si),axis=1)
-                    R[new_bi]['vsi'] = np.concatenate((R[new_bi]['vsi'],vsi),axis=2)
-                    R[new_bi]['dis'] = np.concatenate((R[new_bi]['dis'],dis),axis=0)
+                    nr = len(ur)
+                    bk = bkeep[:, ur]
+                    # kept points : ray major order, then transposition
+                    bkt = bk.T
+                    pt = self[k]['pt'][..., ur].transpose(0, 2, 1)[:, bkt]
+                    pt = pt.reshape(3, nr, nb+2).transpose(0, 2, 1)
+                    sig = self[k]['sig'][..., ur].transpose(0, 2, 1)[:, bkt]
+                    sig = sig.reshape(2, nr, nb+2).transpose(0, 2, 1)
+                    #
+                    # segment j ends on point j+1. The distance of the
+                    # segments ending on an AIR point is added to the next
+                    # segment.
+                    #
+                    si_old = self[k]['si'][:, ur]
+                    vsi_old = self[k]['vsi'][..., ur]
+                    si = np.zeros((nb+1, nr))
+                    vsi = np.zeros((3, nb+1, nr))
+                    si_aw = np.zeros(nr)
+                    iu = np.zeros(nr, dtype=int)
+                    for j in range(k+1):
+                        si_aw = si_aw + si_old[j]
+                        b = bk[j+1]
+                        si[iu[b], b] = si_aw[b]
+                        vsi[:, iu[b], b] = vsi_old[:, j, b]
+                        si_aw[b] = 0
+                        iu[b] = iu[b] + 1
+                    dis = np.sum(si, axis=0)
+
+                if nb in R:
+                    R[nb]['pt'] = np.concatenate((R[nb]['pt'],pt),axis=2)
+                    R[nb]['sig'] = np.concatenate((R[nb]['sig'],sig),axis=2)
+                    R[nb]['rayidx'] = np.concatenate((R[nb]['rayidx'],self[k]['rayidx'][ur]))
+                    R[nb]['si'] = np.concatenate((R[nb]['si'],si),axis=1)
+                    R[nb]['vsi'] = np.concatenate((R[nb]['vsi'],vsi),axis=2)
+                    R[nb]['dis'] = np.concatenate((R[nb]['dis'],dis),axis=0)
                 else:
-                    R[new_bi] = {}
-                    # R[new_bi]['sig2d'] = [self[k]['sig2d'][0][...,ur]]
-                    R[new_bi]['pt'] = pt
-                    R[new_bi]['sig'] = sig
-                    R[new_bi]['rayidx'] = np.array([self[k]['rayidx'][ur]])
-                    R[new_bi]['si'] = si
-                    R[new_bi]['vsi'] = vsi
-                    R[new_bi]['dis'] = dis
+                    R[nb] = {}
+                    R[nb]['pt'] = pt
+                    R[nb]['sig'] = sig
+                    R[nb]['rayidx'] = self[k]['rayidx'][ur]
+                    R[nb]['si'] = si
+                    R[nb]['vsi'] = vsi
+                    R[nb]['dis'] = dis
 
         if 0 in R:
             R.los=True
 
-        X = [[R[k]['rayidx'][u] for u in range(len(R[k]['rayidx']))] for k in R]
-        R._rayidx_aw = sum(X,[])
+        R._rayidx_aw = [ x for k in R for x in R[k]['rayidx'] ]
 
         return R
 
@@ -2500,92 +2339,55 @@ class Rays(PyLayers, dict):
         B : IntB
         B0 : IntB
 
+        The interaction table of I and the basis B (B0) are allocated
+        once from the number of interactions (rays) and are filled
+        group by group at the interaction (ray) indices.
+
         """
 
         # reinitialized ray pointer if not in append mode
         if not append:
             self.raypt = 0
 
-        # stacked interactions
-        I = Interactions(slab=L.sl)
+        # number of interactions and of rays
+        lk = [k for k in self if ('rays' in self[k]) and (self[k]['rays'].size > 0)]
+        if len(lk) > 0:
+            nimax = 1 + max([np.max(self[k]['rays']) for k in lk])
+            nray = 1 + max([np.max(self[k]['rayidx']) for k in lk])
+        else:
+            nimax = 0
+            nray = 0
+
+        # interaction table
+        I = Interactions(slab=L.sl, nimax=nimax)
 
         # rotation basis
+        # B.idx refers to an interaction index
+        # whereas B0.idx refers to a ray number
         B  = IntB(slab=L.sl)
+        B.data = np.zeros((nimax, 3, 3))
+        B.idx = np.arange(nimax)
         B0 = IntB(slab=L.sl)
+        B0.data = np.zeros((nray, 3, 3))
+        B0.idx = np.arange(nray)
 
-        # # LOS Interaction
-        # Los = IntL()
-
-        # Reflexion
-        R = IntR(slab=L.sl)
-
-        # Transmission
-        T = IntT(slab=L.sl)
-
-        # Diffraction
-        D = IntD(slab=L.sl)
-
-        idx = np.array(())
-        if self.los:
-            idxts = 1
-            nbrayt = 1
-        else:
-            idxts = 0
-            nbrayt = 0
-
-
-        # Transform dictionnary of slab name to array
-        # slv = nx.get_node_attributes(L.Gs, "name").values()
-        # slk = nx.get_node_attributes(L.Gs, "name").keys()
-        # find all material used in simulation
-        #uslv = np.unique(L.sla[1:])
-        uslv = L.sl.keys()
-        #
-        # add CEIL and FLOOR
-        #
-        #uslv = np.hstack((uslv, np.array(('CEIL', 'FLOOR'))))
-
-        # create reverse dictionnary with all material as a key
-        # and associated point/segment as a value
-
-        #dsla = {}
-        #for s in uslv:
-        #    dsla[s] = np.where(s == np.array(slv))[0]
-
-        nsmax = max(L.Gs.node.keys())
-        #sla = np.zeros((nsmax+1), dtype='S20')
-
-        # array type str with more than 1 character
-        # warning use zeros instead of empty because slab zero
-        # is virtually used before assigning correct slab to ceil and floor
-
-        #
-        # sla is an array of string.
-        # each value of Gs node is the index of the corresponding slab
-        #
-
-        #sla[slk] = np.array(slv)
-
-        R.dusl = dict.fromkeys(uslv, np.array((), dtype=int))
-        T.dusl = dict.fromkeys(uslv, np.array((), dtype=int))
-
-        #to be specified and limited to used wedges
-        if hasattr(self,'_luw'):
-            D.dusl = dict.fromkeys(self._luw, np.array((), dtype=int))
+        # slab index of the segments
+        dname = nx.get_node_attributes(L.Gs, 'name')
+        lseg = [x for x in dname if x > 0]
+        segsl = np.zeros((max(lseg+[0])+1), dtype=int)
+        segsl[lseg] = I.slabid([dname[x] for x in lseg])
 
-        # transmission/reflection slab array
-        tsl = np.array(())
-        rsl = np.array(())
-        # diffraction wedge list
-        dw = np.array(())
+        # WARNING
+        # in future versions floor and ceil could be different for each cycle.
+        # this information would be directly obtained from L.Gs
+        # then the two following lines would have to be modified
+        slf, slc = I.slabid(['FLOOR', 'CEIL'])
 
         # loop on group of interactions
         for k in self:
 
             if k !=0:
 
-                uR = uT = uD = uRf = uRc = 0.
-
                 # structure number (segment or point)
                 # nstr : i x r
                 nstr = self[k]['sig'][0, 1:-1, :]
@@ -2598,219 +2400,62 @@ class Rays(PyLayers, dict):
 
                 # (i+1) x r
                 si = self[k]['si']
-                # distance in
-                s_in = si[0:-1,:]
-                # distance in
-                s_out = si[1:,:]
-
-                if 'diffvect' in self[k]:
-                    dvec = self[k]['diffvect']
-                    ldsl = self[k]['diffslabs']
-                    dix = self[k]['diffidx']
-
 
                 ## flatten information
                 ######################
 
-                # flatten nstr (1 dimension)
                 # size1 = i x r
                 size1 = nstr.size
 
-                # flatten ityp (method faster than np.ravel() )
-                nstrf = np.reshape(nstr,size1,order='F')
-                itypf = ityp.reshape(size1,order='F')
-                thetaf = theta.reshape(size1,order='F')
-                #sif = si[0, :, :].reshape(si[0, :, :].size)
-
-                # ## index creation / already done in rays.locbas
-                # ##################
-                # # create index for retrieving interactions
-
-                # # integer offset : total size idx
-
-                # idxts = idxts + idx.size
+                nstrf = nstr.reshape(size1, order='F')
+                itypf = ityp.reshape(size1, order='F')
 
-                # idx = idxts + np.arange(ityp.size).reshape(np.shape(ityp),order='F')
+                # interaction index
+                idxf = self[k]['rays'].reshape(size1, order='F')
 
-                # nbray = np.shape(idx)[1]
+                # (theta, s_in, s_out)
+                I.ityp[idxf] = itypf
+                I.theta[idxf] = theta.reshape(size1, order='F')
+                I.si0[idxf] = si[0:-1, :].reshape(size1, order='F')
+                I.sout[idxf] = si[1:, :].reshape(size1, order='F')
 
-                # self[k]['rays'] = idx
-                # self[k]['nbrays'] = nbray
-                # self[k]['rayidx'] = nbrayt + np.arange(nbray)
-                # # create a numpy array to relate the ray index to its corresponding
-                # # number of interactions
+                # used slab
+                # wall reflexion and transmission, floor and ceil reflexion
+                uRT = (itypf == 2) | (itypf == 3)
+                I.isl[idxf[uRT]] = segsl[nstrf[uRT]]
+                I.isl[idxf[itypf == 4]] = slf
+                I.isl[idxf[itypf == 5]] = slc
 
-                # # _ray2nbi = np.ones((nbray))
-
-                # #try:
-                # #    self._ray2nbi=np.hstack((self._ray2nbi,_ray2nbi))
-                # #except:
-                # #    self._ray2nbi=_ray2nbi
-
-                # #self._ray2nbi[self[k]['rayidx']]  = k
-                # nbrayt = nbrayt + nbray
-                # #self.raypt = self.raypt + self[k]['nbrays']
-
-                idxf = self[k]['rays'].reshape(self[k]['rays'].size,order='F')
-                #  (i+1)xr
-                # 
-
-                size2 = si[:, :].size
-                nbray = self[k]['nbrays']
-                # TODO
-                # dirty fix
-                # nbray is either an int or an array. why ?
-                if type(nbray)==np.ndarray:
-                    nbray=nbray[0]
-
-                #  ,(i+1)xr
-                # sif = si[:, :].reshape(size2,order='F') # TO BE REMOVE
-                s_inf = s_in[:, :].reshape(ityp.size,order='F')
-                s_outf = s_out[:, :].reshape(ityp.size,order='F')
-
-                # 2x2,(i+1)xr
+                ###
+                #Diffraction
+                #phi0,phi,beta,N and the used wedge
+                #
+                if 'diffvect' in self[k]:
+                    dix = self[k]['diffidx']
+                    I.dvec[dix] = self[k]['diffvect'].T
+                    I.isl[dix] = I.slabid(self[k]['diffslabs'])
 
+                # Basis
                 #
                 # self[k]['B'] 3 x 3 x i x r
                 #
                 # first unitary matrix (3x3xr)
-                b0 = self[k]['B'][:,:,0,:]
+                b0 = self[k]['B'][:, :, 0, :]
                 # first unitary matrix 1:
                 # dimension i and r are merged
-                b = self[k]['B'][:,:,1:,:].reshape(3, 3, size2-nbray,order='F')
-
-
-                ## find used slab
-                ##################
-                # find slab type for the rnstr
-                # nstrf is a number of slab
-                # this is a problem for handling subsegment
-                #
-
-                # seek for interactions position
-                ################################
-
-                uD  = np.where((itypf == 1))[0]
-                uR  = np.where((itypf == 2))[0]
-                uT  = np.where((itypf == 3))[0]
-                uRf = np.where((itypf == 4))[0]
-                uRc = np.where((itypf == 5))[0]
-
-                # assign floor and ceil slab
-                ############################
-
-                slT = [ L.Gs.node[x]['name'] for x in nstrf[uT] ]
-                slR = [ L.Gs.node[x]['name'] for x in nstrf[uR] ]
-
-                # WARNING
-                # in future versions floor and ceil could be different for each cycle.
-                # this information would be directly obtained from L.Gs
-                # then the two following lines would have to be modified
-
-                slRf = np.array(['FLOOR']*len(uRf))
-                slRc = np.array(['CEIL']*len(uRc))
-
+                b = self[k]['B'][:, :, 1:, :].reshape(3, 3, size1, order='F')
 
-                # Fill the used slab
-                #####################
-
-                tsl = np.hstack((tsl, slT))
-                rsl = np.hstack((rsl, slR, slRf, slRc))
-                if 'diffvect' in self[k]:
-                    dw = np.hstack((dw,self[k]['diffslabs']))
-    ##            for s in uslv:
-    ##
-    ##                T.dusl[s]=np.hstack((T.dusl[s],len(T.idx) + np.where(sl[uT]==s)[0]))
-    ##                R.dusl[s]=np.hstack((R.dusl[s],len(R.idx) + np.where(sl[uR]==s)[0]))
-    ##            R.dusl['FLOOR']=np.hstack((R.dusl['FLOOR'],len(R.idx)+len(uR) + np.where(sl[uRf]=='FLOOR')[0]))
-    # R.dusl['CEIL']=np.hstack((R.dusl['CEIL'],len(R.idx)+len(uR)+len(uRf) +
-    # np.where(sl[uRc]=='CEIL')[0]))
-
-                # Basis
-                # Hugr issue with B index
-                # Friedman version Bs was entering in the index
-                # maybe B can have the same index that interactions
-                # but this must be managed when evaluation of CIR is made
-
-                # BU 10/4/2013
-                # .. todo:  This is no longer idxf the good index
-                # why the transposition b is first 2x2x(i+1)xr
-                #                             idxf is (ixr)
-                #
-                # need to check how B is used in eval()
-                #
-                # Warning
-                # -------
-                # B.idx refers to an interaction index
-                # whereas B0.idx refers to a ray number
-                # B.stack(data=b.T, idx=idxf)
-                # B0.stack(data=b0.T,idx=self[k]['rayidx'])
-
-                B.stack(data=b.T, idx=idxf)
-                B0.stack(data=b0.T,idx=self[k]['rayidx'])
-                ### Reflexion
-                ############
-                ### wall reflexion
-                #(theta, s_in,s_out)
-
-                R.stack(data=np.array((thetaf[uR], s_inf[uR], s_outf[uR])).T,
-                        idx=idxf[uR])
-                # floor reflexion
-                R.stack(data=np.array((thetaf[uRf], s_inf[uRf], s_outf[uRf])).T,
-                        idx=idxf[uRf])
-                # ceil reflexion
-                R.stack(data=np.array((thetaf[uRc], s_inf[uRc], s_outf[uRc])).T,
-                        idx=idxf[uRc])
-
-                # R.stack(data=np.array((thetaf[uR], sif[uR], sif[uR+1])).T,
-                #         idx=idxf[uR])
-                # # floor reflexion
-                # R.stack(data=np.array((thetaf[uRf], sif[uRf], sif[uRf+1])).T,
-                #         idx=idxf[uRf])
-                # # ceil reflexion
-                # R.stack(data=np.array((thetaf[uRc], sif[uRc], sif[uRc+1])).T,
-                #         idx=idxf[uRc])
-
-                ### sl[idxf[uT]]
-                # Transmision
-                ############
-                # (theta, s_in,s_out)
-                # T.stack(data=np.array((thetaf[uT], sif[uT], sif[uT+1])).T, idx=idxf[uT])
-                T.stack(data=np.array((thetaf[uT], s_inf[uT], s_outf[uT])).T, idx=idxf[uT])
-
-                ###
-                #Diffraction
-                #phi0,phi,si,sd,N,mat0,matN,beta
-                #
-
-                if 'diffvect' in self[k]:
-                    # self[k]['diffvect'] = ((phi0,phi,beta,N) x (nb_rayxnb_interactions)   )
-                    #si and so are stacked at the end of self[k]['diffvect']
-                    #as well:
-                    #data =  (6 x (nb_rayxnb_interactions) )
-                    # ((phi0,phi,beta,N,sin,sout) x (nb_rayxnb_interactions) )
-                    data = np.vstack((self[k]['diffvect'],s_inf[uD],s_outf[uD]))
-                    D.stack(data=data.T,idx=self[k]['diffidx'])#idxf[uD])
+                B.data[idxf] = b.T
+                B0.data[self[k]['rayidx']] = b0.T
 
             elif self.los:
-                ze = np.array([0])
-                #self[k]['rays'] = np.array(([[0]]))
-                #self[k]['nbrays'] = 1
-                #self[k]['rayidx'] = ze
-                #self.raypt = 1
-                #self._ray2nbi=ze
-                B.stack(data=np.eye(3)[np.newaxis,:,:], idx=ze)
-                B0.stack(data=np.eye(3)[np.newaxis,:,:],idx=ze)
-
-        if len(tsl)>0:
-            T.create_dusl(tsl)
-        if len(rsl)>0:
-            R.create_dusl(rsl)
-        if len(dw)>0:
-            D.create_dusl(dw)
+                B.data[0] = np.eye(3)
+                B0.data[0] = np.eye(3)
+
         # create interactions structure
+        # slab grouped index and R, T, D interactions
+        I.group()
         self.I = I
-        self.I.add([T, R, D])
         # create rotation base B
         self.B = B
         # create rotation base B0
@@ -2818,7 +2463,7 @@ class Rays(PyLayers, dict):
 
         self.filled = True
 
-    def eval(self,fGHz=np.array([2.4]),bfacdiv=False,ib=[]):
+    def eval(self,fGHz=np.array([2.4]),bfacdiv=False,ib=[],evalI=True,fchunk=None,dirname=None,mode='exact'):
         """  field evaluation of rays
 
         Parameters
@@ -2827,6 +2472,37 @@ class Rays(PyLayers, dict):
         fGHz : array
             frequency in GHz
         ib : list of interactions block
+        evalI : boolean
+            if False, self.I has already been evaluated in fGHz
+            (see interactions.intersplit)
+        fchunk : int
+            number of frequency points processed at once
+            (default None : all frequency points)
+        dirname : string
+            directory of the memmap file of the propagation channel
+            (default None : in memory)
+        mode : string
+            slab coefficients of the interactions, 'exact' or 'tab'
+            (see Interactions.eval)
+
+        Notes
+        -----
+
+        For each group of rays with the same number of interactions,
+        the chain of 3x3 matrices
+
+            B_l I_l ... B_1 I_1 B_0
+
+        is evaluated with batched matrix products in preallocated buffers.
+        fchunk bounds the size of those buffers and the peak memory,
+        the peak RSS of the process is stored in self.peakMB
+
+        If fchunk is set, the interactions are evaluated chunk by chunk
+        (self.I.I is not kept and self.I.evaluated is False afterwards,
+        see Interactions.eval) and the returned Ctilde
+        keeps fchunk, so that Ctilde.locbas, Ctilde.prop2tran and the
+        Tchannel methods also stream over chunks. With dirname the
+        channels are memmap files (out-of-core mode).
 
         """
 
@@ -2834,29 +2510,30 @@ class Rays(PyLayers, dict):
 
         self.fGHz=fGHz
 
+        #nf : number of frequency point
+        nf = len(fGHz)
+        nfc = nf if fchunk is None else fchunk
+        # interactions evaluated chunk by chunk
+        Ichunk = evalI and (nfc < nf)
+
         # evaluation of all interactions
         #
         # core calculation of all interactions is done here
         #
 
-        self.I.eval(fGHz)
+        if evalI and not Ichunk:
+            self.I.eval(fGHz,mode=mode)
 
-        # if np.isnan(self.I.I).any():
-        #     pdb.set_trace()
-        # evaluation of base B  (2x2)
+        # evaluation of base B  (3x3)
         # B and B0 do no depend on frequency
-        # just an axis extension (np.newaxis)
-        #pdb.set_trace()
 
-        # 1 x i x 3 x 3
-        B  = self.B.data[np.newaxis,...]
-        B  = B.swapaxes(2,3)
-        # 1 x r x 3 x 3
-        B0 = self.B0.data[np.newaxis,...]
-        B0  = B0.swapaxes(2,3)
+        # i x 3 x 3
+        B  = self.B.data.swapaxes(1,2)
+        # r x 3 x 3
+        B0 = self.B0.data.swapaxes(1,2)
 
-        # Ct : f x r x 3 x 3
-        Ct = np.zeros((self.I.nf, self.nray, 3, 3), dtype=complex)
+        # C : 2 x 2 x r x f  (tt,tp,pt,pp)
+        C = chanalloc((2, 2, self.nray, nf), dirname)
 
         # delays : ,r
         self.delays = np.zeros((self.nray))
@@ -2864,23 +2541,48 @@ class Rays(PyLayers, dict):
         # dis : ,r
         self.dis = np.zeros((self.nray))
 
-        #nf : number of frequency point
-        nf = self.I.nf
-
         aod= np.empty((2,self.nray))
         aoa= np.empty((2,self.nray))
         # loop on interaction blocks
         if ib==[]:
             ib=self.keys()
 
-        # loop over group of interactions
         for l in ib:
             # ir : ray index
-
             ir = self[l]['rayidx']
             aoa[:,ir]=self[l]['aoa']
             aod[:,ir]=self[l]['aod']
             if l != 0:
+                self.delays[ir] = self[l]['dis']/0.3
+                self.dis[ir] = self[l]['dis']
+
+        #  A0  (X dot Y)
+        #  |    |     |
+        #  v    v     v
+        ##########################
+        ## B  # I  # B  # I  # B #
+        ##########################
+        #      \_____/   \______/
+        #         |         |
+        #       Atmp(i)   Atmp(i+1)
+        #
+        # Z=Atmp(i) dot Atmp(i+1)
+
+        # loop over frequency chunks
+        for f0 in range(0, nf, nfc):
+            f1 = min(f0 + nfc, nf)
+            n = f1 - f0
+            if Ichunk:
+                self.I.eval(fGHz[f0:f1],mode=mode)
+                I = self.I.I
+            else:
+                I = self.I.I[f0:f1]
+            # loop over group of interactions
+            for l in ib:
+                if l == 0:
+                    continue
+                # ir : ray index
+                ir = self[l]['rayidx']
                 # l stands for the number of interactions
                 r = self[l]['nbrays']
                 # dirty fix should not be an array
@@ -2889,167 +2591,69 @@ class Rays(PyLayers, dict):
                 # reshape in order to have a 1D list of index
                 # reshape ray index
                 rrl = self[l]['rays'].reshape(r*l,order='F')
-                # get the corresponding evaluated interactions
-                #
-                # reshape error can be tricky to debug.
-                #
-                # f , r , l , 2 , 2
-                A = self.I.I[:, rrl, :, :].reshape(self.I.nf, r, l, 3, 3)
                 # get the corresponding unitary matrix B
-                # 1 , r , l , 2 , 2
-                #Bl = B[:, rrl, :, :].reshape(self.I.nf, r, l, 2, 2,order='F')
-                Bl = B[:, rrl, :, :].reshape(1, r, l, 3, 3)
+                # r , l , 3 , 3
+                Bl = B[rrl, :, :].reshape(r, l, 3, 3)
                 # get the first unitary matrix B0l
-                B0l = B0[:,ir,:, :]
-                # get alpha
-                alpha = self.I.alpha[rrl].reshape(r, l,order='F')
-                # # get gamma
-                gamma = self.I.gamma[rrl].reshape(r, l,order='F')
-                # # get si0
-                si0 = self.I.si0[rrl].reshape(r, l,order='F')
-                # # get sout
-                sout = self.I.sout[rrl].reshape(r, l,order='F')
-
-                try:
-                    del Z
-                except:
-                    pass
-
-
-                #print "\nrays",ir
-                #print "-----------------------"
-                ## loop on all the interactions of ray with l interactions
-                for i in range(0, l):
-
-
-    ############################################
-    ##                # Divergence factor D
-    ###                 not yet implementented
-    ############################################
-#                    if i == 0:
-#                        pdb.set_trace()
-#                        D0 = 1./si0[:,1]
-#                        rho1 = si0[:,1]*alpha[:,i]
-#                        rho2 = si0[:,1]*alpha[:,i]*gamma[:,i]
-#                        D =np.sqrt(
-#                         ( (rho1 ) / (rho1 + sout[:,i]) )
-#                         *( (rho2) / (rho2 + sout[:,i])))
-#                        D=D*D0
-#                        rho1=rho1+(sout[:,i]*alpha[:,i])
-#                        rho2=rho2+(sout[:,i]*alpha[:,i]*gamma[:,i])
-#
-#   ##                     gerer le loss
-#                        if np.isnan(D).any():
-#                            p=np.nonzero(np.isnan(D))[0]
-#                            D[p]=1./sout[p,1]
-#                    else :
-#                        D=np.sqrt(
-#                         ( (rho1 ) / (rho1 + sout[:,i]) )
-#                         *( (rho2) / (rho2 + sout[:,i])))
-#
-#                        rho1=rho1+(sout[:,i]*alpha[:,i])
-#                        rho2=rho2+(sout[:,i]*alpha[:,i]*gamma[:,i])
-    ############################################
-
-                    #  A0  (X dot Y)
-                    #  |    |     |
-                    #  v    v     v
-                    ##########################
-                    ## B  # I  # B  # I  # B #
-                    ##########################
-                    #      \_____/   \______/
-                    #         |         |
-                    #       Atmp(i)   Atmp(i+1)
-                    #
-                    # Z=Atmp(i) dot Atmp(i+1)
-
-                    #X = A [:, :, i, :, :]
-                    #Y = Bl[:, :, i, :, :]
-                    # pdb.set_trace()
-                    if i == 0:
-                    ## First Basis added
-                        Atmp = A[:, :, i, :, :]
-                        B00 = B0l[:, :,  :, :]
-                        Z = np.sum(Atmp[..., :, :, np.newaxis]
-                                  *B00[..., np.newaxis, :, :], axis=-2)
-                    else:
-                        Atmp = A[:, :, i, :, :]
-                        BB = Bl[:, :, i-1, :, :]
-                        Ztmp = np.sum(Atmp[..., :, :, np.newaxis]
-                                  *BB[..., np.newaxis, :, :], axis=-2)
-
-
-                        Z = np.sum(Ztmp[..., :, :, np.newaxis]
-                                  *Z[..., np.newaxis, :, :], axis=-2)
-
-                    if i == l-1:
-                        BB = Bl[:, :, i, :, :]
-                        Z = np.sum(BB[..., :, :, np.newaxis]
-                                  *Z[..., np.newaxis, :, :], axis=-2)
+                # r , 3 , 3
+                B0l = B0[ir, :, :]
+                # 1/distance
+                idis = 1./self[l]['dis']
 
+                # buffers
+                # f , r , 3 , 3
+                z = np.empty((n, r, 3, 3), dtype=complex)
+                zb = np.empty((n, r, 3, 3), dtype=complex)
+                y = np.empty((n, r, 3, 3), dtype=complex)
 
+                # get the corresponding evaluated interactions
+                # f , r , l , 3 , 3
+                A = I[:, rrl, :, :].reshape(n, r, l, 3, 3)
+                # first basis
+                np.matmul(A[:, :, 0, :, :], B0l, out=z)
+                for i in range(1, l):
+                    np.matmul(A[:, :, i, :, :], Bl[:, i-1, :, :], out=y)
+                    np.matmul(y, z, out=zb)
+                    z, zb = zb, z
+                # last basis
+                np.matmul(Bl[:, l-1, :, :], z, out=zb)
+                zb *= idis[None, :, None, None]
                 # fill the C tilde MDA
-
-                Ct[:,ir, :, :] = Z[:, :, :, :]
-
-                #
-                if bfacdiv:
-                    Ct[:,ir, :, :] = Ct[:, ir, :, :]*1./(self[l]['dis'][np.newaxis, :, np.newaxis, np.newaxis])
-                else:
-                    Ct[:,ir, :, :] = Ct[:, ir, :, :]*1./(self[l]['dis'][np.newaxis, :, np.newaxis, np.newaxis])
-                self.delays[ir] = self[l]['dis']/0.3
-                self.dis[ir] = self[l]['dis']
+                C[:, :, ir, f0:f1] = zb[:, :, 1:, 1:].transpose(2, 3, 1, 0)
+        if Ichunk:
+            # self.I.I only holds the last frequency chunk
+            del self.I.I
+            self.I.evaluated = False
         #
         # true LOS when no interaction
         #
         if self.los:
-            Ct[:,0, :, :]= np.eye(3,3)[None,None,:,:]
-            #self[0]['dis'] = self[0]['si'][0]
             # Fris
-            Ct[:,0, :, :] = Ct[:,0, :, :]*1./(self[0]['dis'][None, :, None, None])
+            C[0, 0, 0, :] = 1./self[0]['dis']
+            C[1, 1, 0, :] = 1./self[0]['dis']
             self.delays[0] = self[0]['dis']/0.3
             self.dis[0] = self[0]['dis']
 
-
-        # To be corrected in a future version
-        #
-        #  Ct : nf , Nray , theta , phi 
-        #
-        #  to 
-        #
-        #  Ct : Nray x nf , theta , phi 
-        #
-        Ct = np.swapaxes(Ct, 1, 0)
-
-        #c11 = Ct[:,:,0,0]
-        #c12 = Ct[:,:,0,1]
-        #c21 = Ct[:,:,1,0]
-        #c22 = Ct[:,:,1,1]
-
-        c11 = Ct[:,:,1,1]
-        c12 = Ct[:,:,1,2]
-        c21 = Ct[:,:,2,1]
-        c22 = Ct[:,:,2,2]
-
+        try:
+            # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == 'darwin':
+                self.peakMB = maxrss/1024.**2
+            else:
+                self.peakMB = maxrss/1024.
+            logger.info(" Rays.eval %d rays x %d frequencies, peak RSS %.1f MB",
+                        self.nray, nf, self.peakMB)
+        except (ImportError, AttributeError):
+            pass
 
         #
         # Construction of the Ctilde propagation channel structure
         #
         Cn = Ctilde()
 
-        # Cn.Cpp = bs.FUsignal(self.I.fGHz, c11)
-        # Cn.Cpt = bs.FUsignal(self.I.fGHz, c12)
-        # Cn.Ctp = bs.FUsignal(self.I.fGHz, c21)
-        # Cn.Ctt = bs.FUsignal(self.I.fGHz, c22)
-        Cn.Ctt = bs.FUsignal(self.I.fGHz, c11)
-        Cn.Ctp = bs.FUsignal(self.I.fGHz, c12)
-        Cn.Cpt = bs.FUsignal(self.I.fGHz, c21)
-        Cn.Cpp = bs.FUsignal(self.I.fGHz, c22)
-
-        Cn.nfreq = self.I.nf
-        Cn.nray = self.nray
+        Cn.fromarray(fGHz, C, fchunk=fchunk, dirname=dirname)
+
         Cn.tauk = self.delays
-        Cn.fGHz = self.I.fGHz
         # r x 2
         Cn.tang = aod.T
         Cn.tangl = aod.T
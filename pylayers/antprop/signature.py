@@ -31,6 +31,9 @@ import pylayers.util.plotutil as plu
 from pylayers.antprop.rays import Rays
 from pylayers.util.project import *
 import heapq
+from collections import OrderedDict
+import multiprocessing as mp
+from math import sqrt, acos
 import shapely.geometry as sh
 import shapely.ops as sho
 from tqdm import tqdm
@@ -113,6 +116,158 @@ def showsig(L,s,tx=[],rx=[]):
     L.display['edlabel']=False
 
 
+def _sigrun_init(S,lis,kw):
+    """ initialize a Signatures.run worker process
+
+    Parameters
+    ----------
+
+    S : Signatures
+    lis : list
+        list of interactions seen from the source
+    kw : dict
+        exploration context (see Signatures._propagate)
+
+    Notes
+    -----
+
+    The context is stored in a module global. With the fork start method
+    the layout graphs are inherited by the worker without being pickled.
+
+    """
+    global _sigrun_ctx
+    _sigrun_ctx = (S,lis,kw)
+
+def _sigrun_chunk(lus):
+    """ explore Gi from a chunk of source interactions
+
+    Parameters
+    ----------
+
+    lus : list
+        indices in the list of source interactions
+
+    Returns
+    -------
+
+    (lsig,nvisit)
+
+    """
+    S,lis,kw = _sigrun_ctx
+    lsig = []
+    lhash = set()
+    nvisit = 0
+    for us in lus:
+        lsigu,nvisitu = S._propagate(lis[us],us=us,**kw)
+        nvisit += nvisitu
+        # drop duplicates locally, the first occurence is kept by the merge
+        for sig,ratio,sighash in lsigu:
+            if sighash is not None:
+                if sighash in lhash:
+                    continue
+                lhash.add(sighash)
+            lsig.append((sig,ratio,sighash))
+    return lsig,nvisit
+
+def _imagetrace(tab, tx, rx, nid, ityp, nint, na, epsilon=1e-12):
+    """ images and backtrace of a chunk of signatures
+
+    Parameters
+    ----------
+
+    tab : tuple
+        (off,pab,normal,K,v) coordinate table (see Layout._segtable)
+    tx : np.array (2,)
+    rx : np.array (2,)
+    nid : np.array (ns,Lmax)
+        node numbers of the signatures (padded)
+    ityp : np.array (ns,Lmax)
+        interaction types of the signatures (padded)
+    nint : np.array (ns,)
+        number of interactions, in decreasing order
+    na : np.array (Lmax,)
+        number of signatures with more than n interactions
+    epsilon : float
+
+    Returns
+    -------
+
+    valid : np.array (ns,)
+        True if the signature is a ray
+    X : np.array (2,ns,Lmax)
+        interaction points of the rays
+
+    Notes
+    -----
+
+    As the signatures are sorted by decreasing number of interactions,
+    the signatures concerned by the nth image are the first na[n] ones.
+    The backtrace goes from the last interaction of each signature to the
+    first one, the (2x2) systems of eq (2.70) thesis Nicolas AMIOT are
+    solved explicitly.
+
+    """
+    off, pab, normal, K, v = tab
+    ns, Lmax = np.shape(nid)
+    r = nid + off
+
+    # images
+    # M : (2,ns,Lmax)
+    M = np.empty((2, ns, Lmax))
+    for n in range(Lmax):
+        s = na[n]
+        rn = r[:s, n]
+        tn = ityp[:s, n]
+        if n == 0:
+            p = tx[:, None]*np.ones(s)
+        else:
+            p = M[:, :s, n-1]
+        # reflexion (2.67)
+        m = np.einsum('ijk,jk->ik', K[:, :, rn], p) + v[:, rn]
+        # transmission
+        uT = tn == 3
+        m[:, uT] = p[:, uT]
+        # diffraction
+        uD = tn == 1
+        m[:, uD] = pab[:, 0, rn[uD]]
+        M[:, :s, n] = m
+
+    # backtrace
+    X = np.zeros((2, ns, Lmax))
+    valid = np.ones(ns, dtype=bool)
+    # next point of the rays
+    q = rx[:, None]*np.ones(ns)
+    for j in range(Lmax):
+        u = np.where(valid[:na[j]])[0]
+        if len(u) == 0:
+            break
+        k = nint[u] - 1 - j
+        rk = r[u, k]
+        uD = ityp[u, k] == 1
+        pa = pab[:, 0, rk]
+        # pa and -pa for diffraction points to avoid a singular system
+        w = pa - pab[:, 1, rk]
+        w[:, uD] = 2*pa[:, uD]
+        p = q[:, u]
+        pm = p - M[:, u, k]
+        ap = pa - p
+        # x = p - alpha (p - m) = a - beta (a - b)
+        det = w[0]*pm[1] - pm[0]*w[1]
+        regular = np.abs(det) >= 1e-15
+        det[~regular] = 1.
+        alpha = (ap[0]*w[1] - w[0]*ap[1])/det
+        beta = (ap[0]*pm[1] - pm[0]*ap[1])/det
+        # valid ray is : 0 < alpha < 1 and 0 < beta < 1
+        # diffraction points are valid
+        validk = regular & (((alpha > 0.) & (alpha < 1.) &
+                             (beta >= epsilon) & (beta <= 1.-epsilon)) | uD)
+        x = p - alpha*pm
+        x[:, uD] = pa[:, uD]
+        q[:, u] = x
+        X[:, u, k] = x
+        valid[u[~validk]] = False
+    return valid, X
+
 def gidl(g):
     """ gi without diffraction
 
@@ -393,9 +548,139 @@ def valid(lsig,L,tahe=[]):
     return np.all(inside)
 
 
+class SigCache(PyLayers):
+    """ in-memory LRU cache of the Signatures of a Layout
+
+    Signatures only depend on the cycle pair and on the parameters of
+    Signatures.run, they are reused by all the links of a Layout whatever
+    the positions of their extremities.
+
+    Attributes
+    ----------
+
+    maxsize : int
+        maximal number of Signatures kept in memory
+    hits : int
+        number of successful lookups
+    misses : int
+        number of failed lookups
 
+    See Also
+    --------
+
+    sigcache, pylayers.simul.link.DLink.eval
+
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._od = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        st = 'SigCache : ' + str(len(self._od)) + '/' + str(self.maxsize)
+        st = st + ' signatures, hits : ' + str(self.hits)
+        st = st + ' misses : ' + str(self.misses)
+        return st
+
+    def __len__(self):
+        return len(self._od)
+
+    def __contains__(self, key):
+        return key in self._od
+
+    @staticmethod
+    def key(ca, cb, cutoff, threshold, **kwargs):
+        """ cache key of the Signatures between cycles ca and cb
+
+        Parameters
+        ----------
+
+        ca : int
+        cb : int
+        cutoff : int
+        threshold : float
+        kwargs : other parameters of Signatures.run
+            (nD, nR, nT, bt, diffraction, delay_excess_max_ns)
+
+        """
+        lk = ['nD', 'nR', 'nT', 'bt', 'diffraction', 'delay_excess_max_ns']
+        return ((ca, cb, cutoff, threshold) +
+                tuple(kwargs.get(k, None) for k in lk))
+
+    def get(self, key):
+        """ get the Signatures of key (None if absent)
+        """
+        if key in self._od:
+            Si = self._od.pop(key)
+            self._od[key] = Si
+            self.hits += 1
+            return Si
+        self.misses += 1
+        return None
+
+    def put(self, key, Si):
+        """ store the Signatures Si, the least recently used one is dropped
+        """
+        if key in self._od:
+            self._od.pop(key)
+        self._od[key] = Si
+        while len(self._od) > self.maxsize:
+            self._od.popitem(last=False)
+
+    def clear(self):
+        """ empty the cache and reset the statistics
+        """
+        self._od.clear()
+        self.hits = 0
+        self.misses = 0
 
 
+# one SigCache per layout content (see Layout.cachekey), only the
+# _nsigcaches most recently used layouts are kept
+_sigcaches = OrderedDict()
+_nsigcaches = 8
+
+
+def sigcache(L, maxsize=256):
+    """ returns the SigCache shared by all the links of Layout L
+
+    Parameters
+    ----------
+
+    L : Layout
+    maxsize : int
+        size of the cache when it is created
+
+    Notes
+    -----
+
+    The cache is identified by the content key of the layout
+    (Layout.cachekey), Layout objects with the same points and segments
+    share the same cache and an in-memory modification of the layout
+    switches to a new cache. The caches of the least recently used
+    layouts are dropped beyond _nsigcaches layouts.
+
+    Examples
+    --------
+
+    >>> from pylayers.gis.layout import Layout
+    >>> from pylayers.antprop.signature import *
+    >>> L = Layout('defstr.lay')
+    >>> sigcache(L) is sigcache(Layout('defstr.lay'))
+    True
+
+    """
+    k = L.cachekey()
+    if k in _sigcaches:
+        sic = _sigcaches.pop(k)
+    else:
+        sic = SigCache(maxsize=maxsize)
+    _sigcaches[k] = sic
+    while len(_sigcaches) > _nsigcaches:
+        _sigcaches.popitem(last=False)
+    return sic
+
 
 class Signatures(PyLayers,dict):
     """ set of Signature given 2 Gt cycle (convex) indices
@@ -1107,6 +1392,11 @@ class Signatures(PyLayers,dict):
             maximum number of reflection
         nT : int
             maximum number of transmission
+        nproc : int
+            number of processes used for exploring Gi (default 1)
+            if nproc > 1 the interactions seen from the source are split
+            in chunks explored in parallel. The result is the same as the
+            serial exploration.
 
 
         See Also
@@ -1124,7 +1414,8 @@ class Signatures(PyLayers,dict):
                     'bt' : True,
                     'progress': True,
                     'diffraction' : True,
-                    'animation' : False
+                    'animation' : False,
+                    'nproc' : 1
                     }
         self.cpt = 0
         for k in defaults:
@@ -1143,19 +1434,13 @@ class Signatures(PyLayers,dict):
         progress = kwargs['progress']
         diffraction = kwargs['diffraction']
         animation = kwargs['animation']
+        nproc = kwargs['nproc']
         delay_excess_max_ns = kwargs['delay_excess_max_ns']
         dist_excess_max = delay_excess_max_ns*0.3
 
 
         self.filename = self.L._filename.split('.')[0] +'_' + str(self.source) +'_' + str(self.target) +'_' + str(self.cutoff) +'.sig'
 
-        #
-        # AIR : editable AIR separation
-        # _AIR : constructed AIR separation
-        #
-
-        lair = self.L.name['AIR'] + self.L.name['_AIR']
-
         # list of interactions visible from source
         lisR, lisT, lisD = self.L.intercy(self.source,typ='source')
 
@@ -1186,10 +1471,15 @@ class Signatures(PyLayers,dict):
         Gi = self.L.Gi
         Gi.pos = self.L.Gi.pos
         #
-        # remove diffractions from Gi
+        # integer indexed form of Gi
+        # diffraction points are skipped during the exploration
+        # if diffraction is False
         #
-        if not diffraction:
-            Gi = gidl(Gi)
+        if not hasattr(self.L,'Gicsr'):
+            self.L.Gi2csr()
+        Gicsr = self.L.Gicsr
+        blit = np.zeros(len(Gicsr['lint']),dtype=bool)
+        blit[[Gicsr['dint'][x] for x in lit if x in Gicsr['dint']]] = True
 
         # initialize dout dictionnary
         dout = {}
@@ -1201,10 +1491,8 @@ class Signatures(PyLayers,dict):
         tic0 = tic
         #for interaction source in list of source interactions
 
-        bvisu = False
-        # signature counter
-        cptsig = 0
-
+        fig = []
+        ax = []
         if animation:
             fig,ax = self.L.showG('s',aw=1)
             ax.plot(self.L.Gt.pos[self.source][0],self.L.Gt.pos[self.source][1],'ob')
@@ -1217,598 +1505,584 @@ class Signatures(PyLayers,dict):
         # s[0] : point (<0) or segment (>0)a
         # pts : list of neighbour nodes from s[0]
         # tahe : segment extremities or point coordinates (repeated twice)
-        lhash = []
 
         if progress :
             pbar = tqdm(total=100, desc='Signatures')
 
-        for us,s in enumerate(lis):
-            if progress:
-                pbar.update(100./(1.*len(lis)))
+        kw = {'Gicsr' : Gicsr,
+              'blit' : blit,
+              'diffraction' : diffraction,
+              'target' : self.target,
+              'pt_source' : pt_source,
+              'pt_target' : pt_target,
+              'd_source_target' : d_source_target,
+              'dist_excess_max' : dist_excess_max,
+              'nD' : nD,
+              'nR' : nR,
+              'nT' : nT,
+              'bt' : bt
+             }
+
+        #
+        # Each interaction seen from the source is the root of an
+        # independent depth first exploration of Gi. With nproc > 1, lis is
+        # split in chunks which are explored in a pool of forked processes
+        # sharing a read-only copy of the layout graphs.
+        # Partial results are merged in lis order, so that the output is
+        # the same as the serial exploration.
+        #
+        if (nproc > 1) and (len(lis) > 1) and (not animation):
+            nchunk = min(len(lis), 4*nproc)
+            lchunk = [ list(u) for u in np.array_split(np.arange(len(lis)),nchunk) ]
+            pool = mp.Pool(processes=nproc,
+                           initializer=_sigrun_init,
+                           initargs=(self,lis,kw))
+            lres = []
+            try:
+                for k,res in enumerate(pool.imap(_sigrun_chunk,lchunk)):
+                    if progress:
+                        pbar.update(100.*len(lchunk[k])/(1.*len(lis)))
+                    lres.append(res)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            lres = []
+            for us,s in enumerate(lis):
+                if progress:
+                    pbar.update(100./(1.*len(lis)))
+                lres.append(self._propagate(s,us=us,animation=animation,
+                                            Gi=Gi,fig=fig,ax=ax,**kw))
+
+        self._merge(lres)
+
+    def _merge(self,lres):
+        """ merge partial exploration results into signatures
+
+        Parameters
+        ----------
+
+        lres : list
+            list of (lsig,nvisit) tuples in the order of the source interactions
+            lsig is a list of (sig,ratio,sighash)
+
+        Notes
+        -----
+
+        A signature with a sighash already encountered is discarded,
+        single interaction signatures (sighash None) are always kept.
 
-            # start from a segment
-            if s[0] > 0:
-                pts = list(dict(self.L.Gs[s[0]]).keys())
-                tahe = [ np.array([ self.L.Gs.pos[pts[0]], self.L.Gs.pos[pts[1]]]) ]
-            # start from a point
+        """
+        lhash = set()
+        dsig = {}
+        dratio = {}
+        for lsig,nvisit in lres:
+            self.cpt += nvisit
+            for sig,ratio,sighash in lsig:
+                if sighash is not None:
+                    if sighash in lhash:
+                        continue
+                    lhash.add(sighash)
+                k = sig.shape[1]
+                if k not in dsig:
+                    dsig[k] = []
+                    dratio[k] = []
+                dsig[k].append(sig)
+                dratio[k].append(ratio)
+
+        for k in dsig:
+            if k in self:
+                self[k] = np.vstack([self[k]]+dsig[k])
+                self.ratio[k] = np.append(self.ratio[k],dratio[k])
             else:
-                tahe = [np.array([self.L.Gs.pos[s[0]], self.L.Gs.pos[s[0]]])]
+                self[k] = np.vstack(dsig[k])
+                self.ratio[k] = np.array(dratio[k])
 
-            # R is a list which contains reflexion matrices (Sn) and translation matrices(vn)
-            # for interaction mirroring
-            # R=[[S0,v0],[S1,v1],...]
+    def _propagate(self,s,**kwargs):
+        """ explore Gi from a single interaction seen from the source
 
-            R = [(np.eye(2),np.array([0,0]))]
+        Parameters
+        ----------
 
-            # initialize visited list sequence with the first intercation s
+        s : tuple
+            starting interaction
+        Gicsr : dict
+            integer indexed form of Gi (see Layout.Gi2csr)
+        blit : np.array (Ni)
+            True for the interactions seen from the target
+        diffraction : boolean
+            if False diffraction points are skipped
+        target : int
+            target cycle
+        pt_source : np.array
+            source cycle centroid
+        pt_target : np.array
+            target cycle centroid
+        d_source_target : float
+        dist_excess_max : float
+        nD : int
+        nR : int
+        nT : int
+        bt : boolean
+        us : int
+            index of s in the list of source interactions (animation only)
+        animation : boolean
+        Gi : nx.DiGraph
+            graph of interactions (animation only)
+        fig : matplotlib figure
+        ax : matplotlib axes
 
-            visited = [s]
+        Returns
+        -------
 
-            # if
-            #   s is in target interaction list
-            # or
-            #   arrival cycle is equal to target cycle
-            # then stack a new signature in self[len(typ)]
-            #
-            # TODO : It concerns self[1] : only one interaction (i.e several single reflection or diffraction)
-            #
-            if (s in lit) or (s[-1]==self.target):
-                #anstr = np.array(map(lambda x: x[0],visited))
-                anstr = np.array([ x[0] for x in visited ])
-                #typ  = np.array(map(lambda x: len(x),visited))
-                typ =np.array([len(x) for x in visited ])
+        lsig : list
+            list of (sig,ratio,sighash) in exploration order
+        nvisit : int
+            number of visited interaction sequences
 
-                assert(len(typ)==1)
-                try:
-                    self[len(typ)] = np.vstack((self[len(typ)],anstr,typ))
-                    self.ratio[len(typ)] = np.append(self.ratio[len(typ)],1.)
-                except:
-                    self[len(typ)] = np.vstack((anstr,typ))
-                    self.ratio[len(typ)] = np.array([1.])
-                # update signature counter
-                cptsig +=1
+        Notes
+        -----
+
+        The exploration works on interaction ids. visited is the list of
+        visited interaction ids and stack a list of iterators over Gi edges.
+        The number of D, R, T interactions and of airwalls in visited are
+        updated when an interaction is pushed or popped.
+
+        See Also
+        --------
+
+        pylayers.gis.layout.Layout.Gi2csr
+        pylayers.antprop.signature.Signatures.run
+
+        """
+        Gic = kwargs['Gicsr']
+        blit = kwargs['blit']
+        diffraction = kwargs['diffraction']
+        target = kwargs['target']
+        pt_source = kwargs['pt_source']
+        pt_target = kwargs['pt_target']
+        d_source_target = kwargs['d_source_target']
+        dist_excess_max = kwargs['dist_excess_max']
+        nD = kwargs['nD']
+        nR = kwargs['nR']
+        nT = kwargs['nT']
+        bt = kwargs['bt']
+        us = kwargs.get('us',0)
+        animation = kwargs.get('animation',False)
+        Gi = kwargs.get('Gi',[])
+        fig = kwargs.get('fig',[])
+        ax = kwargs.get('ax',[])
+
+        # the exploration loop reads the list forms of the Gicsr arrays
+        # (indexing a list of Python floats is much cheaper than
+        # indexing small numpy arrays)
+        lint = Gic['lint']
+        anstr = Gic['nstr']
+        atyp = Gic['ltyp']
+        air = Gic['lair']
+        atahe = Gic['ltahe']
+        axS = Gic['laxS']
+        axv = Gic['laxv']
+        indptr = Gic['lindptr']
+        indices = Gic['lindices']
+        optr = Gic['loptr']
+        oedge = Gic['loedge']
+        btyp = Gic['typ']
+        blit = blit.tolist()
+        # cycle centroids may be given as (2,1) arrays
+        pt_source = np.ravel(pt_source).tolist()
+        pt_target = np.ravel(pt_target).tolist()
+
+        lsig = []
+        lhash = set()
+        nvisit = 0
+        ratio = 1.0
+
+        u0 = Gic['dint'][s]
+
+        # tahe : list of well mirrored tail-head coordinates
+        tahe = [atahe[u0]]
+
+        # R is a list which contains reflexion matrices (Sn) and translation matrices(vn)
+        # for interaction mirroring
+        # R=[[S0,v0],[S1,v1],...]
+        # Sn is None for the identity (start of the mirroring chain)
+
+        R = [(None,None)]
+
+        # initialize visited list sequence with the first intercation s
+
+        visited = [u0]
+
+        # if
+        #   s is in target interaction list
+        # or
+        #   arrival cycle is equal to target cycle
+        # then stack a new signature in self[1]
+        #
+        if blit[u0] or (s[-1]==target):
+            sig = np.vstack((np.array([anstr[u0]]),np.array([btyp[u0]])))
+            # single interaction signatures are not subject to hashing
+            lsig.append((sig,1.,None))
+
+        # stack is a list of iterators over Gi edges
+        stack = [iter(range(indptr[u0],indptr[u0+1]))]
+        # air walls do not intervene in the number of transmission (cutoff criteria)
+        # lawp is the list of airwall position in visited sequence
+        # handle the case of the first segment which can be an airwall
+        #
+        if (atyp[u0]==3) and air[u0]:
+            lawp = [1]
+        else:
+            lawp = [0]
+        nair = lawp[0]
+        # number of D, R and T in visited
+        nvis = [0,0,0,0]
+        nvis[atyp[u0]] += 1
+        # positions of diffraction points in visited
+        ldiff = []
+        if atyp[u0] == 1:
+            ldiff.append(0)
+
+        cpt = 0
+        while stack:
+            # next Gi edge from the last iterator in the stack
+            e = next(stack[-1], None)
+            # cond1 : there is no more interactions
+            # continue if True
+            cond1 = not(e is None)
+            if cond1:
+                interaction = indices[e]
+                ti = atyp[interaction]
+                if (ti==1) and (not diffraction):
+                    continue
+            # cond2 : enable reverberation
+            #     interaction has not been visited yet
+            #     or
+            #     bt : True (allow reentrance) (unconditionnaly)
+            # continue if True
+            cond2 = bt or (cond1 and not (interaction in visited))
+            # cond3 : test the cutoff condition not get to the limit
+            # continue if True
+            cond3 = not(len(visited) > (self.cutoff + nair))
+            if cond1:
+                condD = not ((ti==1) and (nvis[1]==nD))
+                condR = not ((ti==2) and (nvis[2]==nR))
+                condT = not ((ti==3) and (nvis[3]==nT))
 
-            # stack is a list of iterators
-            #
             #
-            stack = [iter(Gi[s])]
-            # air walls do not intervene in the number of transmission (cutoff criteria)
-            # lawp is the list of airwall position in visited sequence
-            # handle the case of the first segment which can be an airwall
+            #  animation
             #
-            if len(s)==3:
-                nseg = s[0]
-                if ((self.L.Gs.node[nseg]['name']=='_AIR') or
-                   (self.L.Gs.node[nseg]['name']=='AIR')):
-                    lawp = [1]
-                else:
-                    lawp = [0]
-            else:
-                lawp = [0]
-            # while the stack of iterators is not void
-            cpt = 0
-            while stack: #
-                # iter_on_interactions is the last iterator in the stack
-                iter_on_interactions = stack[-1]
-                # next interaction child
-                interaction = next(iter_on_interactions, None)
-                #print visited
-                #if ((visited ==[(6236,74,91),(-213,)]) and (interaction==(-1002,))):
-                #    print(interaction)
-                #    pdb.set_trace()
-                #if (visited ==[(6236,74,91),(-213,),(6248,99,111)]):
-                #if (visited ==[(6236,74,91),(-213,),(6248,99,111),(6287,111,118)]):
-                    #pdb.set_trace()
-                #    import ipdb
-                # cond1 : there is no more interactions
-                # continue if True
-                cond1 = not(interaction is None)
-                # cond2 : enable reverberation
-                #     interaction has not been visited yet
-                #     or 
-                #     bt : True (allow reentrance) (unconditionnaly)
-                # continue if True
-                #cond2 = (interaction in visited) and bt (old)
-                cond2 = not (interaction in visited) or bt
-                # cond3 : test the cutoff condition not get to the limit
-                # continue if True
-                cond3 = not(len(visited) > (self.cutoff + sum(lawp)))
-                uD = [ k for k in range(len(visited)) if len(visited[k])==1 ]
-                uR = [ k for k in range(len(visited)) if len(visited[k])==2 ]
-                uT = [ k for k in range(len(visited)) if len(visited[k])==3 ]
-                if cond1:
-                    condD = True
-                    condR = True
-                    condT = True
-                    if ((len(interaction)==1) and (len(uD)==nD)):
-                        condD = False
-                    if ((len(interaction)==2) and (len(uR)==nR)):
-                        condR = False
-                    if ((len(interaction)==3) and (len(uT)==nT)):
-                        condT = False
+            if animation :
+                cpt = cpt+1
+                lvis = [ lint[x] for x in visited ]
+                edge = zip(lvis[:-1],lvis[1:])
+                N = nx.draw_networkx_nodes(Gi,pos=Gi.pos,
+                        nodelist=lvis,labels={},
+                        node_size=15,ax=ax,fig=fig)
+                E = nx.draw_networkx_edges(Gi,pos=Gi.pos,
+                        edgelist=edge,labels={},width=0.1,
+                        arrows=False,ax=ax,fig=fig)
+
+                plt.savefig('./figure/' +str(us) +'_' + str(cpt) +'.png')
+                try:
+                    ax.collections.remove(N)
+                except:
+                    pass
+                try:
+                    ax.collections.remove(E)
+                except:
+                    pass
+
+            if (cond1 and cond2 and cond3):
+                if (condD and condR and condT):
+                    visited.append(interaction)
+                    nvis[ti] += 1
+                    if ti == 1:
+                        ldiff.append(len(visited)-1)
+                    nvisit+=1
+
+                    # update list of airwalls
+                    if air[interaction]:
+                        lawp.append(1)
+                        nair += 1
+                    else:
+                        lawp.append(0)
 
-                #
-                #  animation
-                #
-                if animation :
-                    cpt = cpt+1
-                    edge = zip(visited[:-1],visited[1:])
-                    N = nx.draw_networkx_nodes(Gi,pos=Gi.pos,
-                            nodelist=visited,labels={},
-                            node_size=15,ax=ax,fig=fig)
-                    E = nx.draw_networkx_edges(Gi,pos=Gi.pos,
-                            edgelist=edge,labels={},width=0.1,
-                            arrows=False,ax=ax,fig=fig)
-
-                    plt.savefig('./figure/' +str(us) +'_' + str(cpt) +'.png')
-                    try:
-                        ax.collections.remove(N)
-                    except:
-                        pass
-                    try:
-                        ax.collections.remove(E)
-                    except:
+                    nstr = anstr[interaction]
+                    tprev = atyp[visited[-2]]
+                    #
+                    # Testing the type of interaction at rank -2
+                    # R is a list which contains a rotation matrix
+                    # and a translation vector for doing the mirroring
+                    # operation
+
+                    # diffraction (retrieve a point)
+                    if tprev == 1:
+                        R.append((None,None))
+                    elif tprev == 2:
+                        #
+                        # l'avant dernier point est une reflection
+                        # get reflection matrix from segment visited[-2]
+                        #
+                        R.append((axS[visited[-2]],axv[visited[-2]]))
+                    # transmission do nothing
+                    else :
                         pass
 
-                if (cond1 and cond2 and cond3):
-                    if (condD and condR and condT):
-                        visited.append(interaction)
-                        logger.debug("{}".format(visited))
-                        self.cpt+=1
-                        #print(visited)
-                        # [(44,2,7),(62,7,15),(21,15),(62,15,7),(44,7,2),(16,2)]
-                        # if visited ==[(6236,74,91),(141,91)]:
-                        #     import ipdb
-                        #     ipdb.set_trace()
-
-
-                        # update list of airwalls
-                        if interaction[0] in lair:
-                            lawp.append(1)
+                    # th is the current segment tail-head coordinates
+                    # (the point is repeated twice for a diffraction)
+                    th = atahe[interaction]
+
+                    ik = 1
+                    r = R[-ik]
+                    #
+                    # dtarget :  distance between th and target
+                    #
+                    dx = pt_target[0]-(th[0][0]+th[1][0])/2.
+                    dy = pt_target[1]-(th[0][1]+th[1][1])/2.
+                    d_target = sqrt(dx*dx+dy*dy)
+
+                    #
+                    # mirroring th until the previous point
+                    # (th_mirror = th.S + v for each (S,v) in R)
+                    #
+                    th_mirror = th
+
+                    while r[0] is not None:
+                        S,v = r
+                        th_mirror = [[p[0]*S[0][0]+p[1]*S[1][0]+v[0],
+                                      p[0]*S[0][1]+p[1]*S[1][1]+v[1]]
+                                     for p in th_mirror]
+                        ik = ik + 1
+                        r  = R[-ik]
+
+                    dx = pt_source[0]-(th_mirror[0][0]+th_mirror[1][0])/2.
+                    dy = pt_source[1]-(th_mirror[0][1]+th_mirror[1][1])/2.
+                    d_source = sqrt(dx*dx+dy*dy)
+                    d_excess = d_source + d_target - d_source_target
+
+                    # if at least 2 interactions
+                    # or previous point is a diffraction
+
+                    if (len(tahe)<2) or (tprev==1) or (ti==1):
+                        ratio = 1.0
+                        ratio2 = 1.0
+                    else:
+                        # seg is the part of th_mirror inside the cone
+                        # it stays void when the cone is degenerated
+                        seg = []
+                        apex = None
+                        # Determine the origin of the cone
+                        # either the transmitter (ilast =0)
+                        # or the last diffraction point (ilast=ldiff[-1] )
+                        if ldiff==[]:
+                            ilast = 0
                         else:
-                            lawp.append(0)
+                            ilast = ldiff[-1]
+
+                        pta0 = tahe[ilast][0]   # tail first segment  (last difraction)
+                        phe0 = tahe[ilast][1]   # head first segment
 
-                        # update number of useful segments
-                        # if there is airwall in visited
-                        nstr = interaction[0]
-                        #
                         #
+                        # TODO : it would be better to replace pta_ and phe_ with the intersection
+                        # of the previous cone with tahe[-1]
                         #
-                        # Testing the type of interaction at rank -2
-                        # R is a list which contains a rotation matrix
-                        # and a translation vector for doing the mirroring
-                        # operation
-
-                        # diffraction (retrieve a point)
-                        if len(visited[-2]) == 1:
-                            #th = self.L.Gs.pos[nstr]
-                            R.append((np.eye(2),np.array([0,0])))
-                        elif len(visited[-2])==2:
-                            #
-                            # l'avant dernier point est une reflection
-                            #
-                            nseg_points = list(dict(self.L.Gs[visited[-2][0]]).keys())
-                            ta_seg = np.array(self.L.Gs.pos[nseg_points[0]])
-                            he_seg = np.array(self.L.Gs.pos[nseg_points[1]])
-                            #
-                            # get reflection matrix from segment visited[-2]
-                            #
-                            R.append(geu.axmat(ta_seg,he_seg))
-                            # direct order
-                            #R.append(geu.axmat(tahe[-1][0],tahe[-1][1]))
-                        # transmission do nothing
-                        else :
-                            pass
-                        # current interaction is of segment type
-                        if (nstr>0):
-                            nseg_points = list(dict(self.L.Gs[nstr]).keys())
-                            th = np.array([self.L.Gs.pos[nseg_points[0]],
-                                           self.L.Gs.pos[nseg_points[1]]])
-                        else:
-                            th = self.L.Gs.pos[nstr]
-                            th = np.array([th,th])
 
-                        # current interaction is of point type (diffraction)
-                        # apply current chain of symmetries
+                        pta_ = tahe[-1][0]  # tail last segment
+                        phe_ = tahe[-1][1]  # head last segment
+
                         #
-                        # th   is the current segment tail-head coordinates
-                        # tahe is a list of well mirrored tail-head coordinates
-
-                            #tahe.append(a)
-                        #if ((visited[0]==(104,23,17)) and (visited[1]==(1,17))):
-                        #    print("th (avant mirror)",th)
-                        ik = 1
-                        r = R[-ik]
+                        # Calculates the left and right vector of the cone
                         #
-                        # dtarget :  distance between th and target
+                        #  vl left vector
+                        #  vr right vector
                         #
-                        pt_th = np.sum(th,axis=0)/2.
-                        d_target = np.linalg.norm(pt_target-pt_th)
-
                         #
-                        # mirroring th until the previous point
+                        # Detect situations of connected segments
                         #
-                        th_mirror = copy.copy(th)
+                        connected = False
+                        if (pta0[0]==pta_[0]) and (pta0[1]==pta_[1]):
+                            apex = pta0
+                            connected = True
+                            v0 = (phe0[0]-apex[0],phe0[1]-apex[1])
+                            v_ = (phe_[0]-apex[0],phe_[1]-apex[1])
+                        elif (pta0[0]==phe_[0]) and (pta0[1]==phe_[1]):
+                            apex = pta0
+                            connected = True
+                            v0 = (phe0[0]-apex[0],phe0[1]-apex[1])
+                            v_ = (pta_[0]-apex[0],pta_[1]-apex[1])
+                        elif (phe0[0]==pta_[0]) and (phe0[1]==pta_[1]):
+                            apex = phe0
+                            connected = True
+                            v0 = (pta0[0]-apex[0],pta0[1]-apex[1])
+                            v_ = (phe_[0]-apex[0],phe_[1]-apex[1])
+                        elif (phe0[0]==phe_[0]) and (phe0[1]==phe_[1]):
+                            apex = phe0
+                            connected = True
+                            v0 = (pta0[0]-apex[0],pta0[1]-apex[1])
+                            v_ = (pta_[0]-apex[0],pta_[1]-apex[1])
+
+                        if connected:
+                            if (((v0[0]==0) and (v0[1]==0)) or ((v_[0]==0) and (v_[1]==0))):
+                                logger.debug("pta0 : %g,%g", pta0[0], pta0[1])
+                                logger.debug("pta_ : %g,%g", pta_[0], pta_[1])
+                                logger.debug("phe0 : %g,%g", phe0[0], phe0[1])
+                                logger.debug("phe_ : %g,%g", phe_[0], phe_[1])
+                                logger.debug("v0 : %g,%g", v0[0], v0[1])
+                                logger.debug("v_ : %g,%g", v_[0], v_[1])
+                        #
+                        # Does the cone is built from 2 connected segments or
+                        # 2 unconnected segments
+                        #
+                        if not connected:
+                            if not (geu._ccw2(pta0,phe0,phe_) ^
+                                    geu._ccw2(phe0,phe_,pta_) ):
+                                vr = (pta0,phe_)
+                                vl = (phe0,pta_)
+                            else:  # twisted case
+                                vr = (pta0,pta_)
+                                vl = (phe0,phe_)
+
+                            # cone dot product
+                            vr_n = geu._unit2(vr[1][0]-vr[0][0],vr[1][1]-vr[0][1])
+                            vl_n = geu._unit2(vl[1][0]-vl[0][0],vl[1][1]-vl[0][1])
+
+                            vrdotvl = vr_n[0]*vl_n[0]+vr_n[1]*vl_n[1]
+                            # cone angle
+                            angle_cone = acos(max(min(vrdotvl,1.0),-1.0))
+                            # prepare lines and seg argument for intersection checking
+                            if angle_cone!=0:
+                                # from origin mirrored segment to be tested
+                                seg   = (th_mirror[0],th_mirror[1])
+
+                                # apex calculation
+                                a0u = pta0[0]*vr_n[0]+pta0[1]*vr_n[1]
+                                a0v = pta0[0]*vl_n[0]+pta0[1]*vl_n[1]
+                                b0u = phe0[0]*vr_n[0]+phe0[1]*vr_n[1]
+                                b0v = phe0[0]*vl_n[0]+phe0[1]*vl_n[1]
+                                kb  = geu._div((b0v-a0v)-vrdotvl*(b0u-a0u),vrdotvl*vrdotvl-1)
+                                apex = (phe0[0]+kb*vl_n[0],phe0[1]+kb*vl_n[1])
+
+                        else: # cone from connected segments
+
+                            v0n = geu._unit2(v0[0],v0[1])
+                            v_n = geu._unit2(v_[0],v_[1])
+
+                            # sign of the cross product v_n x v0n
+                            sign = v_n[0]*v0n[1]-v_n[1]*v0n[0]
+                            if sign>0:
+                                vr_n = (-v0n[0],-v0n[1])
+                                vl_n = v_n
+                            else:
+                                vr_n = v_n
+                                vl_n = (-v0n[0],-v0n[1])
 
-                        while np.any(r[0] != np.eye(2)):
-                            th_mirror = np.einsum('ki,ij->kj',th_mirror,r[0])+r[1]
-                            ik = ik + 1
-                            r  = R[-ik]
+                            vrdotvl = vr_n[0]*vl_n[0]+vr_n[1]*vl_n[1]
+                            # cone angle
+                            angle_cone = acos(max(min(vrdotvl,1.0),-1.))
 
-                        pt_mirror = np.sum(th_mirror,axis=0)/2.
-                        d_source = np.linalg.norm(pt_source-pt_mirror)
-                        d_excess = d_source + d_target - d_source_target
+                        #
+                        # the illuminating cone is defined
+                        # the th_mirror to be tested with this cone are known
+                        #
 
-                        # if at least 2 interactions
-                        # or previous point is a diffraction
+                        if ( (not geu._isclose(angle_cone,0,atol=1e-6) )
+                         and ( not geu._isclose(angle_cone,np.pi)) ) :
+                            seg,ratio2 = geu.intersect_cone_seg((apex,vl_n),(apex,vr_n),(th_mirror[0],th_mirror[1]),bvis=False)
+                        elif ( not geu._isclose(angle_cone,0) ):
+                            ratio2 = 1
+                        else:
+                            ratio2 = 0
+                        if len(seg)==2:
+                            th_mirror = [[float(seg[0][0]),float(seg[0][1])],
+                                         [float(seg[1][0]),float(seg[1][1])]]
+
+                        if apex is not None:
+                            # same as np.allclose(th_mirror[k],apex)
+                            if ((geu._isclose(th_mirror[0][0],apex[0]) and geu._isclose(th_mirror[0][1],apex[1])) or
+                                (geu._isclose(th_mirror[1][0],apex[0]) and geu._isclose(th_mirror[1][1],apex[1]))):
+                                ratio2 = 1.
 
-                        if (len(tahe)<2) or (len(visited[-2])==1) or (len(visited[-1])==1):
-                            ratio = 1.0
-                            ratio2 = 1.0
+                    if (ratio2 > self.threshold) and (d_excess<dist_excess_max):
+                        #
+                        # Update sequence of mirrored points
+                        #
+                        if nstr<0:
+                            tahe.append(th)
                         else:
-                            # Determine the origin of the cone
-                            # either the transmitter (ilast =0)
-                            # or the last diffraction point (ilast=udiff[-1] )
-                            udiff = [ k for k in range(len(visited)) if len(visited[k])==1 ]
-                            if udiff==[]:
-                                ilast = 0
-                            else:
-                                ilast=udiff[-1]
-
-                            #print(tahe)
-                            pta0 = tahe[ilast][0]   # tail first segment  (last difraction)
-                            phe0 = tahe[ilast][1]   # head first segment
-
-                            #
-                            # TODO : it would be better to replace pta_ and phe_ with the intersection
-                            # of the previous cone with tahe[-1]
-                            #
-
-                            pta_ = tahe[-1][0]  # tail last segment
-                            phe_ = tahe[-1][1]  # head last segment
-
-                            #
-                            # Calculates the left and right vector of the cone
-                            #
-                            #  vl left vector
-                            #  vr right vector
-                            #
-                            #
-                            # Detect situations of connected segments
-                            #
-                            # [(60, 2, 8), (61, 8, 11), (15, 11), (61, 11, 8), (60 ,8, 2), (44, 2, 7)]
-                            # if visited == [(60, 2, 8), (61, 8, 11), (15, 11), (61, 11, 8), (60 ,8, 2), (44, 2, 7)]:
-                            #     print '\n',visited
-                            #     import ipdb
-                            #     ipdb.set_trace()
-
-                            connected = False
-                            if (pta0==pta_).all():
-                                apex = pta0
-                                connected = True
-                                v0 = phe0 - apex
-                                v_ = phe_ - apex
-                            elif (pta0==phe_).all():
-                                apex = pta0
-                                connected = True
-                                v0 = phe0 - apex
-                                v_ = pta_ - apex
-                            elif (phe0==pta_).all():
-                                apex = phe0
-                                connected = True
-                                v0 = pta0 - apex
-                                v_ = phe_ - apex
-                            elif (phe0==phe_).all():
-                                apex = phe0
-                                connected = True
-                                v0 = pta0 - apex
-                                v_ = pta_ - apex
-
-                            if connected:
-                                if ((np.linalg.norm(v0)==0) or (np.linalg.norm(v_)==0)):
-                                    logger.debug("pta0 : %g,%g", pta0[0], pta0[1])
-                                    logger.debug("pta_ : %g,%g", pta_[0], pta_[1])
-                                    logger.debug("phe0 : %g,%g", phe0[0], phe0[1])
-                                    logger.debug("phe_ : %g,%g", phe_[0], phe_[1])
-                                    logger.debug("v0 : %g,%g", v0[0], v0[1])
-                                    logger.debug("v_ : %g,%g", v_[0], v_[1])
-                            #
-                            # Does the cone is built from 2 connected segments or
-                            # 2 unconnected segments
-                            #
-                            if not connected:
-                                if not (geu.ccw(pta0,phe0,phe_) ^
-                                        geu.ccw(phe0,phe_,pta_) ):
-                                    vr = (pta0,phe_)
-                                    vl = (phe0,pta_)
-                                else:  # twisted case
-                                    vr = (pta0,pta_)
-                                    vl = (phe0,phe_)
-
-                                # cone dot product
-                                # print vr
-                                # print vl
-                                vr_n = (vr[1]-vr[0])/np.linalg.norm(vr[1]-vr[0])
-                                vl_n = (vl[1]-vl[0])/np.linalg.norm(vl[1]-vl[0])
-
-
-                                vrdotvl = np.dot(vr_n,vl_n)
-                                # cone angle
-                                angle_cone = np.arccos(np.maximum(np.minimum(vrdotvl,1.0),-1.0))
-                                #angle_cone = np.arccos(vrdotvl)
-                                # prepare lines and seg argument for intersection checking
-                                if angle_cone!=0:
-                                    linel = (vl[0],vl[1]-vl[0])
-                                    liner = (vr[0],vr[1]-vr[0])
-                                    # from origin mirrored segment to be tested
-                                    seg   = (th_mirror[0],th_mirror[1])
-
-                                    # apex calculation
-                                    a0u = np.dot(pta0,vr_n)
-                                    a0v = np.dot(pta0,vl_n)
-                                    b0u = np.dot(phe0,vr_n)
-                                    b0v = np.dot(phe0,vl_n)
-                                    #import warnings
-                                    #warnings.filterwarnings("error")
-                                    try:
-                                        kb  = ((b0v-a0v)-vrdotvl*(b0u-a0u))/(vrdotvl*vrdotvl-1)
-                                    except:
-                                        pdb.set_trace()
-                                    apex = phe0 + kb*vl_n
-
-
-
-                            else: # cone from connected segments
-
-                                v0n  = v0/np.linalg.norm(v0)
+                            tahe.append(th_mirror)
+                        #
+                        # Check if the target has been reached
+                        # sequence is valid and last interaction is in the list of targets
+                        #
+                        if blit[interaction]:
+                            sig = np.array([anstr[visited],btyp[visited]])
+                            sighash = sig.tobytes()
+                            if sighash not in lhash:
+                                lhash.add(sighash)
+                                lsig.append((sig,ratio,sighash))
+
+                            if animation:
+                                Nf = nx.draw_networkx_nodes(Gi,pos=Gi.pos,
+                                        nodelist=lvis,labels={},
+                                        node_color='b',
+                                        node_size=40,
+                                        ax=ax,fig=fig)
+                                Ef = nx.draw_networkx_edges(Gi,pos=Gi.pos,
+                                        edgelist=edge,labels={},
+                                        width=0.1,arrows=False,
+                                        ax=ax,fig=fig)
+                                cpt=cpt+1
+                                plt.savefig('./figure/' +str(us) +'_' + str(cpt) +'.png')
                                 try:
-                                    v_n  = v_/np.linalg.norm(v_)
+                                    ax.collections.remove(Nf)
                                 except:
-                                    pdb.set_trace()
-
-                                # import ipdb
-                                # ipdb.set_trace()
-                                sign = np.sign(np.cross(v_n,v0n))
-                                if sign>0:
-                                    vr_n = -v0n
-                                    vl_n = v_n
-                                else:
-                                    vr_n = v_n
-                                    vl_n = -v0n
-
-                                vrdotvl = np.dot(vr_n,vl_n)
-                                # cone angle
-                                angle_cone = np.arccos(np.maximum(np.minimum(vrdotvl,1.0),-1.))
-
-
-                            #
-                            # the illuminating cone is defined
-                            # the th_mirror to be tested with this cone are known
-                            #
-
-                            if ( (not np.isclose(angle_cone,0,atol=1e-6) )
-                             and ( not np.isclose(angle_cone,np.pi)) ) :
-                                #if self.cpt==16176:
-                                #    pdb.set_trace()
-                                seg,ratio2 = geu.intersect_cone_seg((apex,vl_n),(apex,vr_n),(th_mirror[0],th_mirror[1]),bvis=False)
-                            elif ( not np.isclose(angle_cone,0) ):
-                                ratio2 = 1
-                            else:
-                                ratio2 = 0
-                            #print ratio
-                            if len(seg)==2:
-                                th_mirror = np.vstack((seg[0],seg[1]))
-                            else:
-                                pass
-
-                            al = np.arctan2(vl_n[1],vl_n[0])
-                            ar = np.arctan2(vr_n[1],vr_n[0])
-                            if np.allclose(th_mirror[0],apex) or np.allclose(th_mirror[1],apex):
-                                ratio2 = 1.
+                                    pass
+                                try:
+                                    ax.collections.remove(Ef)
+                                except:
+                                    pass
 
-                            # On connecte l'apex du cone courant aux extrémités du segment courant mirroré
-
-                            # Dans certaines circonstances par example un cone emanant d'un point colinéaire 
-                            # avec le segment d'arrivé" (-4) (6,4) le point -4 est aligné avec le segment 6
-                            # l'ouverture du cone est nul => arret. Cela pourrait être géré dans Gi en interdisant 
-                            # la visibilité (-4) (6,4) 
-
-#                            if angle_cone ==0:
-#                                ratio = 0
-#                            else:
-#                                if np.allclose(th_mirror[0],apex) or np.allclose(th_mirror[1],apex):
-#                                    ratio = 1.
-#                                else:
-#                                    wseg0 = th_mirror[0] - apex
-#                                    wseg1 = th_mirror[1] - apex
-#                                    mod_wseg0 = np.sqrt(np.sum(wseg0*wseg0,axis=0))
-#                                    mod_wseg1 = np.sqrt(np.sum(wseg1*wseg1,axis=0))
-#
-#                                    if np.isclose(mod_wseg0,0):
-#                                        #bvisu = True 
-#                                        #pdb.set_trace()#
-#                                        pass
-#                                    if np.isclose(mod_wseg1,0):
-#                                        #bvisu = True 
-#                                        #pdb.set_trace()#
-#                                        pass
-#                                    #wseg0_n = wseg0/mod_wseg0
-#                                    #wseg1_n = wseg1/mod_wseg1
-#                                    wseg0_n = wseg0/np.linalg.norm(wseg0)
-#                                    wseg1_n = wseg1/np.linalg.norm(wseg1)
-#                                    aseg0 = np.arctan2(wseg0_n[1],wseg0_n[0])
-#                                    aseg1 = np.arctan2(wseg1_n[1],wseg1_n[0])
-#                                    
-#                                    # if al==aseg0 or al==aseg1 or ar==aseg0 or ar==aseg1:
-#                                    #     ratio = 1
-#                                        #print "toto"
-#                                    # else:
-#                                    I = geu.angle_intersection2(al,ar,aseg0,aseg1)
-#                                    ratio = I/angle_cone
-#                                    #if ratio>=1:
-#                                    #    pdb.set_trace()
-#
-#                                # if connected:
-#                                #     print "ratio :",ratio
-#                                
-#
-#                            #if visited == [(104, 23, 17), (1, 17), (53, 17)]:
-#                            if (bvisu):
-#                                fig ,ax = self.L.showG('s',aw=1,labels=0)
-#                                #
-#                                # magenta : start of the cone
-#                                # cyan    :
-#                                # yellow  : last interaction
-#                                #
-#                                ax = geu.linet(ax,pta0,phe0,al=1,color='magenta',linewidth=3)
-#                                ax = geu.linet(ax,pta_,phe_,al=1,color='cyan',linewidth=3)
-#                                ax = geu.linet(ax,np.array(self.L.Gs.pos[nseg_points[0]]),np.array(self.L.Gs.pos[nseg_points[1]]),al=1,color='yellow',linewidth=4)
-#                                # ax = geu.linet(ax,vr[0],vr[1],al=1,color='red',linewidth=3)
-#                                # ax = geu.linet(ax,vl[0],vl[1],al=1,color='blue',linewidth=3)
-#                                ax = geu.linet(ax,seg[0],seg[1],al=1,color='k',linewidth=3)
-#                                ax = geu.linet(ax,th_mirror[0,:],th_mirror[1,:],al=1,color='green',linewidth=3)
-#                                nx.draw_networkx_labels(self.L.Gi,
-#                                        self.L.Gi.pos,labels={x:str(x) for x in visited},
-#                                        ax=ax,fontsize=18)
-#                                plt.title(str(visited)+'  '+str(ratio))
-#                                ax.plot(apex[0],apex[1],'or')
-#                                plt.axis('auto')
-#                                pdb.set_trace()
-#                            #if visited == [(104, 23, 17), (1, 17), (53, 17), (108, 17, 18)]:
-#                            # if visited == [(104, 23, 17), (1, 17), (53, 17)]:
-#                            if (1==0):
-#                                fig ,ax = self.L.showG('s',aw=1,labels=0)
-#                                ax = geu.linet(ax,pta0,phe0,al=1,color='magenta',linewidth=3)
-#                                ax = geu.linet(ax,pta_,phe_,al=1,color='cyan',linewidth=3)
-#
-#                                ax = geu.linet(ax,np.array(self.L.Gs.pos[pts[0]]),np.array(self.L.Gs.pos[pts[1]]),al=1,color='yellow',linewidth=4)
-#                                ax = geu.linet(ax,vr[0],vr[1],al=1,color='red',linewidth=3)
-#                                ax = geu.linet(ax,vl[0],vl[1],al=1,color='blue',linewidth=3)
-#                                #ax = geu.linet(ax,seg[0],seg[1],al=1,color='k',linewidth=3)
-#                                ax = geu.linet(ax,th[0,:],th[1,:],al=1,color='green',linewidth=3)
-#                                plt.title(str(visited)+'  '+str(ratio))
-#                                ax.plot(apex[0],apex[1],'or')
-#                                plt.axis('auto')
-#                                plt.show()
-                    #else:
-                    #    th = self.L.Gs.pos[nstr]
-                    #    th = np.array([th,th])
-                    #    ratio = 1
-                        #print self.cpt,ratio,ratio2
-                        #if (ratio>0.1) and (ratio2==0):
-                        #     pdb.set_trace()
-                        #print d_excess,dist_excess_max
-                        #if (ratio2 > self.threshold) and (d_excess<dist_excess_max):
-                        if (ratio2 > self.threshold) and (d_excess<dist_excess_max):
-                        #if (ratio > self.threshold):
-                            #
-                            # Update sequence of mirrored points
-                            #
-                            if nstr<0:
-                                tahe.append(th)
-                            else:
-                                tahe.append(th_mirror)
-                            #if (tahe[-1][0]==tahe[-1][1]).all():
-                            #    pdb.set_trace()
-                            # 
-                            # Check if the target has been reached
-                            # sequence is valid and last interaction is in the list of targets   
-                            #if (interaction in lit) or (interaction[-1]==self.target):
-                            if (interaction in lit):
-                                # idea here is to produce signature without any airwalls
-                                # lawp_tmp is a mask where 0 mean no air wall and 1 = airwall
-                                # anstr does not contains airwalls
-                                # lawp_tmp = [0]+lawp
-                                # lll = [x[0] for ix,x in enumerate(visited) if lawp_tmp[ix]==1]
-                                # print([self.L.Gs.node[x]['name'] for x in lll])
-
-                                #anstr = np.array([x[0] for ix,x in enumerate(visited) 
-                                #                                  if ((lawp[ix]!=1) or (x[0] in self.L.name['AIR']) or (x in (lit+lis)))] )
-                                #typ  = np.array([len(x) for ix,x in enumerate(visited) 
-                                #                                  if ((lawp[ix]!=1) or (x[0] in self.L.name['AIR']) or (x in (lit+lis)))] )
-                                #sig = np.array([anstr,typ])
-                                #sighash = hash(str(sig))
-
-
-                                # if len(anstr) == 2:
-                                #     if (anstr == np.array([323,351])).all():
-                                #         import ipdb
-                                #         ipdb.set_trace()
-                                anstr = np.array([x[0] for x in visited ])
-                                typ  = np.array([len(x) for x in visited])
-                                sig = np.array([anstr,typ])
-                                sighash = hash(str(sig))
-                                if sighash not in lhash:
-                                    lhash.append(sighash)
-                                    try:
-                                        self[len(typ)] = np.vstack((self[len(typ)],sig))
-                                        self.ratio[len(typ)] = np.append(self.ratio[len(typ)],ratio)
-                                    except:
-                                        self[len(typ)] = np.vstack((sig))
-                                        self.ratio[len(typ)] = np.array([ratio])
-                                # print ('added',visited)
-                                    cptsig +=1
-
-                                if animation:
-                                    Nf = nx.draw_networkx_nodes(Gi,pos=Gi.pos,
-                                            nodelist=visited,labels={},
-                                            node_color='b',
-                                            node_size=40,
-                                            ax=ax,fig=fig)
-                                    Ef = nx.draw_networkx_edges(Gi,pos=Gi.pos,
-                                            edgelist=edge,labels={},
-                                            width=0.1,arrows=False,
-                                            ax=ax,fig=fig)
-                                    cpt=cpt+1
-                                    plt.savefig('./figure/' +str(us) +'_' + str(cpt) +'.png')
-                                    try:
-                                        ax.collections.remove(Nf)
-                                    except:
-                                        pass
-                                    try:
-                                        ax.collections.remove(Ef)
-                                    except:
-                                        pass
-
-                            outint = Gi[visited[-2]][interaction]['output'].keys()
-                            #
-                            # proint not used 
-                            #
-                            proint = Gi[visited[-2]][interaction]['output'].values()
-                            nexti  = [it for it in outint ]
-                            stack.append(iter(nexti))
-                        # 1590 ratio <= threshold
-                        else:
-                            if len(visited)>1:
-                                if ((len(visited[-2])==2) or len(visited[-2])==1):
-                                    R.pop()
-                            last = visited.pop()
-                            lawp.pop()
-                    # 1389 condR and condT and condD
+                        # outputs of Gi edge (visited[-2],interaction)
+                        stack.append(iter(oedge[optr[e]:optr[e+1]]))
+                    # ratio <= threshold
                     else:
-                        pass
-                # 1388 cond1 and cond2 and cond3  
+                        if len(visited)>1:
+                            if ((tprev==2) or (tprev==1)):
+                                R.pop()
+                        last = visited.pop()
+                        nvis[atyp[last]] -= 1
+                        if atyp[last] == 1:
+                            ldiff.pop()
+                        nair -= lawp.pop()
+                # condR and condT and condD
                 else:
-                    # if at least 2 interactions 
-                    # and antepenultiem is a reflexion  
-                    if len(visited)>1:
-                        if ((len(visited[-2])==2) or len(visited[-2])==1):
-                            R.pop()
-                    last = visited.pop()
-                    #
-                    # Poping 
-                    #      tahe 
-                    #      lawp
-                    #      stack
-                    #if (tahe[-1][0]==tahe[-1][1]).all():
-                    #    pdb.set_trace()
-                    tahe.pop()
-                    try:
-                        lawp.pop()
-                    except:
-                        pass
-                    stack.pop()
-                    #stack.pop()
+                    pass
+            # cond1 and cond2 and cond3
+            else:
+                # if at least 2 interactions
+                # and antepenultiem is a reflexion
+                if len(visited)>1:
+                    if ((atyp[visited[-2]]==2) or (atyp[visited[-2]]==1)):
+                        R.pop()
+                last = visited.pop()
+                nvis[atyp[last]] -= 1
+                if atyp[last] == 1:
+                    ldiff.pop()
+                #
+                # Poping
+                #      tahe
+                #      lawp
+                #      stack
+                tahe.pop()
+                try:
+                    nair -= lawp.pop()
+                except:
+                    pass
+                stack.pop()
+
+        return lsig,nvisit
 
     def plot_cones(self,L,i=0,s=0,fig=[],ax=[],figsize=(10,10)):
         """ display cones of an unfolded signature
@@ -2250,7 +2524,7 @@ class Signatures(PyLayers,dict):
         return rays
 
 
-    def raysv(self, ptx=0, prx=1):
+    def raysv(self, ptx=0, prx=1, nsigmax=65536):
         """ transform dict of signatures into 2D rays - default vectorized version
 
         Parameters
@@ -2262,6 +2536,9 @@ class Signatures(PyLayers,dict):
         prx :  numpy.array or int
             Rx coordinates is the center of gravity of the cycle prx if
             type(prx)=int
+        nsigmax : int
+            maximum number of signatures processed at once
+            (bounds the memory of the image/backtrace kernel)
 
         Returns
         -------
@@ -2273,8 +2550,8 @@ class Signatures(PyLayers,dict):
 
         This is a vectorized version of Signatures.rays.
         This implementation takes advantage of the np.ndarray
-        and calculates images and backtrace for block of signatures.
-        A block of signatures gathers all signatures with the same number of interactions.
+        and calculates images and backtrace of all the signatures
+        in a single kernel (see Signatures.imagetrace).
 
         For mathematical details see :
 
@@ -2294,7 +2571,8 @@ class Signatures(PyLayers,dict):
         See Also
         --------
 
-        Signatures.image
+        Signatures.imagetrace
+        Signatures.image2
         Signatures.backtrace
 
         """
@@ -2343,8 +2621,7 @@ class Signatures(PyLayers,dict):
             else:
                 rays.los = False
 
-        M = self.image2(ptx)
-        R = self.backtrace(ptx,prx,M)
+        R = self.imagetrace(ptx, prx, nsigmax=nsigmax)
 
         #
         # Add LOS ray in ray 2D
@@ -2359,6 +2636,120 @@ class Signatures(PyLayers,dict):
 
         return rays
 
+    def _sigpack(self, nsigmax=65536):
+        """ signatures packed by chunks for imagetrace
+
+        Parameters
+        ----------
+
+        nsigmax : int
+            maximum number of signatures of a chunk
+
+        Returns
+        -------
+
+        lchunk : list of tuple (nid, ityp, nint, na)
+            see _imagetrace
+
+        Notes
+        -----
+
+        The signatures are sorted by decreasing number of interactions.
+        The packing is kept until a block of signatures is modified.
+
+        """
+        lsig = [(k, self[k]) for k in self.keys()]
+        if hasattr(self, '_sigpk'):
+            lsigc, nsigmaxc, lchunk = self._sigpk
+            if ((nsigmaxc == nsigmax) and (len(lsigc) == len(lsig)) and
+                all([(k == kc) and (a is ac)
+                     for (k, a), (kc, ac) in zip(lsig, lsigc)])):
+                return lchunk
+
+        lk = sorted([k for k in self.keys() if len(self[k]) > 0], reverse=True)
+        lchunk = []
+        if len(lk) > 0:
+            Lmax = lk[0]
+            nsig = sum([len(self[k])//2 for k in lk])
+            nid = np.zeros((nsig, Lmax), dtype=int)
+            ityp = np.zeros((nsig, Lmax), dtype=int)
+            nint = np.zeros(nsig, dtype=int)
+            ks = 0
+            for k in lk:
+                ns = len(self[k])//2
+                nid[ks:ks+ns, :k] = self[k][::2]
+                ityp[ks:ks+ns, :k] = self[k][1::2]
+                nint[ks:ks+ns] = k
+                ks = ks + ns
+            for k0 in range(0, nsig, nsigmax):
+                k1 = min(k0 + nsigmax, nsig)
+                L = nint[k0]
+                na = np.array([np.sum(nint[k0:k1] > n) for n in range(L)])
+                lchunk.append((nid[k0:k1, :L], ityp[k0:k1, :L],
+                               nint[k0:k1], na))
+        self._sigpk = (lsig, nsigmax, lchunk)
+        return lchunk
+
+    def imagetrace(self, tx, rx, nsigmax=65536):
+        """ images and backtrace of all the signatures
+
+        Parameters
+        ----------
+
+        tx : ndarray
+            position of tx (2,)
+        rx : ndarray
+            position of rx (2,)
+        nsigmax : int
+            maximum number of signatures processed at once
+
+        Returns
+        -------
+
+        rayp : dict
+            key = number_of_interactions
+            value = {'pt': np.array (3,ninter,nray), 'sig': np.array (2,ninter,nray)}
+
+        Notes
+        -----
+
+        Same result as backtrace(tx,rx,image2(tx)). The signatures of all
+        lengths are processed together by chunks of nsigmax signatures
+        (see _imagetrace), the coordinates of the segments come from the
+        table of the layout (Layout._segtable).
+
+        See Also
+        --------
+
+        pylayers.antprop.signature._imagetrace
+
+        """
+        tx = np.asarray(tx, dtype=float)[:2]
+        rx = np.asarray(rx, dtype=float)[:2]
+        tab = self.L._segtable()
+
+        dpt = {}
+        dsig = {}
+        for nid, ityp, nint, na in self._sigpack(nsigmax):
+            # check every node of the chunk is in the layout
+            used = np.arange(nid.shape[1])[None, :] < nint[:, None]
+            assert not np.isnan(tab[1][0, 0, nid[used] + tab[0]]).any()
+            valid, X = _imagetrace(tab, tx, rx, nid, ityp, nint, na)
+            for k in np.unique(nint[valid]):
+                u = np.where(valid & (nint == k))[0]
+                dpt.setdefault(k, []).append(X[:, u, :k])
+                dsig.setdefault(k, []).append(np.array((nid[u, :k],
+                                                        ityp[u, :k])))
+        rayp = {}
+        for k in self.keys():
+            if k in dpt:
+                X = np.concatenate(dpt[k], axis=1)
+                pt = np.zeros((3, k, X.shape[1]))
+                pt[:2] = X.swapaxes(1, 2)
+                sig = np.concatenate(dsig[k], axis=1).swapaxes(1, 2)
+                rayp[k] = {'pt': pt, 'sig': sig.astype('int')}
+        return rayp
+
     def backtrace(self, tx, rx, M):
         ''' backtracing betwen tx and rx
 
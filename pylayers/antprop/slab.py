@@ -14,6 +14,7 @@ import doctest
 #import objxml
 import pdb
 import copy
+from collections import OrderedDict
 import numpy as np
 import scipy as sp
 from scipy.interpolate import interp1d
@@ -1480,6 +1481,181 @@ class Slab(Interface,dict):
 
         self['evaluated'] = True
 
+    def evaltab(self, fGHz=np.array([1.0]), theta=np.linspace(0, np.pi / 2, 50),
+                compensate=False, RT='R', tol=1e-5, ntmax=2049, fallback=True,
+                ntabmax=2**20):
+        """ evaluation of the Slab from a lookup table
+
+        Parameters
+        ----------
+
+        fGHz : frequency GHz ( np.array([1.0]) )
+        theta : np.array
+            incidence angle (from normal) radians
+        compensate : boolean
+        RT : string
+            'R' or 'T'
+        tol : float
+            maximal interpolation error on the R or T coefficients
+        ntmax : int
+            maximal number of angles of the table
+        fallback : boolean
+            if False, nothing is evaluated when the table can not be used
+        ntabmax : int
+            no table is built if len(fGHz) x ntmax exceeds ntabmax
+
+        Returns
+        -------
+
+        tabulated : boolean
+            True if the coefficients come from the table
+
+        Notes
+        -----
+
+        The table gathers the diagonal terms of R (or T) at frequencies fGHz
+        over a uniform grid of cos(theta) in [0,1]. Unlike theta, cos(theta)
+        keeps the coefficients smooth up to the grazing incidence. The table
+        is interpolated with a cubic Lagrange polynomial. The grid is refined
+        by doubling until the interpolation error on the middle of the grid
+        intervals is lower than tol.
+
+        Frequencies for which tol is not reached with ntmax angles (sharp
+        resonances of lossless multilayers) are evaluated with Slab.eval,
+        as well as all frequencies if theta is out of [0,pi/2].
+
+        Building a table costs up to ntmax evaluations per frequency, it
+        only pays off when the same frequencies are evaluated again. So
+        the first request of a set of frequencies is evaluated with
+        Slab.eval, the table is built at the second request, unless
+        len(fGHz) x ntmax exceeds ntabmax (wideband, see Rays.eval fchunk).
+        Tables are kept in self._tab (at most 4 entries, the oldest one
+        is dropped), they are rebuilt if the frequencies, the layers or
+        the materials of the slab change. The error bound of the last
+        used table is in self.taberr.
+
+        Examples
+        --------
+
+        >>> from pylayers.gis.layout import Layout
+        >>> sl = Layout('DLR.lay').sl
+        >>> fGHz = np.linspace(2,11,181)
+        >>> theta = np.linspace(0,np.pi/2-0.01,1000)
+        >>> sl['PARTITION'].evaltab(fGHz,theta[::2],RT='R')
+        >>> sl['PARTITION'].evaltab(fGHz,theta,RT='R')
+        >>> R = sl['PARTITION'].R
+        >>> sl['PARTITION'].eval(fGHz,theta,RT='R')
+        >>> np.abs(R-sl['PARTITION'].R).max() < 1e-5
+        True
+
+        See Also
+        --------
+
+        Slab.eval
+
+        """
+        if not isinstance(fGHz, np.ndarray):
+            fGHz = np.array([fGHz])
+        if not isinstance(theta, np.ndarray):
+            theta = np.array([theta])
+
+        if not hasattr(self, '_tab'):
+            self._tab = {}
+        lmat = tuple(tuple(sorted((k, str(v)) for k, v in m.items()))
+                     for m in self['lmat'])
+        key = (RT, compensate, tol, ntmax, fGHz.tobytes(),
+               tuple(self['lmatname']), tuple(self['lthick']), lmat)
+        if key not in self._tab:
+            # bounded cache (frequency chunks would otherwise pile up)
+            while len(self._tab) >= 4:
+                self._tab.pop(next(iter(self._tab)))
+            # first request : the table is not worth building yet
+            self._tab[key] = None
+        elif (self._tab[key] is None) and (len(fGHz) * ntmax <= ntabmax):
+            self._tab[key] = self._buildtab(fGHz, compensate, RT, tol, ntmax)
+
+        if self._tab[key] is None:
+            if fallback:
+                self.eval(fGHz, theta, compensate=compensate, RT=RT)
+            return False
+
+        tab, errf = self._tab[key]
+        # frequencies without table
+        bad = ~(errf < tol)
+        if (bad.all() or (theta.ndim != 1) or
+            (theta.min() < 0) or (theta.max() > np.pi / 2)):
+            if fallback:
+                self.eval(fGHz, theta, compensate=compensate, RT=RT)
+            return False
+
+        nf = len(fGHz)
+        nt = len(theta)
+        # nf x nt x 2
+        d = _lagrange3(tab, np.cos(theta), 1. / (tab.shape[1] - 1))
+        M = np.zeros((nf, nt, 2, 2), dtype=complex)
+        M[:, :, 0, 0] = d[..., 0]
+        M[:, :, 1, 1] = d[..., 1]
+        if bad.any():
+            self.eval(fGHz[bad], theta, compensate=compensate, RT=RT)
+            M[bad] = self.R if RT == 'R' else self.T
+        if RT == 'R':
+            self.R = M
+        else:
+            self.T = M
+        self.taberr = errf[~bad].max()
+        self.nf = nf
+        self.nt = nt
+        self.fGHz = fGHz.reshape(nf, 1)
+        self.theta = theta.reshape(1, nt)
+        self['evaluated'] = True
+        return True
+
+    def _buildtab(self, fGHz, compensate, RT, tol, ntmax):
+        """ build the lookup table of Slab.evaltab
+
+        Returns
+        -------
+
+        tab : np.array (nf x nt x 2)
+            diagonal terms of R (or T) on a uniform grid of cos(theta)
+        errf : np.array (nf,)
+            estimation of the interpolation error for each frequency
+
+        """
+        nf = len(fGHz)
+        if ('T' in RT) and ('METAL' in self['lmatname']):
+            return None, np.inf * np.ones(nf)
+
+        def diag(ct):
+            # the grazing incidence is replaced by its limit
+            th = np.arccos(np.maximum(ct, 1e-6))
+            self.eval(fGHz, th, compensate=compensate, RT=RT)
+            M = self.R if RT == 'R' else self.T
+            return np.stack((M[:, :, 0, 0], M[:, :, 1, 1]), axis=-1)
+
+        nt = 65
+        ct = np.linspace(0, 1, nt)
+        tab = diag(ct)
+        errf = np.inf * np.ones(nf)
+        while 2 * nt - 1 <= ntmax:
+            # the exact values on the middle of the intervals both give
+            # the error of the current table and refine it
+            ctm = (ct[:-1] + ct[1:]) / 2.
+            tabm = diag(ctm)
+            errf = np.abs(_lagrange3(tab, ctm, ct[1]) - tabm).max(axis=(1, 2))
+            nt = 2 * nt - 1
+            ct = np.linspace(0, 1, nt)
+            tab2 = np.empty((nf, nt, 2), dtype=complex)
+            tab2[:, 0::2, :] = tab
+            tab2[:, 1::2, :] = tabm
+            tab = tab2
+            if (errf < tol).all():
+                break
+
+        logger.info('slab %s %s table : %d angles, %d/%d frequencies within %g',
+                    self['name'], RT, nt, np.sum(errf < tol), nf, tol)
+        return tab, errf
+
     def filter(self,win,theta=0):
         """ filtering waveform
 
@@ -1708,6 +1884,8 @@ class SlabDB(dict):
         in  the Layout file .ini or from 2 specified file
 
         """
+        # dispersion cache (see SlabDB.epsc)
+        self._disp = OrderedDict()
         # Load from file
         if (fileslab != ''):
             self.fileslab = fileslab
@@ -1786,6 +1964,145 @@ class SlabDB(dict):
         elif type(sl).__name__ == SlabDB.__name__:
             pass
 
+    def epsc(self, mat, fGHz):
+        """ complex permittivity of a material from the dispersion cache
+
+        Parameters
+        ----------
+
+        mat : Mat
+        fGHz : np.array (nf,)
+
+        Returns
+        -------
+
+        epsc : np.array (nf,)
+            Mat.eval(fGHz) (read only)
+
+        Notes
+        -----
+
+        The entries are keyed by the material parameters and the frequency
+        grid, an edited material is evaluated again. The cache keeps
+        the 256 last used entries.
+
+        """
+        if not hasattr(self, '_disp'):
+            self._disp = OrderedDict()
+        key = (tuple(sorted((k, str(v)) for k, v in mat.items())),
+               fGHz.tobytes())
+        if key in self._disp:
+            self._disp.move_to_end(key)
+            return self._disp[key]
+        epsc = np.asarray(mat.eval(fGHz) * np.ones(len(fGHz)), dtype=complex)
+        epsc.flags.writeable = False
+        self._disp[key] = epsc
+        while len(self._disp) > 256:
+            self._disp.popitem(last=False)
+        return epsc
+
+    def eval(self, fGHz, dtheta, RT='R', compensate=False, mode='exact'):
+        """ evaluation of several slabs in one batch
+
+        Parameters
+        ----------
+
+        fGHz : np.array (nf,)
+            frequency (GHz)
+        dtheta : dict
+            {slabname : np.array (nt_k,)} incidence angles from normal (rad)
+        RT : string
+            'R' or 'T'
+        compensate : boolean
+            see Slab.eval
+        mode : string
+            'exact' : all slabs are evaluated in the batch
+            'tab' : slabs with a lookup table are interpolated
+            (Slab.evaltab), the other ones are evaluated in the batch
+
+        Returns
+        -------
+
+        M : np.array (nf x sum(nt_k) x 2 x 2)
+            R (or T) matrices, the slabs in the order of dtheta
+
+        Notes
+        -----
+
+        Slabs with the same number of layers are stacked along the angular
+        axis : the layer parameters become arrays over the angles and the
+        transfer matrices of the whole group are chained in one pass.
+        The complex permittivities come from the dispersion cache
+        (SlabDB.epsc) and are not evaluated again for the next batches
+        on the same frequencies.
+
+        Examples
+        --------
+
+        >>> from pylayers.antprop.slab import *
+        >>> sl = SlabDB(fileslab='slabDB.ini',filemat='matDB.ini')
+        >>> fGHz = np.linspace(2,6,11)
+        >>> th = np.linspace(0,np.pi/2-0.01,20)
+        >>> M = sl.eval(fGHz,{'WOOD':th,'PARTITION':th[::2]},RT='T')
+        >>> sl['PARTITION'].eval(fGHz,th[::2],RT='T')
+        >>> np.allclose(M[:,20:],sl['PARTITION'].T)
+        True
+
+        See Also
+        --------
+
+        Slab.eval
+        Slab.evaltab
+
+        """
+        if not isinstance(fGHz, np.ndarray):
+            fGHz = np.array([fGHz])
+        lname = list(dtheta.keys())
+        ltheta = [np.asarray(dtheta[name], dtype=float).ravel() for name in lname]
+        lnt = np.array([len(th) for th in ltheta], dtype=int)
+        ptr = np.hstack((0, np.cumsum(lnt)))
+        nf = len(fGHz)
+        M = np.zeros((nf, ptr[-1], 2, 2), dtype=complex)
+
+        # group the slabs evaluated in the batch by number of layers
+        dgroup = {}
+        for k, name in enumerate(lname):
+            if lnt[k] == 0:
+                continue
+            sl = self[name]
+            if mode == 'tab':
+                if sl.evaltab(fGHz, ltheta[k], RT=RT, compensate=compensate,
+                              fallback=False):
+                    M[:, ptr[k]:ptr[k+1]] = sl.R if RT == 'R' else sl.T
+                    continue
+            dgroup.setdefault(len(sl['lmat']), []).append(k)
+
+        for nl, lk in dgroup.items():
+            # column of the batch -> slab of the group
+            js = np.repeat(np.arange(len(lk)), lnt[lk])
+            theta = np.hstack([ltheta[k] for k in lk])
+            # media : AIR | layers | AIR
+            leps = [np.ones((nf, 1), dtype=complex)]
+            lmur = [np.ones(1, dtype=complex)]
+            lthick = []
+            lmetal = []
+            for i in range(nl):
+                lm = [self[lname[k]]['lmat'][i] for k in lk]
+                eps = np.array([self.epsc(m, fGHz) for m in lm]).T
+                leps.append(eps[:, js])
+                lmur.append(np.array([m['mur'] for m in lm], dtype=complex)[js])
+                lthick.append(np.array([self[lname[k]]['lthick'][i]
+                                        for k in lk], dtype=float)[js])
+                lmetal.append(np.array([m['name'] == 'METAL'
+                                        for m in lm])[js])
+            leps.append(leps[0])
+            lmur.append(lmur[0])
+            Ms = _slabstack(fGHz, theta, leps, lmur, lthick, lmetal,
+                            RT=RT, compensate=compensate)
+            u = np.hstack([np.arange(ptr[k], ptr[k+1]) for k in lk])
+            M[:, u] = Ms
+        return M
+
     def showall(self):
         """ show all slabs
 
@@ -2114,6 +2431,145 @@ class SlabDB(dict):
 #     #     geu.
 
 
+def _slabstack(fGHz, theta, leps, lmur, lthick, lmetal, RT='R',
+               compensate=False):
+    """ R or T matrices of a batch of slabs with the same number of layers
+
+    Parameters
+    ----------
+
+    fGHz : np.array (nf,)
+    theta : np.array (nt,)
+        incidence angle from normal (rad)
+    leps : list of nl+2 np.array (nf x nt) or (nf x 1)
+        complex permittivity of the media AIR | layers | AIR
+    lmur : list of nl+2 np.array (nt,) or (1,)
+        relative permeability of the media
+    lthick : list of nl np.array (nt,)
+        thickness of the layers (m)
+    lmetal : list of nl np.array (nt,) of bool
+        METAL layers
+    RT : string
+        'R' or 'T'
+    compensate : boolean
+        see Slab.eval
+
+    Returns
+    -------
+
+    M : np.array (nf x nt x 2 x 2)
+
+    Notes
+    -----
+
+    This is the chain of MatInterface matrices of Slab.eval evaluated
+    for all the angles of the batch. Only the first line of the chained
+    matrices is needed by R and T. The angle in the next layer is
+    propagated through its cosine and sine (Snell law) instead of
+    arccos. The chain stops at the first METAL layer of each slab.
+
+    """
+    nf = len(fGHz)
+    nt = len(theta)
+    f = fGHz[:, None]
+    nl = len(lthick)
+    ct = np.cos(theta)[None, :] * np.ones((nf, 1), dtype=complex)
+    st = np.sin(theta)[None, :] * np.ones((nf, 1), dtype=complex)
+    # first line of the chained matrices (o : _|_ , p : //)
+    co0 = np.ones((nf, nt), dtype=complex)
+    co1 = np.zeros((nf, nt), dtype=complex)
+    cp0 = np.ones((nf, nt), dtype=complex)
+    cp1 = np.zeros((nf, nt), dtype=complex)
+    # columns whose chain is not stopped by a METAL layer
+    alive = np.ones(nt, dtype=bool)
+    n1 = np.sqrt(leps[0] / lmur[0])
+    # the columns stopped by a METAL layer may overflow, they are not used
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for i in range(nl + 1):
+            n2 = np.sqrt(leps[i + 1] / lmur[i + 1])
+            r = n1 / n2
+            cti = np.sqrt(1 - (r * st) ** 2)
+            nT1p = n1 / ct
+            nT1o = n1 * ct
+            nT2p = n2 / cti
+            nT2o = n2 * cti
+            Rp = (nT1p - nT2p) / (nT1p + nT2p)
+            Ro = -(nT1o - nT2o) / (nT1o + nT2o)
+            if i < nl:
+                jdeltai = 1j * 2 * np.pi * lthick[i] * n2 * cti * f / 0.3
+                epd = np.exp(jdeltai)
+                emd = np.exp(-jdeltai)
+                metal = lmetal[i] & alive
+            else:
+                epd = 1.
+                emd = 1.
+                metal = np.zeros(nt, dtype=bool)
+            # [c0 c1] x [[epd , R emd],[R epd , emd]] / (1+R)
+            io00 = epd / (1.0 + Ro)
+            io11 = emd / (1.0 + Ro)
+            ip00 = epd / (1.0 + Rp)
+            ip11 = emd / (1.0 + Rp)
+            o0 = co0 * io00 + co1 * Ro * io00
+            o1 = co0 * Ro * io11 + co1 * io11
+            p0 = cp0 * ip00 + cp1 * Rp * ip00
+            p1 = cp0 * Rp * ip11 + cp1 * ip11
+            # METAL layer : Io = [[1,-1],[-1,1]] , Ip = [[1,1],[1,1]]
+            if metal.any():
+                o0[:, metal] = (co0 - co1)[:, metal]
+                o1[:, metal] = (co1 - co0)[:, metal]
+                p0[:, metal] = (cp0 + cp1)[:, metal]
+                p1[:, metal] = (cp0 + cp1)[:, metal]
+            co0 = np.where(alive, o0, co0)
+            co1 = np.where(alive, o1, co1)
+            cp0 = np.where(alive, p0, cp0)
+            cp1 = np.where(alive, p1, cp1)
+            alive = alive & ~metal
+            ct = cti
+            st = r * st
+            n1 = n2
+
+    M = np.zeros((nf, nt, 2, 2), dtype=complex)
+    if 'R' in RT:
+        M[:, :, 1, 1] = co1 / co0
+        M[:, :, 0, 0] = cp1 / cp0
+    else:
+        # the transmission through a METAL layer is 0
+        M[:, alive, 1, 1] = 1.0 / co0[:, alive]
+        M[:, alive, 0, 0] = 1.0 / cp0[:, alive]
+        if compensate:
+            d = np.sum(lthick, axis=0) * np.cos(theta)
+            M = M * np.exp(1j * 2 * np.pi * f * d[None, :] / 0.3)[:, :, None, None]
+    return M
+
+
+def _lagrange3(tab, x, h):
+    """ cubic Lagrange interpolation on a uniform grid
+
+    Parameters
+    ----------
+
+    tab : np.array (nf x N x p)
+        values on the grid 0, h, ... , (N-1)h
+    x : np.array (nt,)
+    h : float
+        grid step
+
+    Returns
+    -------
+
+    y : np.array (nf x nt x p)
+
+    """
+    N = tab.shape[1]
+    s = x / h
+    i = np.clip(np.floor(s).astype(int), 1, N - 3)
+    u = (s - i)[None, :, None]
+    y = (-u * (u - 1) * (u - 2) / 6.) * tab[:, i - 1, :]
+    y = y + ((u + 1) * (u - 1) * (u - 2) / 2.) * tab[:, i, :]
+    y = y - ((u + 1) * u * (u - 2) / 2.) * tab[:, i + 1, :]
+    y = y + ((u + 1) * u * (u - 1) / 6.) * tab[:, i + 2, :]
+    return y
+
 def calsig(cval, fGHz, typ='epsr'):
     """ evaluate sigma from epsr or index at a given frequency
 
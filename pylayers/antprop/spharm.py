@@ -16,6 +16,7 @@ import os
 import re
 import sys
 import pdb
+from collections import OrderedDict
 import numpy as np
 import scipy as sp
 import scipy.special as special
@@ -1940,7 +1941,18 @@ def VW2(l, m, x, phi, Pmm1l, Pmp1l):
     V[np.isinf(V) | np.isnan(V)] = 0
     return V, W
 
-def VW(l, m, theta ,phi):
+#
+# cache of the VW basis, keyed by the (l,m) indexes and the direction set
+#
+_vwcache = OrderedDict()
+_vwcache_maxbytes = 2**27
+
+def VWclear():
+    """ clear the cache of the VW basis functions
+    """
+    _vwcache.clear()
+
+def VW(l, m, theta ,phi, cache=True):
     """ evaluate vector Spherical Harmonics basis functions
 
     Parameters
@@ -1954,6 +1966,9 @@ def VW(l, m, theta ,phi):
 
     phi   : np.array (1 x Nray)
 
+    cache : boolean
+        if True (default) the basis is looked up in and stored into a
+        cache keyed by (l,m,theta,phi)
 
     Returns
     -------
@@ -1965,9 +1980,16 @@ def VW(l, m, theta ,phi):
     --------
 
     AFLegendre
+    VWsynth
 
     Nray x M x L
 
+    Notes
+    -----
+
+    The cache holds at most _vwcache_maxbytes bytes, the least recently
+    used basis are dropped first. The cached V and W are read only.
+
     Examples
     --------
 
@@ -1991,6 +2013,13 @@ def VW(l, m, theta ,phi):
         theta[index]=np.pi/2-0.01
     x = -np.cos(theta)
 
+    if cache:
+        key = (l.tobytes(), m.tobytes(), np.asarray(theta).tobytes(),
+               np.asarray(phi).tobytes())
+        if key in _vwcache:
+            _vwcache.move_to_end(key)
+            return _vwcache[key]
+
     # The - sign is necessary to get the good reconstruction
     #     deduced from observation
     #     May be it comes from a different definition of theta in SPHEREPACK
@@ -2026,8 +2055,67 @@ def VW(l, m, theta ,phi):
     #W[np.isinf(W) | np.isnan(W)] = 0
     #V[np.isinf(V) | np.isnan(V)] = 0
 
+    if cache:
+        nbytes = V.nbytes + W.nbytes + sum(len(k) for k in key)
+        if nbytes <= _vwcache_maxbytes:
+            V.flags.writeable = False
+            W.flags.writeable = False
+            _vwcache[key] = (V, W)
+            size = sum(v[0].nbytes + v[1].nbytes + sum(len(k) for k in u)
+                       for u, v in _vwcache.items())
+            while size > _vwcache_maxbytes:
+                u, v = _vwcache.popitem(last=False)
+                size -= v[0].nbytes + v[1].nbytes + sum(len(k) for k in u)
+
     return V, W
 
+def VWsynth(Br, Bi, Cr, Ci, V, W):
+    """ synthesis of a pattern from shape 3 vsh coefficients
+
+    Parameters
+    ----------
+
+    Br : np.array (Nf x K)
+    Bi : np.array (Nf x K)
+    Cr : np.array (Nf x K)
+    Ci : np.array (Nf x K)
+    V  : np.array (Nray x K)
+    W  : np.array (Nray x K)
+
+    Returns
+    -------
+
+    Fth : np.array (Nf x Nray)
+    Fph : np.array (Nf x Nray)
+
+    Notes
+    -----
+
+    The 8 products of the coefficients with the real and imaginary parts of
+    V and W are gathered in a single (2Nf x 4K) x (4K x Nray) product.
+
+    .. math::
+
+        F_{\theta} = B_r \Re V - B_i \Im V + C_i \Re W + C_r \Im W
+
+        F_{\phi} = -C_r \Re V + C_i \Im V + B_i \Re W + B_r \Im W
+
+    See Also
+    --------
+
+    VW
+
+    """
+    Nf = Br.shape[0]
+    A = np.vstack((np.hstack((Br, -Bi, Ci, Cr)),
+                   np.hstack((-Cr, Ci, Bi, Br))))
+    X = np.vstack((np.real(V.T), np.imag(V.T), np.real(W.T), np.imag(W.T)))
+    if np.iscomplexobj(A):
+        F = np.dot(np.real(A), X) + 1j*np.dot(np.imag(A), X)
+    else:
+        F = np.dot(A, X)
+    return F[:Nf], F[Nf:]
+
 def VW0(n, m, x, phi, Pmm1n, Pmp1n):
     """ evaluate vector Spherical Harmonics basis functions
 
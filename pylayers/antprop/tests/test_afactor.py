@@ -0,0 +1,29 @@
+from pylayers.antprop.aarray import *
+
+A = ULArray(N=[8,1,4],dm=[0.005,0,0.005])
+fGHz = np.array([27.,28.,29.])
+th = np.pi*np.random.rand(50)
+ph = 2*np.pi*np.random.rand(50)
+w = np.random.randn(5,32,3)+1j*np.random.randn(5,32,3)
+
+# direct sum over the elements
+k = 2*np.pi*fGHz/0.3
+s = np.vstack((np.sin(th)*np.cos(ph),np.sin(th)*np.sin(ph),np.cos(th)))
+E = np.exp(1j*k[None,None,:]*np.dot(s.T,A.p)[:,:,None])
+ref = np.einsum('baf,daf->bdf',w,E)
+
+# any set of points, regular grid, small direction blocks
+for N in [[],A.N]:
+    AF = afactor(A.p,w,th,ph,fGHz,N=N,nmax=1000)
+    assert np.allclose(AF,ref)
+    AF = afactor(A.p,w,th,ph,fGHz,N=N,dtype=np.complex64)
+    assert AF.dtype == np.complex64
+    assert np.abs(AF-ref).max() < 1e-3*np.abs(ref).max()
+
+# separable weights along x and z
+wx = np.random.randn(5,8,3)+0j
+wy = np.ones((5,1,3))
+wz = np.random.randn(5,4,3)+0j
+w = (wx[:,:,None,None,:]*wy[:,None,:,None,:]*wz[:,None,None,:,:]).reshape(5,32,3)
+AF = afactor(A.p,[wx,wy,wz],th,ph,fGHz,N=A.N)
+assert np.allclose(AF,afactor(A.p,w,th,ph,fGHz))
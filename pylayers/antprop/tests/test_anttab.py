@@ -0,0 +1,42 @@
+from pylayers.antprop.antenna import *
+
+fGHz = np.array([2.4,3.5,5.2])
+th = np.arccos(1-2*np.random.rand(500))
+ph = 2*np.pi*np.random.rand(500)
+
+for typ in ['Gauss','3gpp']:
+    A = Antenna(typ,fGHz=fGHz)
+    Fte, Fpe = A.eval(th=th,ph=ph,fGHz=fGHz,inplace=False)
+    err = A.tabulate(dtheta=np.pi/45,dphi=np.pi/45,tol=1e-2)
+    assert err < 1e-2
+    Ft, Fp = A.eval(th=th,ph=ph,fGHz=fGHz,inplace=False)
+    Fmax = max(np.abs(Fte).max(),np.abs(Fpe).max())
+    assert np.abs(Ft-Fte).max() < 2e-2*Fmax
+    assert np.abs(Fp-Fpe).max() < 2e-2*Fmax
+
+    # subset of the table frequencies
+    Ft1, Fp1 = A.eval(th=th,ph=ph,fGHz=fGHz[1:2],inplace=False)
+    assert np.allclose(Ft1,Ft[...,1:2])
+
+    # frequency out of the table : exact evaluation
+    Ft2, Fp2 = A.eval(th=th,ph=ph,fGHz=np.array([4.]),inplace=False)
+    A.tab = None
+    Ft3, Fp3 = A.eval(th=th,ph=ph,fGHz=np.array([4.]),inplace=False)
+    assert np.allclose(Ft2,Ft3)
+
+# the table of an antenna file is saved and reloaded for the same request,
+# even when the steps were refined to reach tol
+A = Antenna('defant.vsh3')
+tabfile = os.path.splitext(pyu.getlong('defant.vsh3',pstruc['DIRANT']))[0]+'.tab.npz'
+if os.path.isfile(tabfile):
+    os.remove(tabfile)
+err = A.tabulate(dtheta=np.pi/10,dphi=np.pi/10,tol=1e-2)
+assert A.tab['dtheta'] < np.pi/10
+mtime = os.stat(tabfile).st_mtime_ns
+A = Antenna('defant.vsh3')
+assert A.tabulate(dtheta=np.pi/10,dphi=np.pi/10,tol=1e-2) == err
+assert os.stat(tabfile).st_mtime_ns == mtime
+# another request builds a new table
+A.tabulate(dtheta=np.pi/10,dphi=np.pi/10,tol=5e-2)
+assert os.stat(tabfile).st_mtime_ns != mtime
+os.remove(tabfile)
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from pylayers.antprop.channel import *
+import pylayers.util.geomutil as geu
+
+nray = 20
+fGHz = np.linspace(3,10,301)
+C = np.random.randn(2,2,nray,len(fGHz))+1j*np.random.randn(2,2,nray,len(fGHz))
+tang = np.random.rand(nray,2)*np.array([np.pi,2*np.pi])
+rang = np.random.rand(nray,2)*np.array([np.pi,2*np.pi])
+tauk = 10+100*np.random.rand(nray)
+
+# in memory and out-of-core propagation channels
+tmpdir = tempfile.mkdtemp()
+lC = []
+for fchunk,dirname in [(None,None),(64,tmpdir)]:
+    Cf = chanalloc(C.shape,dirname)
+    Cf[:] = C
+    Ct = Ctilde()
+    Ct.fromarray(fGHz,Cf,fchunk=fchunk,dirname=dirname)
+    Ct.tang = tang
+    Ct.rang = rang
+    Ct.tauk = tauk
+    lC.append(Ct)
+C0, C1 = lC
+assert isinstance(C1.Ctt.y,np.memmap)
+
+Ta = geu.MEulerAngle(0.3,0.2,0.1)
+Tb = geu.MEulerAngle(0.1,0.5,0.7)
+C0.locbas(Ta=Ta,Tb=Tb)
+C1.locbas(Ta=Ta,Tb=Tb)
+assert np.allclose(C0.Ctp.y,C1.Ctp.y)
+
+for mode in ['mean','integ','center']:
+    for E0,E1 in zip(C0.energy(mode=mode),C1.energy(mode=mode)):
+        assert np.allclose(E0,E1)
+
+H0 = C0.prop2tran()
+H1 = C1.prop2tran()
+assert isinstance(H1.y,np.memmap)
+assert np.allclose(H0.y,H1.y)
+assert np.allclose(H0.energy(),H1.energy())
+
+cir0 = H0.getcir(BWGHz=7,Nf=1000)
+cir1 = H1.getcir(BWGHz=7,Nf=1000)
+assert np.allclose(cir0.y,cir1.y)
+
+# the memmap files are unlinked as soon as they are mapped
+if os.name == 'posix':
+    assert os.listdir(tmpdir) == []
+
+# a channel without ray
+H2 = Tchannel(x=fGHz,y=np.zeros((0,1,1,len(fGHz)),dtype=complex),
+              tau=np.zeros(0),dod=np.zeros((0,2)),doa=np.zeros((0,2)))
+H2.taue = np.zeros(0)
+H2.fchunk = 64
+H2.dirname = tmpdir
+assert H2.applywav([]).y.shape[0] == 0
+
+shutil.rmtree(tmpdir)
+
+# Rays.eval by frequency chunks does not keep the interactions
+from pylayers.simul.link import DLink
+DL = DLink(L='defstr.lay',fGHz=np.linspace(4,6,41))
+DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+C0 = DL.C.Ctt.y.copy()
+DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False,fchunk=8)
+assert np.allclose(C0,DL.C.Ctt.y)
+assert not DL.R.I.evaluated
@@ -0,0 +1,25 @@
+from pylayers.antprop.loss import *
+
+# radial grid over a random terrain
+Nphi, Nr = 7, 60
+phi = np.linspace(0, 2*np.pi, Nphi)[:, None]
+r = np.linspace(0.02, 4000, Nr)[None, :]
+X = r*np.cos(phi)
+Y = r*np.sin(phi)
+Z = 100 + 30*np.random.rand(Nphi, Nr)
+fGHz = np.array([0.3, 0.9, 2.4])
+
+L = cover(X, Y, Z, 30, 1.5, fGHz, 4/3.)
+L0 = np.zeros(len(fGHz))
+for ip in range(Nphi):
+    for il in range(2, Nr-1):
+        d = np.sqrt((X[ip, :il+1]-X[ip, 0])**2+(Y[ip, :il+1]-Y[ip, 0])**2)
+        z = Z[ip, :il+1] + d*d[::-1]/(2*4/3.*6375e3)
+        z[0] = z[0] + 30
+        z[-1] = z[-1] + 1.5
+        LOS = 32.4 + 20*np.log10(fGHz) + 20*np.log10(d[-1])
+        Ld = deygout(d, z, fGHz, L0, 0)
+        assert np.allclose(L[ip, il, :], Ld+LOS)
+
+Lb = cover(X, Y, Z, 30, 1.5, fGHz, 4/3., nproc=2)
+assert np.allclose(L, Lb)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from pylayers.antprop.coverage import *
+
+# small coverage of defstr.lay, 2 access points
+tmpdir = tempfile.mkdtemp()
+fileini = os.path.join(tmpdir,'covtile.ini')
+with open(fileini,'w') as fd:
+    fd.write("""[grid]
+nx = 9
+ny = 5
+boundary = [0,0,10,8]
+zgrid = 1.2
+mode = zone
+file = points.ini
+
+[layout]
+filename = defstr.lay
+
+[ap]
+0 = {'name':'ap1','wstd':'ieee80211b','p':(1,2,1.2),'PtdBm':0,'chan':[11],'on':True,'ant':'Omni','phideg':0}
+1 = {'name':'ap2','wstd':'ieee80211b','p':(8,4,1.2),'PtdBm':0,'chan':[11],'on':True,'ant':'Omni','phideg':0}
+
+[rx]
+temperaturek = 300
+noisefactordb = 0
+
+[show]
+show = False
+""")
+
+C = Coverage(fileini)
+C.snr = True
+C.sinr = True
+C.best = True
+lname = ['Lwo','Lwp','Edo','Edp','freespace','tgain','CmWo','CmWp',
+         'snro','snrp','sinro','sinrp','bestsvo','bestsvp']
+
+# reference : a single tile
+C.cover(size=C.ng)
+assert len(C.lblock) == 1
+dref = dict([(name,np.array(getattr(C,name))) for name in lname])
+
+# tiles which do not divide the grid, serial then pooled
+for kwargs in [{'size':7},{'size':7,'nproc':2},{'size':7,'nproc':2,'dirname':tmpdir}]:
+    C.cover(**kwargs)
+    assert len(C.lblock) == int(np.ceil(C.ng/7.))
+    for name in lname:
+        assert np.allclose(np.array(getattr(C,name)),dref[name],equal_nan=True),name
+
+shutil.rmtree(tmpdir)
@@ -0,0 +1,28 @@
+import copy
+from pylayers.simul.link import *
+from pylayers.antprop.channel import ctildeconcat
+
+# two links of defstr.lay with vsh3 antennas, on the antenna frequencies
+A = Antenna('defant.vsh3')
+DL = DLink(L='defstr.lay',fGHz=A.fGHz,Aa=A,Ab=A)
+DL.a = np.array([1,2,1.2])
+lC = []
+lH = []
+for b in [np.array([8,4,1.2]),np.array([5,6,1.5])]:
+    DL.b = b
+    DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+    lC.append(copy.deepcopy(DL.C))
+    lH.append(DL.H)
+
+# the antennas evaluated once for the rays of both links give the
+# channels of each link
+C, ptr = ctildeconcat(lC)
+assert C.nray == lC[0].nray + lC[1].nray
+assert np.all(ptr == np.array([0,lC[0].nray,C.nray]))
+H = C.prop2tran(a=DL.Aa,b=DL.Ab,Friis=True)
+for k,Hk in enumerate(lH):
+    u = slice(ptr[k],ptr[k+1])
+    assert np.allclose(H.y[u],Hk.y)
+    assert np.allclose(H.taud[u],Hk.taud)
+    assert np.allclose(H.doa[u],Hk.doa)
+    assert np.allclose(H.dod[u],Hk.dod)
@@ -0,0 +1,33 @@
+import numpy as np
+from pylayers.antprop.slab import *
+from pylayers.antprop.diffRT import *
+
+dm = MatDB(_fileini='matDB.ini')
+Nr = 200
+fGHz = np.linspace(2,6,11)
+N = 1.5+0.5*np.random.rand(Nr)
+phi0 = np.random.rand(Nr)*N*np.pi
+phi = np.random.rand(Nr)*N*np.pi
+beta = np.pi/2+0.3*(np.random.rand(Nr)-0.5)
+si = 1+20*np.random.rand(Nr)
+sd = 1+20*np.random.rand(Nr)
+
+# the table of the transition function is built once per process
+assert Ftab() is Ftab()
+x = np.logspace(-6,3,500)
+assert np.allclose(FreFtab(x),FreF(x)[0],atol=1e-5)
+
+for m0,mN in [('METAL','METAL'),('WOOD','PLASTER')]:
+    mat0 = dm[m0]
+    matN = dm[mN]
+    Ds,Dh = diff(fGHz,phi0,phi,si,sd,N,mat0,matN,beta=beta,mode='tab')
+    Dse,Dhe = diff(fGHz,phi0,phi,si,sd,N,mat0,matN,beta=beta,mode='exact')
+    assert Ds.shape == (len(fGHz),Nr)
+    assert np.allclose(Ds,Dse,atol=1e-5*np.abs(Dse).max())
+    assert np.allclose(Dh,Dhe,atol=1e-5*np.abs(Dhe).max())
+    # the 4 terms evaluated for all the wedges, combined on a subset
+    D = Dkernel(fGHz,phi0,phi,si,sd,N,beta=beta)
+    idx = np.arange(0,Nr,3)
+    Rso,Rho,Rsn,Rhn = Rwedge(fGHz,phi0[idx],phi[idx],N[idx],mat0,matN)
+    Dsi = D[0][:,idx]+D[1][:,idx]+Rsn*D[2][:,idx]+Rso*D[3][:,idx]
+    assert np.allclose(Dsi,Ds[:,idx])
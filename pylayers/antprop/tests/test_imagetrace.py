@@ -0,0 +1,32 @@
+from pylayers.simul.link import *
+
+def check(S,tx,rx):
+    R = S.backtrace(tx,rx,S.image2(tx))
+    # small chunks of signatures of several lengths
+    for nsigmax in [10,65536]:
+        Rv = S.imagetrace(tx,rx,nsigmax=nsigmax)
+        assert list(R.keys()) == list(Rv.keys())
+        for k in R:
+            assert np.array_equal(R[k]['sig'],Rv[k]['sig'])
+            assert np.allclose(R[k]['pt'],Rv[k]['pt'])
+    return R
+
+L = Layout('defstr.lay',bbuild=True)
+S = Signatures(L,1,2,cutoff=5)
+S.run(cutoff=5,diffraction=True,progress=False)
+check(S,np.array(L.Gt.pos[1]),np.array(L.Gt.pos[2]))
+
+# diffraction rays
+DL = DLink(L=Layout('defdiff.lay',bbuild=True))
+DL.a[0] = DL.a[0]+3
+DL.eval(force=True,diffraction=True,ra_ceil_H=[],si_progress=False,si_cache=False)
+R = check(DL.Si,DL.a[:2],DL.b[:2])
+assert any([np.any(R[k]['sig'][1]==1) for k in R])
+
+# the coordinate table follows the layout
+off, pab, normal, K, v = L._segtable()
+s = L.tsg[0]
+assert np.allclose(pab[:,:,s+off],L.pt[:,L.tahe[:,0]])
+# the points of the segment are their own image
+assert np.allclose(np.dot(K[:,:,s+off],pab[:,:,s+off])+v[:,[s+off]],pab[:,:,s+off])
+assert L._segtable()[1] is pab
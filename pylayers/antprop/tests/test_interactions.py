@@ -0,0 +1,62 @@
+from pylayers.simul.link import *
+from pylayers.antprop.interactions import *
+
+L = Layout('defstr.lay',bbuild=True)
+DL = DLink(L=L,fGHz=np.linspace(4,6,5))
+DL.a = np.array([1,2,1.2])
+DL.b = np.array([8,4,1.5])
+DL.eval(force=True,cutoff=4,ra_ceil_H=[],si_progress=False)
+R = DL.R
+I = R.I
+
+# one row of the table per interaction index : the k interactions of the
+# rays of group k are numbered 0..nimax-1
+iray = np.hstack([R[k]['rays'].ravel() for k in R if k != 0])
+assert I.nimax == len(iray)
+assert np.all(np.sort(iray) == np.arange(I.nimax))
+for k in R:
+    if k != 0:
+        idx = R[k]['rays'].ravel(order='F')
+        assert np.all(I.ityp[idx] == R[k]['sig'][1,1:-1,:].ravel(order='F'))
+
+# slab grouped index : each slab is a contiguous range of R, T
+for key, typ in (('R',2),('T',3)):
+    Int = getattr(I, key)
+    n = 0
+    for m in Int.dusl:
+        u = Int.dusl[m]
+        assert np.all(np.diff(u) == 1)
+        assert np.all(Int.idx[u] == I.dgroup[(typ,m)])
+        n = n + len(u)
+    assert n == len(Int.idx)
+
+# the table equals the evaluation of each type on its own data, in its
+# own array (self.A)
+I.eval(DL.fGHz)
+n = 0
+for Int in (I.T, I.R, I.D):
+    if len(Int.idx) != 0:
+        A = Int.eval(DL.fGHz)
+        assert A.shape[1] == len(Int.idx)
+        assert np.allclose(I.I[:,Int.idx], A)
+        n = n + len(Int.idx)
+assert n == I.nimax - np.sum(I.ityp == 0)
+
+# the channel does not depend on the order of the groups of rays
+C = R.eval(DL.fGHz)
+d = dict([(k, R.pop(k)) for k in list(R.keys())])
+for k in sorted(d, reverse=True):
+    R[k] = d[k]
+R.fillinter(L)
+C2 = R.eval(DL.fGHz)
+assert np.allclose(C.Ctt.y, C2.Ctt.y)
+assert np.allclose(C.Cpp.y, C2.Cpp.y)
+assert np.allclose(C.Ctp.y, C2.Ctp.y)
+
+# regression : the ray groups of this link come unsorted from to3D. Its
+# channel is the one of the previous implementation run on sorted groups,
+# which chained the rays with the basis of other rays when they were not
+# sorted (energy 1.04e-6)
+DL.eval(force=True,cutoff=4,ra_ceil_H=0,si_progress=False)
+assert list(DL.R.keys()) != sorted(DL.R.keys())
+assert np.isclose(np.sum(np.abs(DL.H.y)**2),3.3381872155e-06,rtol=1e-6)
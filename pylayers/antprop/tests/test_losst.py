@@ -0,0 +1,51 @@
+from pylayers.gis.layout import Layout
+from pylayers.antprop.loss import *
+from pylayers.antprop.loss import _scatteradd
+
+# _scatteradd sums the columns with the same index
+W = np.arange(12.).reshape(2,6)
+S = _scatteradd(np.array([3,0,3,1,0,3]),W,5)
+assert np.allclose(S,np.array([[5,3,0,7,0],[17,9,0,25,0]]))
+
+L = Layout('DLR.lay')
+L.build()
+fGHz = np.array([2.4,5.])
+np.random.seed(1)
+Nlink = 400
+pmin = np.min(L.pt,axis=1)
+pmax = np.max(L.pt,axis=1)
+tx = np.hstack(((pmin+pmax)/2.,1.2))
+rx = np.vstack((pmin[:,None]+(pmax-pmin)[:,None]*np.random.rand(2,Nlink),
+                1.2*np.ones(Nlink)))
+
+# reference : loop over the crossings of the links
+data = L.angleonlink3(tx,rx)
+Lo0 = np.zeros((len(fGHz),Nlink))
+Lp0 = np.zeros((len(fGHz),Nlink))
+Eo0 = np.zeros(Nlink)
+Ep0 = np.zeros(Nlink)
+for i,s,a in zip(data['i'],data['s'],data['a']):
+    slname = L.Gs.node[s]['name']
+    if slname in ['','AIR','_AIR']:
+        continue
+    lko,lkp = L.sl[slname].losst(fGHz,np.array([a]))
+    do,dp = L.sl[slname].excess_grdelay(theta=np.array([a]))
+    Lo0[:,i] += lko[:,0]
+    Lp0[:,i] += lkp[:,0]
+    Eo0[i] += do[0]
+    Ep0[i] += dp[0]
+assert Lo0.max() > 0
+
+Lo,Lp,Eo,Ep = Losst(L,fGHz,tx,rx,dB=True,mode='exact')
+assert np.allclose(Lo,Lo0,rtol=0,atol=1e-10)
+assert np.allclose(Lp,Lp0,rtol=0,atol=1e-10)
+assert np.allclose(Eo,Eo0,rtol=0,atol=1e-10)
+assert np.allclose(Ep,Ep0,rtol=0,atol=1e-10)
+
+# the 'tab' mode interpolates the slab losses in cos(theta) : 5e-3 dB and
+# 1e-4 ns per link at most with the default 1024 intervals
+Lot,Lpt,Eot,Ept = Losst(L,fGHz,tx,rx,dB=True,mode='tab')
+assert np.abs(Lot-Lo0).max() < 5e-3
+assert np.abs(Lpt-Lp0).max() < 5e-3
+assert np.abs(Eot-Eo0).max() < 1e-4
+assert np.abs(Ept-Ep0).max() < 1e-4
@@ -0,0 +1,18 @@
+from pylayers.antprop.signature import *
+from pylayers.gis.layout import *
+
+L = Layout('defstr.lay',bbuild=True)
+lcy = [ x for x in L.Gt.nodes() if x > 0 ]
+ca = lcy[0]
+cb = lcy[-1]
+
+S1 = Signatures(L,ca,cb,cutoff=3)
+S1.run(cutoff=3,diffraction=True,progress=False)
+S2 = Signatures(L,ca,cb,cutoff=3)
+S2.run(cutoff=3,diffraction=True,progress=False,nproc=2)
+
+assert sorted(S1.keys()) == sorted(S2.keys()), 'signature lengths differ'
+for k in S1:
+    assert (S1[k] == S2[k]).all(), 'signatures differ'
+    assert (S1.ratio[k] == S2.ratio[k]).all(), 'ratios differ'
+assert S1.cpt == S2.cpt
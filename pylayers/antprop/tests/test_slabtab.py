@@ -0,0 +1,52 @@
+from pylayers.gis.layout import Layout
+from pylayers.antprop.slab import *
+
+sl = Layout('DLR.lay').sl
+fGHz = np.linspace(2,11,91)
+theta = np.linspace(0,np.pi/2-0.01,500)
+
+for name in ['WALL','PARTITION','3D_WINDOW_GLASS']:
+    S = sl[name]
+    # the tables are built at the second request
+    S.evaltab(fGHz,theta,RT='R')
+    S.evaltab(fGHz,theta,RT='T',compensate=True)
+    S.evaltab(fGHz,theta,RT='R')
+    assert S.taberr < 1e-5
+    R = S.R
+    S.eval(fGHz,theta,RT='R')
+    assert np.abs(R-S.R).max() < 1e-5
+    S.evaltab(fGHz,theta,RT='T',compensate=True)
+    T = S.T
+    S.eval(fGHz,theta,RT='T',compensate=True)
+    assert np.abs(T-S.T).max() < 1e-5
+
+# the table is rebuilt when the slab changes
+S = sl['PARTITION']
+S.evaltab(fGHz,theta,RT='R')
+S['lthick'] = [2*x for x in S['lthick']]
+S.evaltab(fGHz,theta,RT='R')
+S.evaltab(fGHz,theta,RT='R')
+R = S.R
+S.eval(fGHz,theta,RT='R')
+assert np.abs(R-S.R).max() < 1e-5
+
+# all the slabs in one batch, including METAL ones
+sl = SlabDB(fileslab='slabDB.ini',filemat='matDB.ini')
+dtheta = {name:np.random.rand(7)*theta[-1] for name in sl}
+for RT,compensate in [('R',False),('T',True)]:
+    M = sl.eval(fGHz,dtheta,RT=RT,compensate=compensate)
+    for k,name in enumerate(dtheta):
+        sl[name].eval(fGHz,dtheta[name],RT=RT,compensate=compensate)
+        Mk = sl[name].R if RT=='R' else sl[name].T
+        assert np.allclose(M[:,7*k:7*(k+1)],Mk)
+# the dispersion of the materials is evaluated once per frequency grid
+mat = sl['WALL']['lmat'][0]
+assert sl.epsc(mat,fGHz) is sl.epsc(mat,fGHz)
+
+# no table beyond ntabmax, the coefficients are then exact
+S = sl['WALL']
+for k in range(2):
+    assert not S.evaltab(fGHz,theta,RT='R',ntabmax=len(fGHz))
+R = S.R
+S.eval(fGHz,theta,RT='R')
+assert (R == S.R).all()
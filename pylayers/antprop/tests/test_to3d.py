@@ -0,0 +1,33 @@
+from pylayers.simul.link import *
+import shapely.geometry as shg
+
+L = Layout('defstr.lay',bbuild=True)
+DL = DLink(L=L,fGHz=np.linspace(4,6,5))
+DL.a = np.array([1,2,1.2])
+DL.b = np.array([8,4,1.5])
+DL.eval(force=True,cutoff=4,diffraction=True,ra_ceil_H=[],
+        ra_number_mirror_cf=2,si_progress=False)
+
+R = DL.r2d.to3D(L,H=L.maxheight,N=2)
+lcy = [x for x in L.Gt.node if x > 0]
+for k in R:
+    pt = R[k]['pt']
+    sig = R[k]['sig']
+    # rays are sorted by length
+    assert np.allclose(np.sum(R[k]['si'],axis=0),R[k]['dis'])
+    assert np.all(np.diff(R[k]['dis']) >= 0)
+    assert np.all(pt[2] >= 0) & np.all(pt[2] <= L.maxheight)
+    # no ceil reflexion in an outdoor cycle
+    uc = np.where(sig[1] == 5)
+    for p in pt[0:2,uc[0],uc[1]].T:
+        lin = [x for x in lcy if L.Gt.node[x]['polyg'].contains(shg.Point(p))]
+        assert all([L.Gt.node[x]['indoor'] for x in lin])
+assert R.nray == sum([R[k]['nbrays'] for k in R])
+assert np.allclose(np.sort(R.delays),np.sort(np.hstack([R[k]['dis'] for k in R])/0.3))
+
+# removing the AIR interactions preserves the ray lengths
+Ra = R.remove_aw(L)
+assert sorted(Ra._rayidx_aw) == list(range(R.nray))
+dis = np.hstack([R[k]['dis'] for k in R])
+disa = np.hstack([Ra[k]['dis'] for k in Ra])
+assert np.allclose(disa,dis[Ra._rayidx_aw])
@@ -0,0 +1,51 @@
+from pylayers.antprop.antenna import *
+from pylayers.antprop.spharm import *
+
+A = Antenna('defant.vsh3')
+A.grid = False
+lBr = A.C.Br.ind3[:,0]
+mBr = A.C.Br.ind3[:,1]
+np.random.seed(0)
+Nray = 50
+theta = np.pi*np.random.rand(Nray)
+phi = 2*np.pi*np.random.rand(Nray)
+
+# cached basis equals the uncached one, the second call is a cache hit
+VWclear()
+V0, W0 = VW(lBr,mBr,theta.copy(),phi.copy(),cache=False)
+V1, W1 = VW(lBr,mBr,theta.copy(),phi.copy())
+V2, W2 = VW(lBr,mBr,theta.copy(),phi.copy())
+assert np.allclose(V0,V1) and np.allclose(W0,W1)
+assert (V2 is V1) and (W2 is W1)
+assert not V1.flags.writeable
+VWclear()
+V3, W3 = VW(lBr,mBr,theta.copy(),phi.copy())
+assert V3 is not V1
+assert np.allclose(V3,V0) and np.allclose(W3,W0)
+
+# VWsynth equals the sums of the 8 coefficient x basis products
+Br = A.C.Br.s3
+Bi = A.C.Bi.s3
+Cr = A.C.Cr.s3
+Ci = A.C.Ci.s3
+Fth0 = np.dot(Br, np.real(V0.T)) - np.dot(Bi, np.imag(V0.T)) + \
+       np.dot(Ci, np.real(W0.T)) + np.dot(Cr, np.imag(W0.T))
+Fph0 = -np.dot(Cr, np.real(V0.T)) + np.dot(Ci, np.imag(V0.T)) + \
+        np.dot(Bi, np.real(W0.T)) + np.dot(Br, np.imag(W0.T))
+Fth, Fph = VWsynth(Br,Bi,Cr,Ci,V0,W0)
+assert np.allclose(Fth,Fth0) and np.allclose(Fph,Fph0)
+
+# complex coefficients
+Bc = Br + 1j*Bi
+Fth, Fph = VWsynth(Bc,Bc,Cr,Ci,V0,W0)
+Fth0 = np.dot(Bc, np.real(V0.T)) - np.dot(Bc, np.imag(V0.T)) + \
+       np.dot(Ci, np.real(W0.T)) + np.dot(Cr, np.imag(W0.T))
+assert np.allclose(Fth,Fth0)
+
+# synthesis of all the rays at once equals the synthesis ray by ray
+VWclear()
+Fth, Fph = A.Fsynth3(theta.copy(),phi.copy())
+for k in range(Nray):
+    Ftk, Fpk = A.Fsynth3(theta[k:k+1].copy(),phi[k:k+1].copy())
+    assert np.allclose(Fth[:,k:k+1],Ftk)
+    assert np.allclose(Fph[:,k:k+1],Fpk)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+.. currentmodule:: pylayers.gis.demstore
+
+.. autosummary::
+    :members:
+
+"""
+from __future__ import print_function
+import os
+import doctest
+from collections import OrderedDict
+import numpy as np
+import h5py
+import pylayers.gis.gisutil as gu
+from pylayers.util.project import *
+
+
+def tilename(ilon, ilat):
+    """ name of the 1 degree tile of south west corner (ilon,ilat)
+
+    Parameters
+    ----------
+
+    ilon : int
+        longitude of the tile west border (degrees)
+    ilat : int
+        latitude of the tile south border (degrees)
+
+    Examples
+    --------
+
+        >>> from pylayers.gis.demstore import *
+        >>> tilename(-2,48)
+        'N48W002'
+        >>> tilename(12,-1)
+        'S01E012'
+
+    """
+    slat = 'N' if ilat >= 0 else 'S'
+    slon = 'E' if ilon >= 0 else 'W'
+    return slat + '%02d' % abs(ilat) + slon + '%03d' % abs(ilon)
+
+
+class DEMStore(PyLayers):
+    """ Store of memory mapped DEM tiles
+
+    Tiles are 1 degree wide and are opened on the first query which
+    touches them. Raw tiles are memory mapped, so that only the pages of
+    the samples are read from the disk.
+
+    Attributes
+    ----------
+
+    dirname : string
+        directory of the tiles
+    fmt : string
+        'hgt' : raw srtm files <prefix>.hgt (big endian int16)
+        'h5' : Ezone files <prefix>.h5 (dataset dem/<source>/hgt<s|a>)
+    source : string
+        'srtm' | 'aster' (only used with fmt='h5')
+    nodata : float
+        height of voids and of missing tiles (default 0)
+    maxtiles : int
+        maximum number of simultaneously opened tiles
+
+    Examples
+    --------
+
+        >>> from pylayers.gis.demstore import *
+        >>> D = DEMStore()
+        >>> h = D.sample(np.array([-1.6,-1.65]),np.array([48.1,48.12]))
+
+    """
+    void = -32768
+
+    def __init__(self, dirname='', fmt='hgt', source='srtm', nodata=0.,
+                 maxtiles=64):
+
+        if dirname == '':
+            if fmt == 'hgt':
+                dirname = os.path.join(basename, 'gis', 'srtm')
+            else:
+                dirname = os.path.join(basename, 'gis', 'h5')
+        self.dirname = dirname
+        self.fmt = fmt
+        self.source = source
+        self.nodata = nodata
+        self.maxtiles = maxtiles
+        self.tiles = OrderedDict()
+
+    def __repr__(self):
+        st = 'DEMStore : ' + self.dirname + ' (' + self.fmt + ')\n'
+        st = st + 'opened tiles : ' + str(list(self.tiles.keys())) + '\n'
+        return(st)
+
+    def _filename(self, prefix):
+        """ tile filename or None if the tile is not in the store
+        """
+        for ext in ['.' + self.fmt, '.' + self.fmt.upper()]:
+            filename = os.path.join(self.dirname, prefix + ext)
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def _open(self, prefix):
+        """ open a tile
+
+        Returns
+        -------
+
+        T : np.memmap | np.array | None
+            heights of the tile, first row at the north border
+
+        """
+        filename = self._filename(prefix)
+        if filename is None:
+            return None
+        if self.fmt == 'hgt':
+            n = int(np.sqrt(os.path.getsize(filename)//2))
+            return np.memmap(filename, dtype='>i2', mode='r', shape=(n, n))
+        with h5py.File(filename, 'r') as fh:
+            name = 'hgt' + self.source[0]
+            if (('dem' not in fh) or (self.source not in fh['dem'])
+                    or (name not in fh['dem'][self.source])):
+                return None
+            ds = fh['dem'][self.source][name]
+            offset = ds.id.get_offset()
+            # a contiguous dataset is mapped, otherwise it is read
+            if (ds.chunks is None) and (offset is not None):
+                return np.memmap(filename, dtype=ds.dtype, mode='r',
+                                 offset=offset, shape=ds.shape)
+            return ds[:]
+
+    def tile(self, ilon, ilat):
+        """ get a tile
+
+        Parameters
+        ----------
+
+        ilon : int
+            longitude of the tile west border (degrees)
+        ilat : int
+            latitude of the tile south border (degrees)
+
+        Returns
+        -------
+
+        T : np.memmap | np.array | None
+            None if the tile is missing
+
+        """
+        prefix = tilename(ilon, ilat)
+        if prefix in self.tiles:
+            self.tiles.move_to_end(prefix)
+            return self.tiles[prefix]
+        T = self._open(prefix)
+        self.tiles[prefix] = T
+        if len(self.tiles) > self.maxtiles:
+            self.tiles.popitem(last=False)
+        return T
+
+    def sample(self, lon, lat):
+        """ bilinear sampling of the heights
+
+        Parameters
+        ----------
+
+        lon : np.array
+            longitudes (degrees)
+        lat : np.array
+            latitudes (degrees)
+
+        Returns
+        -------
+
+        h : np.array
+            heights (meters), broadcast shape of lon and lat
+
+        Notes
+        -----
+
+        The samples are grouped by tile, each tile is opened once per call.
+        Voids and missing tiles take the nodata value.
+
+        """
+        lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=float),
+                                       np.asarray(lat, dtype=float))
+        shape = lon.shape
+        lon = lon.ravel()
+        lat = lat.ravel()
+        h = np.full(len(lon), self.nodata, dtype=float)
+        ilon = np.floor(lon).astype(int)
+        ilat = np.floor(lat).astype(int)
+        # group the samples by tile
+        key = (ilat+90)*360 + (ilon+180)
+        ukey, inv = np.unique(key, return_inverse=True)
+        order = np.argsort(inv, kind='stable')
+        bound = np.cumsum(np.bincount(inv))
+        for k, u in enumerate(np.split(order, bound[:-1])):
+            T = self.tile(ilon[u[0]], ilat[u[0]])
+            if T is None:
+                continue
+            nr = T.shape[0] - 1
+            nc = T.shape[1] - 1
+            # the first row is the north border of the tile
+            row = (ilat[u] + 1 - lat[u])*nr
+            col = (lon[u] - ilon[u])*nc
+            r0 = np.minimum(row.astype(int), nr-1)
+            c0 = np.minimum(col.astype(int), nc-1)
+            dr = row - r0
+            dc = col - c0
+            hc = np.array([T[r0, c0], T[r0, c0+1],
+                           T[r0+1, c0], T[r0+1, c0+1]], dtype=float)
+            hc[hc == self.void] = self.nodata
+            h[u] = ((1-dr)*((1-dc)*hc[0] + dc*hc[1]) +
+                    dr*((1-dc)*hc[2] + dc*hc[3]))
+        return h.reshape(shape)
+
+    def profiles(self, pa, pb, Npt=1000):
+        """ height profiles of a batch of links
+
+        Parameters
+        ----------
+
+        pa : np.array (2,N)
+            (lon,lat) of the links origin (degrees)
+        pb : np.array (2,N)
+            (lon,lat) of the links termination (degrees)
+        Npt : int
+            number of points along each link
+
+        Returns
+        -------
+
+        height : np.array (N,Npt)
+            ground height (meters)
+        d : np.array (N,Npt)
+            distance from the link origin (meters)
+        lon : np.array (N,Npt)
+        lat : np.array (N,Npt)
+
+        Notes
+        -----
+
+        The points are uniformly spaced in (lon,lat), which is a good
+        approximation of the great circle on links of a few tens of km.
+
+        """
+        pa = np.asarray(pa, dtype=float).reshape(2, -1)
+        pb = np.asarray(pb, dtype=float).reshape(2, -1)
+        pa, pb = np.broadcast_arrays(pa, pb)
+        u = np.linspace(0, 1, Npt)[None, :]
+        lon = pa[0][:, None] + (pb[0]-pa[0])[:, None]*u
+        lat = pa[1][:, None] + (pb[1]-pa[1])[:, None]*u
+        height = self.sample(lon, lat)
+        lat0 = np.broadcast_to(lat[:, 0:1], lat.shape).ravel()
+        lon0 = np.broadcast_to(lon[:, 0:1], lon.shape).ravel()
+        d = gu.haversine(lat0, lon0, lat.ravel(), lon.ravel()).reshape(lat.shape)
+        return height, d, lon, lat
+
+
+if (__name__ == "__main__"):
+    doctest.testmod()
@@ -29,6 +29,7 @@ from shapely.geometry import Polygon
 from pylayers.gis.gisutil import *
 import pylayers.gis.kml as gkml
 import pylayers.gis.srtm as srtm
+from pylayers.gis.demstore import DEMStore
 from mpl_toolkits.basemap import Basemap
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from mpl_toolkits.axes_grid1.colorbar import colorbar
@@ -449,6 +450,34 @@ class Ezone(PyLayers):
 
 
 
+    def setstore(self, dirname='', fmt='hgt', source='srtm'):
+        """ attach a DEM tile store to the Ezone
+
+        Parameters
+        ----------
+
+        dirname : string
+            directory of the tiles (default $BASENAME/gis/srtm)
+        fmt : string
+            'hgt' | 'h5'
+        source : string
+            'srtm' | 'aster'
+
+        Notes
+        -----
+
+        With source='store', profile, route and cover sample the heights
+        from the tiles touched by the query instead of the hgts/hgta
+        arrays. The Ezone may then extend over several tiles.
+
+        See Also
+        --------
+
+        pylayers.gis.demstore.DEMStore
+
+        """
+        self.store = DEMStore(dirname=dirname, fmt=fmt, source=source)
+
     def loadh5old(self,_fileh5):
         """ load an Ezone from hdf5 file
 
@@ -599,7 +628,7 @@ class Ezone(PyLayers):
         fGHz : float
             frequency in GHz
         source : string
-            'aster' | 'srtm'
+            'aster' | 'srtm' | 'store' (see setstore)
 
         Returns
         -------
@@ -656,15 +685,16 @@ class Ezone(PyLayers):
 
         lon, lat = self.m(x, y, inverse=True)
 
-        Dx = (lon - self.extent[0]) / self.lonstep
-        Dy = (self.extent[3]-lat) / self.latstep
-        rx = np.floor(Dx).astype(int)
-        ry = np.floor(Dy).astype(int)
-        dx = Dx-rx
-        dy = Dy-ry
+        if kwargs['source'] != 'store':
+            Dx = (lon - self.extent[0]) / self.lonstep
+            Dy = (self.extent[3]-lat) / self.latstep
+            rx = np.floor(Dx).astype(int)
+            ry = np.floor(Dy).astype(int)
+            dx = Dx-rx
+            dy = Dy-ry
 
-        rx_old = np.round((lon - self.extent[0]) / self.lonstep).astype(int)
-        ry_old = np.round((self.extent[3]-lat) / self.latstep).astype(int)
+            rx_old = np.round((lon - self.extent[0]) / self.lonstep).astype(int)
+            ry_old = np.round((self.extent[3]-lat) / self.latstep).astype(int)
 
         # add earth sphericity deviation to hgt (depends on K factor)
         if kwargs['source'] == 'srtm':
@@ -691,6 +721,10 @@ class Ezone(PyLayers):
             height = (wll*hll+wlr*hlr+wul*hul+wur*hur)/(wll+wlr+wul+wur)
             height_old = self.hgta[ry,rx] + dh
 
+        if kwargs['source'] == 'store':
+            height = self.store.sample(lon, lat)
+            height_old = height + dh
+
         # seek for local maxima along link profile
 
         m, ind = maxloc(height[None, :])
@@ -754,7 +788,7 @@ class Ezone(PyLayers):
         K   : float
             K facteur (default 4/3)
         method :
-        source :
+        source : 'srtm' | 'aster' | 'store' (see setstore)
         binterb : boolean
             interpolation (default True)
 
@@ -793,13 +827,16 @@ class Ezone(PyLayers):
         # equivalent earth curvature
         dh = d*(d[:,::-1])/(2*K*6375e3)
 
-        Dlon = (lon - self.extent[0]) / self.lonstep
-        Dlat= (self.extent[3]-lat) / self.latstep
         #
         # Interpolation
         #
 
-        if binterp:
+        if source == 'store':
+            height = self.store.sample(lon, lat) + dh
+        elif binterp:
+            Dlon = (lon - self.extent[0]) / self.lonstep
+            Dlat= (self.extent[3]-lat) / self.latstep
+
             rlon = np.floor(Dlon).astype(int)
             rlat = np.floor(Dlat).astype(int)
             dlon = Dlon - rlon
@@ -824,6 +861,8 @@ class Ezone(PyLayers):
             wur = (1-dlon)**2 + dlat**2
             height = (wll*hll+wlr*hlr+wul*hul+wur*hur)/(wll+wlr+wul+wur) + dh
         else:
+            Dlon = (lon - self.extent[0]) / self.lonstep
+            Dlat= (self.extent[3]-lat) / self.latstep
             rlon = np.round(Dlon).astype(int)
             rlat = np.round(Dlat).astype(int)
             if source == 'srtm':
@@ -855,6 +894,12 @@ class Ezone(PyLayers):
             Transmitter height
         K : float
             K factor
+        source : string
+            'srtm' | 'aster' | 'store' (see setstore)
+        method : 'deygout' | 'bullington'
+            diffraction method (default 'deygout')
+        nproc : int
+            number of processes (default 1)
 
         Returns
         -------
@@ -871,6 +916,8 @@ class Ezone(PyLayers):
                     'K': 1.3333,
                     'fGHz': .3,
                     'source': 'srtm',
+                    'method': 'deygout',
+                    'nproc': 1,
                     'divider': []
                     }
 
@@ -917,13 +964,16 @@ class Ezone(PyLayers):
 
         lon, lat = self.m(x, y, inverse=True)
 
-        rx = np.floor((lon - self.extent[0]) / self.lonstep).astype(int)
-        if rx.max() >self.hgts.shape[1]:
-            rx = np.floor(( self.extent[1]-lon) / self.lonstep).astype(int)
+        if kwargs['source'] == 'store':
+            height = self.store.sample(lon, lat)
+        else:
+            rx = np.floor((lon - self.extent[0]) / self.lonstep).astype(int)
+            if rx.max() >self.hgts.shape[1]:
+                rx = np.floor(( self.extent[1]-lon) / self.lonstep).astype(int)
 
-        ry = np.floor((self.extent[3]-lat) / self.latstep).astype(int)
-        if ry.max() >self.hgts.shape[0]:
-            ry = np.floor((lat - self.extent[2]) / self.latstep).astype(int)
+            ry = np.floor((self.extent[3]-lat) / self.latstep).astype(int)
+            if ry.max() >self.hgts.shape[0]:
+                ry = np.floor((lat - self.extent[2]) / self.latstep).astype(int)
         # height
         #cov = self.hgts[ry, rx]
         if kwargs['source'] == 'srtm':
@@ -932,7 +982,9 @@ class Ezone(PyLayers):
         if kwargs['source'] == 'aster':
             height = self.hgta[ry, rx]
 
-        L = loss.cover(x, y, height, Ht, Hr, fGHz, K, method='deygout')
+        L = loss.cover(x, y, height, Ht, Hr, fGHz, K,
+                       method=kwargs['method'],
+                       nproc=kwargs['nproc'])
         self.triang = triang
         self.coverage  = L
         return triang, L
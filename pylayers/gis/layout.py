@@ -45,6 +45,9 @@ from descartes.patch import PolygonPatch
 from numpy import array
 import PIL.Image as Image
 import hashlib
+import pickle
+import multiprocessing as mp
+import h5py
 import pylayers.gis.kml as gkml
 #from pathos.multiprocessing import ProcessingPool as Pool
 #from pathos.multiprocessing import cpu_count
@@ -176,6 +179,9 @@ class Layout(pro.PyLayers):
     s2pu : segment to point index
     sgsg
 
+    segindex : spatial index of segments (geu.BoxIndex)
+    ptindex : spatial index of points (geu.BoxIndex)
+
     sl
 
 
@@ -415,10 +421,11 @@ class Layout(pro.PyLayers):
                     # if ans.lower()=='y'
                     self.build()
                     self.lbltg.append('s')
-                    self.dumpw()
                 #
-                # load graphs from file
+                # load graphs from the cache or from file
                 #
+                elif self.bgraphs and self.loadcache():
+                    pass
                 elif self.bgraphs:
                     if os.path.splitext(self._filename)[1]=='.lay':
                         dirname = self._filename.replace('.lay','')
@@ -448,7 +455,6 @@ class Layout(pro.PyLayers):
                         # they are built
                         self.build()
                         self.lbltg.append('s')
-                        self.dumpw()
 
     def __repr__(self):
         st = '\n'
@@ -559,6 +565,7 @@ class Layout(pro.PyLayers):
 
         """
         Ls = copy.deepcopy(self)
+        Ls._clearcachekey()
         if type(other) == np.ndarray:
             for k in Ls.Gs.pos:
                 Ls.Gs.pos[k] = Ls.Gs.pos[k] + other[0:2]
@@ -631,6 +638,7 @@ class Layout(pro.PyLayers):
         """ switch coordinates
 
         """
+        self._clearcachekey()
         if hasattr(self,'m'):
             if self.coordinates=='cart':
                 for k in self.Gs.pos.keys():
@@ -765,6 +773,7 @@ class Layout(pro.PyLayers):
         __add__
 
         """
+        self._clearcachekey()
 
         newpoint = dict((k - offp, v) for k, v in self.Gs.node.items() if k < 0)
         assert (np.array(list(newpoint.keys())) < 0).all()
@@ -1064,6 +1073,7 @@ class Layout(pro.PyLayers):
         extrseg
 
         """
+        self._clearcachekey()
 
         nodes = self.Gs.nodes()
         # nodes include points and segments
@@ -1381,6 +1391,7 @@ class Layout(pro.PyLayers):
         _fileshp :
 
         """
+        self._clearcachekey()
         defaults = {'pref': [np.array([25481100, 6676890]), np.array([60.2043716, 24.6591147])],
                     'dist_m': 250,
                     'latlon': True,
@@ -1474,6 +1485,7 @@ class Layout(pro.PyLayers):
         col8 : ground height  
 
         """
+        self._clearcachekey()
         fileres = pyu.getlong(_fileres, os.path.join('struc', 'res'))
         D  = np.fromfile(fileres,dtype='int',sep=' ')
         self.typ = 'outdoor'
@@ -1581,6 +1593,7 @@ class Layout(pro.PyLayers):
         pylayers.gis.osmparser.osmparse
 
         """
+        self._clearcachekey()
 
         self._fileosm = kwargs.pop('fileosm','')
         cart = kwargs.pop('cart',False)
@@ -2161,6 +2174,7 @@ class Layout(pro.PyLayers):
 
 
         """
+        self._clearcachekey()
 
         # di : dictionnary which reflects the content of ini file
         di = {}
@@ -2608,6 +2622,7 @@ class Layout(pro.PyLayers):
 
 
         """
+        self._clearcachekey()
         # next free node
         if len(self.Gs.node)>0:
             num = -( -min(self.Gs.node) + 1 )
@@ -2734,6 +2749,7 @@ class Layout(pro.PyLayers):
         If a segment is _AIR it cannnot be duplicated
 
         """
+        self._clearcachekey()
 
         # if 2 points are selected
 
@@ -2860,6 +2876,7 @@ class Layout(pro.PyLayers):
             segment 2 (the smaller) index
 
         """
+        self._clearcachekey()
         # get height/slabname information from segment n1
         zn1 = self.Gs.node[n1]['z']
         namen1 = self.Gs.node[n1]['name']
@@ -3172,6 +3189,7 @@ class Layout(pro.PyLayers):
             node list
 
         """
+        self._clearcachekey()
 
         # test if array
         if (type(lp) == np.ndarray):
@@ -3222,6 +3240,7 @@ class Layout(pro.PyLayers):
         100% of time is in g2npy
 
         """
+        self._clearcachekey()
         if (type(le) == np.ndarray):
             le = list(le)
 
@@ -3387,6 +3406,7 @@ class Layout(pro.PyLayers):
      loa   vec :
 
         """
+        self._clearcachekey()
         for k in self.Gs.pos:
             pt = self.Gs.pos[k]
             self.Gs.pos[k] = (pt[0] + vec[0], pt[1] + vec[1])
@@ -3401,6 +3421,7 @@ class Layout(pro.PyLayers):
             (degrees)
 
         """
+        self._clearcachekey()
 
         a = angle * np.pi / 180
 
@@ -3458,6 +3479,7 @@ class Layout(pro.PyLayers):
         1. Remove nodes which are not connected
         2. Remove supperimposed segments
         """
+        self._clearcachekey()
         lk = list(self.Gs.node.keys())
         for n in lk:
             if ((n < 0) & (self.Gs.degree(n) == 0)):
@@ -3542,6 +3564,7 @@ class Layout(pro.PyLayers):
             + ss_z : list of subsegment e.q. [(min height (meters),max height (meters))]
             + ss_offset : list of offset in [0,1]
         """
+        self._clearcachekey()
 
         if data == {}:
             pass
@@ -3970,24 +3993,20 @@ class Layout(pro.PyLayers):
         # warning : seglist contains the segment number in tahe not in Gs
         #
 
-        seglist  = np.unique(self.seginframe2(p1[0:2], p2[0:2])).astype(int)
-        #seglist  = np.unique(self.seginframe(p1[0:2], p2[0:2]))
-
-        upos = np.nonzero(seglist >= 0)[0]
-        uneg = np.nonzero(seglist < 0)[0]
-
-
-        # nNLOS = len(uneg) + 1
-        # # retrieve the number of segments per link
-        # if nNLOS > 1:
-        #     llink = np.hstack(
-        #         (uneg[0], np.hstack((uneg[1:], array([len(seglist)]))) - uneg - 1))
-        # else:
-        #     llink = np.array([len(seglist)])
-        # [(link id,number of seg),...]
-        # nl = zip(np.arange(nlink),llink)n
-
-        seglist = seglist[upos]
+        # candidate (link, segment) pairs from the spatial index of segments
+        # only the segments whose box overlaps the box of the link are kept
+        # (as in seginframe2)
+        ulink, seglist = self.segindex.query_line(p1[0:2], p2[0:2])
+        max_x = np.maximum(p1[0, ulink], p2[0, ulink])
+        min_x = np.minimum(p1[0, ulink], p2[0, ulink])
+        max_y = np.maximum(p1[1, ulink], p2[1, ulink])
+        min_y = np.minimum(p1[1, ulink], p2[1, ulink])
+        binframe = ((self.max_sx[seglist] > min_x) &
+                    (self.min_sx[seglist] < max_x) &
+                    (self.max_sy[seglist] > min_y) &
+                    (self.min_sy[seglist] < max_y))
+        ulink = ulink[binframe]
+        seglist = seglist[binframe]
 
         npta = self.tahe[0, seglist]
         nphe = self.tahe[1, seglist]
@@ -3997,10 +4016,11 @@ class Layout(pro.PyLayers):
 
         Nscreen = len(npta)
         # get segment height bounds
+        useg, iseg = np.unique(seglist, return_inverse=True)
         zmin = np.array([self.Gs.node[x]['z'][0]
-                         for x in self.tsg[seglist]])
+                         for x in self.tsg[useg]]).reshape(-1)[iseg]
         zmax = np.array([self.Gs.node[x]['z'][1]
-                         for x in self.tsg[seglist]])
+                         for x in self.tsg[useg]]).reshape(-1)[iseg]
         # centroid of the screen
         Pg = np.vstack(((Phe + Pta) / 2., (zmax + zmin) / 2.))
         Ptahe = Phe - Pta
@@ -4010,30 +4030,31 @@ class Layout(pro.PyLayers):
         L2 = zmax - zmin
         U2 = np.array([0, 0, 1])[:, None]  # 3 x 1  U2 is along z
         #
-        # p1 : 3 x Ng
-        # p2 : 3 x Ng
-        # Pg : 3 x Nscreen
-        # U1 : 3 x Nscreen
+        # p1[:,ulink] : 3 x Npair
+        # p2[:,ulink] : 3 x Npair
+        # Pg : 3 x Npair
+        # U1 : 3 x Npair
         # U2 : 3 x 1
-        # L1 : ,Nscreen
-        # L2 : ,Nscreen
+        # L1 : ,Npair
+        # L2 : ,Npair
 
-        bo, pt = geu.intersect3(p1, p2, Pg, U1, U2, L1, L2)
-        ubo = np.where(bo)
+        bo, pt = geu.intersect3(p1[:, ulink], p2[:, ulink], Pg, U1, U2, L1, L2,
+                                pairwise=True)
+        ubo = np.where(bo)[0]
 
-        Nseg = len(ubo[0])
+        Nseg = len(ubo)
         data = np.zeros(Nseg, dtype=[('i', 'i8'), ('s', 'i8'), ('a', np.float32)])
 
-        data['i'] = ubo[0]
-        data['s'] = self.tsg[seglist[ubo[1]]]
+        data['i'] = ulink[ubo]
+        data['s'] = self.tsg[seglist[ubo]]
 
         #
         # Calculate angle of incidence refered from segment normal
         #
 
-        norm = self.normal[:, seglist[ubo[1]]]
+        norm = self.normal[:, seglist[ubo]]
         # vector along the link
-        uu = un[:, ubo[0]]
+        uu = un[:, ulink[ubo]]
         unn = abs(np.sum(uu * norm, axis=0))
         angle = np.arccos(unn)
 
@@ -4403,6 +4424,9 @@ class Layout(pro.PyLayers):
             `max_sx`
             `min_sy`
             `max_sy`
+        + segindex : spatial index of the segments (tahe index)
+        + ptindex : spatial index of the points (pt index)
+
         Used in seginframe
 
         """
@@ -4422,6 +4446,12 @@ class Layout(pro.PyLayers):
         #self.max_sy = np.array([ np.maximum(pt[1, x[0]], pt[1, x[1]]) for x in th ])
         #self.min_sy = np.array([ np.minnimum(pt[1, x[0]], pt[1, x[1]]) for x in th ])
 
+        # spatial indexes used to prune the segments and points
+        # candidates of geometrical queries
+        self.segindex = geu.BoxIndex(np.vstack((self.min_sx, self.min_sy)),
+                                     np.vstack((self.max_sx, self.max_sy)))
+        self.ptindex = geu.BoxIndex(pt, pt)
+
     def seginframe2(self, p1, p2):
         """ returns the seg list of a given zone defined by two points
         (vectorised version)
@@ -4492,19 +4522,25 @@ class Layout(pro.PyLayers):
         max_y = np.maximum(p1[1,:],p2[1,:])
         min_y = np.minimum(p1[1,:],p2[1,:])
 
-        seglist = [ np.nonzero((self.max_sx > x[0]) &
-                               (self.min_sx < x[1]) &
-                               (self.max_sy > x[2]) &
-                               (self.min_sy < x[3]))[0]
-                   for x in zip(min_x, max_x, min_y, max_y) ]
+        # candidates from the spatial index of segments
+        ulink, useg = self.segindex.query(np.vstack((min_x, min_y)),
+                                          np.vstack((max_x, max_y)))
+        binframe = ((self.max_sx[useg] > min_x[ulink]) &
+                    (self.min_sx[useg] < max_x[ulink]) &
+                    (self.max_sy[useg] > min_y[ulink]) &
+                    (self.min_sy[useg] < max_y[ulink]))
+        ulink = ulink[binframe]
+        useg = useg[binframe]
 
         # np.array stacking
         # -1 acts as a deliminiter (not as a segment number)
-
-        # seglist = reduce(lambda x, y: np.hstack((x, array([-1]), y)), seglist)
-        x = np.array([]).astype(int)
-        for y in seglist:
-            x = np.hstack((x, np.array([-1]), y))
+        Nlink = len(min_x)
+        nseg = np.bincount(ulink, minlength=Nlink)
+        udelim = np.arange(Nlink) + np.cumsum(nseg) - nseg
+        x = -np.ones(Nlink + len(useg), dtype=int)
+        bseg = np.ones(len(x), dtype=bool)
+        bseg[udelim] = False
+        x[bseg] = useg
 
         return(x)
 
@@ -4682,7 +4718,15 @@ class Layout(pro.PyLayers):
         """
         I = np.array([]).reshape(3, 0)
         line = sh.LineString((p1, p2))
+        # candidates from the spatial indexes of segments and points
+        pa = np.array(p1[0:2]).reshape(2, 1)
+        pb = np.array(p2[0:2]).reshape(2, 1)
+        iseg = self.segindex.query_line(pa, pb)[1]
+        ipt = self.ptindex.query_line(pa, pb)[1]
+        lcand = set(self.tsg[iseg]) | set(self.upnt[ipt])
         for seg in self.Gs.nodes():
+            if seg not in lcand:
+                continue
             if seg > 0:
                 # v1.1 ta, he = self.Gs.neighbors(seg)
                 ta, he = self.Gs[seg] 
@@ -5485,7 +5529,7 @@ class Layout(pro.PyLayers):
 
         return fig, ax
 
-    def build(self, graph='tvirw',verbose=False,difftol=0.15,multi=False):
+    def build(self, graph='tvirw',verbose=False,difftol=0.15,multi=False,cache=True,incremental=True):
         """ build graphs
 
         Parameters
@@ -5501,6 +5545,13 @@ class Layout(pro.PyLayers):
         difftol : diffraction tolerance
         multi : boolean
             enable multi processing
+        cache : boolean
+            if True (default) the graphs are read from the layout cache
+            when it exists and the cache is written after the build
+        incremental : boolean
+            if True (default) and the layout has already been built, the
+            outputs of the Gi edges which are not affected by the
+            modifications of the layout are reused (see outputGi)
 
         Notes
         -----
@@ -5509,14 +5560,31 @@ class Layout(pro.PyLayers):
 
         Warning : by default the layout is saved (dumpw) after each build
 
+        See Also
+        --------
+
+        loadcache, savecache
+
         """
         # list of built graphs
         if not self.hasboundary:
             self.boundary()
 
+        bcache = cache and ('t' in graph) and ('v' in graph) and ('i' in graph)
+        if bcache:
+            key = self.cachekey(difftol=difftol)
+            if self.loadcache(key=key):
+                return
+
         # to save graoh Gs
         self.lbltg.extend('s')
 
+        # graphs of the previous build (see outputGi)
+        ref = None
+        if (incremental and ('i' in graph) and self.isbuilt
+            and ('Gicsr' in self.__dict__)):
+            ref = (self.Gi, self.Gicsr, self.Gt)
+
         Buildpbar = pbar(verbose,total=5,desc='Build Layout',position=0)
 
         if verbose:
@@ -5534,9 +5602,9 @@ class Layout(pro.PyLayers):
         if 'i' in graph:
             self.buildGi(verbose=verbose, tqdmpos=1)
             if not multi:
-                self.outputGi(verbose=verbose,tqdmpos=1)
+                self.outputGi(verbose=verbose,tqdmpos=1,ref=ref)
             else:
-                self.outputGi_mp()
+                self.outputGi_mp(verbose=verbose,tqdmpos=1,ref=ref)
             self.lbltg.extend('i')
         if verbose:
             Buildpbar.update(1)
@@ -5560,6 +5628,8 @@ class Layout(pro.PyLayers):
 
         # There is a dumpw after each build
         self.dumpw()
+        if bcache:
+            self.savecache(difftol=difftol, key=key)
         self.isbuilt = True
         if verbose:
             Buildpbar.update(1)
@@ -5678,6 +5748,9 @@ class Layout(pro.PyLayers):
             else :
                 self.lnss=[]
 
+        if ('i' in graphs) and hasattr(self,'Gi'):
+            self.Gi2csr()
+
         filedca = os.path.join(path, 'dca.gpickle')
         if os.path.isfile(filedca):
             dca = read_gpickle(filedca)
@@ -5687,6 +5760,227 @@ class Layout(pro.PyLayers):
         if os.path.isfile(filem):
             setattr(self, 'm', read_gpickle(filem))
 
+    def __getattr__(self, name):
+        """ lazy loading of the graphs stored in the layout cache
+
+        Gv and Gi are only read from the cache file at their first access
+        (see loadcache)
+
+        """
+        lazy = self.__dict__.get('_lazyG',{})
+        if name in lazy:
+            filecache = lazy.pop(name)
+            with h5py.File(filecache,'r') as f:
+                G = pickle.loads(f['graphs'][name][()].tobytes())
+            setattr(self, name, G)
+            return G
+        raise AttributeError("'Layout' object has no attribute '" + name + "'")
+
+    def _cachepath(self):
+        """ get the directory of the layout cache files
+        """
+        if os.path.splitext(self._filename)[1]=='.ini':
+            dirname = self._filename.replace('.ini','')
+        if os.path.splitext(self._filename)[1]=='.lay':
+            dirname = self._filename.replace('.lay','')
+        return os.path.join(pro.basename, 'struc', 'gpickle', dirname)
+
+    def cachekey(self, difftol=0.15):
+        """ content key of the layout graphs cache
+
+        Parameters
+        ----------
+
+        difftol : float
+            diffraction tolerance (see build)
+
+        Returns
+        -------
+
+        key : string
+            md5 hexdigest
+
+        Notes
+        -----
+
+        The key is computed from the layout as it is in memory : points
+        and segments (number, extremities, name, z, offset, transition,
+        iso segments and sub-segments ss_name, ss_z, ss_offset), the
+        slab and material files, the layout type and the diffraction
+        tolerance. Boundary points and _AIR segments are excluded as
+        they are created by the build itself, so that the key of a
+        layout is the same before and after its build.
+        Any edition of the layout changes the key, which invalidates
+        the cache.
+
+        The key is memoized per difftol. The methods which modify the
+        layout (g2npy, add_*, del_*, edit_seg, load, ...) forget it
+        with _clearcachekey, a direct edition of Gs must be followed by
+        g2npy.
+
+        """
+        dkey = self.__dict__.setdefault('_cachekeys', {})
+        if difftol in dkey:
+            return dkey[difftol]
+        h = hashlib.md5()
+        h.update(('pylayers-cache-1' + self.typ +
+                  repr(float(difftol))).encode())
+        lseg = sorted([x for x in self.Gs.node if x > 0
+                       and self.Gs.node[x]['name'] != '_AIR'])
+        lpt = set([])
+        for s in lseg:
+            d = self.Gs.node[s]
+            n1, n2 = d['connect']
+            lpt.update([n1, n2])
+            st = repr((s, n1, n2, d['name'],
+                       tuple([float(x) for x in d['z']]),
+                       float(d.get('offset', 0)),
+                       bool(d.get('transition', False)),
+                       tuple(sorted(d.get('iso', []))),
+                       tuple(d.get('ss_name', [])),
+                       tuple([float(x) for x in np.ravel(d.get('ss_z', []))]),
+                       tuple([float(x) for x in d.get('ss_offset', [])])))
+            h.update(st.encode())
+        for p in sorted(lpt):
+            h.update(repr((p, tuple([float(x) for x in self.Gs.pos[p]]))).encode())
+        for fileini, dirini in [(self._fileslabini, 'DIRSLAB'),
+                                (self._filematini, 'DIRMAT')]:
+            try:
+                fd = open(pyu.getlong(fileini, pro.pstruc[dirini]), 'rb')
+                h.update(fd.read())
+                fd.close()
+            except (IOError, OSError):
+                h.update(fileini.encode())
+        dkey[difftol] = h.hexdigest()
+        return dkey[difftol]
+
+    def _clearcachekey(self):
+        """ forget the memoized cachekey of the modified layout
+        """
+        self._cachekeys = {}
+
+    def savecache(self, difftol=0.15, key=''):
+        """ save the layout graphs in a content addressed cache file
+
+        Parameters
+        ----------
+
+        difftol : float
+            diffraction tolerance used for the build
+        key : string
+            cache key, computed from the layout if not given
+
+        Notes
+        -----
+
+        The cache file is an hdf5 file $BASENAME/struc/gpickle/<layout>/<key>.h5
+
+        + graphs : Gs, Gt, Gv, Gi and the build dictionnaries
+                   (ddiff, lnss, dca) as binary pickle blobs
+        + Gicsr : the arrays of Gi2csr, interactions in lint are stored
+                  as a (Ni x 3) array padded with zeros
+
+        See Also
+        --------
+
+        loadcache, cachekey
+
+        """
+        if key == '':
+            key = self.cachekey(difftol=difftol)
+        path = self._cachepath()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        if not hasattr(self, 'Gicsr'):
+            self.Gi2csr()
+        filecache = os.path.join(path, key + '.h5')
+        # write in a temporary file first, a cache file is either complete
+        # or absent
+        filetmp = filecache + '.tmp' + str(os.getpid())
+        with h5py.File(filetmp, 'w') as f:
+            f.attrs['difftol'] = difftol
+            f.attrs['typ'] = self.typ
+            gg = f.create_group('graphs')
+            for g in ['Gs', 'Gt', 'Gv', 'Gi', 'ddiff', 'lnss', 'dca']:
+                if hasattr(self, g):
+                    blob = pickle.dumps(getattr(self, g), pickle.HIGHEST_PROTOCOL)
+                    gg.create_dataset(g, data=np.void(blob))
+            gc = f.create_group('Gicsr')
+            lint = np.zeros((len(self.Gicsr['lint']), 3), dtype=int)
+            for u, k in enumerate(self.Gicsr['lint']):
+                lint[u, :len(k)] = k
+            gc.create_dataset('lint', data=lint)
+            for k in ['nstr', 'typ', 'air', 'tahe', 'axS', 'axv',
+                      'indptr', 'indices', 'optr', 'oedge']:
+                gc.create_dataset(k, data=self.Gicsr[k])
+        os.rename(filetmp, filecache)
+
+    def loadcache(self, difftol=0.15, key=''):
+        """ load the layout graphs from the cache file if it exists
+
+        Parameters
+        ----------
+
+        difftol : float
+            diffraction tolerance
+        key : string
+            cache key, computed from the layout if not given
+
+        Returns
+        -------
+
+        boolean : True if the graphs have been loaded from the cache
+
+        Notes
+        -----
+
+        Gs, Gt and the arrays of Gicsr are read immediately. Gv and Gi
+        are read at their first access. Signatures.run only needs Gicsr.
+
+        """
+        if key == '':
+            key = self.cachekey(difftol=difftol)
+        filecache = os.path.join(self._cachepath(), key + '.h5')
+        if not os.path.isfile(filecache):
+            return False
+        try:
+            with h5py.File(filecache, 'r') as f:
+                gg = f['graphs']
+                lg = list(gg.keys())
+                for g in ['Gs', 'Gt', 'ddiff', 'lnss', 'dca']:
+                    if g in lg:
+                        setattr(self, g, pickle.loads(gg[g][()].tobytes()))
+                Gicsr = {k: f['Gicsr'][k][()] for k in f['Gicsr']}
+        except:
+            logger.warning('unable to read layout cache file %s', filecache)
+            return False
+
+        self.__dict__.pop('Gv', None)
+        self.__dict__.pop('Gi', None)
+        self._lazyG = {g: filecache for g in ['Gv', 'Gi'] if g in lg}
+
+        typ = Gicsr['typ']
+        lint = [tuple(k[:typ[u]]) for u, k in enumerate(Gicsr['lint'].tolist())]
+        Gicsr['lint'] = lint
+        Gicsr['dint'] = {k: u for u, k in enumerate(lint)}
+        for k in ['typ', 'air', 'tahe', 'axS', 'axv',
+                  'indptr', 'indices', 'optr', 'oedge']:
+            Gicsr['l' + k] = Gicsr[k].tolist()
+        self.Gicsr = Gicsr
+
+        # as in dumpr
+        lseg = [x for x in self.Gs.node if x > 0]
+        for name in self.name:
+            self.name[name] = [
+                x for x in lseg if self.Gs.node[x]['name'] == name]
+        self.g2npy()
+        self.hasboundary = True
+        for g in 'stvi':
+            if g not in self.lbltg:
+                self.lbltg.append(g)
+        self.isbuilt = True
+        return True
+
     def polysh2geu(self, poly):
         """ transform sh.Polygon into geu.Polygon
         """
@@ -7568,13 +7862,22 @@ class Layout(pro.PyLayers):
 
 
 
-    def outputGi(self,verbose=False,tqdmpos=0.):
+    def outputGi(self,verbose=False,tqdmpos=0.,nproc=1,ref=None):
         """ filter output of Gi edges
 
         Parameters
         ----------
 
-        L : Layout
+        verbose : boolean
+        tqdmpos : int
+            position of the progress bar
+        nproc : int
+            number of processes (default 1)
+        ref : tuple (Gi,Gicsr,Gt) | None
+            Gi graph, its integer indexed form and Gt graph of a previous
+            build. The output of an edge of ref is reused when the geometry
+            of its interactions, and the successors and geometry of
+            the successors of its central interaction have not changed.
 
         Notes
         -----
@@ -7585,11 +7888,16 @@ class Layout(pro.PyLayers):
         The feasible outputs from nstr0 to nstr1 are stored in an output field of
         edge (nstr0,nstr1)
 
+        The edges are processed by central interaction nstr1. The
+        candidate successors of nstr1 are gathered once and tested against
+        the cones of all the incoming edges at once (outputGi_i1).
+
         See Also
         --------
 
+        outputGi_i1
         pylayers.util.cone.Cone.from2seg
-        pylayers.util.cone.Cone.belong_seg
+        pylayers.util.cone.belong_seg_cones
 
 
         """
@@ -7597,187 +7905,124 @@ class Layout(pro.PyLayers):
 
         assert('Gi' in self.__dict__)
 
-        oGipbar=pbar(verbose,total=100.,leave=False,desc='OutputGi',position=tqdmpos)
-        # loop over all edges of Gi
-        Nedges = len(self.Gi.edges())
-        cpt = 100./Nedges
-        # print "Gi Nedges :",Nedges
-        for k, e in enumerate(self.Gi.edges()):
-
-            # if (k%100)==0:
-            # print"edge :  ",k
-            # extract  both termination interactions nodes
-            if verbose:
-                oGipbar.update(cpt)
-
-            i0 = e[0]
-            i1 = e[1]
-
-            nstr0 = i0[0]
-            nstr1 = i1[0]
-
-            # list of authorized outputs. Initialized void
-            output = []
-
-            # nstr1 : segment number of central interaction
-            if nstr1 > 0:
-                # central interaction is a segment
-                pseg1 = self.seg2pts(nstr1).reshape(2, 2).T
-                # list all potential successors of interaction i1
-                # v1.1 i2 = nx.neighbors(self.Gi, i1)
-                i2 = list(dict(self.Gi[i1]).keys())
-                # create a Cone object
-                cn = cone.Cone()
-                # if starting from segment
-                if nstr0 > 0:
-                    pseg0 = self.seg2pts(nstr0).reshape(2, 2).T
-                    # if nstr0 and nstr1 are connected segments
-                    # v1.1 if (len(np.intersect1d(nx.neighbors(self.Gs, nstr0), nx.neighbors(self.Gs, nstr1))) == 0):
-                    if (len(np.intersect1d(self.Gs[nstr0], self.Gs[nstr1])) == 0):
-                        # from 2 not connected segment
-                        cn.from2segs(pseg0, pseg1)
+        # segment coordinates [[xta,xhe],[yta,yhe]] and connected points
+        lseg = np.array([x for x in self.Gs.node if x > 0])
+        pth = self.seg2pts(lseg)
+        pseg = {s: pth[:, k].reshape(2, 2).T for k, s in enumerate(lseg)}
+        nbr = {s: list(dict(self.Gs[s]).keys()) for s in lseg}
+        pos = {p: np.array(self.Gs.pos[p]) for p in self.Gs.node if p < 0}
+
+        succ = {i: list(dict(self.Gi[i]).keys()) for i in self.Gi.node}
+
+        # ltask : list of (i1, [i0, ...]) edges whose output is evaluated
+        ltask = []
+        nreuse = 0
+        if ref is None:
+            for i1 in self.Gi.node:
+                li0 = list(self.Gi.predecessors(i1))
+                if len(li0) > 0:
+                    ltask.append((i1, li0))
+        else:
+            Giref, Gicsref, Gtref = ref
+            # cycles of ref are renumbered by buildGt, they are matched
+            # with the cycles of Gt having the same vertices
+            dcy = {}
+            for cy in self.Gt.node:
+                if 'polyg' in self.Gt.node[cy]:
+                    dcy[frozenset(self.Gt.node[cy]['polyg'].vnodes)] = cy
+            cymap = {0: 0}
+            for cy in Gtref.node:
+                if 'polyg' in Gtref.node[cy]:
+                    cymap[cy] = dcy.get(frozenset(Gtref.node[cy]['polyg'].vnodes))
+
+            def rename(k):
+                k = (k[0],) + tuple([cymap.get(cy) for cy in k[1:]])
+                if None in k:
+                    return None
+                return k
+
+            # successors and outputs of ref with renamed interactions
+            succref = {}
+            for i1 in Giref.node:
+                j1 = rename(i1)
+                if j1 is not None:
+                    succref[j1] = set([rename(i2) for i2 in Giref[i1]])
+            outref = {}
+            for i0, i1, d in Giref.edges(data=True):
+                e = (rename(i0), rename(i1))
+                if (None not in e) and ('output' in d):
+                    outref[e] = {rename(k): v for k, v in d['output'].items()}
+
+            # geometry of segments and points at the time of ref
+            geo = {}
+            for u, k in enumerate(Gicsref['lint']):
+                geo[k[0]] = Gicsref['tahe'][u]
+
+            dchanged = {}
+            def changed(n):
+                if n not in dchanged:
+                    if n > 0:
+                        g = np.array([self.Gs.pos[p] for p in nbr[n]])
                     else:
-                        # from 2 connected segments
-                        cn.from2csegs(pseg0, pseg1)
-                # if starting from a point
-                else:
-                    pt = np.array(self.Gs.pos[nstr0])
-                    cn.fromptseg(pt, pseg1)
-                    #
-
-                ipoints = [x for x in i2 if len(x)==1 ]
-                # i0      i1     i2[x]
-                # Avoid to have the same diffaction point after reflection 
-                # exemple :  (-10,),(245,12),(-10,) impossible 
-                #                                 nstr0  nstr1 
-                if nstr0<0: 
-                    ipoints = [x for x in ipoints if x[0]!=nstr0] 
-                #ipoints = filter(lambda x: len(x) == 1, i2)
-                pipoints = np.array([self.Gs.pos[ip[0]] for ip in ipoints]).T
-                # filter tuple (R | T)
-                #istup = filter(lambda x : type(eval(x))==tuple,i2)
-                # map first argument segment number
-                #isegments = np.unique(map(lambda x : eval(x)[0],istup))
-                #isegments = np.unique(
-                #    filter(lambda y: y > 0, map(lambda x: x[0], i2)))
-                isegments = np.unique(np.array([ s for s in [ n[0] for n in i2]
-                                                if s >0 ] ))
-                # if nstr0 and nstr1 are adjescent segment remove nstr0 from
-                # potential next interaction
-                # Fix 01/2017
-                # This is not always True if the angle between
-                # the two adjascent segments is < pi/2
-                # v1.1 nb_nstr0 = self.Gs.neighbors(nstr0)
-                # v1.1 nb_nstr1 = self.Gs.neighbors(nstr1)
-                nb_nstr0 = self.Gs[nstr0]
-                nb_nstr1 = self.Gs[nstr1]
-                common_point = np.intersect1d(nb_nstr0,nb_nstr1)
-
-                if len(common_point) == 1:
-                    num0 = [x for x in nb_nstr0 if x != common_point]
-                    num1 = [x for x in nb_nstr1 if x != common_point]
-                    p0 = np.array(self.Gs.pos[num0[0]])
-                    p1 = np.array(self.Gs.pos[num1[0]])
-                    pc = np.array(self.Gs.pos[common_point[0]])
-                    v0 = p0 - pc
-                    v1 = p1 - pc
-                    v0n = v0/np.sqrt(np.sum(v0*v0))
-                    v1n = v1/np.sqrt(np.sum(v1*v1))
-                    if np.dot(v0n,v1n)<=0:
-                        isegments = np.array([ x for x in isegments if x != nstr0 ])
-                    #    filter(lambda x: x != nstr0, isegments))
-                # there are one or more segments
-                if len(isegments) > 0:
-                    points = self.seg2pts(isegments)
-                    pta = points[0:2, :]
-                    phe = points[2:, :]
-                    # add difraction points
-                    # WARNING Diffraction points are added only if a segment is seen
-                    # it should be the case in 99% of cases
-
-                    if len(ipoints) > 0:
-                        isegments = np.hstack((isegments, np.array(ipoints)[:, 0]))
-                        pta = np.hstack((pta, pipoints))
-                        phe = np.hstack((phe, pipoints))
-
-                    # cn.show()
-
-                    # if i0 == (38,79) and i1 == (135,79,23):
-                    #     printi0,i1
-                    #     import ipdb
-                    #     ipdb.set_trace()
-                    # i1 : interaction T
-                    if len(i1) == 3:
-                        #if ((e[0]==(53,17)) and (e[1]==(108,17,18))):
-                        #    typ, prob = cn.belong_seg(pta, phe,visu=True)
-                        #else:
-                        typ, prob = cn.belong_seg(pta, phe)
-                        # if bs.any():
-                        #    plu.displot(pta[:,bs],phe[:,bs],color='g')
-                        # if ~bs.any():
-                        #    plu.displot(pta[:,~bs],phe[:,~bs],color='k')
-
-                    # i1 : interaction R --> mirror
-                    if len(i1) == 2:
-                        Mpta = geu.mirror(pta, pseg1[:, 0], pseg1[:, 1])
-                        Mphe = geu.mirror(phe, pseg1[:, 0], pseg1[:, 1])
-                        typ, prob = cn.belong_seg(Mpta, Mphe)
-                        # printi0,i1
-                        # if ((i0 == (6, 0)) & (i1 == (7, 0))):
-                        #    pdb.set_trace()
-                        # if bs.any():
-                        #    plu.displot(pta[:,bs],phe[:,bs],color='g')
-                        # if ~bs.any():
-                        #    plu.displot(pta[:,~bs],phe[:,~bs],color='m')
-                        #    plt.show()
-                        #    pdb.set_trace())
-                    ########
-                    # SOMETIMES PROBA IS 0 WHEReAS SEG IS SEEN
-                    ###########
-                    # # keep segment with prob above a threshold
-                    # isegkeep = isegments[prob>0]
-                    # # dict   {numint : proba}
-                    # dsegprob = {k:v for k,v in zip(isegkeep,prob[prob>0])}
-                    # 4 lines are replaced by
-                    # keep segment with prob above a threshold
-                    utypseg = typ != 0
-                    isegkeep = isegments[utypseg]
-                    # dict   {numint : proba}
-                    dsegprob = {k: v for k, v in zip(isegkeep, prob[utypseg])}
-                    #########
-                    # output = filter(lambda x: x[0] in isegkeep, i2)
-                    output = [x for x in i2 if x[0] in isegkeep]
-                    # probint = map(lambda x: dsegprob[x[0]], output)
-                    probint = [dsegprob[x[0]] for x in output]
-                    # dict interaction : proba
-                    dintprob = {k: v for k, v in zip(output, probint)}
+                        g = np.array([pos[n], pos[n]])
+                    gref = geo.get(n)
+                    dchanged[n] = not ((gref is not None) and
+                                       (np.array_equal(g, gref) or
+                                        np.array_equal(g, gref[::-1])))
+                return dchanged[n]
+
+            for i1 in self.Gi.node:
+                li0 = list(self.Gi.predecessors(i1))
+                if len(li0) == 0:
+                    continue
+                # the outputs of i1 can only change if i1 sees a modified
+                # segment or point
+                bsame = ((not changed(i1[0])) and
+                         (set(succ[i1]) == succref.get(i1)) and
+                         (not any([changed(i2[0]) for i2 in succ[i1]])))
+                lcompute = []
+                for i0 in li0:
+                    if (bsame and (not changed(i0[0])) and
+                       ((i0, i1) in outref)):
+                        self.Gi.add_edge(i0, i1, output=outref[(i0, i1)])
+                        nreuse += 1
+                    else:
+                        lcompute.append(i0)
+                if len(lcompute) > 0:
+                    ltask.append((i1, lcompute))
 
-                    # keep all segment above nstr1 and in Cone if T
-                    # keep all segment below nstr1 and in Cone if R
+        oGipbar=pbar(verbose,total=100.,leave=False,desc='OutputGi',position=tqdmpos)
+        cpt = 100./max(len(ltask), 1)
 
-            else:
-                # central interaction is a point (nstr1 <0) 
+        kw = {'succ': succ, 'pseg': pseg, 'pos': pos, 'nbr': nbr}
 
-                # 1) Simple approach
-                #       output interaction are all visible interactions
-                # 2) TO BE DONE
-                #
-                #       output of the diffraction points
-                #       exploring
-                # b
-                #          + right of ISB
-                #          + right of RSB
-                #
-                #  + using the wedge cone
-                #  + using the incident cone
-                #
+        if (nproc > 1) and (len(ltask) > 1):
+            nchunk = min(len(ltask), 4*nproc)
+            lchunk = [ltask[k::nchunk] for k in range(nchunk)]
+            pool = mp.Pool(processes=nproc,
+                           initializer=_outputGi_init,
+                           initargs=(kw,))
+            try:
+                for lres in pool.imap_unordered(_outputGi_chunk, lchunk):
+                    for i0, i1, dintprob in lres:
+                        self.Gi.add_edge(i0, i1, output=dintprob)
+                    if verbose:
+                        oGipbar.update(cpt*len(ltask)/nchunk)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for i1, li0 in ltask:
+                if verbose:
+                    oGipbar.update(cpt)
+                for i0, i1, dintprob in outputGi_i1(i1, li0, **kw):
+                    self.Gi.add_edge(i0, i1, output=dintprob)
 
-                # v1.1 output = nx.neighbors(self.Gi, (nstr1,))
-                output = self.Gi[(nstr1,)]
-                nout = len(output)
-                probint = np.ones(nout)  # temporarybns
-                dintprob = {k: v for k, v in zip(output, probint)}
-            self.Gi.add_edge(i0, i1, output=dintprob)
+        if ref is not None:
+            logger.info('outputGi : %d edges reused, %d edges evaluated',
+                        nreuse, sum([len(t[1]) for t in ltask]))
+        # integer indexed form of Gi used by the signature exploration
+        self.Gi2csr()
 
 
     def outputGi_new(self,verbose=False,tqdmpos=0.):
@@ -8045,281 +8290,124 @@ class Layout(pro.PyLayers):
                 self.Gi.add_edge(i0, i1, output=dintprob)
             except:
                 pass
+        self.Gi2csr()
 
 
-    def outputGi_mp(self):
-        """ filter output of Gi edges
+    def outputGi_mp(self,verbose=False,tqdmpos=0.,ref=None):
+        """ filter output of Gi edges using all the cpus
 
-        Parameters
-        ----------
+        See Also
+        --------
 
-        L : Layout
+        outputGi
+
+        """
+        self.outputGi(verbose=verbose,tqdmpos=tqdmpos,
+                      nproc=mp.cpu_count(),ref=ref)
+
+    def Gi2csr(self):
+        """ export Gi in an integer indexed compressed sparse row form
 
         Notes
         -----
 
-        Let assume a sequence (nstr0,nstr1,{nstr2A,nstr2B,...}) in a signature.
-        This function checks whether this sequence is feasible or not
-        , whatever the type of nstr0 and nstr1.
-        The feasible outputs from nstr0 to nstr1 are stored in an output field of
-        edge (nstr0,nstr1)
+        This function updates the dictionnary self.Gicsr
+
+        + lint    : list of interactions (tuple) indexed by interaction id
+        + dint    : dict interaction (tuple) -> interaction id
+        + nstr    : (Ni) segment or point number of interaction
+        + typ     : (Ni) interaction type 1 : D , 2 : R , 3 : T
+        + air     : (Ni) True if the interaction is on an airwall
+        + tahe    : (Ni x 2 x 2) tail and head coordinates of the segment
+                    (diffraction point repeated twice)
+        + axS     : (Ni x 2 x 2) symmetry matrix of reflection interactions
+        + axv     : (Ni x 2) translation vector of reflection interactions
+                    (see geu.axmat)
+        + indptr  : (Ni+1) Gi successors of interaction u are the nodes
+                    indices[indptr[u]:indptr[u+1]]
+        + indices : (Ne) interaction id of the head of each Gi edge
+        + optr    : (Ne+1) the outputs of edge e are the edges
+                    oedge[optr[e]:optr[e+1]]
+        + oedge   : (No) output edges, the output interaction of an edge e2
+                    is indices[e2]
+
+        Outputs are stored as edges (not as interactions) so that a
+        traversal of Gi never needs an edge lookup.
+        The arrays from typ to oedge are also stored as lists under the
+        same key prefixed by l (ltyp, ..., loedge), these are the forms
+        read by the exploration loop.
+        The order of successors and outputs is the order of Gi.
 
         See Also
         --------
 
-        pylayers.util.cone.Cone.from2seg
-        pylayers.util.cone.Cone.belong_seg
-
+        pylayers.antprop.signature.Signatures.run
 
         """
+        lint = list(self.Gi.nodes())
+        dint = {k:u for u,k in enumerate(lint)}
+        Ni = len(lint)
 
+        lair = set(self.name.get('AIR',[]) + self.name.get('_AIR',[]))
 
-        # assert('Gi' in self.__dict__)
+        nstr = np.array([k[0] for k in lint],dtype=int)
+        typ = np.array([len(k) for k in lint],dtype=int)
+        air = np.array([k[0] in lair for k in lint],dtype=bool)
 
-        # oGipbar=pbar(verbose,total=100.,leave=False,desc='OutputGi',position=tqdmpos)
-        # # loop over all edges of Gi
-        # Nedges = len(self.Gi.edges())
-        # cpt = 100./Nedges
-        # print "Gi Nedges :",Nedges
-        e = self.Gi.edges()
-        #Gi_no = [self.Gi_no]*len(e)
-
-        # densify sparse matrix
-        #aGi_A = self.Gi_A.toarray()
-        #ap2pc = self.p2pc.toarray()
-        #asgsg = self.sgsg.toarray()
-        #as2pc = self.s2pc.toarray()
-        #as2pu = self.s2pu.toarray()
-
-        global Gi_A
-        global Gi_no
-        global p2pc
-        global sgsg
-        global s2pc
-        global s2pu
-
-        Gi_A = self.Gi_A
-        Gi_no = self.Gi_no
-        p2pc = self.p2pc
-        sgsg = self.sgsg
-        s2pc = self.s2pc
-        s2pu = self.s2pu
-
-
-        #Gi_A = [aGi_A]*len(e)
-        #p2pc = [ap2pc]*len(e)
-        #s2pc = [as2pc]*len(e)
-        #s2pu = [as2pu]*len(e)
-        #sgsg = [asgsg]*len(e)
-
-        pool = Pool(cpu_count())
-
-        # multiprocessing style
-        #Z=zip(e, Gi_no, Gi_A, p2pc, sgsg, s2pc, s2pu)
-        #res = pool.map(outputGi_func,Z)
-        Z = zip(e)
-        res = pool.map(outputGi_func,Z)
-        self.Gi.add_edges_from(res)
-
-
-
-
-        # res = pool.map(outputGi_func_test,e)
-        # print('e')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,Gi_no)
-        # print('no')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,Gi_A)
-        # print('A')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,Gspos)
-        # print('pos')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,sgsg)
-        # print('sgsg')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,s2pc)
-        # print('s2pc')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,s2pu)
-        # print('s2pu')
-        # time.sleep(1)
-        # res = pool.map(outputGi_func_test,Z)
-        # print('Z')
-        
-
-
-
-    #def outputGi_func(arg):
-           
-        # if (k%100)==0:
-        # print"edge :  ",k
-        # extract  both termination interactions nodes
-
-        #for k in arg:
-        #    Z=arg*arg
-        # e=arg[0]
-        # s2pc=arg[1]
-        # Gs=arg[2]
-        # Gi=arg[3]
-
-        # i0 = e[0]
-        # i1 = e[1]
-        # nstr0 = i0[0]
-        # nstr1 = i1[0]
-        # print(i0,i1)
-
-        # for k in range(1000):
-        #     y=k*k
-        # # list of authorized outputs. Initialized void
-        # output = []
-        # # nstr1 : segment number of central interaction
-        # if nstr1 > 0:
-        #     # central interaction is a segment
-        #     pseg1 = np.array(s2pc[nstr1,:].todense()).reshape(2, 2).T
-        #     # create a Cone object
-        #     cn = cone.Cone()
-        #     # if starting from segment
-        #     if nstr0 > 0:
-        #         pseg0 = np.array(s2pc[nstr0,:].todense()).reshape(2, 2).T
-        #         # if nstr0 and nstr1 are connected segments
-        #         if (len(np.intersect1d(nx.neighbors(Gs, nstr0), nx.neighbors(Gs, nstr1))) == 0):
-        #             # from 2 not connected segment
-        #             cn.from2segs(pseg0, pseg1)
-        #         else:
-        #             # from 2 connected segments
-        #             cn.from2csegs(pseg0, pseg1)
-        #     # if starting from a point
-        #     else:
-        #         pt = np.array(Gs.pos[nstr0])
-        #         cn.fromptseg(pt, pseg1)
-
-        #     # list all potential successors of interaction i1
-        #     i2 = nx.neighbors(Gi, i1)
-        #     ipoints = [x for x in i2 if len(x)==1 ]
-        #     #ipoints = [ x for x in rle if  len(x) == 1, i2)
-        #     pipoints = np.array([Gs.pos[ip[0]] for ip in ipoints]).T
-        #     # filter tuple (R | T)
-        #     #istup = filter(lambda x : type(eval(x))==tuple,i2)
-        #     # map first argument segment number
-        #     #isegments = np.unique(map(lambda x : eval(x)[0],istup))
-        #     isegments = np.unique(
-        #         filter(lambda y: y > 0, map(lambda x: x[0], i2)))
-        #     # if nstr0 and nstr1 are adjescent segment remove nstr0 from
-        #     # potential next interaction
-        #     # Fix 01/2017
-        #     # This is not always True if the angle between 
-        #     # the two adjascent segments is < pi/2
-        #     nb_nstr0 = Gs.neighbors(nstr0)
-        #     nb_nstr1 = Gs.neighbors(nstr1)
-        #     common_point = np.intersect1d(nb_nstr0,nb_nstr1)
-        #     if len(common_point) == 1:
-        #         num0 = [x for x in nb_nstr0 if x != common_point]
-        #         num1 = [x for x in nb_nstr1 if x != common_point]
-        #         p0 = np.array(Gs.pos[num0[0]])
-        #         p1 = np.array(Gs.pos[num1[0]])
-        #         pc = np.array(Gs.pos[common_point[0]])
-        #         v0 = p0-pc 
-        #         v1 = p1-pc 
-        #         v0n = v0/np.sqrt(np.sum(v0*v0))
-        #         v1n = v1/np.sqrt(np.sum(v1*v1))
-        #         if np.dot(v0n,v1n)<=0:
-        #             isegments = np.array([ x for x in isegments if x != nstr0 ]) 
-        #         #    [ x for x in rle if  x != nstr0, isegments))
-        #     # there are one or more segments
-        #     if len(isegments) > 0:
-        #         points = np.array(s2pc[isegments,:].todense()).T
-        #         pta = points[0:2, :]
-        #         phe = points[2:, :]
-        #         # add difraction points
-        #         # WARNING Diffraction points are added only if a segment is seen
-        #         # it should be the case in 99% of cases
-
-        #         if len(ipoints) > 0:
-        #             isegments = np.hstack(
-        #                 (isegments, np.array(ipoints)[:, 0]))
-        #             pta = np.hstack((pta, pipoints))
-        #             phe = np.hstack((phe, pipoints))
-
-        #         # cn.show()
-
-        #         # if i0 == (38,79) and i1 == (135,79,23):
-        #         #     printi0,i1
-        #         #     import ipdb
-        #         #     ipdb.set_trace()
-        #         # i1 : interaction T
-        #         if len(i1) == 3:
-        #             typ, prob = cn.belong_seg(pta, phe)
-        #             # if bs.any():
-        #             #    plu.displot(pta[:,bs],phe[:,bs],color='g')
-        #             # if ~bs.any():
-        #             #    plu.displot(pta[:,~bs],phe[:,~bs],color='k')
-
-        #         # i1 : interaction R --> mirror
-        #         if len(i1) == 2:
-        #             Mpta = geu.mirror(pta, pseg1[:, 0], pseg1[:, 1])
-        #             Mphe = geu.mirror(phe, pseg1[:, 0], pseg1[:, 1])
-        #             typ, prob = cn.belong_seg(Mpta, Mphe)
-        #             # printi0,i1
-        #             # if ((i0 == (6, 0)) & (i1 == (7, 0))):
-        #             #    pdb.set_trace()
-        #             # if bs.any():
-        #             #    plu.displot(pta[:,bs],phe[:,bs],color='g')
-        #             # if ~bs.any():
-        #             #    plu.displot(pta[:,~bs],phe[:,~bs],color='m')
-        #             #    plt.show()
-        #             #    pdb.set_trace())
-        #         ########
-        #         # SOMETIMES PROBA IS 0 WHEREAS SEG IS SEEN
-        #         ###########
-        #         # # keep segment with prob above a threshold
-        #         # isegkeep = isegments[prob>0]
-        #         # # dict   {numint : proba}
-        #         # dsegprob = {k:v for k,v in zip(isegkeep,prob[prob>0])}
-        #         # 4 lines are replaced by
-        #         # keep segment with prob above a threshold
-        #         utypseg = typ != 0
-        #         isegkeep = isegments[utypseg]
-        #         # dict   {numint : proba}
-        #         dsegprob = {k: v for k, v in zip(isegkeep, prob[utypseg])}
-        #         #########
-        #         # output = [ x for x in rle if  x[0] in isegkeep, i2)
-        #         output = [x for x in i2 if x[0] in isegkeep]
-        #         # probint = map(lambda x: dsegprob[x[0]], output)
-        #         probint = [dsegprob[x[0]] for x in output]
-        #         # dict interaction : proba
-        #         dintprob = {k: v for k, v in zip(output, probint)}
-
-        #         # keep all segment above nstr1 and in Cone if T
-        #         # keep all segment below nstr1 and in Cone if R
-
-        # else:
-        #     # central interaction is a point
-
-        #     # 1) Simple approach
-        #     #       output interaction are all visible interactions
-        #     # 2) TO BE DONE
-        #     #
-        #     #       output of the diffraction points
-        #     #       exploring
-        #     # b
-        #     #          + right of ISB
-        #     #          + right of RSB
-        #     #
-        #     #  + using the wedge cone
-        #     #  + using the incident cone
-        #     #
-
-        #     output = nx.neighbors(Gi, (nstr1,))
-        #     nout = len(output)
-        #     probint = np.ones(nout)  # temporarybns
-        #     dintprob = {k: v for k, v in zip(output, probint)}
-
-        # return(i0,i1,dintprob)
-        #self.Gi.add_edge(i0, i1, output=dintprob)
-
-        
+        tahe = np.zeros((Ni,2,2))
+        for u,k in enumerate(lint):
+            if k[0] > 0:
+                pts = list(dict(self.Gs[k[0]]).keys())
+                tahe[u,0,:] = self.Gs.pos[pts[0]]
+                tahe[u,1,:] = self.Gs.pos[pts[1]]
+            else:
+                tahe[u,0,:] = self.Gs.pos[k[0]]
+                tahe[u,1,:] = self.Gs.pos[k[0]]
+
+        axS = np.zeros((Ni,2,2))
+        axv = np.zeros((Ni,2))
+        for u in np.where(typ==2)[0]:
+            axS[u],axv[u] = geu.axmat(tahe[u,0,:],tahe[u,1,:])
+
+        indptr = np.zeros(Ni+1,dtype=int)
+        indices = []
+        dedge = {}
+        for u,k in enumerate(lint):
+            for k2 in self.Gi[k]:
+                dedge[(u,dint[k2])] = len(indices)
+                indices.append(dint[k2])
+            indptr[u+1] = len(indices)
+        indices = np.array(indices,dtype=int)
+
+        optr = np.zeros(len(indices)+1,dtype=int)
+        oedge = []
+        for u,k in enumerate(lint):
+            for e in range(indptr[u],indptr[u+1]):
+                v = indices[e]
+                output = self.Gi[k][lint[v]].get('output',{})
+                for k2 in output:
+                    if k2 in dint:
+                        e2 = dedge.get((v,dint[k2]))
+                        if e2 is not None:
+                            oedge.append(e2)
+                optr[e+1] = len(oedge)
+        oedge = np.array(oedge,dtype=int)
+
+        self.Gicsr = {'lint' : lint,
+                      'dint' : dint,
+                      'nstr' : nstr,
+                      'typ' : typ,
+                      'air' : air,
+                      'tahe' : tahe,
+                      'axS' : axS,
+                      'axv' : axv,
+                      'indptr' : indptr,
+                      'indices' : indices,
+                      'optr' : optr,
+                      'oedge' : oedge}
+        for k in ['typ','air','tahe','axS','axv',
+                  'indptr','indices','optr','oedge']:
+            self.Gicsr['l'+k] = self.Gicsr[k].tolist()
 
     def intercy(self, ncy, typ='source'):
         """ return the list of interactions seen from a cycle
@@ -9244,6 +9332,96 @@ class Layout(pro.PyLayers):
         b1 = self.Gt.node[cy]['indoor']
         return b1
 
+    def _segtable(self):
+        """ coordinate table of the nodes of Gs
+
+        Returns
+        -------
+
+        off : int
+            node n of Gs is the row n+off of the table
+        pab : np.array (2,2,nn)
+            (x,y) of the tail and of the head of the segments
+            (pa = pb for points)
+        normal : np.array (2,nn)
+            unitary normal of the segments (0 for points)
+        K : np.array (2,2,nn)
+            linear part of the image through the segment line
+        v : np.array (2,nn)
+            translation part of the image through the segment line
+
+        Notes
+        -----
+
+        The image of p through segment n is K[:,:,n+off].p + v[:,n+off]
+        (formula 2.61 -> 2.64 N.AMIOT PH.D thesis).
+        Rows of unused node numbers are nan. The table is rebuilt when
+        Gs or the point array (see g2npy) has changed.
+
+        """
+        if ((not hasattr(self, '_segtab')) or
+            (self._segtab[0] is not self.Gs) or
+            (self._segtab[1] is not self.pt) or
+            (self._segtab[2] != len(self.Gs))):
+            lnode = list(self.Gs.node)
+            off = -min(lnode + [0])
+            nn = max(lnode + [0]) + off + 1
+            pab = np.nan*np.zeros((2, 2, nn))
+            normal = np.zeros((2, nn))
+            # points
+            lpt = np.array([x for x in lnode if x < 0], dtype=int)
+            if len(lpt) > 0:
+                ppt = np.array([self.Gs.pos[x] for x in lpt]).T
+                pab[:, 0, lpt+off] = ppt
+                pab[:, 1, lpt+off] = ppt
+            # segments
+            if self.Ns > 0:
+                pab[:, :, self.tsg+off] = self.pt[:, self.tahe]
+                normal[:, self.tsg+off] = self.normal[0:2]
+            x0 = pab[0, 0]
+            y0 = pab[1, 0]
+            sx = pab[0, 1] - x0
+            sy = pab[1, 1] - y0
+            den = sx**2 + sy**2
+            # points and unused nodes
+            den[~(den > 0)] = 1.
+            a = 1 - (2. / den) * sy**2
+            b = -(2. / den) * sx * sy
+            c = (2. / den) * (x0 * sy**2 - y0 * sy * sx)
+            d = (2. / den) * (y0 * sx**2 - x0 * sy * sx)
+            K = np.array([[a, -b], [-b, -a]])
+            v = np.array([c, d])
+            self._segtab = (self.Gs, self.pt, len(self.Gs),
+                            off, pab, normal, K, v)
+        return self._segtab[3:]
+
+    def _cycleindex(self):
+        """ spatial index of the cycle polygons
+
+        Returns
+        -------
+
+        lcy : np.array
+            cycle numbers (> 0)
+        cyindex : geu.BoxIndex
+            index of the bounding boxes of the cycles of lcy
+
+        Notes
+        -----
+
+        The index is rebuilt when Gt has changed.
+
+        """
+        if ((not hasattr(self, '_cyindex')) or
+            (self._cyindex[0] is not self.Gt) or
+            (self._cyindex[1] != len(self.Gt))):
+            lcy = np.array([x for x in self.Gt.node if x > 0], dtype=int)
+            bounds = np.array([self.Gt.node[x]['polyg'].bounds
+                               for x in lcy]).reshape(-1, 4).T
+            self._cyindex = (self.Gt, len(self.Gt), lcy,
+                             geu.BoxIndex(bounds[0:2], bounds[2:4]))
+        return self._cyindex[2:]
+
     def pt2cy(self, pt=np.array((0, 0))):
         """ point to cycle
 
@@ -9269,7 +9447,12 @@ class Layout(pro.PyLayers):
         ptsh = sh.Point(pt[0], pt[1])
         cycle_exists = False
 
-        for ncy in list(dict(self.Gt.node).keys()):
+        # candidate cycles from the spatial index of cycle polygons
+        lcy, cyindex = self._cycleindex()
+        pt2 = np.array(pt[0:2], dtype=float).reshape(2, 1)
+        icy = cyindex.query(pt2, pt2)[1]
+
+        for ncy in lcy[icy].tolist():
             if ncy > 0:
                 criter1 = self.Gt.node[ncy]['polyg'].touches(ptsh)
                 criter2 = self.Gt.node[ncy]['polyg'].contains(ptsh)
@@ -9466,7 +9649,7 @@ class Layout(pro.PyLayers):
                 [(dz_seg[i].append(x),dz_sl[i].append(self.Gs.node[x]['name']))
                                                                     for i in uz]
 
-        return dz_seg.values(),dz_sl.values()
+        return list(dz_seg.values()),list(dz_sl.values())
 
     def _find_diffractions(self, difftol=0.01,verbose = False,tqdmkwargs={}):
         """ find diffractions points of the Layout
@@ -11281,6 +11464,175 @@ def outputGi_func(args):
     # self.Gi.add_edge(i0, i1, output=dintprob)
 
 
+
+def outputGi_i1(i1, li0, succ, pseg, pos, nbr):
+    """ outputs of the Gi edges (i0,i1) of a central interaction i1
+
+    Parameters
+    ----------
+
+    i1 : tuple
+        central interaction
+    li0 : list
+        input interactions i0 of the evaluated edges (i0,i1)
+    succ : dict
+        successors of Gi interactions
+    pseg : dict
+        segment coordinates [[xta,xhe],[yta,yhe]]
+    pos : dict
+        point coordinates
+    nbr : dict
+        points connected to a segment
+
+    Returns
+    -------
+
+    lres : list of (i0,i1,dict output interaction : proba)
+
+    Notes
+    -----
+
+    The candidate successors of i1 (segments then diffraction points)
+    and their images through i1 when it is a reflection are
+    computed once. The cones of all edges are then tested together
+    against all the candidates with cone.belong_seg_cones and the
+    candidates which are not allowed for a given input i0 are masked.
+
+    See Also
+    --------
+
+    Layout.outputGi
+
+    """
+    nstr1 = i1[0]
+    i2 = succ[i1]
+    lres = []
+
+    if nstr1 < 0:
+        # central interaction is a point (nstr1 <0)
+
+        # 1) Simple approach
+        #       output interaction are all visible interactions
+        # 2) TO BE DONE
+        #
+        #       output of the diffraction points
+        #       exploring
+        # b
+        #          + right of ISB
+        #          + right of RSB
+        #
+        #  + using the wedge cone
+        #  + using the incident cone
+        #
+        for i0 in li0:
+            probint = np.ones(len(i2))  # temporarybns
+            dintprob = {k: v for k, v in zip(i2, probint)}
+            lres.append((i0, i1, dintprob))
+        return lres
+
+    # central interaction is a segment
+    pseg1 = pseg[nstr1]
+
+    # candidates : segments then diffraction points
+    isegments = np.unique(np.array([x[0] for x in i2 if x[0] > 0], dtype=int))
+    ipoints = np.array([x[0] for x in i2 if len(x) == 1], dtype=int)
+    Nseg = len(isegments)
+    icand = np.hstack((isegments, ipoints))
+    pta = np.zeros((2, len(icand)))
+    phe = np.zeros((2, len(icand)))
+    for k, s in enumerate(isegments):
+        pta[:, k] = pseg[s][:, 0]
+        phe[:, k] = pseg[s][:, 1]
+    for k, p in enumerate(ipoints):
+        pta[:, Nseg+k] = pos[p]
+        phe[:, Nseg+k] = pos[p]
+    # i1 : interaction R --> mirror
+    if (len(i1) == 2) and (len(icand) > 0):
+        pta = geu.mirror(pta, pseg1[:, 0], pseg1[:, 1])
+        phe = geu.mirror(phe, pseg1[:, 0], pseg1[:, 1])
+
+    lcone = []
+    lmask = []
+    for i0 in li0:
+        nstr0 = i0[0]
+        mask = np.ones(len(icand), dtype=bool)
+        # create a Cone object
+        cn = cone.Cone()
+        # if starting from segment
+        if nstr0 > 0:
+            pseg0 = pseg[nstr0]
+            common_point = [x for x in nbr[nstr0] if x in nbr[nstr1]]
+            if len(common_point) == 0:
+                # from 2 not connected segment
+                cn.from2segs(pseg0, pseg1)
+            else:
+                # from 2 connected segments
+                cn.from2csegs(pseg0, pseg1)
+            # if nstr0 and nstr1 are adjascent segment remove nstr0 from
+            # potential next interaction
+            # Fix 01/2017
+            # This is not always True if the angle between
+            # the two adjascent segments is < pi/2
+            if len(common_point) == 1:
+                pc = pos[common_point[0]]
+                num0 = [x for x in nbr[nstr0] if x != common_point[0]]
+                num1 = [x for x in nbr[nstr1] if x != common_point[0]]
+                v0 = pos[num0[0]] - pc
+                v1 = pos[num1[0]] - pc
+                v0n = v0/np.sqrt(np.sum(v0*v0))
+                v1n = v1/np.sqrt(np.sum(v1*v1))
+                if np.dot(v0n, v1n) <= 0:
+                    mask[:Nseg] = isegments != nstr0
+        # if starting from a point
+        else:
+            cn.fromptseg(pos[nstr0], pseg1)
+            # Avoid to have the same diffaction point after reflection
+            # exemple :  (-10,),(245,12),(-10,) impossible
+            mask[Nseg:] = ipoints != nstr0
+        # WARNING Diffraction points are added only if a segment is seen
+        # it should be the case in 99% of cases
+        if not mask[:Nseg].any():
+            mask[:] = False
+        lcone.append(cn)
+        lmask.append(mask)
+
+    if len(icand) > 0:
+        apex = np.array([cn.apex for cn in lcone]).T
+        u = np.array([cn.u for cn in lcone]).T
+        v = np.array([cn.v for cn in lcone]).T
+        angle = np.array([cn.angle for cn in lcone])
+        typ, prob = cone.belong_seg_cones(apex, u, v, angle, pta, phe)
+
+    for k, i0 in enumerate(li0):
+        if lmask[k].any():
+            # keep candidates seen from the cone
+            utypseg = (typ[k] != 0) & lmask[k]
+            # dict   {numint : proba}
+            dsegprob = {n: p for n, p in zip(icand[utypseg], prob[k][utypseg])}
+            output = [x for x in i2 if x[0] in dsegprob]
+            # dict interaction : proba
+            dintprob = {x: dsegprob[x[0]] for x in output}
+        else:
+            dintprob = {}
+        lres.append((i0, i1, dintprob))
+
+    return lres
+
+def _outputGi_init(kw):
+    """ initializer of the outputGi worker processes
+    """
+    global _outputGi_kw
+    _outputGi_kw = kw
+
+def _outputGi_chunk(ltask):
+    """ outputs of a chunk of (i1, li0) tasks in a worker process
+    """
+    lres = []
+    for i1, li0 in ltask:
+        lres.extend(outputGi_i1(i1, li0, **_outputGi_kw))
+    return lres
+
+
 if __name__ == "__main__":
     plt.ion()
     doctest.testmod()
@@ -0,0 +1,43 @@
+import shutil
+import tempfile
+import h5py
+from pylayers.gis.demstore import *
+
+# two adjacent synthetic tiles of a plane h = 100*lon + 10*lat + 500
+n = 121
+dirname = tempfile.mkdtemp()
+for ilon in [-2,-1]:
+    lon = ilon + np.linspace(0,1,n)[None,:]
+    lat = 48 + np.linspace(1,0,n)[:,None]
+    h = np.round(100*lon+10*lat+500).astype('>i2')
+    h[0,0] = DEMStore.void
+    h.tofile(os.path.join(dirname,tilename(ilon,48)+'.hgt'))
+    with h5py.File(os.path.join(dirname,tilename(ilon,48)+'.h5'),'w') as fh:
+        fh.create_dataset('dem/srtm/hgts',data=h.astype('i2'))
+
+lon = np.random.uniform(-2,0,1000)
+lat = np.random.uniform(48,48.98,1000)
+for fmt in ['hgt','h5']:
+    D = DEMStore(dirname=dirname,fmt=fmt,maxtiles=1)
+    hs = D.sample(lon,lat)
+    assert np.abs(hs - (100*lon+10*lat+500)).max() < 1
+    assert len(D.tiles) == 1
+    assert isinstance(D.tile(-2,48),np.memmap)
+
+# the void corner (nodata) weighs half between the first two rows
+h10 = np.round(100*(-2)+10*(48+119/120.)+500)
+assert np.allclose(D.sample(-2,49-0.5/120),0.5*h10)
+# missing tiles
+assert D.sample(-2,49) == 0
+assert D.sample(3.5,48.5) == 0
+
+# batch of profiles crossing the tile border
+pa = np.array([[-1.5,-1.2],[48.2,48.5]])
+pb = np.array([[-0.5,-1.8],[48.3,48.5]])
+height, d, lon, lat = D.profiles(pa,pb,Npt=50)
+assert height.shape == (2,50)
+assert np.allclose(height,D.sample(lon,lat))
+assert np.allclose(d[:,0],0)
+assert np.all(np.diff(d,axis=1)>0)
+
+shutil.rmtree(dirname)
@@ -0,0 +1,39 @@
+from pylayers.gis.layout import *
+
+L1 = Layout('defstr.lay')
+key = L1.cachekey()
+L1.build()
+assert L1.cachekey() == key, 'the build changes the cache key'
+
+# second build is read from the cache
+L2 = Layout('defstr.lay',bgraphs=True)
+assert L2.isbuilt
+for k in ['nstr','typ','air','indptr','indices','optr','oedge']:
+    assert (L1.Gicsr[k] == L2.Gicsr[k]).all(), k
+assert L1.Gicsr['lint'] == L2.Gicsr['lint']
+# Gi is read at its first access
+assert set(L1.Gi.edges()) == set(L2.Gi.edges())
+
+# an edition of the layout invalidates the cache
+L3 = Layout('defstr.lay')
+ns = [ x for x in L3.Gs.node if x > 0 ][0]
+L3.Gs.pos[L3.Gs.node[ns]['connect'][0]] = (0.1,0.1)
+L3.g2npy()
+assert L3.cachekey() != key
+
+# so does an edition of the iso segments or of the sub-segments
+L4 = Layout('defstr.lay')
+L4.Gs.node[1]['iso'] = [2]
+L4.g2npy()
+assert L4.cachekey() != key
+L5 = Layout('defstr.lay')
+L5.Gs.node[1]['ss_name'] = ['DOOR']
+L5.Gs.node[1]['ss_z'] = [(0,2)]
+L5.g2npy()
+assert L5.cachekey() != key
+
+# the key is memoized until the layout is modified
+L6 = Layout('defstr.lay')
+assert L6.cachekey() is L6.cachekey()
+L6.translate(np.array([1.,0.]))
+assert L6.cachekey() != key
@@ -0,0 +1,26 @@
+from pylayers.gis.layout import *
+
+L = Layout('DLR.lay')
+L.build(cache=False)
+dout = { e : L.Gi[e[0]][e[1]]['output'] for e in L.Gi.edges() }
+
+# multi process evaluation
+L.buildGi()
+L.outputGi(nproc=2)
+for e in L.Gi.edges():
+    assert L.Gi[e[0]][e[1]]['output'] == dout[e]
+
+# incremental evaluation after the displacement of a point
+ns = [ x for x in L.name['WALL'] ][0]
+npt = L.Gs.node[ns]['connect'][0]
+x,y = L.Gs.pos[npt]
+L.Gs.pos[npt] = (x+0.05,y+0.03)
+L.g2npy()
+L.build(cache=False)
+dinc = { e : L.Gi[e[0]][e[1]]['output'] for e in L.Gi.edges() }
+L.outputGi()
+for e in L.Gi.edges():
+    o = L.Gi[e[0]][e[1]]['output']
+    assert set(o) == set(dinc[e])
+    for k in o:
+        assert np.isclose(o[k],dinc[e][k])
@@ -0,0 +1,37 @@
+from pylayers.gis.layout import *
+
+L = Layout('DLR.lay')
+L.build()
+rng = np.random.RandomState(0)
+xmin, xmax, ymin, ymax = L.ax
+N = 40
+p1 = np.vstack((xmin + (xmax - xmin) * rng.rand(N),
+                ymin + (ymax - ymin) * rng.rand(N), 1.2 * np.ones(N)))
+p2 = np.vstack((xmin + (xmax - xmin) * rng.rand(N),
+                ymin + (ymax - ymin) * rng.rand(N), 1.5 * np.ones(N)))
+
+# angleonlink3 against an exhaustive test of every (link,segment) pair
+data = L.angleonlink3(p1, p2)
+Ns = len(L.tsg)
+il = np.repeat(np.arange(N), Ns)
+iseg = np.tile(np.arange(Ns), N)
+Pta = L.pt[:, L.tahe[0, iseg]]
+Phe = L.pt[:, L.tahe[1, iseg]]
+z = np.array([L.Gs.node[x]['z'] for x in L.tsg])[iseg]
+Pg = np.vstack(((Pta + Phe) / 2., z.mean(axis=1)))
+L1 = np.sqrt(np.sum((Phe - Pta)**2, axis=0))
+U1 = np.vstack(((Phe - Pta) / L1, np.zeros(len(iseg))))
+U2 = np.array([0, 0, 1])[:, None]
+bo, pt = geu.intersect3(p1[:, il], p2[:, il], Pg, U1, U2, L1,
+                        z[:, 1] - z[:, 0], pairwise=True)
+sref = set(zip(il[bo], L.tsg[iseg[bo]]))
+assert set(zip(data['i'], data['s'])) == sref
+
+# pt2cy against the exhaustive test over the cycles
+for k in range(N):
+    pt = p1[0:2, k]
+    cy = L.pt2cy(pt)
+    lcy = [ c for c in L.Gt.nodes() if c > 0 and
+            L.Gt.node[c]['polyg'].contains(sh.Point(pt)) ]
+    if len(lcy) > 0:
+        assert cy in lcy
@@ -19,7 +19,7 @@ from pylayers.util.project import *
 if sys.version_info.major==2:
     from SimPy.SimulationRT import Process,hold
 else:
-    from simpy import Process
+    from pylayers.util.simpy2 import Process, hold
 
 from pylayers.util import utilnet
 from pylayers.network.network import Network, Node
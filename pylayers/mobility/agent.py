@@ -18,7 +18,7 @@ if sys.version_info.major==2:
     from SimPy.SimulationRT import Simulation
 else:
     import configparser as ConfigParser
-    import simpy
+    from pylayers.util.simpy2 import Simulation
 
 from pylayers.mobility.transit.Person import Person
 from pylayers.mobility.transit.World import world
@@ -136,7 +136,7 @@ class Agent(object):
                     'wstd': ['rat1'],
                     'world': world(),
                     'save': [],
-                    'sim': simpy.Environment(),
+                    'sim': Simulation(),
                     'epwr': {},
                     'sens': {},
                     'dcond': {},
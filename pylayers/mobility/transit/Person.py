@@ -30,7 +30,7 @@ if sys.version_info.major==2:
     from SimPy.SimulationRT import Process,Simulation,hold
 else:
     import configparser as ConfigParser
-    from  simpy import Process
+    from pylayers.util.simpy2 import Process, hold, passivate
 
 #from math import *
 #from random import normalvariate,uniform
@@ -178,7 +178,7 @@ class Person(Process):
         
         if roomId < 0:
             try :
-                self.roomId   = random.sample(self.L.Gr.nodes(),1)[0]
+                self.roomId   = random.sample(list(self.L.Gr.nodes()),1)[0]
             except:
                 raise NameError('This error is due to the lack of Gr graph in the Layout argument passed to Person(Object)')
         else:
@@ -188,12 +188,12 @@ class Person(Process):
         if self.cdest == 'random':
             # self.nextroomId   = int(np.floor(random.uniform(0,self.L.Gr.size())))
             try :
-                self.nextroomId   = random.sample(self.L.Gr.nodes(),1)[0]
+                self.nextroomId   = random.sample(list(self.L.Gr.nodes()),1)[0]
             except:
                 raise NameError('This error is due to the lack of Gr graph in the Layout argument passed to Person(Object)')
             while self.nextroomId == self.roomId or (self.nextroomId in self.forbidroomId): # or (self.nextroomId in self.sim.roomlist): # test destination different de l'arrive
                 # self.nextroomId   = int(np.floor(random.uniform(0,self.L.Gr.size())))
-                self.nextroomId   = random.sample(self.L.Gr.nodes(),1)[0]
+                self.nextroomId   = random.sample(list(self.L.Gr.nodes()),1)[0]
             #self.sim.roomlist.append(self.nextroomId) # list of all destiantion of all nodes in object sim
         elif self.cdest == 'file':
            cfg = ConfigParser.ConfigParser()
@@ -392,13 +392,13 @@ class Person(Process):
                     #Nadjroom = len(adjroom)
                         if self.cdest == 'random':
                             # self.nextroomId   = int(np.floor(random.uniform(0,self.L.Gr.size())))
-                            self.nextroomId   = random.sample(self.L.Gr.nodes(),1)[0]
+                            self.nextroomId   = random.sample(list(self.L.Gr.nodes()),1)[0]
                             # test 1 ) next != actualroom
                             #      2 ) nextroom != fordiden room
                             #      3 ) room not share without another agent
                             while self.nextroomId == self.roomId or (self.nextroomId in self.forbidroomId):# or (self.nextroomId in self.sim.roomlist):
                                 # self.nextroomId   = int(np.floor(random.uniform(0,self.L.Gr.size())))
-                                self.nextroomId   = random.sample(self.L.Gr.nodes(),1)[0]
+                                self.nextroomId   = random.sample(list(self.L.Gr.nodes()),1)[0]
                         elif self.cdest == 'file':
                            self.room_counter=self.room_counter+1
                            if self.room_counter >= self.nb_room:
@@ -54,8 +54,7 @@ if sys.version_info.major==2:
     from SimPy.SimulationRT import Process, hold, SimEvent, Simulation, waitevent
 else:
     import configparser as ConfigParser
-    import simpy
-    #from  simpy import Process
+    from pylayers.util.simpy2 import Process, hold, SimEvent, Simulation, waitevent
 
 from random import uniform,gauss
 from pylayers.network.network import  Node,Network
@@ -99,8 +98,7 @@ class dcond(dict):
 
 
 
-#class TX(Process):
-class TX():
+class TX(Process):
     """
        TX process ( not used for now)
         Each agent use the TX process for querying LDP/information/message passing data
@@ -129,11 +127,7 @@ class TX():
         self.gcom = self.args['gcom']
 
 
-        if sys.version_info.major==2:
-            self.cmdrq =SimEvent('RQ'+str(self.ID),sim=self.sim) # command request
-        else:
-            pass
-            # Python3 implementation not done
+        self.cmdrq =SimEvent('RQ'+str(self.ID),sim=self.sim) # command request
 
         try:
             self.PN = self.net.node[self.ID]['PN']
@@ -144,12 +138,7 @@ class TX():
 
 #        self.c_init()
 
-        if sys.version_info.major==2:
-            Process.__init__(self,name='Tx'+str(self.ID),sim=self.sim)
-        else:
-            pass
-            #Process.__init__(self,env,generator)
-            # Python3 implementation not done
+        Process.__init__(self,name='Tx'+str(self.ID),sim=self.sim)
 
         Cf = ConfigParser.ConfigParser()
         Cf.read(pyu.getlong('agent.ini','ini'))
@@ -295,8 +284,7 @@ class TX():
                         self.devt[eval(key)].signal()
 
 
-#class RX(Process):
-class RX():
+class RX(Process):
     """ RX process
 
     Each agent has a RX process to receive information asynchronously.
@@ -602,13 +590,16 @@ class Gcom(nx.MultiDiGraph):
     The keys of devt are a tuple (nodeid#1, nodeid#2 , wstd).
 
     """
-    #def __init__(self, net=Network(), sim=Simulation()):
-    def __init__(self, net, sim):
+    def __init__(self, net=None, sim=None):
         """
         net : pylayers.network.Network
+            default Network()
+        sim : simulation of the nodes
 
         """
         nx.MultiDiGraph.__init__(self)
+        if net is None:
+            net = Network()
         self.net = net
         self.sim = sim
         self.fileini = 'communication.ini'
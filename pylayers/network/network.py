@@ -143,7 +143,7 @@ class Node(PyLayers,nx.MultiGraph):
         # Personnal Network init
         self.ID = kwargs['ID']
         self.PN = Network(owner=self.ID,PN=True)
-        self.PN.add_node(self.ID,dict(ID=kwargs['ID'],
+        self.PN.add_node(self.ID,**dict(ID=kwargs['ID'],
                                       name=kwargs['name'],
                                       pe=kwargs['pe'],
                                       te=kwargs['te'],
@@ -153,7 +153,7 @@ class Node(PyLayers,nx.MultiGraph):
                                       typ=kwargs['typ'],
                                       ))
         # Network init
-        self.add_node(self.ID,dict(ID=kwargs['ID'],
+        self.add_node(self.ID,**dict(ID=kwargs['ID'],
                               name=kwargs['name'],
                               PN=self.PN,
                               p=kwargs['p'],
@@ -37,7 +37,7 @@ if sys.version_info.major==2:
     from SimPy.SimulationRT import Process, hold  # sympy 2
 else:
     import configparser as ConfigParser
-    from  simpy import Process
+    from pylayers.util.simpy2 import Process, hold
 
 import pkgutil
 
@@ -34,17 +34,407 @@ from pylayers.gis.layout import Layout
 from pylayers.antprop.antenna import Antenna
 
 # Handle Signature
-from pylayers.antprop.signature import Signatures,Signature
+from pylayers.antprop.signature import Signatures,Signature,SigCache,sigcache
 # Handle Rays
 from pylayers.antprop.rays import Rays
+from pylayers.antprop.interactions import interconcat, intersplit
 # Handle VectChannel and ScalChannel
-from pylayers.antprop.channel import Ctilde, Tchannel , AFPchannel
+from pylayers.antprop.channel import Ctilde, Tchannel , AFPchannel, ctildeconcat
 from pylayers.antprop.statModel import getchannel
 import tqdm
 import copy
 import h5py
+import atexit
+from collections import OrderedDict
+from scipy.spatial import cKDTree
 import pdb
 
+
+class LinkStore(PyLayers):
+    """ single writer store of a Links h5 file
+
+    The store keeps one open handle on the file for the whole process.
+    The mapping datasets (p_map, c_map, f_map, A_map, T_map) and the group
+    names are read once, lookups are done in memory :
+
+    + p_map : KD-tree of the points (tolerance search), the points
+      appended since the last build of the tree are compared at once
+    + c_map, A_map, T_map : hash of the rows (exact match)
+    + f_map : vectorized comparison of the frequency ranges
+
+    New rows are appended in memory and written by batches (flush).
+
+    Attributes
+    ----------
+
+    filename : string
+        long filename of the h5 file
+    nflush : int
+        number of pending rows triggering a flush
+    maxobj : int
+        maximal number of loaded objects kept in memory
+    maxbytes : int
+        maximal size of the arrays of the kept objects
+    hits : int
+        number of objects taken from memory
+    misses : int
+        number of objects read from the file
+
+    Notes
+    -----
+
+    The pending rows are flushed on close (and at exit), every nflush
+    appended rows and before the writing of a data group, so that a
+    group of the file never refers to an index of a map which is
+    not in the file.
+
+    See Also
+    --------
+
+    linkstore, DLink.get_idx, DLink.load
+
+    """
+    maps = ['p_map', 'c_map', 'f_map', 'A_map', 'T_map']
+    grps = ['sig', 'ray2', 'ray', 'Ct', 'H']
+
+    def __init__(self, filename, nflush=100, maxobj=32, maxbytes=2**28):
+        self.filename = filename
+        self.nflush = nflush
+        self.maxobj = maxobj
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self._obj = OrderedDict()
+        self.fh5 = h5py.File(filename, 'a')
+        self._read()
+
+    def __repr__(self):
+        st = 'LinkStore : ' + self.filename + '\n'
+        for k in self.maps:
+            st = st + k + ' : ' + str(len(self._rows[k])) + ' rows ('
+            st = st + str(len(self._pending[k])) + ' pending)\n'
+        st = st + 'objects : ' + str(len(self._obj)) + '/' + str(self.maxobj)
+        st = st + ' hits : ' + str(self.hits) + ' misses : ' + str(self.misses)
+        return st
+
+    def _rowkey(self, key, row):
+        """ hashable value of a row of c_map, A_map or T_map
+        """
+        if key == 'A_map':
+            return np.asarray(row).ravel()[0]
+        return tuple(np.asarray(row).ravel().tolist())
+
+    def _read(self):
+        """ read the maps and the group names of the file
+        """
+        self._rows = {}
+        self._pending = {}
+        self._hash = {}
+        for k in self.maps:
+            fa = self.fh5[k][...]
+            self._rows[k] = list(fa)
+            self._pending[k] = []
+            if k in ['c_map', 'A_map', 'T_map']:
+                d = {}
+                for u, row in enumerate(fa):
+                    d.setdefault(self._rowkey(k, row), []).append(u)
+                self._hash[k] = d
+        # points of p_map in a growing array
+        ncol = int(np.prod(self.fh5['p_map'].shape[1:]))
+        self._np = len(self._rows['p_map'])
+        self._pt = np.array(self._rows['p_map'], dtype=float).reshape(-1, ncol)
+        self._tree()
+        self._fa = None
+        self.groups = {}
+        for g in self.grps:
+            self.groups[g] = set(self.fh5[g].keys())
+
+    def _tree(self):
+        """ (re)build the KD-tree of the points of p_map
+        """
+        self._ntree = self._np
+        if self._ntree > 0:
+            self._kdt = cKDTree(self._pt[:self._np])
+        else:
+            self._kdt = None
+
+    def find(self, key, array, tol=1e-3):
+        """ indices of the rows of map key matching array
+
+        Parameters
+        ----------
+
+        key : string
+            'p_map' | 'c_map' | 'f_map' | 'A_map' | 'T_map'
+        array : np.ndarray | string
+        tol : float
+            tolerance in meters (p_map)
+
+        Returns
+        -------
+
+        ua : np.ndarray
+            sorted indices, empty if array is not in the map
+
+        See Also
+        --------
+
+        DLink.array_exist
+
+        """
+        if key in ['c_map', 'T_map']:
+            lu = self._hash[key].get(self._rowkey(key, array), [])
+            ua = np.array(lu, dtype=int)
+
+        elif key == 'A_map':
+            lu = self._hash[key].get(array.encode('utf-8'), [])
+            ua = np.array(lu, dtype=int)
+
+        elif key == 'p_map':
+            p = np.asarray(array, dtype=float).ravel()
+            lu = []
+            if self._kdt is not None:
+                u = np.array(self._kdt.query_ball_point(p, tol), dtype=int)
+                if len(u) > 0:
+                    da = np.sqrt(np.sum((self._kdt.data[u]-p)**2, axis=1))
+                    lu = list(np.sort(u[da < tol]))
+            # points appended since the last build of the tree
+            P = self._pt[self._ntree:self._np]
+            if len(P) > 0:
+                ut = np.where(np.sqrt(np.sum((P-p)**2, axis=1)) < tol)[0]
+                lu.extend(self._ntree + ut)
+            ua = np.array(lu, dtype=int)
+
+        elif key == 'f_map':
+            if self._fa is None:
+                self._fa = np.array(self._rows[key]).reshape(-1, 3)
+            fa = self._fa
+            # fmin_h5 <= fmin_rqst, fmax_h5 >= fmax_rqst, fstep_h5 <= fstep_rqst
+            ufmi = fa[:, 0] <= array[0]
+            ufma = fa[:, 1] >= array[1]
+            ufst = fa[:, 2] <= array[2]
+            if (not ufmi.any()) and (not ufma.any()):
+                ua = np.array([], dtype=int)
+            else:
+                ua = np.where(ufmi & ufma & ufst)[0]
+        else:
+            raise NameError('LinkStore.find : invalid key')
+
+        return ua
+
+    def append(self, key, array):
+        """ append a row to map key
+
+        Parameters
+        ----------
+
+        key : string
+        array : np.ndarray | string
+
+        Returns
+        -------
+
+        u : int
+            index of the row
+
+        """
+        ds = self.fh5[key]
+        if isinstance(array, str):
+            array = array.encode('utf-8')
+        row = np.array(array, dtype=ds.dtype).reshape(ds.shape[1:])
+        u = len(self._rows[key])
+        self._rows[key].append(row)
+        self._pending[key].append(row)
+        if key in self._hash:
+            self._hash[key].setdefault(self._rowkey(key, row), []).append(u)
+        elif key == 'f_map':
+            self._fa = None
+        elif key == 'p_map':
+            if self._np == len(self._pt):
+                n = max(64, len(self._pt))
+                self._pt = np.vstack((self._pt,
+                                      np.empty((n, self._pt.shape[1]))))
+            self._pt[self._np] = row.ravel()
+            self._np += 1
+            # the tree is rebuilt when the part out of the tree becomes long
+            if (self._np - self._ntree) > max(64, self._ntree // 8):
+                self._tree()
+        if sum(len(self._pending[k]) for k in self.maps) >= self.nflush:
+            self.flush()
+        return u
+
+    def flush(self):
+        """ write the pending rows in the file
+        """
+        for k in self.maps:
+            lrows = self._pending[k]
+            if len(lrows) > 0:
+                ds = self.fh5[k]
+                n0 = ds.shape[0]
+                ds.resize((n0 + len(lrows),) + ds.shape[1:])
+                ds[n0:] = np.array(lrows)
+                self._pending[k] = []
+        self.fh5.flush()
+
+    def exist(self, key, grpname):
+        """ check if group key/grpname is in the file
+        """
+        return grpname in self.groups[key]
+
+    def add(self, key, grpname):
+        """ record group key/grpname (written by an object _saveh5)
+        """
+        self.groups[key].add(grpname)
+
+    def delete(self, key, grpname):
+        """ delete group key/grpname from the file
+        """
+        del self.fh5[key][grpname]
+        self.groups[key].discard(grpname)
+        self._dropobj(key, grpname)
+
+    def getobj(self, key, grpname):
+        """ copy of the object loaded from group key/grpname (None if absent)
+
+        The numpy arrays of the object are copied (see _copyarrays), an
+        in-place evaluation of the returned object does not modify the
+        kept object.
+
+        """
+        k = (key, grpname)
+        if k in self._obj:
+            obj = self._obj.pop(k)
+            self._obj[k] = obj
+            self.hits += 1
+            return _copyarrays(obj[0])
+        self.misses += 1
+        return None
+
+    def putobj(self, key, grpname, obj):
+        """ keep a copy of the object loaded from key/grpname
+        """
+        nbytes = _nbytes(obj)
+        if (self.maxobj > 0) and (nbytes <= self.maxbytes):
+            self._dropobj(key, grpname)
+            self._obj[(key, grpname)] = (_copyarrays(obj), nbytes)
+            self.nbytes += nbytes
+            while ((len(self._obj) > self.maxobj) or
+                   (self.nbytes > self.maxbytes)):
+                self.nbytes -= self._obj.popitem(last=False)[1][1]
+
+    def _dropobj(self, key, grpname):
+        """ forget the object of group key/grpname
+        """
+        objc = self._obj.pop((key, grpname), None)
+        if objc is not None:
+            self.nbytes -= objc[1]
+
+    def close(self):
+        """ flush and close the file
+        """
+        if self.fh5:
+            self.flush()
+            self.fh5.close()
+        self._obj.clear()
+        self.nbytes = 0
+        if _linkstores.get(self.filename) is self:
+            del _linkstores[self.filename]
+
+
+def _nbytes(obj, depth=3):
+    """ size of the numpy arrays of an object (dict items and attributes)
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if depth == 0:
+        return 0
+    lv = []
+    if isinstance(obj, dict):
+        lv.extend(obj.values())
+    if hasattr(obj, '__dict__'):
+        lv.extend(obj.__dict__.values())
+    return sum(_nbytes(v, depth-1) for v in lv)
+
+
+def _copyarrays(obj, depth=3):
+    """ copy of an object with copies of its numpy arrays
+
+    The dict items and the attributes of the dicts and of the pylayers
+    objects are copied down to depth levels, the other members are
+    shared. A Layout is always shared.
+
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if (depth == 0) or isinstance(obj, Layout):
+        return obj
+    if not (isinstance(obj, dict) or
+            type(obj).__module__.startswith('pylayers')):
+        return obj
+    objc = copy.copy(obj)
+    if isinstance(obj, dict):
+        for k in obj:
+            dict.__setitem__(objc, k, _copyarrays(obj[k], depth-1))
+    if hasattr(obj, '__dict__'):
+        for k, v in obj.__dict__.items():
+            objc.__dict__[k] = _copyarrays(v, depth-1)
+    return objc
+
+
+# one LinkStore per Links h5 file and per process
+_linkstores = {}
+# stores inherited from a parent process (never used, never closed)
+_forkedstores = []
+
+
+def linkstore(filename, **kwargs):
+    """ returns the LinkStore of a Links h5 file
+
+    Parameters
+    ----------
+
+    filename : string
+        long filename of the h5 file
+    kwargs :
+        LinkStore parameters (when the store is created)
+
+    Notes
+    -----
+
+    A store inherited through a fork is left untouched, the child
+    process opens its own store.
+
+    """
+    S = _linkstores.get(filename)
+    if (S is not None) and (S.pid != os.getpid()):
+        _forkedstores.append(S)
+        S = None
+    if S is None:
+        S = LinkStore(filename, **kwargs)
+        _linkstores[filename] = S
+    return S
+
+
+def closelinkstores(filename=''):
+    """ close the LinkStores of the process
+
+    Parameters
+    ----------
+
+    filename : string
+        long filename of the h5 file ('' : all the stores)
+
+    """
+    for k, S in list(_linkstores.items()):
+        if (filename in ['', k]) and (S.pid == os.getpid()):
+            S.close()
+
+
+atexit.register(closelinkstores)
+
+
 class Link(PyLayers):
     """ Link class
 
@@ -363,13 +753,17 @@ class DLink(Link):
                 print('Links save file for ' + self.L._filename + ' does not exist.')
                 print('Creating file. You\'ll see this message only once per Layout')
                 self.save_init(filenameh5)
-            try:
-                self.L.dumpr()
-                print('Layout Graph loaded')
-            except:
-                print('This is the first time the Layout is used. Graphs have to be built. Please Wait')
-                self.L.build(graph=self.graph)
-                self.L.dumpw()
+            # graphs already loaded (e.g from the layout cache)
+            if self.L.isbuilt:
+                pass
+            else:
+                try:
+                    self.L.dumpr()
+                    print('Layout Graph loaded')
+                except:
+                    print('This is the first time the Layout is used. Graphs have to be built. Please Wait')
+                    self.L.build(graph=self.graph)
+                    self.L.dumpw()
 
             #
             # In outdoor situation we delete transmission node involving
@@ -403,6 +797,8 @@ class DLink(Link):
                         del output[d]
 
                     self.L.Gi[e[0]][e[1]]['output']=output
+                # keep the integer indexed form of Gi consistent
+                self.L.Gi2csr()
             #self.L.dumpw()
             #self.L.build()
 
@@ -433,6 +829,19 @@ class DLink(Link):
     def L(self):
         return self._L
 
+    @property
+    def sigcache(self):
+        """ LRU cache of signatures shared by the links of the Layout
+        (see pylayers.antprop.signature.sigcache)
+        """
+        return sigcache(self._L)
+
+    @property
+    def store(self):
+        """ LinkStore of the h5 file of the link (see linkstore)
+        """
+        return linkstore(pyu.getlong(self.filename,pstruc['DIRLNK']))
+
     @property
     def a(self):
         return self._a
@@ -1014,6 +1423,8 @@ class DLink(Link):
         """
 
 
+        # the store of a previous file is dropped
+        closelinkstores(filename_long)
         f=h5py.File(filename_long,'w')
         # try/except to avoid loosing the h5 file if
         # read/write error
@@ -1057,26 +1468,16 @@ class DLink(Link):
         idx : int
             indice of last element of the array of key
 
-        """
-        try :
-            lfilename=pyu.getlong(self.filename,pstruc['DIRLNK'])
-            f=h5py.File(lfilename,'a')
+        Notes
+        -----
 
-            if type(array)==str:
-                array = array.encode('utf-8')
+        The array is appended to the LinkStore of the file, it is written
+        in the file with the next flush of the store.
 
-            if key != 'T_map':
-                sc = f[key].shape
-                f[key].resize((sc[0]+1,sc[1]))
-                f[key][-1,:] = array
-            else:
-                sc = f[key].shape
-                f[key].resize((sc[0]+1,sc[1],sc[2]))
-                f[key][-1,:,:] = array
-            f.close()
-            return np.array([sc[0]])
+        """
+        try :
+            return np.array([self.store.append(key,array)])
         except:
-            f.close()
             raise NameError('Link stack: issue during stacking')
 
     def _delete(self,key,grpname):
@@ -1091,17 +1492,9 @@ class DLink(Link):
             groupe name of the h5py file
 
         """
-        lfilename = pyu.getlong(self.filename,pstruc['DIRLNK'])
-        f = h5py.File(lfilename,'a')
-        # try/except to avoid loosing the h5 file if
-        # read/write error
-
         try:
-            del f[key][grpname]
-            # print 'delete ',key , ' in ', grpname
-            f.close()
+            self.store.delete(key,grpname)
         except:
-            f.close()
             raise NameError('Link._delete: issue when deleting in h5py file')
 
 
@@ -1121,21 +1514,15 @@ class DLink(Link):
         force : boolean or list
         """
 
-        if not force :
-            obj._saveh5(self.filename,grpname)
+        # the indices of the group name are written before the group
+        self.store.flush()
         # if save is forced, previous existing data are removed and
         # replaced by new ones.
-        else :
-            if self.dexist[key]['exist']:
-                self._delete(key,grpname)
-
-            #if type(grpname)==str:
-            #    grpname.encode('utf-8')
-            #print(key,grpname)
-            #if key=='ray':
-            #    pdb.set_trace()
-            obj._saveh5(self.filename,grpname)
+        if force and self.dexist[key]['exist']:
+            self._delete(key,grpname)
 
+        obj._saveh5(self.filename,grpname)
+        self.store.add(key,grpname)
 
         logger.debug(str(obj.__class__).split('.')[-1] + ' from '+ grpname + ' saved')
 
@@ -1154,11 +1541,40 @@ class DLink(Link):
         kwargs :
         layout for sig and rays
 
+        Returns
+        -------
+
+        obj : Object
+            the updated object
+
+        Notes
+        -----
+
+        The objects recently loaded are kept by the LinkStore, a new load
+        of the same group is a shallow copy of the kept object (the arrays
+        are shared).
 
         """
+        if isinstance(obj,Signatures):
+            key = 'sig'
+        elif isinstance(obj,Rays):
+            key = 'ray' if obj.is3D else 'ray2'
+        elif isinstance(obj,Ctilde):
+            key = 'Ct'
+        else:
+            key = 'H'
 
-        obj._loadh5(self.filename,grpname,**kwargs)
+        objc = self.store.getobj(key,grpname)
+        if objc is None:
+            obj._loadh5(self.filename,grpname,**kwargs)
+            self.store.putobj(key,grpname,obj)
+        else:
+            if isinstance(obj,dict):
+                obj.clear()
+                obj.update(objc)
+            obj.__dict__.update(objc.__dict__)
         logger.debug(str(obj.__class__).split('.')[-1] + ' from '+ grpname + ' loaded')
+        return obj
 
 
     def get_grpname(self):
@@ -1260,17 +1676,7 @@ class DLink(Link):
         update the key grpname of self.dexist[key] dictionnary
 
         """
-        try :
-            lfilename=pyu.getlong(self.filename,pstruc['DIRLNK'])
-            f = h5py.File(lfilename,'r')
-            if grpname.encode('utf8') in f[key].keys():
-                self.dexist[key]['exist'] = True
-            else :
-                self.dexist[key]['exist'] = False
-            f.close()
-        except:
-            f.close()
-            raise NameError('Link exist: issue during stacking')
+        self.dexist[key]['exist'] = self.store.exist(key,grpname)
 
 
     def get_idx(self,key,array,tol=1e-3):
@@ -1351,74 +1757,7 @@ class DLink(Link):
         Add a tolerance on the rotation angle (T_map)
 
         """
-
-        lfilename = pyu.getlong(self.filename,pstruc['DIRLNK'])
-        # file should exist before calling (append mode)
-        f = h5py.File(lfilename,'a')
-        try :
-            fa = f[key][...]
-            f.close()
-        except:
-            f.close()
-            raise NameError('Link check_exist: issue during reading')
-
-        if key == 'c_map':
-            eq = array == fa
-            # sum eq = 3 means cy0,cy1 and cutoff are the same in fa and array
-            ua = np.where(np.sum(eq,axis=1)==3)[0]
-
-        elif key == 'p_map':
-
-            da = np.sqrt(np.sum((array-fa)**2,axis=1))
-            # indice points candidate in db for a
-
-            ua = np.where(da<tol)[0]
-
-        elif key == 'f_map':
-            # import ipdb
-            # ipdb.set_trace()
-            #### fmin_h5 < fmin_rqst
-            ufmi = fa[:,0]<=array[0]
-            # old version
-                # ufmi = np.where(fa[:,0]<=array[0])[0]
-                # lufmi = len(ufmi)
-
-            #### fmax_h5 > fmax_rqst
-            ufma = fa[:,1]>=array[1]
-            # old version
-                # ufma = np.where(fa[:,1]>=array[1])[0]
-                # lufma = len(ufma)
-
-            ### fstep_h5 < fstep_rqst
-            ufst = fa[:,2]<=array[2]
-            # old version
-                # ufst = np.where(fa[:,2]<=array[2])[0]
-                # lufst = len(ufst)
-
-            # if fmin, fmax or fstep
-            #if (lufmi==0) and (lufma==0) and (lufst==0):
-            if (not ufmi.any()) and (not ufma.any()):
-                ua = np.array([])
-            else:
-                # find common lines of fmin and fmax and fstep
-                ua = np.where(ufmi & ufma & ufst)[0]
-                # ua = np.where(np.in1d(ufmi,ufma,ufst))[0]
-                # # find common lines of fmin and fmax
-                # ufmima = np.where(np.in1d(ufmi,ufma))[0]
-                # # find common lines of fmin, fmax and fstep
-                # ua = np.where(np.in1d(ufmima,ufst))[0]
-
-        elif key == 'A_map':
-            ua = np.where(fa == array.encode('utf-8'))[0]
-
-        elif key == 'T_map':
-            eq = array == fa
-            seq = np.sum(np.sum(eq,axis=1), axis=1)
-            ua = np.where(seq == 9)[0]
-        else :
-            raise NameError('Link.array_exist : invalid key')
-
-        return ua
+        return self.store.find(key,array,tol=tol)
 
     def evalH(self,**kwargs):
         """ evaluate channel transfer function
@@ -1452,6 +1791,8 @@ class DLink(Link):
             version of run for signature
         si_progress: bollean ( False)
             display progression bar for signatures
+        si_nproc : int (1)
+            number of processes for the signature exploration
         diffraction : boolean (False)
             takes into consideration diffraction points
         ra_number_mirror_cf : int
@@ -1463,9 +1804,23 @@ class DLink(Link):
                 If -1 : neither ceil nor floor reflection (2D case)
         ra_vectorized: boolean (True)
             if True used the (2015 new) vectorized approach to determine 2drays
+        ra_mode : string ('exact')
+            slab coefficients of the interactions, 'exact' or 'tab'
+            (lookup tables, see Interactions.eval)
         progressbar: str
             None: no progress bar
             python : progress bar in ipython
+        fchunk : int
+            number of frequency points processed at once (default None)
+            see Rays.eval
+        dirname : string
+            directory of the memmap files of the channels (default None)
+            see Rays.eval
+        si_cache : boolean (True)
+            reuse the signatures of the cycle pair from the in-memory cache
+            shared by the links of the Layout (see self.sigcache). The
+            cache is not read when the signatures are forced ('sig' in force)
+            but it is updated with the new signatures
 
 
         Notes
@@ -1504,6 +1859,7 @@ class DLink(Link):
 
         defaults = {'applywav': False,
                    'si_progress': True,
+                   'si_nproc': 1,
                    'diffraction': True,
                    'ra_vectorized': True,
                    'ra_ceil_H': [],
@@ -1516,7 +1872,11 @@ class DLink(Link):
                    'nT': 10,
                    'debug': False,
                    'progressbar': None,
-                   'rm_aw': True
+                   'rm_aw': True,
+                   'fchunk': None,
+                   'dirname': None,
+                   'si_cache': True,
+                   'ra_mode': 'exact'
                    }
         # check antenna frequency range compatibility
         if (self.Aa.fGHz!=self.Ab.fGHz).all():
@@ -1575,17 +1935,33 @@ class DLink(Link):
                         cutoff = kwargs['cutoff'],
                         threshold = kwargs['threshold'])
 
-        if (self.dexist['sig']['exist'] and not ('sig' in kwargs['force'])):
+        self.nD = kwargs['nD']
+        self.nT = kwargs['nT']
+        self.nR = kwargs['nR']
+        self.bt = kwargs['bt']
+
+        # the in-memory cache is checked before the h5 file
+        Sic = None
+        if kwargs['si_cache']:
+            sicache = self.sigcache
+            sikey = SigCache.key(self.ca, self.cb, self.cutoff, self.threshold,
+                                 nD=self.nD, nR=self.nR, nT=self.nT, bt=self.bt,
+                                 diffraction=kwargs['diffraction'],
+                                 delay_excess_max_ns=self.delay_excess_max_ns)
+            if not ('sig' in kwargs['force']):
+                Sic = sicache.get(sikey)
+
+        if Sic is not None:
+            logger.info(" Signatures from cache : %s", str(sicache))
+            Si = Sic
+            if not self.dexist['sig']['exist']:
+                self.save(Si,'sig',self.dexist['sig']['grpname'],force = kwargs['force'])
+        elif (self.dexist['sig']['exist'] and not ('sig' in kwargs['force'])):
             logger.info(" Load existing signatures from :%s",self.dexist['sig']['grpname'])
             self.load(Si, self.dexist['sig']['grpname'], L=self.L)
         else:
             logger.info(" Run signatures")
 
-            self.nD = kwargs['nD']
-            self.nT = kwargs['nT']
-            self.nR = kwargs['nR']
-            self.bt = kwargs['bt']
- 
             Si.run(cutoff = self.cutoff,
                     diffraction = kwargs['diffraction'],
                     threshold = self.threshold,
@@ -1594,11 +1970,15 @@ class DLink(Link):
                     nR = self.nR,
                     nT = self.nT,
                     progress = kwargs['si_progress'],
+                    nproc = kwargs['si_nproc'],
                     bt = self.bt)
 
             logger.info(" Save signature in %s ",self.dexist['sig']['grpname'])
             self.save(Si,'sig',self.dexist['sig']['grpname'],force = kwargs['force'])
 
+        if kwargs['si_cache'] and (Sic is None):
+            sicache.put(sikey, Si)
+
         self.Si = Si
 
         toc = time.time()
@@ -1709,7 +2089,10 @@ class DLink(Link):
             # Find an other criteria in order to decide if the R has
             # already been evaluated
 
-            C = R.eval(self.fGHz)
+            C = R.eval(self.fGHz,
+                       fchunk=kwargs['fchunk'],
+                       dirname=kwargs['dirname'],
+                       mode=kwargs['ra_mode'])
             # ...save Ct
             self.save(C,'Ct',self.dexist['Ct']['grpname'],force = kwargs['force'])
 
@@ -1751,6 +2134,197 @@ class DLink(Link):
         self.checkh5()
 
 
+    def eval_many(self,lab,**kwargs):
+        """ evaluate a batch of links
+
+        Parameters
+        ----------
+
+        lab : list of tuples (a,b)
+            link extremities, a and b are np.array (3,)
+        cutoff : int
+            signature cutoff (default self.cutoff)
+        threshold : float
+            signature threshold (default self.threshold)
+        delay_excess_max_ns : float
+            (default self.delay_excess_max_ns)
+        si_progress : boolean (False)
+            display progression bar for signatures
+        si_nproc : int (1)
+            number of processes for the signature exploration
+        diffraction : boolean (True)
+        ra_ceil_H : float, (default [])
+            ceil height (see DLink.eval)
+        ra_number_mirror_cf : int
+            rays.to3D number of ceil/floor reflexions
+        ra_mode : string ('exact')
+            slab coefficients of the interactions (see DLink.eval)
+        rm_aw : boolean (True)
+            remove rays with AIR interactions
+
+        Returns
+        -------
+
+        H : Tchannel
+            rays of all links, stacked along the ray axis
+            H.ptr (Nlink+1,) ray pointer, the rays of link k are the
+            rays H.ptr[k]:H.ptr[k+1]
+            H.ilink (nray,) link index of each ray
+
+        Notes
+        -----
+
+        The layout, the antennas, their orientations and the frequency
+        range of the DLink are shared by all the links.
+        The links are grouped by cycle pair (ca,cb) and the signatures are
+        evaluated once per group, or taken from self.sigcache. The interactions of the rays of all the
+        links are evaluated in a single call of Interactions.eval.
+        Contrary to DLink.eval, nothing is saved in the h5 file and the
+        cutoff is not adapted to each link. As in DLink.eval the slab
+        coefficients are exact by default, ra_mode='tab' takes them from
+        the lookup tables when the batches reuse the same frequencies.
+
+        The throughput (links/s) is stored in self.lps
+
+        Examples
+        --------
+
+        >>> from pylayers.simul.link import *
+        >>> DL = DLink(L='defstr.lay')
+        >>> lab = [(DL.a,DL.b),(DL.b,DL.a)]
+        >>> H = DL.eval_many(lab,ra_ceil_H=0)
+        >>> H.ptr[-1] == len(H.taud)
+        True
+
+        See Also
+        --------
+
+        DLink.eval
+        pylayers.antprop.interactions.interconcat
+
+        """
+
+        defaults = {'si_progress': False,
+                    'si_nproc': 1,
+                    'diffraction': True,
+                    'ra_ceil_H': [],
+                    'ra_number_mirror_cf': 1,
+                    'ra_mode': 'exact',
+                    'bt': True,
+                    'nD': 2,
+                    'nR': 10,
+                    'nT': 10,
+                    'rm_aw': True,
+                    'cutoff': self.cutoff,
+                    'threshold': self.threshold,
+                    'delay_excess_max_ns': self.delay_excess_max_ns
+                   }
+
+        for key, value in defaults.items():
+            if key not in kwargs:
+                kwargs[key] = value
+
+        tic = time.time()
+
+        if kwargs['ra_ceil_H'] == []:
+            if self.L.typ == 'indoor':
+                ceilheight = self.L.maxheight
+            else:
+                ceilheight = 0
+        else:
+            ceilheight = kwargs['ra_ceil_H']
+
+        #
+        # group the links by cycle pair
+        #
+        dgrp = {}
+        for k, (a, b) in enumerate(lab):
+            if not (self.L.ptin(a) and self.L.ptin(b)):
+                raise NameError('Warning : link %d is not inside the Layout' % k)
+            ca = self.L.pt2cy(a)
+            cb = self.L.pt2cy(b)
+            if (ca, cb) in dgrp:
+                dgrp[(ca, cb)].append(k)
+            else:
+                dgrp[(ca, cb)] = [k]
+
+        #
+        # signatures (once per cycle pair) and 3D rays (once per link)
+        #
+        lR = [None]*len(lab)
+        for (ca, cb) in dgrp:
+            sikey = SigCache.key(ca, cb, kwargs['cutoff'], kwargs['threshold'],
+                                 nD=kwargs['nD'], nR=kwargs['nR'],
+                                 nT=kwargs['nT'], bt=kwargs['bt'],
+                                 diffraction=kwargs['diffraction'],
+                                 delay_excess_max_ns=kwargs['delay_excess_max_ns'])
+            Si = self.sigcache.get(sikey)
+            if Si is None:
+                Si = Signatures(self.L, ca, cb,
+                                cutoff=kwargs['cutoff'],
+                                threshold=kwargs['threshold'])
+                Si.run(cutoff=kwargs['cutoff'],
+                       diffraction=kwargs['diffraction'],
+                       threshold=kwargs['threshold'],
+                       delay_excess_max_ns=kwargs['delay_excess_max_ns'],
+                       nD=kwargs['nD'],
+                       nR=kwargs['nR'],
+                       nT=kwargs['nT'],
+                       progress=kwargs['si_progress'],
+                       nproc=kwargs['si_nproc'],
+                       bt=kwargs['bt'])
+                self.sigcache.put(sikey, Si)
+            for k in dgrp[(ca, cb)]:
+                a, b = lab[k]
+                r2d = Si.raysv(a, b)
+                R = r2d.to3D(self.L, H=ceilheight,
+                             N=kwargs['ra_number_mirror_cf'])
+                if kwargs['rm_aw']:
+                    R = R.remove_aw(self.L)
+                R.locbas(self.L)
+                R.fillinter(self.L)
+                lR[k] = R
+
+        #
+        # interactions of all the links in a single evaluation
+        #
+        lRv = [R for R in lR if R.nray > 0]
+        if len(lRv) > 0:
+            I, nptr = interconcat([R.I for R in lRv])
+            I.eval(self.fGHz, mode=kwargs['ra_mode'])
+            intersplit(I, [R.I for R in lRv], nptr)
+
+        #
+        # transmission channels : the antennas are evaluated once
+        # for the rays of all the links
+        #
+        lC = []
+        nray = np.zeros(len(lab), dtype=int)
+        for k, R in enumerate(lR):
+            if R.nray == 0:
+                continue
+            C = R.eval(self.fGHz, evalI=False)
+            C.locbas(Ta=self.Ta, Tb=self.Tb)
+            lC.append(C)
+            nray[k] = C.nray
+
+        if len(lC) > 0:
+            C, ptr = ctildeconcat(lC)
+            H = C.prop2tran(a=self.Aa, b=self.Ab, Friis=True)
+            H.isFriis = True
+        else:
+            H = Tchannel()
+
+        H.ptr = np.hstack((0, np.cumsum(nray)))
+        H.ilink = np.repeat(np.arange(len(lab)), nray)
+
+        toc = time.time()
+        self.lps = len(lab)/(toc-tic)
+        logger.info(" %d links (%d cycle pairs) in %.2f s : %.2f links/s",
+                    len(lab), len(dgrp), toc-tic, self.lps)
+
+        return H
+
     def adp(self,imax=1000):
         """ construct the angular delay profile
 
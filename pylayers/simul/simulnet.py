@@ -26,14 +26,14 @@ import random
 from random import seed
 
 import time
+import multiprocessing as mp
 import matplotlib.pyplot as plt
 import sys
 if sys.version_info.major==2:
     import ConfigParser
-    from simpy.SimulationRT import SimulationRT, Process, hold
 else:
     import configparser as ConfigParser
-    import simpy
+import simpy
 
 import pylayers.util.pyutil as pyu
 
@@ -50,14 +50,111 @@ from pylayers.mobility.transit.World import world
 #from pylayers.util.pymysqldb import Database as DB
 from pylayers.util.project import *
 from pylayers.util.save import *
+from pylayers.util.simpy2 import Simulation
 
 
 import pdb
 import os
 
 
-#~class Simul(SimulationRT):  # Simpy 2
-class Simul(object):  # Simpy 3
+def _simulnet_rep(kw):
+    """ run a headless replication of simulnet in a worker
+
+    Parameters
+    ----------
+
+    kw : dict
+        [Simulation] options of the replication (seed, filename, ...)
+
+    Returns
+    -------
+
+    (seed, filename) : the seed and the savepandas file of the replication
+
+    """
+    S = Simul(real_time=False, **kw)
+    S.runsimul()
+    if not str2bool(S.save_opt['savepd']):
+        return S.seed, S.savepandas()
+    layfile = S.L._filename.split('.')[0]
+    filename = pyu.getlong(eval(S.sim_opt['filename']), pstruc['DIRNETSAVE'])
+    return S.seed, filename + '_' + layfile + '.h5'
+
+def runreplications(lseed, nproc=None, filename='simulnet', **kwargs):
+    """ run seeded replications of simulnet as fast as possible
+
+    Parameters
+    ----------
+
+    lseed : list of int
+        seeds of the replications
+    nproc : int
+        number of worker processes (default mp.cpu_count())
+    filename : string
+        base name of the saved files
+    kwargs :
+        other [Simulation] options (e.g. duration)
+
+    Returns
+    -------
+
+    filename : string
+        <filename>_<layout>.h5 in DIRNETSAVE
+
+    Notes
+    -----
+
+    Each replication is a headless Simul (real_time=False) run in its own
+    process and saved with savepandas in <filename>_seed<seed>_<layout>.h5.
+    The files are then gathered in a single store : one table per agent,
+    the rows of all the replications with a 'seed' column. The
+    [Simulation] options of the first replication are kept in the
+    attributes of the store, the seeds in its seeds attribute.
+
+    """
+    lkw = [dict(kwargs, seed=s, filename=filename + '_seed' + str(s))
+           for s in lseed]
+    if nproc == 1:
+        lres = [_simulnet_rep(kw) for kw in lkw]
+    else:
+        pool = mp.Pool(nproc)
+        try:
+            lres = pool.map(_simulnet_rep, lkw)
+        finally:
+            pool.close()
+            pool.join()
+
+    # <filename>_seed<seed>_<layout>.h5 -> <filename>_<layout>.h5
+    s0, f0 = lres[0]
+    _filename = f0.replace('_seed' + str(s0) + '_', '_')
+    dag = {}
+    dattrs = {}
+    for s, f in lres:
+        store = pd.HDFStore(f, 'r')
+        # [Simulation] options of the first replication
+        if s == s0:
+            attributes = store.root._v_attrs.attributes
+        for k in store.keys():
+            df = store[k]
+            df['seed'] = s
+            dag.setdefault(k, []).append(df)
+            attrs = store.get_storer(k).attrs
+            dattrs[k] = dict([(attr, getattr(attrs, attr))
+                              for attr in ['typ', 'name', 'ID', 'layout']])
+        store.close()
+    store = pd.HDFStore(_filename, 'w')
+    for k in dag:
+        store.put(k, pd.concat(dag[k]))
+        for attr in dattrs[k]:
+            setattr(store.get_storer(k).attrs, attr, dattrs[k][attr])
+    store.root._v_attrs.attributes = attributes
+    store.root._v_attrs.seeds = list(lseed)
+    store.close()
+    return _filename
+
+
+
+class Simul(Simulation):
     """
 
     Attributes
@@ -88,13 +185,16 @@ class Simul(object):  # Simpy 3
     All the previous dictionnary are obtained from the chosen simulnet.ini file
     in the project directory
 
-    """
+    The keyword arguments of the constructor override the options of the
+    [Simulation] section, e.g. Simul(seed=3,real_time=False).
+    With real_time=False the simulation is headless (no tk or network
+    display) and the event loop is run as fast as possible in a
+    simpy.Environment, otherwise it is paced by speedratio in a
+    simpy.RealtimeEnvironment.
 
-    def __init__(self):
+    """
 
-        #SimulationRT.__init__(self)  # Simpy 2
-        simpy.RealtimeEnvironment.__init__(self)  #simpy 3
-        #self.initialize()
+    def __init__(self, **kwargs):
 
         self.config = ConfigParser.ConfigParser()
         filename = pyu.getlong('simulnet.ini', pstruc['DIRSIMUL'])
@@ -107,7 +207,30 @@ class Simul(object):  # Simpy 3
         self.loc_opt = dict(self.config.items('Localization'))
         self.save_opt = dict(self.config.items('Save'))
         self.sql_opt = dict(self.config.items('Mysql'))
+        for k in kwargs:
+            if k not in self.sim_opt and k != 'real_time':
+                raise AttributeError('unknown [Simulation] option ' + k)
+            # options are stored as in the ini file
+            self.sim_opt[k] = repr(kwargs[k])
+        # The network process (PNetwork) and the Network graph are not
+        # ported to Python 3 (dict.has_key, networkx 1 API). The
+        # communication (TX, RX) and localization processes need them.
+        if ((sys.version_info.major > 2) and
+            (str2bool(self.net_opt['network']) or
+             str2bool(self.loc_opt['localization']))):
+            raise NotImplementedError('Simul : the network and localization'
+                                      ' layers are only available with'
+                                      ' Python 2, set network and'
+                                      ' localization to False in '
+                                      + filename)
         self.seed = eval(self.sim_opt['seed'])
+        self.real_time = str2bool(self.sim_opt.get('real_time', 'True'))
+        if self.real_time:
+            speedratio = float(self.sim_opt['speedratio'])
+            Simulation.__init__(self, simpy.RealtimeEnvironment(
+                factor=1. / speedratio, strict=False))
+        else:
+            Simulation.__init__(self, simpy.Environment())
 
         self.traj = Trajectories()
 
@@ -117,6 +240,9 @@ class Simul(object):  # Simpy 3
         self.roomlist = []
 
         self.finish = False
+        # the rooms of the agents are drawn at their creation
+        seed(self.seed)
+        np.random.seed(self.seed)
         self.create()
 
     def __repr__(self):
@@ -307,9 +433,11 @@ class Simul(object):  # Simpy 3
         # Network
         self.create_network()
 
-        if str2bool(self.sim_opt['showtk']):
-            self.create_visual()
-        self.create_show()
+        # no display in headless mode
+        if self.real_time:
+            if str2bool(self.sim_opt['showtk']):
+                self.create_visual()
+            self.create_show()
 
         if str2bool(self.save_opt['savep']):
             self.save = Save(L=self.L, net=self.net, sim=self)
@@ -339,15 +467,23 @@ class Simul(object):  # Simpy 3
 
     def savepandas(self):
         """ save mechanics in pandas hdf5 format
+
+        Returns
+        -------
+
+        filename : string
+            <filename>_<layout>.h5 in DIRNETSAVE
+
         """
         filename = pyu.getlong(
             eval(self.sim_opt["filename"]), pstruc['DIRNETSAVE'])
         layfile = self.L._filename.split('.')[0]
-        store = pd.HDFStore(filename + '_' + layfile + '.h5', 'w')
+        filename = filename + '_' + layfile + '.h5'
+        store = pd.HDFStore(filename, 'w')
         for a in self.lAg:
 
             if a.typ != 'ap':
-                store.put(a.ID, a.meca.df.convert_objects())
+                store.put(a.ID, a.meca.df.infer_objects())
 
             else:  # if agent acces point, its position is saved
                 store.put(a.ID, a.posdf)
@@ -361,21 +497,24 @@ class Simul(object):  # Simpy 3
         store.close()
         self.traj.loadh5(
             eval(self.sim_opt["filename"]) + '_' + layfile + '.h5')
+        return filename
 
+    def runsimul(self):
+        """ run simulation
 
+        Notes
+        -----
 
+        If self.real_time is False the events are processed as fast as
+        possible, speedratio is ignored.
 
-
-    def runsimul(self):
-        """ run simulation
         """
 
         if not self.finish:
             # random number seed
             seed(self.seed)
-            self.simulate(until=float(self.sim_opt['duration']),
-                          real_time=True,
-                          rel_speed=float(self.sim_opt['speedratio']))
+            np.random.seed(self.seed)
+            self.env.run(until=float(self.sim_opt['duration']))
 
             self.the_world._boids = {}
 
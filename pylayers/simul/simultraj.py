@@ -31,6 +31,206 @@ from pylayers.mobility.ban.body import *
 from pylayers.antprop.statModel import *
 import pandas as pd
 import csv
+import time
+import multiprocessing as mp
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
+
+# columns of the simulation dataframe
+_dfcolumns = ['id_a', 'id_b',
+              'x_a', 'y_a', 'z_a',
+              'x_b', 'y_b', 'z_b',
+              'd', 'eng', 'typ',
+              'wstd', 'fcghz',
+              'fbminghz', 'fbmaxghz', 'fstep', 'aktk_id',
+              'sig_id', 'ray_id', 'Ct_id', 'H_id', 'save_idx'
+              ]
+
+
+def _simulrun_init(S, kw, counter):
+    """ initialize a Simul.run worker process
+
+    Parameters
+    ----------
+
+    S : Simul
+    kw : dict
+        fmod, fGHz and DLkwargs of Simul.run
+    counter : mp.Value
+        number of started workers
+
+    Notes
+    -----
+
+    The context is stored in a module global. With the fork start method
+    the Simul and its Layout are inherited by the worker without being
+    pickled, they are private copies of the worker. Each worker has its
+    own DLink, saved in its own Links_<save_idx>_<Layout>.h5 file
+    (save_idx = S.DL.save_idx + worker rank), so that workers never
+    write in the same file. The signatures are run with si_nproc=1 in
+    the workers.
+
+    """
+    global _simulrun_ctx
+    with counter.get_lock():
+        counter.value += 1
+        rank = counter.value
+    S.DL = DLink(L=S.L, verbose=False, save_idx=S.DL.save_idx + rank,
+                 cutoff=S.DL.cutoff)
+    # the pool workers are daemonic, they can not start a signature pool
+    kw = dict(kw, DLkwargs=dict(kw['DLkwargs'], si_nproc=1))
+    _simulrun_ctx = (S, kw)
+
+def _simulrun(job):
+    """ evaluate a (t,link) job of Simul.run in a worker
+
+    Parameters
+    ----------
+
+    job : tuple
+        (t, na, nb, w, row, dnode) row is the dataframe row without the
+        identifiers of the DLink results, dnode the positions and
+        orientations of na and nb at time t
+
+    Returns
+    -------
+
+    (t, row, ak, tk)
+
+    """
+    S, kw = _simulrun_ctx
+    t, na, nb, w, row, dnode = job
+    for n in dnode:
+        S.N.node[n]['p'] = dnode[n][0]
+        S.N.node[n]['T'] = dnode[n][1]
+    S.evaldeter(na, nb, w,
+                applywav=False,
+                fmod=kw['fmod'],
+                fGHz=kw['fGHz'],
+                **kw['DLkwargs'])
+    for k in ['sig', 'ray', 'Ct', 'H']:
+        row[k + '_id'] = S.DL.dexist[k]['grpname']
+    row['save_idx'] = S.DL.save_idx
+    return t, row, S.DL.H.y, S.DL.H.taud
+
+def _simulsave(filenameh5, lres, replace_data, lid):
+    """ write simulation results in the simultraj h5 file
+
+    Parameters
+    ----------
+
+    filenameh5 : string
+        simultraj h5 file
+    lres : list
+        (t, row, ak, tk) results
+    replace_data : boolean
+        if True the rows and the alpha_k, tau_k groups of an already
+        simulated (t,link) are replaced by the new ones, if False the
+        new result is dropped
+    lid : set
+        aktk_id of the rows of the file, updated by this function
+        (None if it has not been read yet)
+
+    Returns
+    -------
+
+    lres : list
+        the written results
+    lid : set
+
+    Notes
+    -----
+
+    The rows are appended to the 'df' table of the pandas store and
+    alpha_k, tau_k are saved in the <aktk_id> groups (see
+    Simul._saveh5). An already simulated (t,link) has the same aktk_id.
+
+    """
+    store = pd.HDFStore(filenameh5)
+    try:
+        if lid is None:
+            if 'df' in store:
+                lid = set(store['df']['aktk_id'])
+            else:
+                lid = set([])
+        lexist = [row['aktk_id'] for t, row, ak, tk in lres
+                  if row['aktk_id'] in lid]
+        if len(lexist) > 0:
+            if replace_data:
+                df = store['df']
+                df = df[~df['aktk_id'].isin(lexist)]
+                store.remove('df')
+                if len(df) > 0:
+                    store.append('df', df)
+            else:
+                lres = [x for x in lres if x[1]['aktk_id'] not in lid]
+        if len(lres) > 0:
+            df = pd.concat([pd.DataFrame(row, columns=_dfcolumns, index=[t])
+                            for t, row, ak, tk in lres])
+            store.append('df', df)
+    finally:
+        store.close()
+    fh5 = h5py.File(filenameh5, 'a')
+    try:
+        for t, row, ak, tk in lres:
+            grpname = row['aktk_id'].strip()
+            if grpname in fh5:
+                del fh5[grpname]
+            f = fh5.create_group(grpname)
+            f.create_dataset('alphak', data=ak)
+            f.create_dataset('tauk', data=tk)
+            lid.add(row['aktk_id'])
+    finally:
+        fh5.close()
+    return lres, lid
+
+def _simulwriter(queue, filenameh5, nflush, nwritten, replace_data=True):
+    """ single writer of the simulation results
+
+    Parameters
+    ----------
+
+    queue : mp.Queue
+        (t, row, ak, tk) items, None ends the writer
+    filenameh5 : string
+        simultraj h5 file
+    nflush : int
+        number of results appended at once
+    nwritten : mp.Value
+        number of written results
+    replace_data : boolean
+        if True the already simulated (t,link) of the file are replaced,
+        if False they are kept and the new results are dropped
+
+    Notes
+    -----
+
+    The results are written by _simulsave. This process is the only one
+    which opens the file during a parallel run.
+
+    """
+    lbuf = []
+    lid = None
+
+    def flush(lid):
+        lres, lid = _simulsave(filenameh5, lbuf, replace_data, lid)
+        with nwritten.get_lock():
+            nwritten.value += len(lres)
+        del lbuf[:]
+        return lid
+
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        lbuf.append(item)
+        if len(lbuf) >= nflush:
+            lid = flush(lid)
+    if len(lbuf) > 0:
+        flush(lid)
+
 
 class Simul(PyLayers):
     """
@@ -345,9 +545,9 @@ class Simul(PyLayers):
         (a, t )
 
         a : ndarray
-            alpha_k
+            alpha_k (transfer function of the rays, DLink.H.y)
         t : ndarray
-            tau_k
+            tau_k (delays of the rays, DLink.H.taud)
 
         See Also
         --------
@@ -383,9 +583,9 @@ class Simul(PyLayers):
             assert len(fGHz)>0,"fGHz has not been defined"
             self.DL.fGHz = fGHz
 
-        a, t = self.DL.eval(**kwargs)
+        self.DL.eval(**kwargs)
 
-        return a, t
+        return self.DL.H.y, self.DL.H.taud
 
     def evalstat(self, na, nb):
         """ statistical evaluation of a link
@@ -462,9 +662,37 @@ class Simul(PyLayers):
         replace_data: boolean (True)
             if True , reference id of all already simulated link will be erased
                 and replace by new simulation id
+            if False, the already simulated (t,link) of the h5 file are
+                kept and the new results are dropped
 
         fGHz : np.array
             frequency in GHz
+        nproc : int
+            number of worker processes (default 1)
+        nflush : int
+            number of results appended at once to the h5 file (nproc>1)
+        timeout : float
+            time (s) after which a result which can not be queued to the
+            writer checks that the writer is alive (nproc>1)
+
+        Notes
+        -----
+
+        The signatures are computed once per visited cycle pair, the
+        deterministic links share the signature cache of the Layout
+        (see DLink.sigcache). Its statistics are logged at the end of
+        the run.
+
+        With nproc > 1 the (t,link) jobs are produced in time order by
+        the main process, which updates the positions of the scene, and
+        evaluated in a pool of workers, each with its own DLink (see
+        _simulrun_init). The results are written by a single writer
+        process (see _simulwriter), alpha_k and tau_k included, as in
+        the serial run. The signatures are not run in parallel inside
+        the workers (si_nproc of DLkwargs is set to 1).
+        The progress is in self.runstats (number of jobs, evaluated and
+        written jobs, elapsed time, jobs per second) and logged every
+        10% of the run.
 
 
         Examples
@@ -492,7 +720,10 @@ class Simul(PyLayers):
                     'DLkwargs':{},
                     'replace_data':True,
                     'fmod':'force',
-                    'fGHz':np.array([2.45])
+                    'fGHz':np.array([2.45]),
+                    'nproc':1,
+                    'nflush':100,
+                    'timeout':10.
                     }
 
         for k in defaults:
@@ -508,6 +739,10 @@ class Simul(PyLayers):
         I2I = kwargs.pop('I2I')
         fmod = kwargs.pop('fmod')
         self.fGHz = kwargs.pop('fGHz')
+        nproc = kwargs.pop('nproc')
+        nflush = kwargs.pop('nflush')
+        timeout = kwargs.pop('timeout')
+        replace_data = kwargs.pop('replace_data')
 
         self.todo.update({'OB':OB,'B2B':B2B,'B2I':B2I,'I2I':I2I})
 
@@ -593,6 +828,19 @@ class Simul(PyLayers):
             ta = kwargs['t']
             it = range(len(ta))
 
+        if nproc > 1:
+            if DLkwargs.get('si_nproc', 1) > 1:
+                logger.warning(" Simul.run : si_nproc is set to 1 in the"
+                               " %d workers", nproc)
+            self._runpool(ta, it, wstd, links, nproc, nflush,
+                          {'fmod':fmod, 'fGHz':self.fGHz,
+                           'DLkwargs':DLkwargs}, timeout=timeout,
+                          replace_data=replace_data)
+            return
+
+        filenameh5 = pyu.getlong(self.filename, pstruc['DIRLNK'])
+        lid = None
+
         ## Start to loop over time
         ##   ut : counter
         ##   t  : time value (s)
@@ -640,44 +888,183 @@ class Simul(PyLayers):
                         # else :
 
                         # Get alphak an tauk
-                        self._ak = self.DL.H.ak
-                        self._tk = self.DL.H.tk
-                        aktk_id = str(ut) + '_' + na + '_' + nb + '_' + w
-                        # this is a dangerous way to proceed ! 
-                        # the id as a finite number of characters
-                        while len(aktk_id)<40:
-                            aktk_id = aktk_id + ' '
-                        df = pd.DataFrame({ 'id_a': na,
-                                    'id_b': nb,
-                                    'x_a': self.N.node[na]['p'][0],
-                                    'y_a': self.N.node[na]['p'][1],
-                                    'z_a': self.N.node[na]['p'][2],
-                                    'x_b': self.N.node[nb]['p'][0],
-                                    'y_b': self.N.node[nb]['p'][1],
-                                    'z_b': self.N.node[nb]['p'][2],
-                                    'd': self.N.edge[na][nb]['d'],
-                                    'eng': eng,
-                                    'typ': typ,
-                                    'wstd': w,
-                                    'fcghz': self.N.node[na]['wstd'][w]['fcghz'],
-                                    'fbminghz': self.fGHz[0],
-                                    'fbmaxghz': self.fGHz[-1],
-                                    'nf': len(self.fGHz),
-                                    'aktk_id':aktk_id,
-                                    'sig_id': self.DL.dexist['sig']['grpname'],
-                                    'ray_id': self.DL.dexist['ray']['grpname'],
-                                    'Ct_id': self.DL.dexist['Ct']['grpname'],
-                                    'H_id': self.DL.dexist['H']['grpname'],
-                                                },columns=['id_a', 'id_b',
-                                              'x_a', 'y_a', 'z_a',
-                                              'x_b', 'y_b', 'z_b',
-                                              'd', 'eng', 'typ',
-                                              'wstd', 'fcghz',
-                                              'fbminghz', 'fbmaxghz', 'fstep', 'aktk_id',
-                                              'sig_id', 'ray_id', 'Ct_id', 'H_id'
-                                              ],index= [t])  #self._time[ut]])
-
-                        self.savepd(df)
+                        self._ak = self.DL.H.y
+                        self._tk = self.DL.H.taud
+                        row = self._linkrow(ut, na, nb, w, typ, eng)
+                        for k in ['sig', 'ray', 'Ct', 'H']:
+                            row[k + '_id'] = self.DL.dexist[k]['grpname']
+                        row['save_idx'] = self.DL.save_idx
+                        lres, lid = _simulsave(filenameh5,
+                                               [(t, row, self._ak, self._tk)],
+                                               replace_data, lid)
+
+        logger.info(" Simul.run %s", str(self.DL.sigcache))
+
+    def _linkrow(self, ut, na, nb, w, typ, eng):
+        """ dataframe row of a link at the current time
+
+        Parameters
+        ----------
+
+        ut : int
+            time index
+        na : string
+        nb : string
+        w : string
+            wireless standard
+        typ : string
+            type of link
+        eng : float
+
+        Returns
+        -------
+
+        row : dict
+            the identifiers of the DLink results (sig_id, ray_id, Ct_id,
+            H_id) are left empty, they are groups of the DLink file
+            Links_<save_idx>_<Layout>.h5
+
+        """
+        aktk_id = str(ut) + '_' + na + '_' + nb + '_' + w
+        # this is a dangerous way to proceed !
+        # the id as a finite number of characters
+        while len(aktk_id)<40:
+            aktk_id = aktk_id + ' '
+        row = {'id_a': na,
+               'id_b': nb,
+               'x_a': self.N.node[na]['p'][0],
+               'y_a': self.N.node[na]['p'][1],
+               'z_a': self.N.node[na]['p'][2],
+               'x_b': self.N.node[nb]['p'][0],
+               'y_b': self.N.node[nb]['p'][1],
+               'z_b': self.N.node[nb]['p'][2],
+               'd': self.N.edge[na][nb]['d'],
+               'eng': eng,
+               'typ': typ,
+               'wstd': w,
+               'fcghz': self.N.node[na]['wstd'][w]['fcghz'],
+               'fbminghz': self.fGHz[0],
+               'fbmaxghz': self.fGHz[-1],
+               'nf': len(self.fGHz),
+               'aktk_id':aktk_id,
+               'sig_id': '',
+               'ray_id': '',
+               'Ct_id': '',
+               'H_id': '',
+               'save_idx': 0}
+        return row
+
+    def _jobs(self, ta, it, wstd, links):
+        """ producer of the (t,link) jobs of Simul.run
+
+        The positions of the scene are updated for each time, the jobs
+        carry the positions and orientations of their nodes.
+
+        """
+        for ks, ut in enumerate(it):
+            t = ta[ut]
+            self.ctime = t
+            self.update_pos(t)
+            for w in wstd:
+                for na, nb, typ in links[w]:
+                    if self.todo[typ]:
+                        row = self._linkrow(ut, na, nb, w, typ, 0)
+                        dnode = {n:(np.array(self.N.node[n]['p']),
+                                    np.array(self.N.node[n]['T']))
+                                 for n in (na, nb)}
+                        yield (t, na, nb, w, row, dnode)
+
+    def _runpool(self, ta, it, wstd, links, nproc, nflush, kw, timeout=10.,
+                 replace_data=True):
+        """ parallel run (see Simul.run)
+
+        Parameters
+        ----------
+
+        ta : np.array
+            time values
+        it : iterable
+            time indices in the order of evaluation
+        wstd : list
+        links : dict
+        nproc : int
+            number of workers
+        nflush : int
+            number of results appended at once by the writer
+        kw : dict
+            fmod, fGHz and DLkwargs
+        timeout : float
+            time (s) of a blocked put on the writer queue after which the
+            writer is checked
+        replace_data : boolean
+            passed to the writer (see _simulwriter)
+
+        Notes
+        -----
+
+        The writer queue is bounded. A put which blocks for more than
+        timeout seconds checks that the writer is alive, a RuntimeError
+        is raised if it has exited.
+
+        """
+        def put(item):
+            while True:
+                try:
+                    queue.put(item, timeout=timeout)
+                    return
+                except Full:
+                    if not writer.is_alive():
+                        queue.cancel_join_thread()
+                        raise RuntimeError('Simul.run : the writer process '
+                                           'has exited (exit code %s)'
+                                           % writer.exitcode)
+
+        njob = sum(len([l for l in links[w] if self.todo[l[2]]])
+                   for w in wstd) * len(it)
+        filenameh5 = pyu.getlong(self.filename, pstruc['DIRLNK'])
+        queue = mp.Queue(maxsize=4*nflush)
+        nwritten = mp.Value('i', 0)
+        writer = mp.Process(target=_simulwriter,
+                            args=(queue, filenameh5, nflush, nwritten,
+                                  replace_data))
+        writer.start()
+        counter = mp.Value('i', 0)
+        pool = mp.Pool(processes=nproc,
+                       initializer=_simulrun_init,
+                       initargs=(self, kw, counter))
+        self.runstats = {'njob':njob, 'ndone':0, 'nwritten':0,
+                         'elapsed':0., 'rate':0., 'nproc':nproc}
+        tic = time.time()
+        step = max(njob//10, 1)
+        try:
+            for ndone, res in enumerate(pool.imap_unordered(_simulrun,
+                                        self._jobs(ta, it, wstd, links)), 1):
+                put(res)
+                elapsed = time.time() - tic
+                self.runstats.update({'ndone':ndone,
+                                      'nwritten':nwritten.value,
+                                      'elapsed':elapsed,
+                                      'rate':ndone/elapsed})
+                if (ndone % step == 0) or self.verbose:
+                    logger.info(" Simul.run %d/%d links %.1f links/s",
+                                ndone, njob, ndone/elapsed)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if writer.is_alive():
+                put(None)
+            else:
+                queue.cancel_join_thread()
+            writer.join()
+        if writer.exitcode != 0:
+            raise RuntimeError('Simul.run : the writer process has exited '
+                               '(exit code %s)' % writer.exitcode)
+        self.runstats.update({'nwritten':nwritten.value,
+                              'elapsed':time.time() - tic})
+        logger.info(" Simul.run %s", str(self.runstats))
 
     def replace_data(self, df):
         """check if a dataframe df already exists in self.data
@@ -0,0 +1,32 @@
+from pylayers.simul.link import *
+
+fGHz = np.linspace(4,6,11)
+DL = DLink(L='defstr.lay',fGHz=fGHz)
+
+# 2 links in the same cycle pair and 1 link in a different one
+lab = [(np.array([1,2,1.2]),np.array([8,4,1.2])),
+       (np.array([1.2,2.1,1.5]),np.array([8.1,3.8,1.2])),
+       (np.array([8,4,1.2]),np.array([1,2,1.2]))]
+
+H = DL.eval_many(lab,cutoff=3,ra_ceil_H=0)
+assert H.ptr[-1] == H.y.shape[0]
+assert (H.ilink[H.ptr[1]:H.ptr[2]] == 1).all()
+assert DL.lps > 0
+
+for k,(a,b) in enumerate(lab):
+    DL.a = a
+    DL.b = b
+    DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+    u = slice(H.ptr[k],H.ptr[k+1])
+    assert np.allclose(H.y[u],DL.H.y)
+    assert np.allclose(H.taud[u],DL.H.taud)
+    assert np.allclose(H.doa[u],DL.H.doa)
+
+# both entry points use the exact slab coefficients by default
+DL.a, DL.b = lab[0]
+DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+H = DL.eval_many(lab[:1],cutoff=3,ra_ceil_H=0)
+assert np.allclose(H.y,DL.H.y,rtol=1e-12,atol=0)
+# the lookup tables are opt-in
+Ht = DL.eval_many(lab[:1],cutoff=3,ra_ceil_H=0,ra_mode='tab')
+assert np.allclose(Ht.y,H.y,rtol=1e-4)
@@ -0,0 +1,49 @@
+from pylayers.simul.link import *
+
+fGHz = np.linspace(4,6,11)
+DL = DLink(L='defstr.lay',fGHz=fGHz,save_idx=99,force_create=True)
+S = DL.store
+assert S is linkstore(S.filename)
+
+# more points than the linear part of the store, the KD-tree is rebuilt
+np.random.seed(0)
+P = np.random.rand(200,3)*np.array([10,5,2])
+lu = [DL.get_idx('p_map',p)[1] for p in P]
+assert lu == list(range(lu[0],lu[0]+len(P)))
+# the points out of the tree stay a small part of the map
+assert S._np - S._ntree <= max(64, S._ntree // 8)
+# points within the tolerance are found
+for u,p in enumerate(P):
+    assert DL.get_idx('p_map',p+1e-4)[0] == 'r'
+    assert DL.array_exist('p_map',p)[0] == lu[u]
+assert len(DL.array_exist('p_map',np.array([-1.,-1.,-1.]))) == 0
+assert DL.get_idx('A_map','Omni') == DL.get_idx('A_map','Omni')
+assert DL.get_idx('T_map',np.eye(3))[1] == DL.get_idx('T_map',np.eye(3))[1]
+
+# evaluation and cached evaluation
+DL.a = np.array([1,2,1.2])
+DL.b = np.array([8,4,1.2])
+DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+H = DL.H
+DL.eval(force=[],cutoff=3,ra_ceil_H=0,si_progress=False)
+DL.eval(force=[],cutoff=3,ra_ceil_H=0,si_progress=False)
+assert S.hits > 0
+assert np.allclose(H.y,DL.H.y)
+# an in-place modification does not change the kept object
+DL.H.y[:] = 0
+DL.eval(force=[],cutoff=3,ra_ceil_H=0,si_progress=False)
+assert np.allclose(H.y,DL.H.y)
+
+# the maps of the file are the maps of the store
+closelinkstores(S.filename)
+f = h5py.File(S.filename,'r')
+assert np.allclose(f['p_map'][lu[0]:lu[-1]+1],P)
+assert 'H/'+DL.dexist['H']['grpname'] in f
+f.close()
+
+# a new store reads the file
+DL.eval(force=[],cutoff=3,ra_ceil_H=0,si_progress=False)
+assert DL.store is not S
+assert DL.store.misses > 0
+assert np.allclose(H.y,DL.H.y)
+closelinkstores()
@@ -0,0 +1,54 @@
+from pylayers.simul.link import *
+
+fGHz = np.linspace(4,6,11)
+DL = DLink(L='defstr.lay',fGHz=fGHz)
+DL.sigcache.clear()
+
+# positions of b along a trajectory inside the same cycle
+lb = [np.array([8,4,1.2]),np.array([8.1,3.8,1.2]),np.array([7.9,4.1,1.2])]
+DL.a = np.array([1,2,1.2])
+# the signatures are not forced, the rays are
+force = ['ray2','ray','Ct','H']
+lH = []
+for b in lb:
+    DL.b = b
+    DL.eval(force=force,cutoff=3,ra_ceil_H=0,si_progress=False)
+    lH.append(DL.H)
+assert DL.sigcache.misses == 1
+assert DL.sigcache.hits == len(lb)-1
+
+# forced signatures do not read the cache
+DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False)
+assert DL.sigcache.hits == len(lb)-1
+
+# the cache is shared by the DLinks of the same layout
+DL2 = DLink(L='defstr.lay',fGHz=fGHz)
+assert DL2.sigcache is DL.sigcache
+
+# same channels without the cache
+for b,H in zip(lb,lH):
+    DL.b = b
+    DL.eval(force=True,cutoff=3,ra_ceil_H=0,si_progress=False,si_cache=False)
+    assert np.allclose(H.y,DL.H.y)
+    assert np.allclose(H.taud,DL.H.taud)
+
+# a different parameter of Signatures.run is a different entry
+DL.eval(force=force,cutoff=3,ra_ceil_H=0,si_progress=False,diffraction=False)
+assert DL.sigcache.misses == 2
+assert len(DL.sigcache) == 2
+
+# an edited layout has its own cache
+sic = DL.sigcache
+DL.L.Gs.node[1]['name'] = 'METAL'
+DL.L.g2npy()
+assert DL.sigcache is not sic
+assert len(DL.sigcache) == 0
+
+# only the caches of the last used layouts are kept
+from pylayers.antprop import signature
+for k in range(signature._nsigcaches):
+    DL.L.Gs.node[1]['z'] = (0, 3. + k)
+    DL.L.g2npy()
+    DL.sigcache
+assert len(signature._sigcaches) == signature._nsigcaches
+assert sic not in signature._sigcaches.values()
@@ -0,0 +1,34 @@
+import os
+from pylayers.simul.simulnet import *
+
+# two short headless replications, in this process then in 2 workers
+lseed = [1, 2]
+kw = dict(duration=3.0)
+f1 = runreplications(lseed, nproc=1, filename='simulnet_rep1', **kw)
+f2 = runreplications(lseed, nproc=2, filename='simulnet_rep2', **kw)
+
+s1 = pd.HDFStore(f1, 'r')
+s2 = pd.HDFStore(f2, 'r')
+assert list(s1.root._v_attrs.seeds) == lseed
+# the [Simulation] options are kept in the aggregated store
+attributes = s1.root._v_attrs.attributes
+assert eval(attributes['duration']) == kw['duration']
+assert not eval(attributes['real_time'])
+assert sorted(s1.keys()) == sorted(s2.keys())
+for k in s1.keys():
+    df1 = s1[k]
+    df2 = s2[k]
+    assert sorted(set(df1['seed'])) == lseed
+    # the same seeds give the same rows
+    assert df1.equals(df2), k
+    if s1.get_storer(k).attrs.typ != 'ap':
+        u = df1[df1['seed'] == 1].drop('seed', axis=1)
+        v = df1[df1['seed'] == 2].drop('seed', axis=1)
+        assert not u.equals(v), k
+s1.close()
+s2.close()
+# <filename>_<layout>.h5 and <filename>_seed<seed>_<layout>.h5
+for name, f in [('simulnet_rep1', f1), ('simulnet_rep2', f2)]:
+    os.remove(f)
+    for s in lseed:
+        os.remove(f.replace(name + '_', name + '_seed' + str(s) + '_'))
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import multiprocessing as mp
+import h5py
+from pylayers.simul.simultraj import *
+from pylayers.simul.simultraj import _simulsave, _simulwriter, _dfcolumns
+
+# writer of Simul.run on synthetic results (no trajectory needed)
+filenameh5 = os.path.join(tempfile.mkdtemp(),'simultraj_test.h5')
+
+def result(ut,val):
+    aktk_id = (str(ut)+'_a_b_w').ljust(40)
+    row = {k:'' for k in _dfcolumns}
+    row.update({'id_a':'a','id_b':'b','wstd':'w','aktk_id':aktk_id,
+                'd':float(val),'save_idx':0})
+    return (0.1*ut,row,val*np.ones(3),val*np.arange(3.))
+
+def read():
+    df = pd.read_hdf(filenameh5,'df')
+    with h5py.File(filenameh5,'r') as fh5:
+        dak = {k.strip():fh5[k.strip()]['alphak'][:] for k in df['aktk_id']}
+    return df, dak
+
+lres, lid = _simulsave(filenameh5,[result(0,1),result(1,1)],True,None)
+assert len(lres) == 2
+df, dak = read()
+assert len(df) == 2
+
+# replace_data False : the already simulated (t,link) are kept
+lres, lid = _simulsave(filenameh5,[result(1,2),result(2,2)],False,lid)
+assert len(lres) == 1
+df, dak = read()
+assert len(df) == 3
+assert (dak['1_a_b_w'] == 1).all()
+assert (dak['2_a_b_w'] == 2).all()
+
+# replace_data True : their rows and groups are replaced
+# (the set of ids is read from the file)
+lres, lid = _simulsave(filenameh5,[result(1,3),result(3,3)],True,None)
+assert len(lres) == 2
+df, dak = read()
+assert len(df) == 4
+assert (df['aktk_id'].str.strip() == '1_a_b_w').sum() == 1
+assert df[df['aktk_id'].str.strip() == '1_a_b_w']['d'].values[0] == 3
+assert (dak['1_a_b_w'] == 3).all()
+
+# the writer honors replace_data
+for replace_data,val in [(False,3),(True,4)]:
+    queue = mp.Queue()
+    nwritten = mp.Value('i',0)
+    for ut in [0,1,4]:
+        queue.put(result(ut,4))
+    queue.put(None)
+    _simulwriter(queue,filenameh5,2,nwritten,replace_data=replace_data)
+    df, dak = read()
+    assert len(df) == 5
+    assert (dak['1_a_b_w'] == val).all()
+    assert (dak['4_a_b_w'] == 4).all()
+    assert nwritten.value == (3 if replace_data else 1)
+
+os.remove(filenameh5)
@@ -0,0 +1,45 @@
+import os
+import h5py
+from pylayers.simul.simultraj import *
+
+# the trajectory file of simulnet is in the netsave directory
+os.chdir(os.path.join(basename,pstruc['DIRNETSAVE']))
+S = Simul('simulnet_TA-Office.h5')
+filenameh5 = pyu.getlong(S.filename,pstruc['DIRLNK'])
+
+w = list(S.N.links.keys())[0]
+links = {w:[l for l in S.N.links[w] if S.todo[l[2]]][:2]}
+lt = S.time[[10,20,30]]
+DLkwargs = {'cutoff':2,'ra_ceil_H':0}
+
+def runh5(**kwargs):
+    """ run the short trajectory and read the h5 output
+    """
+    if os.path.isfile(filenameh5):
+        os.remove(filenameh5)
+    S.run(links=links,t=lt,btr=False,**kwargs)
+    df = pd.read_hdf(filenameh5,'df')
+    df = df.sort_values('aktk_id')
+    daktk = {}
+    with h5py.File(filenameh5,'r') as fh5:
+        for k in df['aktk_id']:
+            g = fh5[k.strip()]
+            daktk[k] = (g['alphak'][:],g['tauk'][:])
+    os.remove(filenameh5)
+    return df, daktk
+
+df1, daktk1 = runh5(DLkwargs=DLkwargs)
+# si_nproc > 1 is not used inside the daemonic workers
+df2, daktk2 = runh5(DLkwargs=dict(DLkwargs,si_nproc=2),nproc=2,nflush=2)
+
+assert len(df1) == len(lt)*len(links[w])
+assert S.runstats['nwritten'] == len(df1)
+# the identifiers of the DLink results are in the file of each worker
+lcol = [c for c in df1.columns
+        if c not in ['sig_id','ray_id','Ct_id','H_id','save_idx']]
+assert (df1.index.values == df2.index.values).all()
+for c in lcol:
+    assert (df1[c].values == df2[c].values).all(), c
+for k in daktk1:
+    assert np.allclose(daktk1[k][0],daktk2[k][0])
+    assert np.allclose(daktk1[k][1],daktk2[k][1])
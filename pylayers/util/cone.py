@@ -34,6 +34,13 @@ import pdb
 import logging
 
 
+def _cross(a,b):
+    """ z component of the cross product of 2 vectors of the plane
+
+    np.cross is slow for single 2D vectors
+    """
+    return a[0]*b[1] - a[1]*b[0]
+
 class Cone(PyLayers):
 
     def __init__(self, a=np.array([1,0]), b = np.array([0,1]), apex=np.array([0, 0])):
@@ -49,7 +56,7 @@ class Cone(PyLayers):
         an = a/np.sqrt(np.dot(a,a))
         bn = b/np.sqrt(np.dot(b,b))
 
-        if np.cross(an,bn) > 0:
+        if _cross(an,bn) > 0:
             self.u = an
             self.v = bn
         else:  
@@ -58,7 +65,7 @@ class Cone(PyLayers):
         
         # -1 < gamma < 1
         self.dot = np.dot(self.u,self.v)
-        self.cross = np.cross(self.u,self.v)
+        self.cross = _cross(self.u,self.v)
 
         if self.cross!=0:
             self.degenerated = False
@@ -135,122 +142,14 @@ class Cone(PyLayers):
             plu.displot(pta,phe,fig=f,ax=a)
             plt.show()
 
-
-        vc  = (self.u+self.v)/2
-        #vcn = vc/np.sqrt(np.dot(vc,vc))
-        w = vc/np.sqrt(np.dot(vc,vc))
-        w = w.reshape(2,1)
-        #w  = np.array([vcn[1],-vcn[0]])
-
-        ptama = pta - self.apex[:,None]
-        phema = phe - self.apex[:,None]
-
-        dtaw = np.sum(ptama*w,axis=0)
-        dhew = np.sum(phema*w,axis=0)
-
-        blta = (dtaw>=0)|(np.isclose(dtaw,0.))
-        blhe = (dhew>=0)|(np.isclose(dhew,0.))
-        #if 'seg1' in self.__dict__:
-        #    pa =  self.seg1[:,0].reshape(2,1)
-        #    pb = (self.seg1[:,0]+w).reshape(2,1)
-        #else:
-        #    pa = self.apex.reshape(2,1)
-        #    pb = pa+w.reshape(2,1)
-        #blta = geu.isleft(pa,pb,pta)
-        #blhe = geu.isleft(pa,pb,phe)
-        # segment candidate for being above segment 1 (,Nseg)
-        boup = blta & blhe
-        # type of segment
+        typ, proba = belong_seg_cones(self.apex[:,None],
+                                      self.u[:,None],
+                                      self.v[:,None],
+                                      np.array([self.angle]),
+                                      pta, phe, prob=prob)
         if prob:
-            proba = np.zeros(np.shape(pta)[1])
-        else :
-            proba =[]
-        typ   = np.zeros(np.shape(pta)[1])
-        # is tail out ? bo1 | bo2  
-        # btaol : boolean tail out left 
-        # btaor : boolean tail out right 
-        # bheol : boolean head out left 
-        # bheor : boolean head out right #
-        # among upper segment check position wrt cone
-        #btaol,btaor = self.outside_point(pta)
-        #bheol,bheor = self.outside_point(phe)
-        btaor,btaol = self.outside_point(pta)
-        bheor,bheol = self.outside_point(phe)
-        # tail and head are they out cone on the same side ? 
-        # if the two termination points are not on the same side of the cone
-        # --> segment is in.
-        # boin = (~((btaol&bheol)|(btaor&bheor)))&boup
-        # full interception (proba to reach = 1) 
-        bfull = ((btaol&bheor)|(btaor&bheol))&boup
-        if prob :
-            proba[bfull] = 1
-        typ[bfull] = 1
-
-        #(he-apex).v
-        btalhein  = (btaol & ~bheol & ~bheor)&boup
-        if (prob and not (btalhein==False).all()):
-            v2  = phe[:,btalhein]-self.apex.reshape(2,1)
-            vn2 = v2/np.sqrt(np.sum(v2*v2,axis=0))
-            vvn2 = np.dot(self.v,vn2)
-            # paranoid verification of scalar product \in [-1,1]
-            vvn2 = np.minimum(vvn2,np.ones(len(vvn2)))
-            vvn2 = np.maximum(vvn2,-np.ones(len(vvn2)))
-            pr2 = np.arccos(vvn2)/self.angle
-            proba[btalhein] = pr2
-        typ[btalhein] = 2
-
-        #(ta-apex).v
-        bheltain  = (bheol & ~btaol & ~btaor)&boup
-        if (prob and not (bheltain==False).all()):
-            v3  = pta[:,bheltain]-self.apex.reshape(2,1)
-            vn3 = v3/np.sqrt(np.sum(v3*v3,axis=0))
-            vvn3 = np.dot(self.v,vn3)
-            vvn3 = np.minimum(vvn3,np.ones(len(vvn3)))
-            vvn3 = np.maximum(vvn3,-np.ones(len(vvn3)))
-            pr3 = np.arccos(vvn3)/self.angle
-            proba[bheltain] = pr3
-        typ[bheltain] = 3
-
-        #ta.u
-        bhertain  = (bheor & ~btaol & ~btaor)&boup
-        if (prob and not(bhertain==False).all()):
-            v4  = pta[:,bhertain]-self.apex.reshape(2,1)
-            vn4 = v4/np.sqrt(np.sum(v4*v4,axis=0))
-            vvn4 = np.dot(self.u,vn4)
-            vvn4 = np.minimum(vvn4,np.ones(len(vvn4)))
-            vvn4 = np.maximum(vvn4,-np.ones(len(vvn4)))
-            pr4 = np.arccos(vvn4)/self.angle
-            proba[bhertain] = pr4
-        typ[bhertain] = 4
-
-        #he.u
-        btarhein  = (btaor & ~bheol & ~bheor)&boup
-        if (prob and not(btarhein==False).all()):
-            v5  = phe[:,btarhein]-self.apex.reshape(2,1)
-            vn5 = v5/np.sqrt(np.sum(v5*v5,axis=0))
-            vvn5 = np.dot(self.u,vn5)
-            vvn5 = np.minimum(vvn5,np.ones(len(vvn5)))
-            vvn5 = np.maximum(vvn5,-np.ones(len(vvn5)))
-            pr5 = np.arccos(vvn5)/self.angle
-            proba[btarhein] = pr5
-        typ[btarhein] = 5
-
-        #ta.he
-        btainhein  = (~btaol & ~btaor & ~bheol & ~bheor)&boup
-        if (prob and not (btainhein==0).all()):
-            va  = pta[:,btainhein]-self.apex.reshape(2,1)
-            vb  = phe[:,btainhein]-self.apex.reshape(2,1)
-            vna = va/np.sqrt(np.sum(va*va,axis=0))
-            vnb = vb/np.sqrt(np.sum(vb*vb,axis=0))
-            # dot product vna,vnb
-            vnab = np.sum(vna*vnb,axis=0)
-            vnab = np.minimum(vnab,np.ones(len(vnab)))
-            vnab = np.maximum(vnab,-np.ones(len(vnab)))
-            pr6 = np.arccos(vnab)/self.angle
-            proba[btainhein] = pr6
-        typ[btainhein] = 6
-
-        return(typ,proba)
+            proba = proba[0]
+        return(typ[0],proba)
 
     def above_seg(self):
         """
@@ -411,7 +310,7 @@ class Cone(PyLayers):
         v0n = v0/np.sqrt(np.dot(v0,v0))
         v1n = v1/np.sqrt(np.dot(v1,v1))
 
-        if np.cross(v0n,v1n) > 0:
+        if _cross(v0n,v1n) > 0:
             self.u = v0n
             self.v = v1n
             self.seg1 = seg
@@ -421,7 +320,7 @@ class Cone(PyLayers):
             self.seg1 = seg[:,::-1]
 
         self.dot = np.dot(self.u,self.v)
-        self.cross = np.cross(self.u,self.v)
+        self.cross = _cross(self.u,self.v)
 
 
         if self.cross < 1e-15:
@@ -480,7 +379,7 @@ class Cone(PyLayers):
         v0n = v0/np.sqrt(np.dot(v0,v0))
         v1n = v1/np.sqrt(np.dot(v1,v1))
 
-        if np.cross(v0n,v1n) > 0:
+        if _cross(v0n,v1n) > 0:
             self.u = v0n
             self.v = v1n
             inversion = False
@@ -505,7 +404,7 @@ class Cone(PyLayers):
             self.seg1 = self.seg1[:,::-1]
 
         self.dot = np.dot(self.u,self.v)
-        self.cross = np.cross(self.u,self.v)
+        self.cross = _cross(self.u,self.v)
 
         if self.cross < 1e-15:
             self.degenerated=True
@@ -584,11 +483,11 @@ class Cone(PyLayers):
         self.u = u/np.sqrt(np.dot(u,u))
 
         self.dot = np.dot(self.u,self.v)
-        self.cross = np.cross(self.u,self.v)
+        self.cross = _cross(self.u,self.v)
         if self.cross<0:
             self.u , self.v = self.v , self.u
             self.dot = np.dot(self.u,self.v)
-            self.cross = np.cross(self.u,self.v)
+            self.cross = _cross(self.u,self.v)
 
         if self.cross < 1e-15:
             self.degenerated=True
@@ -711,6 +610,134 @@ class Cone(PyLayers):
 
         return(fig, ax)
         
+def belong_seg_cones(apex,u,v,angle,pta,phe,prob=True):
+    """ test if segments belong to several cones
+
+    Parameters
+    ----------
+
+    apex : np.array (2xNc)
+        apex of the cones
+    u  : np.array (2xNc)
+        starting vector of the cones
+    v  : np.array (2xNc)
+        ending vector of the cones
+    angle : np.array (Nc)
+        cone angles
+    pta : np.array (2xNseg)
+    phe : np.array (2xNseg)
+    prob : boolean
+
+    Returns
+    -------
+
+    typ : np.array (NcxNseg)
+        segment type wrt each cone (see Cone.belong_seg)
+    proba : np.array (NcxNseg)
+        geometric probability ([] if prob is False)
+
+    Notes
+    -----
+
+    This is the vectorized form of Cone.belong_seg, every segment is tested
+    against every cone.
+
+    See Also
+    --------
+
+    Cone.belong_seg
+
+    """
+    Nc = np.shape(apex)[1]
+    Ns = np.shape(pta)[1]
+
+    vc = (u+v)/2
+    w = vc/np.sqrt(np.sum(vc*vc,axis=0))
+
+    # (2 x Nc x Nseg)
+    ptama = pta[:,None,:] - apex[:,:,None]
+    phema = phe[:,None,:] - apex[:,:,None]
+
+    dtaw = np.sum(ptama*w[:,:,None],axis=0)
+    dhew = np.sum(phema*w[:,:,None],axis=0)
+
+    blta = (dtaw>=0)|(np.isclose(dtaw,0.))
+    blhe = (dhew>=0)|(np.isclose(dhew,0.))
+    # segment candidate for being above segment 1 (Nc,Nseg)
+    boup = blta & blhe
+
+    # position of termination points wrt cones (see Cone.outside_point)
+    bu = (apex + u) - apex
+    bv = (apex + v) - apex
+    p0a0 = pta[0,None,:] - apex[0,:,None]
+    p1a1 = pta[1,None,:] - apex[1,:,None]
+    lu = (bu[0,:,None]*p1a1 - bu[1,:,None]*p0a0) > 0
+    lv = (bv[0,:,None]*p1a1 - bv[1,:,None]*p0a0) > 0
+    btaor = ~lu & ~lv
+    btaol = lu & lv
+    p0a0 = phe[0,None,:] - apex[0,:,None]
+    p1a1 = phe[1,None,:] - apex[1,:,None]
+    lu = (bu[0,:,None]*p1a1 - bu[1,:,None]*p0a0) > 0
+    lv = (bv[0,:,None]*p1a1 - bv[1,:,None]*p0a0) > 0
+    bheor = ~lu & ~lv
+    bheol = lu & lv
+
+    typ = np.zeros((Nc,Ns))
+    if prob:
+        proba = np.zeros((Nc,Ns))
+    else:
+        proba = []
+
+    # full interception (proba to reach = 1)
+    bfull = ((btaol&bheor)|(btaor&bheol))&boup
+    # (he-apex).v
+    btalhein = (btaol & ~bheol & ~bheor)&boup
+    # (ta-apex).v
+    bheltain = (bheol & ~btaol & ~btaor)&boup
+    # ta.u
+    bhertain = (bheor & ~btaol & ~btaor)&boup
+    # he.u
+    btarhein = (btaor & ~bheol & ~bheor)&boup
+    # ta.he
+    btainhein = (~btaol & ~btaor & ~bheol & ~bheor)&boup
+
+    typ[bfull] = 1
+    typ[btalhein] = 2
+    typ[bheltain] = 3
+    typ[bhertain] = 4
+    typ[btarhein] = 5
+    typ[btainhein] = 6
+
+    if prob:
+        proba[bfull] = 1
+        # angle between the cone vector and the termination point
+        for b,pm,vec in [(btalhein,phema,v),
+                         (bheltain,ptama,v),
+                         (bhertain,ptama,u),
+                         (btarhein,phema,u)]:
+            if b.any():
+                ub = np.where(b)
+                vp = pm[:,ub[0],ub[1]]
+                vn = vp/np.sqrt(np.sum(vp*vp,axis=0))
+                vvn = np.sum(vec[:,ub[0]]*vn,axis=0)
+                # paranoid verification of scalar product \in [-1,1]
+                vvn = np.minimum(vvn,1)
+                vvn = np.maximum(vvn,-1)
+                proba[b] = np.arccos(vvn)/angle[ub[0]]
+        # angle under which the segment is seen from the apex
+        if btainhein.any():
+            ub = np.where(btainhein)
+            va = ptama[:,ub[0],ub[1]]
+            vb = phema[:,ub[0],ub[1]]
+            vna = va/np.sqrt(np.sum(va*va,axis=0))
+            vnb = vb/np.sqrt(np.sum(vb*vb,axis=0))
+            vnab = np.sum(vna*vnb,axis=0)
+            vnab = np.minimum(vnab,1)
+            vnab = np.maximum(vnab,-1)
+            proba[btainhein] = np.arccos(vnab)/angle[ub[0]]
+
+    return(typ,proba)
+
 if __name__ == '__main__':
     plt.ion()
     doctest.testmod()
@@ -14,6 +14,7 @@ import doctest
 import os
 import matplotlib.pyplot as plt
 import numpy as np
+import math
 from scipy.linalg import toeplitz
 import pylayers.util.project as pro
 import pylayers.util.pyutil as pyu
@@ -2516,6 +2517,194 @@ class Geomoff(Geomview):
         fd.close()
 
 
+class BoxIndex(pro.PyLayers):
+    """ uniform grid spatial index of axis aligned boxes
+
+    Each box is registered in all the cells of the grid it overlaps.
+    Queries return candidate items, the exact geometric test is
+    left to the caller.
+
+    Parameters
+    ----------
+
+    bmin : np.array (2 x N)
+        lower left corner of the boxes
+    bmax : np.array (2 x N)
+        upper right corner of the boxes
+    cellsize : float
+        size of a grid cell, if 0 (default) it is chosen so that the
+        number of cells is close to the number of boxes
+
+    Examples
+    --------
+
+    >>> bmin = np.array([[0,2,5],[0,2,5]])
+    >>> bmax = np.array([[1,3,6],[1,3,6]])
+    >>> B = BoxIndex(bmin,bmax)
+    >>> iq,it = B.query(np.array([[1.5],[1.5]]),np.array([[2.5],[2.5]]))
+    >>> it
+    array([0, 1])
+
+    Box 0 is a candidate because it shares a cell with the query box.
+
+    """
+
+    def __init__(self, bmin, bmax, cellsize=0):
+        bmin = np.asarray(bmin, dtype=float).reshape(2, -1)
+        bmax = np.asarray(bmax, dtype=float).reshape(2, -1)
+        self.N = bmin.shape[1]
+        if self.N > 0:
+            self.origin = np.min(bmin, axis=1)
+            extent = np.max(bmax, axis=1) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        # tolerance for points on cell borders
+        self.eps = 1e-9 * max(1., np.max(extent))
+        if cellsize == 0:
+            area = max(extent[0], self.eps) * max(extent[1], self.eps)
+            cellsize = np.sqrt(area / max(self.N, 1))
+            if self.N > 0:
+                size = np.max(bmax - bmin, axis=0)
+                cellsize = max(cellsize, np.median(size))
+            cellsize = max(cellsize, 10 * self.eps)
+        self.cellsize = cellsize
+        self.shape = (int(extent[0] // cellsize) + 1,
+                      int(extent[1] // cellsize) + 1)
+
+        iq, cell = self._cells(bmin - self.eps, bmax + self.eps)
+        # items sorted by cell (stable sort keeps items increasing)
+        order = np.argsort(cell, kind='mergesort')
+        self.items = iq[order]
+        ncell = self.shape[0] * self.shape[1]
+        self.ptr = np.zeros(ncell + 1, dtype=int)
+        self.ptr[1:] = np.cumsum(np.bincount(cell, minlength=ncell))
+
+    def __repr__(self):
+        st = 'BoxIndex : ' + str(self.N) + ' boxes\n'
+        st = st + 'grid ' + str(self.shape) + ' cellsize ' + str(self.cellsize)
+        return(st)
+
+    def _ix(self, x, axis):
+        """ cell index along axis (clipped to the grid)
+        """
+        i = np.floor((x - self.origin[axis]) / self.cellsize).astype(int)
+        return np.clip(i, 0, self.shape[axis] - 1)
+
+    def _cells(self, qmin, qmax):
+        """ cells overlapped by boxes
+
+        Returns
+        -------
+
+        iq : np.array
+            box index
+        cell : np.array
+            cell index
+
+        """
+        ix0 = self._ix(qmin[0], 0)
+        ix1 = self._ix(qmax[0], 0)
+        iy0 = self._ix(qmin[1], 1)
+        iy1 = self._ix(qmax[1], 1)
+        ny = iy1 - iy0 + 1
+        cnt = (ix1 - ix0 + 1) * ny
+        iq = np.repeat(np.arange(len(cnt)), cnt)
+        off = np.arange(len(iq)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        cx = ix0[iq] + off // ny[iq]
+        cy = iy0[iq] + off % ny[iq]
+        return iq, cx * self.shape[1] + cy
+
+    def _gather(self, iq, cell):
+        """ items of cells, without duplicates, sorted by query then item
+        """
+        cnt = self.ptr[cell + 1] - self.ptr[cell]
+        jq = np.repeat(iq, cnt)
+        off = np.arange(len(jq)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        it = self.items[np.repeat(self.ptr[cell], cnt) + off]
+        key = np.unique(jq * max(self.N, 1) + it)
+        return key // max(self.N, 1), key % max(self.N, 1)
+
+    def query(self, qmin, qmax):
+        """ candidate boxes overlapping query boxes
+
+        Parameters
+        ----------
+
+        qmin : np.array (2 x Nq)
+        qmax : np.array (2 x Nq)
+
+        Returns
+        -------
+
+        iq : np.array
+            query index
+        it : np.array
+            box index
+
+        """
+        qmin = np.asarray(qmin, dtype=float).reshape(2, -1)
+        qmax = np.asarray(qmax, dtype=float).reshape(2, -1)
+        iq, cell = self._cells(qmin - self.eps, qmax + self.eps)
+        return self._gather(iq, cell)
+
+    def query_line(self, pa, pb):
+        """ candidate boxes crossed by line segments
+
+        Parameters
+        ----------
+
+        pa : np.array (2 x Nq)
+        pb : np.array (2 x Nq)
+
+        Returns
+        -------
+
+        iq : np.array
+            query index
+        it : np.array
+            box index
+
+        Notes
+        -----
+
+        Only the cells traversed by the segment [pa,pb] are visited,
+        not all the cells of its bounding box.
+
+        """
+        pa = np.asarray(pa, dtype=float).reshape(2, -1)
+        pb = np.asarray(pb, dtype=float).reshape(2, -1)
+        eps = self.eps
+        xlo = np.minimum(pa[0], pb[0])
+        xhi = np.maximum(pa[0], pb[0])
+        ylo = np.minimum(pa[1], pb[1])
+        yhi = np.maximum(pa[1], pb[1])
+        # grid columns crossed by each segment
+        ix0 = self._ix(xlo - eps, 0)
+        ix1 = self._ix(xhi + eps, 0)
+        cnt = ix1 - ix0 + 1
+        iq = np.repeat(np.arange(len(cnt)), cnt)
+        col = ix0[iq] + np.arange(len(iq)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        # part of the segment in the column
+        x0 = np.maximum(self.origin[0] + col * self.cellsize, xlo[iq])
+        x1 = np.minimum(self.origin[0] + (col + 1) * self.cellsize, xhi[iq])
+        dx = pb[0] - pa[0]
+        bvert = np.abs(dx) <= eps
+        slope = (pb[1] - pa[1]) / np.where(bvert, 1., dx)
+        y0 = np.where(bvert[iq], ylo[iq], pa[1, iq] + slope[iq] * (x0 - pa[0, iq]))
+        y1 = np.where(bvert[iq], yhi[iq], pa[1, iq] + slope[iq] * (x1 - pa[0, iq]))
+        y0 = np.clip(y0, ylo[iq], yhi[iq])
+        y1 = np.clip(y1, ylo[iq], yhi[iq])
+        iy0 = self._ix(np.minimum(y0, y1) - eps, 1)
+        iy1 = self._ix(np.maximum(y0, y1) + eps, 1)
+        # cells of each column
+        cnt = iy1 - iy0 + 1
+        jq = np.repeat(iq, cnt)
+        cy = np.repeat(iy0, cnt) + np.arange(len(jq)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        cell = np.repeat(col, cnt) * self.shape[1] + cy
+        return self._gather(jq, cell)
+
+
 def angular(p1, p2):
     """ determine angle between p1 and p2 in inerval [0 2pi]
 
@@ -3380,6 +3569,67 @@ def are_points_inside_cone1(points,apex,v,radius=np.inf):
     bcone__[bhs] = bcone_
     return bcone__
 
+def _isclose(a,b,rtol=1e-05,atol=1e-08):
+    """ scalar version of np.isclose
+
+    Parameters
+    ----------
+
+    a : float
+    b : float
+        finite reference value
+    rtol : float
+    atol : float
+
+    Notes
+    -----
+
+    Gives the same result as np.isclose(a,b) for a finite b, without the
+    array overhead which dominates when called on scalars in loops.
+
+    """
+    return abs(a-b) <= (atol + rtol*abs(b))
+
+def _div(a,b):
+    """ scalar division with the numpy semantic
+
+    Returns a/b, and inf or nan instead of raising ZeroDivisionError when
+    b is zero.
+
+    """
+    if b != 0:
+        return a/b
+    if (a != a) or (a == 0):
+        return np.nan
+    return math.copysign(np.inf,a)*math.copysign(1.,b)
+
+def _unit2(x,y):
+    """ scalar 2D version of v/np.linalg.norm(v)
+
+    Returns
+    -------
+
+    (ux,uy) : unit vector (nan or inf for a null vector, as numpy)
+
+    """
+    n = math.sqrt(x*x+y*y)
+    if n != 0:
+        return (x/n,y/n)
+    return (_div(x,n),_div(y,n))
+
+def _ccw2(a,b,c):
+    """ scalar 2D version of ccw
+
+    Parameters
+    ----------
+
+    a : point (2,)
+    b : point (2,)
+    c : point (2,)
+
+    """
+    return (c[1]-a[1])*(b[0]-a[0]) > (b[1]-a[1])*(c[0]-a[0])
+
 def are_points_inside_cone(points,apex,v,radius=np.inf):
     """ determine if a set of points are inside a cone
 
@@ -3401,7 +3651,8 @@ def are_points_inside_cone(points,apex,v,radius=np.inf):
     w = points - apex[None,:]
     nw = np.linalg.norm(w,axis=1)
     # remove point which are too close to the apex
-    bvalid = ~np.isclose(nw,0)
+    # (same as ~np.isclose(nw,0) without the overhead)
+    bvalid = ~(nw <= 1e-8)
 
     Nvec = v.shape[1]
     # vcone  : cone axis
@@ -3427,6 +3678,125 @@ def are_points_inside_cone(points,apex,v,radius=np.inf):
     bcone__[bhs] = bcone_
     return bcone__
 
+def _solve2(a00,a01,a10,a11,b0,b1):
+    """ solve the 2x2 linear system [[a00,a01],[a10,a11]] x = [b0,b1]
+
+    Returns
+    -------
+
+    (x0,x1) : solution or None if the matrix is singular
+
+    Notes
+    -----
+
+    The system is solved on scalars by a LU decomposition with partial
+    pivoting, in the order of operations of LAPACK gesv, so that the
+    result is the one of np.linalg.solve. The cone functions below test
+    the sign of the solution, this matters for the degenerated cases.
+
+    """
+    if abs(a10) > abs(a00):
+        a00,a01,a10,a11 = a10,a11,a00,a01
+        b0,b1 = b1,b0
+    if a00 == 0:
+        return None
+    l = a10*(1.0/a00)
+    u11 = a11 - l*a01
+    if u11 == 0:
+        return None
+    x1 = (b1 - l*b0)/u11
+    x0 = (b0 - a01*x1)/a00
+    return x0,x1
+
+def _inside_cone2(points,apex,v0,v1):
+    """ scalar 2D version of are_points_inside_cone
+
+    Parameters
+    ----------
+
+    points : tuple (pta,phe)
+        the 2 points to be tested
+    apex : np.array (2,)
+    v0 : np.array (2,)
+    v1 : np.array (2,)
+        cone edge vectors
+
+    Returns
+    -------
+
+    [b0,b1] : booleans, True if the point is inside the cone
+              None if the cone is degenerated
+
+    Notes
+    -----
+
+    Same result as are_points_inside_cone(np.vstack(points),apex,
+    np.vstack((v0,v1)).T) without the array overhead.
+
+    """
+    n0 = math.sqrt(v0[0]*v0[0]+v0[1]*v0[1])
+    n1 = math.sqrt(v1[0]*v1[0]+v1[1]*v1[1])
+    v0x = v0[0]/n0
+    v0y = v0[1]/n0
+    v1x = v1[0]/n1
+    v1y = v1[1]/n1
+    # cone axis
+    vcx = (v0x+v1x)/2.
+    vcy = (v0y+v1y)/2.
+    lb = []
+    for p in points:
+        wx = p[0]-apex[0]
+        wy = p[1]-apex[1]
+        # points too close to the apex and points outside the half space
+        # are not in the cone
+        if (math.sqrt(wx*wx+wy*wy) <= 1e-8) or (wx*vcx+wy*vcy <= 0):
+            lb.append(False)
+        else:
+            x = _solve2(v0x,v1x,v0y,v1y,wx,wy)
+            if x is None:
+                return None
+            lb.append((x[0]>0) and (x[1]>0))
+    return lb
+
+def _halfline_seg2(line, seg):
+    """ scalar 2D version of intersect_halfline_seg
+
+    Parameters
+    ----------
+
+    line : tuple
+        (point,vec)
+    seg :  tuple
+        (pta,phe)
+
+    Returns
+    -------
+
+    k : intersection parameter (0<k<1 if intersection)
+    P : intersection point P = pta + k vseg
+
+    """
+    ptO, u = line
+    pta, phe = seg
+    vx = phe[0]-pta[0]
+    vy = phe[1]-pta[1]
+    nu = math.sqrt(u[0]*u[0]+u[1]*u[1])
+    ux = u[0]/nu
+    uy = u[1]/nu
+    x = None
+    if not (_isclose(vx*uy - ux*vy,0)):
+        x = _solve2(ux,-vx,uy,-vy,pta[0]-ptO[0],pta[1]-ptO[1])
+    if x is None:
+        k = -np.inf
+        P = seg[0]
+    elif x[0]>0:
+        k = x[1]
+        P = np.array([pta[0]+k*vx,pta[1]+k*vy])
+    else:
+        k = np.inf
+        P = seg[0]
+    return(k, P)
+
 def intersect_cone_seg(line0,line1,seg,bvis=False,bbool=False):
     """ intersection of a cone and a segment
 
@@ -3466,40 +3836,49 @@ def intersect_cone_seg(line0,line1,seg,bvis=False,bbool=False):
     """
     tahe = []
     ratio = 0
-    # points : np.array 2 x 2
-    points = np.vstack((seg[0],seg[1]))
     apex = line0[0]
     # if second point of lines are the same (problem)
     if ( (line0[1][0]==line1[1][0]) and
          (line0[1][1]==line1[1][1])   ):
          pdb.set_trace()
 
-    # v : np.array 2 x 2
-    # first column  termination of line0
-    # second column termination of line1
-
-    v = np.vstack((line0[1],line1[1])).T
-    bb = are_points_inside_cone(points,apex,v,radius=np.inf)
-
-    x0,p0 = intersect_halfline_seg(line0, seg)
-    x1,p1 = intersect_halfline_seg(line1, seg)
+    # the 2 points and the 2 cone edges are handled as scalars
+    # (this function is called in the inner loop of Signatures.run)
+    bb = _inside_cone2(seg,apex,line0[1],line1[1])
+    if bb is None:
+        # v : np.array 2 x 2
+        # first column  termination of line0
+        # second column termination of line1
+        points = np.vstack((seg[0],seg[1]))
+        v = np.vstack((line0[1],line1[1])).T
+        bb = are_points_inside_cone(points,np.asarray(apex),v,radius=np.inf)
+    bb = [bool(bb[0]),bool(bb[1])]
+
+    x0,p0 = _halfline_seg2(line0, seg)
+    x1,p1 = _halfline_seg2(line1, seg)
 
     # intersection at the apex 
-    if (p0==p1).all():
+    if (p0[0]==p1[0]) and (p0[1]==p1[1]):
         return(tahe,ratio)
 
+    if (abs(x0)!=np.inf) and (abs(x1)!=np.inf):
+        dx = p1[0]-p0[0]
+        dy = p1[1]-p0[1]
+        # length of the cone section on the segment line
+        l01 = math.sqrt(dx*dx+dy*dy)
 
-
-    if bb[0] & bb[1]: # termination of segment fully inside the cone
+    if bb[0] and bb[1]: # termination of segment fully inside the cone
         tahe = seg
-        if (np.abs(x0)!=np.inf) and (np.abs(x1)!=np.inf):
-            ratio = np.linalg.norm(seg[1]-seg[0])/np.linalg.norm(p1-p0)
+        if (abs(x0)!=np.inf) and (abs(x1)!=np.inf):
+            dx = seg[1][0]-seg[0][0]
+            dy = seg[1][1]-seg[0][1]
+            ratio = math.sqrt(dx*dx+dy*dy)/l01
         else:
             ratio = 1
 
-    if ~bb[0] & ~bb[1]: # termination segment fully outside the cone
-        if (( ( (x1>0) or np.isclose(x1,0)) & ((x1<1) or np.isclose(x1,1)) ) and
-            ( ( (x0>0) or np.isclose(x0,0)) & ((x0<1) or np.isclose(x0,1)) ) ):
+    if (not bb[0]) and (not bb[1]): # termination segment fully outside the cone
+        if (( ( (x1>0) or _isclose(x1,0)) & ((x1<1) or _isclose(x1,1)) ) and
+            ( ( (x0>0) or _isclose(x0,0)) & ((x0<1) or _isclose(x0,1)) ) ):
             tahe = [p0,p1]
             ratio = 1
         else:
@@ -3507,26 +3886,30 @@ def intersect_cone_seg(line0,line1,seg,bvis=False,bbool=False):
             ratio = 0
 
     #pdb.set_trace()
-    if bb[0] & ~bb[1]: # seg0 inside seg1 outside
-        if (( (x1>0) or np.isclose(x1,0)) & ((x1<1) or np.isclose(x1,1)) ):
+    if bb[0] and (not bb[1]): # seg0 inside seg1 outside
+        if (( (x1>0) or _isclose(x1,0)) & ((x1<1) or _isclose(x1,1)) ):
             tahe = [seg[0],p1]
-        if (( (x0>0) or np.isclose(x0,0)) & ((x0<1) or np.isclose(x0,1)) ):
+        if (( (x0>0) or _isclose(x0,0)) & ((x0<1) or _isclose(x0,1)) ):
             tahe = [seg[0],p0]
-        if (np.abs(x0)!=np.inf) and (np.abs(x1)!=np.inf):
+        if (abs(x0)!=np.inf) and (abs(x1)!=np.inf):
             try:
-                ratio = np.linalg.norm(tahe[1]-tahe[0])/np.linalg.norm(p1-p0)
+                dx = tahe[1][0]-tahe[0][0]
+                dy = tahe[1][1]-tahe[0][1]
+                ratio = math.sqrt(dx*dx+dy*dy)/l01
             except:
                 pdb.set_trace()
         else:
             ratio = 1
 
-    if ~bb[0] & bb[1]: # seg0 outside seg1 inside
-        if (( (x0>0) or np.isclose(x0,0)) & ((x0<1) or np.isclose(x0,1)) ):
+    if (not bb[0]) and bb[1]: # seg0 outside seg1 inside
+        if (( (x0>0) or _isclose(x0,0)) & ((x0<1) or _isclose(x0,1)) ):
             tahe = [seg[1],p0]
-        if (( (x1>0) or np.isclose(x1,0)) & ((x1<1) or np.isclose(x1,1)) ):
+        if (( (x1>0) or _isclose(x1,0)) & ((x1<1) or _isclose(x1,1)) ):
             tahe = [seg[1],p1]
-        if (np.abs(x0)!=np.inf) and (np.abs(x1)!=np.inf ):
-            ratio = np.linalg.norm(tahe[1]-tahe[0])/np.linalg.norm(p1-p0)
+        if (abs(x0)!=np.inf) and (abs(x1)!=np.inf ):
+            dx = tahe[1][0]-tahe[0][0]
+            dy = tahe[1][1]-tahe[0][1]
+            ratio = math.sqrt(dx*dx+dy*dy)/l01
         else:
             ratio = 1
 
@@ -3738,7 +4121,7 @@ def intersect_halfline_seg(line, seg):
     b  = np.array([[pta[0]-ptO[0]],
                   [pta[1]-ptO[1]]])
     detA = np.linalg.det(A)
-    if not (np.isclose(detA,0)):
+    if not (_isclose(detA,0)):
         x  = np.linalg.solve(A,b)
         if x[0]>0:
             P  = pta + x[1]*v
@@ -3764,7 +4147,7 @@ def intersect_halfline_seg(line, seg):
     return(x[1][0], P)
 
 
-def intersect3(a, b, pg, u1, u2, l1, l2,binter=False):
+def intersect3(a, b, pg, u1, u2, l1, l2,binter=False,pairwise=False):
     """ Intersection of a line and a 3D rectangle screen
 
     Parameters
@@ -3784,6 +4167,11 @@ def intersect3(a, b, pg, u1, u2, l1, l2,binter=False):
         length along first dimension in meters
     l2   : np.array (,Nscreen)
         length along second dimension in meters
+    binter : boolean
+        if True the intersection points are also returned
+    pairwise : boolean
+        if True, Nseg == Nscreen and only segment k is tested against
+        screen k (the result is then (,Nseg))
 
     Returns
     -------
@@ -3811,6 +4199,33 @@ def intersect3(a, b, pg, u1, u2, l1, l2,binter=False):
 
     """
 
+    if pairwise:
+        Nseg = a.shape[1]
+        ba = b - a
+        u1 = np.broadcast_to(u1, (3, Nseg))
+        u2 = np.broadcast_to(u2, (3, Nseg))
+        # A : (Nseg,3,3)
+        A = np.concatenate((ba.T[:, :, None],
+                            -u1.T[:, :, None],
+                            -u2.T[:, :, None]), axis=2)
+        c = pg.T - a.T
+        visi = np.zeros(Nseg, dtype=bool)
+        pinter = np.nan*np.zeros((Nseg, 3))
+        if Nseg > 0:
+            boolvalid = ~ (np.isclose(np.linalg.det(A), 0))
+            ui = np.where(boolvalid)[0]
+            if len(ui) > 0:
+                x = np.linalg.solve(A[ui], c[ui])
+                pinter[ui] = ba.T[ui]*x + a.T[ui]
+                condseg = ((x[:, 0] > 1) | (x[:, 0] < 0))
+                cond1 = ((x[:, 1] > l1[ui] / 2.) | (x[:, 1] < -l1[ui] / 2.))
+                cond2 = ((x[:, 2] > l2[ui] / 2.) | (x[:, 2] < -l2[ui] / 2.))
+                visi[ui] = ~(condseg | cond1 | cond2)
+        if binter:
+            return visi, pinter
+        else:
+            return visi, None
+
     Nseg = a.shape[1]
     Nscreen = u1.shape[1]
 
@@ -10,7 +10,7 @@ if sys.version_info.major==2:
     import ConfigParser
 else:
     import configparser as ConfigParser
-    from simpy import Process
+    from pylayers.util.simpy2 import Process, hold
 
 from pylayers.util.project import *
 import pylayers.util.pyutil as pyu
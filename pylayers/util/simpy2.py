@@ -0,0 +1,171 @@
+#   -*- coding:Utf-8 -*-
+"""
+.. currentmodule:: pylayers.util.simpy2
+
+SimPy 2 processes on a SimPy 3 environment
+
+The processes of simulnet (Person, Save, ShowNet, ...) are written with
+the SimPy 2 API : a Process is activated with sim.activate(p,p.run(),at)
+and its generator yields (hold,p,delay) or (passivate,p).
+Simulation runs these generators as SimPy 3 processes of its environment
+(simpy.Environment or simpy.RealtimeEnvironment).
+
+The communication processes (TX, RX) also wait SimEvent signals with
+(waitevent,p,evt) or (waitevent,p,[evt1,evt2,...]).
+
+.. autosummary::
+
+"""
+import simpy
+
+hold = 'hold'
+passivate = 'passivate'
+waitevent = 'waitevent'
+
+
+class Process(object):
+    """ SimPy 2 process
+
+    Attributes
+    ----------
+
+    name : string
+    sim : Simulation
+    eventsFired : list
+        SimEvent which ended the last waitevent
+
+    """
+    def __init__(self, name='a_process', sim=None):
+        self.name = name
+        self.sim = sim
+        self.eventsFired = []
+        self._wakeup = None
+
+    def passive(self):
+        """ True if the process waits for a reactivation
+        """
+        return self._wakeup is not None
+
+
+class SimEvent(object):
+    """ SimPy 2 event
+
+    Attributes
+    ----------
+
+    name : string
+    sim : Simulation
+    occurred : boolean
+        True if the event has been signaled while no process was waiting
+        for it, until a process waits for it
+    waits : list
+        (process,list of events) of the processes waiting for the event
+
+    Notes
+    -----
+
+    As in SimPy 2, a signal wakes up all the processes waiting for the
+    event. If no process is waiting, the signal is memorized in occurred,
+    and the next waitevent on the event does not wait.
+
+    """
+    def __init__(self, name='a_SimEvent', sim=None):
+        self.name = name
+        self.sim = sim
+        self.occurred = False
+        self.waits = []
+        self.signalparam = None
+
+    def signal(self, param=None):
+        """ signal the event
+        """
+        self.signalparam = param
+        if len(self.waits) == 0:
+            self.occurred = True
+        else:
+            for proc, levt in self.waits:
+                proc.eventsFired.append(self)
+                # the process does not wait for its other events anymore
+                for evt in levt:
+                    if evt is not self:
+                        if evt.occurred:
+                            proc.eventsFired.append(evt)
+                        evt.waits = [w for w in evt.waits if w[0] is not proc]
+                if not proc._wakeup.triggered:
+                    proc._wakeup.succeed()
+            self.waits = []
+
+
+class Simulation(object):
+    """ SimPy 2 simulation on a SimPy 3 environment
+
+    Attributes
+    ----------
+
+    env : simpy.Environment
+        default simpy.Environment()
+
+    """
+    def __init__(self, env=None):
+        if env is None:
+            env = simpy.Environment()
+        self.env = env
+
+    def now(self):
+        """ current simulation time
+        """
+        return self.env.now
+
+    def activate(self, proc, gen, at=0.):
+        """ run a SimPy 2 generator as a process of the environment
+
+        Parameters
+        ----------
+
+        proc : Process
+        gen : generator
+            yields (hold,proc,delay), (passivate,proc) or
+            (waitevent,proc,events)
+        at : float
+            delay before the first step of gen
+
+        """
+        return self.env.process(self._run(proc, gen, at))
+
+    def reactivate(self, proc):
+        """ wake up a passive process
+        """
+        if proc.passive():
+            proc._wakeup.succeed()
+
+    def _run(self, proc, gen, at):
+        if at > 0:
+            yield self.env.timeout(at)
+        for cmd in gen:
+            if cmd[0] == hold:
+                yield self.env.timeout(cmd[2])
+            elif cmd[0] == passivate:
+                proc._wakeup = self.env.event()
+                yield proc._wakeup
+                proc._wakeup = None
+            elif cmd[0] == waitevent:
+                levt = cmd[2]
+                if isinstance(levt, SimEvent):
+                    levt = [levt]
+                else:
+                    levt = list(levt)
+                proc.eventsFired = [e for e in levt if e.occurred]
+                if len(proc.eventsFired) > 0:
+                    # already signaled : the process goes on at the same
+                    # time, after the processes already scheduled
+                    for e in proc.eventsFired:
+                        e.occurred = False
+                    yield self.env.timeout(0)
+                else:
+                    proc._wakeup = self.env.event()
+                    for e in levt:
+                        e.waits.append((proc, levt))
+                    yield proc._wakeup
+                    proc._wakeup = None
+            else:
+                raise NotImplementedError('SimPy 2 command ' + str(cmd[0]))
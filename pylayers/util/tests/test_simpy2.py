@@ -0,0 +1,106 @@
+import time
+import simpy
+from pylayers.util.simpy2 import *
+
+class Clock(Process):
+    def __init__(self, name, dt, sim):
+        Process.__init__(self, name=name, sim=sim)
+        self.dt = dt
+        self.lt = []
+
+    def run(self):
+        while True:
+            self.lt.append(self.sim.now())
+            yield hold, self, self.dt
+
+class Sleeper(Process):
+    def run(self):
+        yield passivate, self
+        self.t = self.sim.now()
+
+# SimPy 2 processes in a simpy.Environment
+S = Simulation()
+a = Clock('a', 0.5, S)
+b = Clock('b', 1., S)
+S.activate(a, a.run(), 0.)
+S.activate(b, b.run(), 1.5)
+c = Sleeper(name='c', sim=S)
+S.activate(c, c.run())
+S.env.run(until=0.2)
+assert c.passive()
+S.reactivate(c)
+S.env.run(until=3.)
+assert a.lt == [0., 0.5, 1., 1.5, 2., 2.5]
+assert b.lt == [1.5, 2.5]
+assert not c.passive()
+assert c.t == 0.2
+
+# paced on the wall clock : 1 s of simulation in 0.1 s
+S = Simulation(simpy.RealtimeEnvironment(factor=0.1, strict=False))
+a = Clock('a', 0.25, S)
+S.activate(a, a.run())
+t0 = time.time()
+S.env.run(until=1.)
+assert a.lt == [0., 0.25, 0.5, 0.75]
+assert time.time() - t0 > 0.09
+
+# SimEvent : a signal wakes up the waiting processes, a signal without
+# waiting process is memorized until the next waitevent
+class Waiter(Process):
+    def __init__(self, name, levt, sim):
+        Process.__init__(self, name=name, sim=sim)
+        self.levt = levt
+        self.lw = []
+
+    def run(self):
+        while True:
+            yield waitevent, self, self.levt
+            self.lw.append((self.sim.now(),
+                            sorted([e.name for e in self.eventsFired])))
+
+class Signaler(Process):
+    def run(self, lsig):
+        for t, e in lsig:
+            yield hold, self, t - self.sim.now()
+            e.signal()
+
+S = Simulation()
+e1 = SimEvent('e1', sim=S)
+e2 = SimEvent('e2', sim=S)
+w = Waiter('w', [e1, e2], S)
+v = Waiter('v', e2, S)
+s = Signaler(name='s', sim=S)
+S.activate(w, w.run())
+S.activate(v, v.run())
+S.activate(s, s.run([(1., e1), (2., e2), (2., e2)]))
+S.env.run(until=5.)
+assert w.lw == [(1., ['e1']), (2., ['e2']), (2., ['e2'])]
+assert v.lw == [(2., ['e2']), (2., ['e2'])]
+assert not e1.occurred
+assert not e2.occurred
+assert len(e1.waits) == 1
+assert len(e2.waits) == 2
+
+# signal before the wait
+S = Simulation()
+e1 = SimEvent('e1', sim=S)
+e1.signal()
+assert e1.occurred
+w = Waiter('w', e1, S)
+S.activate(w, w.run(), 1.)
+S.env.run(until=2.)
+assert w.lw == [(1., ['e1'])]
+assert not e1.occurred
+
+# 2 signals in a row (as in TX.request) : the second one is memorized
+S = Simulation()
+e1 = SimEvent('e1', sim=S)
+w = Waiter('w', [e1], S)
+S.activate(w, w.run())
+S.env.run(until=1.)
+e1.signal()
+e1.signal()
+assert e1.occurred
+S.env.run(until=2.)
+assert w.lw == [(1., ['e1']), (1., ['e1'])]
+assert not e1.occurred